@@ -23,6 +23,7 @@ from utilities.mosaic_validator_utils import main as run_mosaic_validator
 from utilities.youtube_csv_prep_utils import main as prepare_csv_for_uploads
 from utilities.archive_utils import archive_previous_generations
 from utilities.youtube.youtube_scheduler_utils import get_authenticated_service, list_scheduled_videos, SEATTLE_TZ, DAILY_POST_FREQUENCY_SCHEDULE
+from utilities.profiling_utils import run_main
 
 QUEUE_TO_UPLOAD_FILE = os.path.abspath(os.path.join(current_dir, "mosaics", "file_upload_log.csv"))
 COMPLETED_DIR = os.path.join(os.path.dirname(QUEUE_TO_UPLOAD_FILE), "completed")
@@ -199,4 +200,4 @@ def main():
     print(f"Based on the DAILY_POST_FREQUENCY_SCHEDULE, your next video whether successful or not, based solely on the math, would mean it would post at: {next_upload_time_est.isoformat()} Seattle time.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
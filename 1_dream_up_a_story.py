@@ -15,6 +15,9 @@ from utilities.ollama_utils import (
     get_story_response_from_model
 )
 from utilities.archive_utils import archive_previous_generations
+from utilities.run_index_utils import ensure_run, record_artifact
+from utilities.run_context_utils import run_path
+from utilities.profiling_utils import run_main
 
 try:
     import GLOBAL_VARIABLES  # Import everything in the global variables module
@@ -35,9 +38,6 @@ except ImportError:
 
 MODEL_NAME = getattr(GLOBAL_VARIABLES, 'GLOBAL_MODEL_NAME', 'llama3')
 
-if getattr(GLOBAL_VARIABLES, 'ARCHIVE_ALL_PREVIOUS_GENERATIONS', False):
-    archive_previous_generations()
-
 APPEND_TO_EACH = " Respond with only the response, nothing more, and do not add any quotes to anything"
 
 GENDER_PROMPT = "Pick a gender from this list: male or female." + APPEND_TO_EACH
@@ -63,15 +63,10 @@ AUTHOR_TEMPLATE = (
 )
 
 output_dir = "storylines"
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
-
-timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-JSON_FILE = os.path.join(output_dir, f"{timestamp}_story.json")
 
-def get_response_from_model(model_name, prompt):
-    """ Wrapper function for getting a response from the model """
-    response = get_story_response_from_model(model_name, prompt)
+def get_response_from_model(model_name, prompt, template):
+    """ Wrapper function for getting a response from the model (template labels the call in metrics) """
+    response = get_story_response_from_model(model_name, prompt, template=template)
     return response.strip()
 
 def clean_response(response):
@@ -89,13 +84,13 @@ def clean_response(response):
 def create_storyline(model_name, place, gender, nationality, age, superpower, theme, movie_type, main_character, main_character_description):
     """ Create a storyline based on the given inputs naming the main character. """
     storyline_prompt = STORYLINE_TEMPLATE.format(main_character=main_character, gender=gender, place=place, nationality=nationality, age=age, superpower=superpower, main_character_description=main_character_description, theme=theme, movie_type=movie_type)
-    storyline = get_response_from_model(model_name, storyline_prompt)
+    storyline = get_response_from_model(model_name, storyline_prompt, "STORYLINE_TEMPLATE")
     return clean_response(storyline), storyline_prompt
 
 def suggest_author_or_director(model_name, storyline, tone):
     """ Suggest an author or movie director based on the storyline and tone """
     author_prompt = AUTHOR_TEMPLATE.format(storyline=storyline, tone=tone)
-    author = get_response_from_model(model_name, author_prompt)
+    author = get_response_from_model(model_name, author_prompt, "AUTHOR_TEMPLATE")
     return clean_response(author)
 
 def select_random_letter():
@@ -106,11 +101,11 @@ def validate_response_starts_with_letter(response, letter):
     """ Validate that the response starts with the specified letter """
     return response.strip().upper().startswith(letter)
 
-def get_valid_response(model_name, prompt_template, letter, max_attempts=3):
+def get_valid_response(model_name, prompt_template, letter, template, max_attempts=3):
     """ Get a response that starts with the specified letter, retry up to max_attempts """
     for attempt in range(max_attempts):
         prompt = prompt_template.format(letter=letter) + APPEND_TO_EACH
-        response = get_response_from_model(model_name, prompt)
+        response = get_response_from_model(model_name, prompt, template)
         response = clean_response(response)
         if validate_response_starts_with_letter(response, letter):
             return response, attempt + 1
@@ -123,7 +118,7 @@ def generate_main_character_description(model_name, main_character, initial_prom
         f"described in the story prompt \"{initial_prompt}\", please provide a detailed and engaging character description "
         "in less than 250 characters. Include characteristics such as appearance, personality, and background. Add no filler or intro, just respond ONLY with the description, nothing else."
     )
-    description = get_response_from_model(model_name, description_prompt)
+    description = get_response_from_model(model_name, description_prompt, "generate_main_character_description")
     return clean_response(description)
 
 def get_name_prompt(nationality, letter, gender):
@@ -136,6 +131,19 @@ def get_name_prompt(nationality, letter, gender):
 
 
 def main():
+    if getattr(GLOBAL_VARIABLES, 'ARCHIVE_ALL_PREVIOUS_GENERATIONS', False):
+        archive_previous_generations()
+
+    story_dir = run_path(output_dir)
+    if not os.path.exists(story_dir):
+        os.makedirs(story_dir)
+
+    # Name the story file per run so in-process reruns never reuse an old timestamp
+    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    JSON_FILE = os.path.join(story_dir, f"{timestamp}_story.json")
+    run_id = ensure_run()
+    print(f"Run id: {run_id}")
+
     kill_existing_ollama_service()
     clear_gpu_memory()
 
@@ -154,10 +162,10 @@ def main():
     if not place:
         random_letter_place = select_random_letter()
         place_prompt_template = "Name a place anywhere in the world that starts with the letter {letter}."
-        place, place_attempts = get_valid_response(MODEL_NAME, place_prompt_template, random_letter_place)
+        place, place_attempts = get_valid_response(MODEL_NAME, place_prompt_template, random_letter_place, "place_prompt_template")
 
-    nationality = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_NATIONALITY', "").strip() or clean_response(get_response_from_model(MODEL_NAME, NATIONALITY_PROMPT))
-    gender = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_GENDER', "").strip().lower() if getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_GENDER', "").strip().lower() in ["male", "female"] else clean_response(get_response_from_model(MODEL_NAME, GENDER_PROMPT))
+    nationality = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_NATIONALITY', "").strip() or clean_response(get_response_from_model(MODEL_NAME, NATIONALITY_PROMPT, "NATIONALITY_PROMPT"))
+    gender = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_GENDER', "").strip().lower() if getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_GENDER', "").strip().lower() in ["male", "female"] else clean_response(get_response_from_model(MODEL_NAME, GENDER_PROMPT, "GENDER_PROMPT"))
 
     # Use the provided age directly
     age = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_AGE', 0)
@@ -165,27 +173,27 @@ def main():
         age = random.randint(8, 25)  # Fallback to a random age if not valid
 
     # Use the provided story theme directly, fallback to fetching if not provided.
-    theme = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_STORY_THEME', "").strip() or clean_response(get_response_from_model(MODEL_NAME, THEME_PROMPT))
+    theme = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_STORY_THEME', "").strip() or clean_response(get_response_from_model(MODEL_NAME, THEME_PROMPT, "THEME_PROMPT"))
     
-    movie_type = clean_response(get_response_from_model(MODEL_NAME, MOVIE_TYPE_PROMPT))
+    movie_type = clean_response(get_response_from_model(MODEL_NAME, MOVIE_TYPE_PROMPT, "MOVIE_TYPE_PROMPT"))
     random_letter_main_character = select_random_letter()
 
     main_character = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_NAME', "").strip()
     main_character_name_attempts = 0
     if not main_character:
         name_prompt = get_name_prompt(nationality, random_letter_main_character, gender)
-        main_character, main_character_name_attempts = get_valid_response(MODEL_NAME, name_prompt, random_letter_main_character)
+        main_character, main_character_name_attempts = get_valid_response(MODEL_NAME, name_prompt, random_letter_main_character, "get_name_prompt")
 
-    superpower = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_MAIN_CHARACTER_SUPERPOWER', "").strip() or clean_response(get_response_from_model(MODEL_NAME, SUPERPOWER_PROMPT))
+    superpower = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_MAIN_CHARACTER_SUPERPOWER', "").strip() or clean_response(get_response_from_model(MODEL_NAME, SUPERPOWER_PROMPT, "SUPERPOWER_PROMPT"))
     main_character_description = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_MAIN_CHARACTER_DESCRIPTION', "").strip() or generate_main_character_description(MODEL_NAME, main_character, "", age, nationality, gender, superpower)
 
     tone = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_TONE', "").strip()
     if not tone:
         tone_prompt = "Generate a suitable tone for the following storyline: \"{storyline}\". Only respond with the tone, nothing else."
-        tone = clean_response(get_response_from_model(MODEL_NAME, tone_prompt.format(storyline="")))
+        tone = clean_response(get_response_from_model(MODEL_NAME, tone_prompt.format(storyline=""), "tone_prompt"))
 
     storyline, storyline_prompt = create_storyline(MODEL_NAME, place, gender, nationality, age, superpower, theme, movie_type, main_character, main_character_description)
-    initial_prompt_raw = get_response_from_model(MODEL_NAME, INITIAL_PROMPT_TEMPLATE.format(storyline=storyline, main_character=main_character, gender=gender))
+    initial_prompt_raw = get_response_from_model(MODEL_NAME, INITIAL_PROMPT_TEMPLATE.format(storyline=storyline, main_character=main_character, gender=gender), "INITIAL_PROMPT_TEMPLATE")
     initial_prompt = clean_response(initial_prompt_raw)
     author_or_director = suggest_author_or_director(MODEL_NAME, storyline, tone)
 
@@ -196,7 +204,7 @@ def main():
     else:
         random_letter_artistic_style = select_random_letter()
         artistic_style_prompt = ARTISTIC_STYLE_PROMPT.format(letter=random_letter_artistic_style)
-        artistic_style, artistic_style_attempts = get_valid_response(MODEL_NAME, artistic_style_prompt, random_letter_artistic_style)
+        artistic_style, artistic_style_attempts = get_valid_response(MODEL_NAME, artistic_style_prompt, random_letter_artistic_style, "ARTISTIC_STYLE_PROMPT")
 
     initial_data = {
         "author": author_or_director,
@@ -229,6 +237,7 @@ def main():
         json.dump(initial_data, f, indent=2)
 
     print(f"Generated initial JSON file: {JSON_FILE}")
+    record_artifact("story", JSON_FILE, stage="1_dream_up_a_story", run_id=run_id)
     print(f"\nHere is the storyline template used:\n{storyline_prompt}")
     print(f"\nHere is your storyline:\n{storyline}")
     print(f"\nMain Character's Name:\n{main_character}")
@@ -250,4 +259,4 @@ def main():
 if __name__ == "__main__":
     atexit.register(stop_ollama_service)
     atexit.register(clear_gpu_memory)
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
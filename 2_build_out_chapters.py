@@ -1,12 +1,9 @@
-import os
 import time
-import json
 import random
 import atexit
 import re
 from datetime import datetime
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ThreadPoolExecutor
 from utilities.ollama_utils import (
     install_and_setup_ollama,
     kill_existing_ollama_service,
@@ -16,6 +13,11 @@ from utilities.ollama_utils import (
     is_windows,
     get_story_response_from_model
 )
+from utilities.run_index_utils import find_story_file
+from utilities.failure_utils import StageFailure
+from utilities.story_journal_utils import StoryJournal, load_story
+from utilities.tracing_utils import propagate
+from utilities.profiling_utils import run_main
 
 try:
     import GLOBAL_VARIABLES  # Import everything in the global variables module
@@ -24,6 +26,7 @@ except ImportError:
         GLOBAL_MODEL_NAME = None
         NUMBER_OF_CHAPTERS_PER_STORY = 4
         USER_PROVIDED_TONE = None
+        SYNOPSIS_MODE = "auto"
 
 # Define the model name with fallback
 MODEL_NAME = getattr(GLOBAL_VARIABLES, 'GLOBAL_MODEL_NAME', 'llama3')
@@ -34,9 +37,16 @@ LOOPS = getattr(GLOBAL_VARIABLES, 'NUMBER_OF_CHAPTERS_PER_STORY', 4)
 # Define the tone of the story with fallback
 USER_PROVIDED_TONE = getattr(GLOBAL_VARIABLES, 'USER_PROVIDED_TONE', None)
 
+# Synopsis mode: "sampled" picks 8 lines, "hierarchical" map-reduces chapter groups, "auto" picks by story length
+SYNOPSIS_MODE = getattr(GLOBAL_VARIABLES, 'SYNOPSIS_MODE', 'auto')
+
 # Constants
 MAX_RETRIES = 5
 COSINE_SIMILARITY_THRESHOLD = 0.8
+HIERARCHICAL_SYNOPSIS_MIN_CHAPTERS = 16  # "auto" mode switches to the hierarchical synopsis at this many chapters
+SYNOPSIS_GROUP_SIZE = 4  # Chapters (or summaries) combined per call; bounds the size of every synopsis prompt
+SYNOPSIS_SUMMARY_MAX_CHARS = 500  # Each intermediate summary is capped so prompts stay bounded at every tree level
+SYNOPSIS_MAX_PARALLEL_CALLS = 4  # Concurrent model calls per tree level
 SUMMARY_COSINE_SIMILARITY_THRESHOLD = 0.6
 CONSTRAINT_REMINDER = "Remember, the response should be only 2 or 3 sentences with a maximum of 100 words in total."
 APPEND_TO_EACH = " Respond with only the response, nothing more, and do not add any quotes to anything."
@@ -80,6 +90,16 @@ COMPLETE_SYNOPSIS_TEMPLATE = (
     "Keep the synopsis limited to 6-7 sentences and less than 900 characters. Return only the synopsis, nothing else."
     + " " + APPEND_TO_EACH
 )
+CHAPTER_GROUP_SUMMARY_TEMPLATE = (
+    "Summarize the following consecutive chapters of a story in 3-4 sentences and less than 500 characters, "
+    "keeping character names, key events and the order in which they happen: \"{chapters}\"."
+    + " " + APPEND_TO_EACH
+)
+SUMMARY_MERGE_TEMPLATE = (
+    "Merge the following consecutive story summaries into a single summary of 3-4 sentences and less than 500 characters, "
+    "keeping character names, key events and their order: \"{summaries}\"."
+    + " " + APPEND_TO_EACH
+)
 CHARACTER_DESCRIPTION_TEMPLATE = (
     "Create a main character description in 250 characters or less, containing ONLY the description and "
     "not a single extra character or introductory phrase. "
@@ -105,12 +125,8 @@ MAIN_CHARACTER_GENDER_TEMPLATE = (
 output_dir = "storylines"
 
 def get_latest_json_file(directory):
-    """ Get the latest modified JSON file from the directory """
-    files = [f for f in os.listdir(directory) if f.endswith('.json')]
-    if not files:
-        return None
-    latest_file = max(files, key=lambda f: os.path.getmtime(os.path.join(directory, f)))
-    return os.path.join(directory, latest_file)
+    """ Get this run's story JSON from the run index (or the latest modified one in the directory) """
+    return find_story_file(directory)
 
 def get_story_context(current_story, initial_prompt, retry_count):
     """ Generate context for the story based on retry count. """
@@ -153,6 +169,9 @@ def get_phase(loop_index, total_loops):
 
 def calculate_cosine_similarity(text1, text2):
     """ Calculate the cosine similarity between two texts. """
+    # sklearn is only needed for this check, so it is imported on first use
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
     vectorizer = TfidfVectorizer().fit_transform([text1, text2])
     vectors = vectorizer.toarray()
     return cosine_similarity(vectors)[0, 1]
@@ -160,7 +179,7 @@ def calculate_cosine_similarity(text1, text2):
 def enhance_summary(current_summary, latest_addition):
     """ Enhance the overall summary with the latest story addition. """
     summary_prompt = SUMMARY_UPDATE_TEMPLATE.format(current_summary=current_summary, latest_addition=latest_addition)
-    enhanced_summary = get_story_response_from_model(MODEL_NAME, summary_prompt).strip()
+    enhanced_summary = get_story_response_from_model(MODEL_NAME, summary_prompt, template="enhance_summary").strip()
 
     # Remove any introductory phrases
     unintended_phrases = [
@@ -175,9 +194,57 @@ def enhance_summary(current_summary, latest_addition):
 
     return enhanced_summary
 
+def cap_summary_length(summary, max_chars=SYNOPSIS_SUMMARY_MAX_CHARS):
+    """ Trim an intermediate summary to max_chars, cutting at a sentence boundary where possible. """
+    summary = summary.strip()
+    if len(summary) <= max_chars:
+        return summary
+    trimmed = summary[:max_chars]
+    last_period = trimmed.rfind(". ")
+    return trimmed[:last_period + 1] if last_period > max_chars // 2 else trimmed[:max_chars - 3] + "..."
+
+def summarize_with_fallback(prompt, fallback_text):
+    """ Ask the model for a summary, falling back to the source text if the call fails. """
+    response = get_story_response_from_model(MODEL_NAME, prompt, template="summarize_with_fallback")
+    return cap_summary_length(response if response else fallback_text)
+
+def chunk_items(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def generate_hierarchical_summary(current_story, group_size=SYNOPSIS_GROUP_SIZE, max_workers=SYNOPSIS_MAX_PARALLEL_CALLS):
+    """ Map-reduce the chapters into one summary.
+
+    Chapter groups are summarized in parallel (map), then neighbouring summaries are merged group_size
+    at a time (reduce) until one remains.  Every prompt holds at most group_size capped texts, so prompt
+    size is bounded and latency grows with the tree depth, ceil(log_group_size(chapters)).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        level = list(executor.map(
+            propagate(lambda group: summarize_with_fallback(CHAPTER_GROUP_SUMMARY_TEMPLATE.format(chapters=" ".join(group)), " ".join(group))),
+            chunk_items(current_story, group_size)
+        ))
+        depth = 1
+        while len(level) > 1:
+            level = list(executor.map(
+                propagate(lambda group: group[0] if len(group) == 1 else summarize_with_fallback(SUMMARY_MERGE_TEMPLATE.format(summaries=" ".join(group)), " ".join(group))),
+                chunk_items(level, group_size)
+            ))
+            depth += 1
+    print(f"Hierarchical summary of {len(current_story)} chapters built with a reduce tree of depth {depth}.")
+    return level[0] if level else ""
+
+def use_hierarchical_synopsis(chapter_count):
+    if SYNOPSIS_MODE == "hierarchical":
+        return True
+    if SYNOPSIS_MODE == "auto":
+        return chapter_count >= HIERARCHICAL_SYNOPSIS_MIN_CHAPTERS
+    return False
+
 def generate_complete_synopsis(current_story, final_summary):
-    """ Generate a complete synopsis from selected lines in the story. """
-    if len(current_story) < 8:
+    """ Generate a complete synopsis from selected lines in the story, or from a hierarchical summary for long stories. """
+    if use_hierarchical_synopsis(len(current_story)):
+        selected_lines = [generate_hierarchical_summary(current_story)]
+    elif len(current_story) < 8:
         selected_lines = current_story
     else:
         selected_lines = []
@@ -192,14 +259,14 @@ def generate_complete_synopsis(current_story, final_summary):
 
     selected_lines_text = " ".join(selected_lines)
     synopsis_prompt = COMPLETE_SYNOPSIS_TEMPLATE.format(selected_lines=selected_lines_text, summary=final_summary)
-    complete_synopsis = get_story_response_from_model(MODEL_NAME, synopsis_prompt).strip()
+    complete_synopsis = get_story_response_from_model(MODEL_NAME, synopsis_prompt, template="generate_complete_synopsis").strip()
 
     return complete_synopsis
 
 def generate_main_character_description(model_name, complete_synopsis, initial_prompt, retries=3):
     """ Generate the main character description ensuring it is under 250 characters. """
     main_character_prompt = CHARACTER_DESCRIPTION_TEMPLATE.format(complete_synopsis=complete_synopsis, initial_prompt=initial_prompt)
-    character_description = get_story_response_from_model(model_name, main_character_prompt).strip()
+    character_description = get_story_response_from_model(model_name, main_character_prompt, template="generate_main_character_description").strip()
 
     # Improved clean-up to ensure only the description is returned
     def clean_character_description(text):
@@ -222,7 +289,7 @@ def generate_main_character_description(model_name, complete_synopsis, initial_p
     attempts = 0
     while len(character_description) > 250 and attempts < retries:
         reprompt = f"Simplify this character description to 250 characters or less without losing key information: \"{character_description}\""
-        character_description = get_story_response_from_model(model_name, reprompt).strip()
+        character_description = get_story_response_from_model(model_name, reprompt, template="clean_character_description").strip()
         character_description = clean_character_description(character_description)
         attempts += 1
 
@@ -238,7 +305,7 @@ def determine_main_character_gender(model_name, character_description, retries=3
     
     attempts = 0
     while attempts < retries:
-        gender_response = get_story_response_from_model(model_name, gender_prompt).strip().lower()
+        gender_response = get_story_response_from_model(model_name, gender_prompt, template="determine_main_character_gender").strip().lower()
         if gender_response in valid_responses:
             return gender_response
         attempts += 1
@@ -249,7 +316,7 @@ def determine_main_character_gender(model_name, character_description, retries=3
 def generate_movie_title(model_name, summary, character_description):
     """ Generate a movie title based on the story summary and main character description. """
     movie_title_prompt = MOVIE_TITLE_TEMPLATE.format(summary=summary, character_description=character_description)
-    movie_title = get_story_response_from_model(model_name, movie_title_prompt).strip()
+    movie_title = get_story_response_from_model(model_name, movie_title_prompt, template="generate_movie_title").strip()
     return movie_title
 
 def generate_tone_if_absent(model_name, synopsis):
@@ -257,11 +324,11 @@ def generate_tone_if_absent(model_name, synopsis):
     if USER_PROVIDED_TONE:
         return USER_PROVIDED_TONE
     tone_prompt = get_tone_prompt(synopsis)
-    tone_response = get_story_response_from_model(model_name, tone_prompt).strip()
+    tone_response = get_story_response_from_model(model_name, tone_prompt, template="generate_tone_if_absent").strip()
     return tone_response
 
 def write_story_segment(model_name, prompt, persona, main_character, main_character_superpower, loops, json_file, tone=None):
-    """ Generate story segments and save them to a file, updating JSON real-time. """
+    """ Generate story segments and save them to a file, journaling each new chapter. """
     current_story = [prompt]  # Initialize story with the prompt
     overall_summary = generate_summary(current_story)
 
@@ -269,19 +336,26 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
     if not tone:
         tone = generate_tone_if_absent(model_name, overall_summary)
 
-    for loop_index in range(loops):
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-            current_story = data["story_chapters"]
-            overall_summary = data["story_summary"]
-            user_image_path = data.get("user_image_path")
-            user_main_character_description = data.get("main_character_description")
-            main_character_age = data.get("main_character_age")
-            main_character_nationality = data.get("main_character_nationality")
-            main_character_name = data.get("main_character", main_character)  # Retrieve main character name when available
+    # Chapters are journaled as they are written; after a crash the journal is replayed and
+    # generation resumes after the last saved chapter (the first entry is the initial prompt)
+    journal = StoryJournal(json_file)
+    data = journal.data
+    current_story = data["story_chapters"]
+    overall_summary = data["story_summary"]
+    user_image_path = data.get("user_image_path")
+    user_main_character_description = data.get("main_character_description")
+    main_character_age = data.get("main_character_age")
+    main_character_nationality = data.get("main_character_nationality")
+    main_character_name = data.get("main_character", main_character)  # Retrieve main character name when available
+
+    # Extract the main character's superpower
+    main_character_superpower = data.get("main_character_superpower")
+
+    completed_loops = max(0, len(current_story) - 1)
+    if completed_loops:
+        print(f"Resuming story after {completed_loops} saved chapters.")
 
-            # Extract the main character's superpower
-            main_character_superpower = data.get("main_character_superpower")
+    for loop_index in range(completed_loops, loops):
 
         retry_count = 0
         phase = get_phase(loop_index, loops)
@@ -298,6 +372,7 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
         while retry_count <= MAX_RETRIES:
             current_story_text = get_story_context(current_story, prompt, retry_count)
             if current_story_text is None:
+                journal.close()
                 return current_story
 
             user_message = USER_MESSAGE_TEMPLATE.format(
@@ -310,7 +385,7 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
                 tone=tone  # Add tone here
             )
 
-            response = get_story_response_from_model(model_name, user_message)
+            response = get_story_response_from_model(model_name, user_message, template="write_story_segment")
             if response:
                 next_line = response.strip()
 
@@ -323,16 +398,12 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
                         break
 
                 if not is_duplicate:
-                    current_story.append(next_line)
                     previous_summary = overall_summary
                     overall_summary = enhance_summary(overall_summary, next_line)
 
-                    # Write the updated story and summary back to the JSON file after each API call
-                    data["story_chapters"] = current_story
-                    data["story_summary"] = overall_summary
-
-                    with open(json_file, 'w') as f:
-                        json.dump(data, f, indent=2, ensure_ascii=False)
+                    # Journal the new chapter and summary after each API call
+                    journal.append(["story_chapters"], next_line)
+                    journal.set(["story_summary"], overall_summary)
 
                     break
                 else:
@@ -344,9 +415,7 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
     complete_synopsis = generate_complete_synopsis(current_story, overall_summary)
 
     # Generate the main character description based on the complete synopsis and initial prompt
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-        initial_prompt = data["initial_prompt"]
+    initial_prompt = data["initial_prompt"]
 
     character_description = user_main_character_description if user_main_character_description else generate_main_character_description(model_name, complete_synopsis, initial_prompt, retries=3)
 
@@ -354,9 +423,6 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
     main_character_gender = determine_main_character_gender(model_name, character_description, retries=3)
 
     # Generate the main character description based on the complete synopsis and initial prompt
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-        initial_prompt = data["initial_prompt"]
 
     character_description = user_main_character_description if user_main_character_description else generate_main_character_description(model_name, complete_synopsis, initial_prompt, retries=3)
 
@@ -367,9 +433,7 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
     movie_title = generate_movie_title(model_name, overall_summary, character_description)
 
     # Save all the final details to JSON
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-    data.update({
+    journal.update({
         "complete_synopsis": complete_synopsis,
         "main_character_description": character_description,
         "main_character_gender": main_character_gender,
@@ -379,9 +443,7 @@ def write_story_segment(model_name, prompt, persona, main_character, main_charac
         "main_character_superpower": main_character_superpower,  # Add superpower to final details
         "tone": tone  # Add the tone here
     })
-
-    with open(json_file, 'w') as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    journal.close()
 
     return current_story
 
@@ -404,14 +466,13 @@ def main():
 
     if not json_file:
         print("No JSON file found in the directory.")
-        return
+        raise StageFailure("No story JSON file found")
 
-    with open(json_file, 'r') as f:
-        data = json.load(f)
-        initial_prompt = data["initial_prompt"]
-        persona = data["author"]
-        main_character = data["main_character"]  # Retrieve main character name
-        main_character_superpower = data.get("main_character_superpower")
+    data = load_story(json_file)
+    initial_prompt = data["initial_prompt"]
+    persona = data["author"]
+    main_character = data["main_character"]  # Retrieve main character name
+    main_character_superpower = data.get("main_character_superpower")
 
     tone = USER_PROVIDED_TONE if USER_PROVIDED_TONE else generate_tone_if_absent(MODEL_NAME, generate_summary([initial_prompt]))
 
@@ -427,4 +488,4 @@ def main():
 if __name__ == "__main__":
     atexit.register(stop_ollama_service)
     atexit.register(clear_gpu_memory)
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -12,6 +12,10 @@ from utilities.ollama_utils import (
     is_windows,
     get_story_response_from_model
 )
+from utilities.negative_prompt_utils import build_negative_prompt
+from utilities.run_index_utils import find_story_file, record_artifact
+from utilities.story_journal_utils import load_story, journal_path_for
+from utilities.profiling_utils import run_main
 
 try:
     import GLOBAL_VARIABLES  # Import the global variables module
@@ -19,6 +23,7 @@ except ImportError:
     class GLOBAL_VARIABLES:  # A dummy class to act as a placeholder for missing GLOBAL_VARIABLES
         GLOBAL_MODEL_NAME = None
         DELETE_INITIAL_STORYLINE_JSON = False
+        USE_LLM_NEGATIVE_PROMPTS = False
 
 # Define the model name with fallback
 MODEL_NAME = getattr(GLOBAL_VARIABLES, 'GLOBAL_MODEL_NAME', 'llama3')
@@ -26,6 +31,9 @@ MODEL_NAME = getattr(GLOBAL_VARIABLES, 'GLOBAL_MODEL_NAME', 'llama3')
 # Define the deletion flag for initial JSON with fallback
 DELETE_INITIAL_STORYLINE_JSON = getattr(GLOBAL_VARIABLES, 'DELETE_INITIAL_STORYLINE_JSON', False)
 
+# Negative prompts are built locally from a lexicon unless the old per-chapter LLM call is requested
+USE_LLM_NEGATIVE_PROMPTS = getattr(GLOBAL_VARIABLES, 'USE_LLM_NEGATIVE_PROMPTS', False)
+
 DIRECTORY_PATH = 'storylines'  # Directory where the JSON file is created
 
 # Constant to append to each prompt to avoid filler information
@@ -79,12 +87,11 @@ SUPERPOWER_PROMPT = "Name a single-word hobby, skill, or human superpower." + AP
 AGE_PROMPT = "Pick a suitable age between 6 and 80 for the main character." + APPEND_TO_EACH
 
 def find_latest_non_summarized_json_file(directory_path):
-    """Find the latest non-summarized JSON file in the specified directory."""
-    json_files = [f for f in os.listdir(directory_path) if f.endswith('.json') and "_summaries" not in f]
-    if not json_files:
+    """Find this run's non-summarized JSON file via the run index (or the latest one in the directory)."""
+    json_file = find_story_file(directory_path)
+    if not json_file:
         raise FileNotFoundError("No non-summarized JSON files found in the specified directory.")
-    latest_file = max(json_files, key=lambda f: os.path.getmtime(os.path.join(directory_path, f)))
-    return os.path.join(directory_path, latest_file)
+    return json_file
 
 # Update function to include synopsis and previous chapter summary
 def get_single_sentence_summary(model_name, line, synopsis, preceding_chapter_summary):
@@ -94,13 +101,13 @@ def get_single_sentence_summary(model_name, line, synopsis, preceding_chapter_su
         preceding_chapter_summary=preceding_chapter_summary,
         line=line
     )
-    summary = get_story_response_from_model(model_name, summary_prompt).strip()
+    summary = get_story_response_from_model(model_name, summary_prompt, template="get_single_sentence_summary").strip()
     return summary
 
 def get_comma_separated_summary(model_name, line):
     """Generate a comma-separated summary for use in the positive AI prompt."""
     summary_prompt = CHAPTER_REQUEST_TEMPLATE.format(line=line)
-    summary = get_story_response_from_model(model_name, summary_prompt).strip()
+    summary = get_story_response_from_model(model_name, summary_prompt, template="get_comma_separated_summary").strip()
     return summary
 
 def generate_main_character_summary(model_name, main_character_description):
@@ -109,7 +116,7 @@ def generate_main_character_summary(model_name, main_character_description):
         "Generate a maximum of 5 comma-separated single words describing the character: \"{description}\". "
         "Respond with only the 5 words, nothing more."
     ).format(description=main_character_description)
-    main_character_summary = get_story_response_from_model(model_name, main_character_summary_prompt).strip()
+    main_character_summary = get_story_response_from_model(model_name, main_character_summary_prompt, template="generate_main_character_summary").strip()
     return main_character_summary
 
 def generate_positive_ai_prompt(main_character_age, main_character_gender, main_character_superpower, main_character_summary, line_summary, model_name, line, previous_chapter_summary):
@@ -122,7 +129,7 @@ def generate_positive_ai_prompt(main_character_age, main_character_gender, main_
     if main_character_superpower:
         char_description += f"{main_character_superpower}, "
     
-    scene_details = get_story_response_from_model(model_name, POSITIVE_AI_PROMPT_TEMPLATE.format(line=line)).strip()
+    scene_details = get_story_response_from_model(model_name, POSITIVE_AI_PROMPT_TEMPLATE.format(line=line), template="POSITIVE_AI_PROMPT_TEMPLATE").strip()
 
     # Include details to connect with the previous chapter for continuity
     if previous_chapter_summary:
@@ -134,9 +141,11 @@ def generate_positive_ai_prompt(main_character_age, main_character_gender, main_
     return positive_prompt.rstrip(', ')
 
 def generate_negative_ai_prompt(model_name, line):
-    """Generate a negative AI prompt for a single line using the model."""
+    """Generate a negative AI prompt for a single line, locally from the lexicon or using the model."""
+    if not USE_LLM_NEGATIVE_PROMPTS:
+        return build_negative_prompt(line)
     negative_prompt = NEGATIVE_AI_PROMPT_TEMPLATE.format(line=line)
-    prompt_response = get_story_response_from_model(model_name, negative_prompt).strip()
+    prompt_response = get_story_response_from_model(model_name, negative_prompt, template="generate_negative_ai_prompt").strip()
     if len(prompt_response) > 300:
         prompt_response = prompt_response[:297] + "..."
     return prompt_response
@@ -144,7 +153,7 @@ def generate_negative_ai_prompt(model_name, line):
 def generate_keywords(model_name, summary):
     """Generate keywords based on the overall summary of the story."""
     keywords_prompt = KEYWORDS_REQUEST_TEMPLATE.format(summary=summary)
-    keywords_response = get_story_response_from_model(model_name, keywords_prompt).strip()
+    keywords_response = get_story_response_from_model(model_name, keywords_prompt, template="generate_keywords").strip()
     
     unintended_phrases = ["Here are the keywords:", "The keywords are:", "Keywords:", "Here are the top keywords:", "Generated keywords:"]
     
@@ -161,39 +170,41 @@ def generate_keywords(model_name, summary):
     
     return ", ".join(keywords_list)
 
-def summarize_story_chapters(json_file_path, model_name):
-    """Summarize each chapter in the story and save as summaries."""
-    with open(json_file_path, 'r') as f:
-        data = json.load(f)
-
-    story_chapters = data.get("story_chapters", [])
-    summarized_chapters = []
-
-    main_character_name = data.get("main_character", "unknown character")
+def summarize_chapter(model_name, chapter, data, previous_chapter_summary):
+    """Summary and image prompts for one chapter's text (regenerate_chapter.py redoes single chapters with it)."""
     main_character_gender = data.get("main_character_gender", "")
     main_character_age = data.get("main_character_age", None)
     main_character_description = data.get("main_character_description", "unspecified description")
     main_character_superpower = data.get("main_character_superpower", None)
     overall_synopsis = data.get("initial_prompt", "")
 
+    line_summary_comma_separated = get_comma_separated_summary(model_name, chapter)
+    main_character_summary = generate_main_character_summary(model_name, main_character_description)
+    positive_ai_prompt = generate_positive_ai_prompt(main_character_age, main_character_gender, main_character_superpower, main_character_summary, line_summary_comma_separated, model_name, chapter, previous_chapter_summary)
+    negative_ai_prompt = generate_negative_ai_prompt(model_name, chapter)
+    line_summary_single_sentence = get_single_sentence_summary(model_name, chapter, overall_synopsis, previous_chapter_summary)
+    return {
+        "chapter": chapter,
+        "chapter_summary": line_summary_single_sentence,
+        "positive_ai_prompt": positive_ai_prompt,
+        "negative_ai_prompt": negative_ai_prompt
+    }
+
+def summarize_story_chapters(json_file_path, model_name):
+    """Summarize each chapter in the story and save as summaries."""
+    data = load_story(json_file_path)  # Includes chapters still only in the journal
+
+    story_chapters = data.get("story_chapters", [])
+    summarized_chapters = []
+
     previous_chapter_summary = None
     combined_chapters = ""
 
     for index, chapter in enumerate(story_chapters):
         if isinstance(chapter, str):
             print(f"Summarizing chapter {index + 1}/{len(story_chapters)}")
-            line_summary_comma_separated = get_comma_separated_summary(model_name, chapter)
-            main_character_summary = generate_main_character_summary(model_name, main_character_description)
-            positive_ai_prompt = generate_positive_ai_prompt(main_character_age, main_character_gender, main_character_superpower, main_character_summary, line_summary_comma_separated, model_name, chapter, previous_chapter_summary)
-            negative_ai_prompt = generate_negative_ai_prompt(model_name, chapter)
-            line_summary_single_sentence = get_single_sentence_summary(model_name, chapter, overall_synopsis, previous_chapter_summary)
-            summarized_chapters.append({
-                "chapter": chapter,
-                "chapter_summary": line_summary_single_sentence,
-                "positive_ai_prompt": positive_ai_prompt,
-                "negative_ai_prompt": negative_ai_prompt
-            })
-            previous_chapter_summary = line_summary_single_sentence
+            summarized_chapters.append(summarize_chapter(model_name, chapter, data, previous_chapter_summary))
+            previous_chapter_summary = summarized_chapters[-1]["chapter_summary"]
             combined_chapters += f"Chapter {index + 1}: {chapter}\n"
         else:
             print(f"Skipping invalid chapter data at index {index}")
@@ -213,16 +224,16 @@ def summarize_story_chapters(json_file_path, model_name):
         json.dump(data, f, indent=2, ensure_ascii=False)
 
     print(f"Summaries and keywords saved to {summary_output_path}")
+    record_artifact("summaries", summary_output_path, stage="3_summarize_chapters_add_ai_prompts")
 
     if DELETE_INITIAL_STORYLINE_JSON:
         os.remove(json_file_path)
+        if os.path.exists(journal_path_for(json_file_path)):
+            os.remove(journal_path_for(json_file_path))
         print(f"Deleted original JSON file: {json_file_path}")
 
-def main():
-    global MODEL_NAME, DIRECTORY_PATH
-
-    start_time = time.time()
-
+def start_model_service():
+    """Restart Ollama with the story model installed (stop it again with stop_ollama_service())."""
     kill_existing_ollama_service()
     clear_gpu_memory()
 
@@ -232,6 +243,13 @@ def main():
         start_ollama_service_windows()
         time.sleep(10)
 
+def main():
+    global MODEL_NAME, DIRECTORY_PATH
+
+    start_time = time.time()
+
+    start_model_service()
+
     latest_json_file = find_latest_non_summarized_json_file(DIRECTORY_PATH)
     print(f"Processing latest non-summarized JSON file: {latest_json_file}")
 
@@ -247,4 +265,4 @@ def main():
 if __name__ == "__main__":
     atexit.register(stop_ollama_service)
     atexit.register(clear_gpu_memory)
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
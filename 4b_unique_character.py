@@ -1,14 +1,11 @@
 import os
 import sys
 import time
-import json
 import random
 import logging
 from datetime import datetime
 import re
-import torch
-from diffusers import StableDiffusionXLPipeline, DPMSolverMultistepScheduler
-from PIL import Image
+from functools import lru_cache
 
 import GLOBAL_VARIABLES as gv
 
@@ -19,6 +16,13 @@ if utilities_path not in sys.path:
 
 import utilities.stablediffusion_utils as sdu
 from utilities.enhance_image_via_import import enhance_image
+from utilities.run_index_utils import find_summary_file
+from utilities.story_journal_utils import StoryJournal
+from utilities.run_context_utils import run_path
+from utilities.tracing_utils import span
+from utilities.profile_utils import capped_steps, has_current_image, record_image
+from utilities.profiling_utils import run_main
+from utilities.failure_utils import StageFailure
 
 # Setup logging
 logging.basicConfig(level=logging.DEBUG)
@@ -26,16 +30,21 @@ logging.basicConfig(level=logging.DEBUG)
 # Define scheduler and settings
 SPECIFIC_SCHEDULER = "DPM++ 2M Karras"
 guidance_scale = 8.0
-num_inference_steps = 30
+num_inference_steps = capped_steps(30)  # MAX_INFERENCE_STEPS (draft profile) caps it
+ENHANCE_IMAGES = getattr(gv, 'ENHANCE_IMAGES', True)
 negative_prompt = "blurry, ugly, duplicate, poorly drawn face, deformed, mosaic, artifacts, bad limbs"
 RANDOMIZE_SEED = True  # Set to True to randomize the seed
 fixed_seed = 3450349066
-seed = fixed_seed if not RANDOMIZE_SEED else random.randint(0, 2**32 - 1)
-torch.manual_seed(seed)  # Set the global seed for reproducibility
 
 model_id = "stabilityai/stable-diffusion-xl-base-1.0"
-pipe = StableDiffusionXLPipeline.from_pretrained(model_id, torch_dtype=torch.float16)
-pipe = pipe.to("cuda")
+
+@lru_cache(maxsize=None)
+def get_pipeline():
+    """Load the SDXL pipeline once; later runs in the same process reuse it."""
+    import torch
+    from diffusers import StableDiffusionXLPipeline
+    pipe = StableDiffusionXLPipeline.from_pretrained(model_id, torch_dtype=torch.float16)
+    return pipe.to("cuda")
 
 # Directory paths
 GENERATED_IMAGES_PATH = "generated_images"
@@ -49,22 +58,14 @@ def create_directories(path):
     if not os.path.exists(path):
         os.makedirs(path)
 
-# Ensure the output directories exist
-create_directories(GENERATED_IMAGES_PATH)
-create_directories(ENHANCED_IMAGES_PATH)
-create_directories(COMPARISONS_PATH)
-
 # Function to get the current timestamp
 def get_timestamp():
     return datetime.now().strftime("%Y%m%d_%H%M%S")
 
-def update_storyline_with_generated_image(storyline_data, index, model_name, filename, storyline_path):
+def update_storyline_with_generated_image(journal, index, model_name, filename):
     sanitized_model_name = re.sub(r'\W+', '_', model_name)
     chapter_image_key = f"chapter_image_location_{sanitized_model_name}"
-    storyline_data['story_chapters'][index][chapter_image_key] = filename
-
-    with open(storyline_path, 'w') as json_file:
-        json.dump(storyline_data, json_file, indent=2)
+    record_image(journal, index, chapter_image_key, filename)
 
 def ensure_subdir(base_dir, subdir_name):
     path = os.path.join(base_dir, subdir_name)
@@ -73,24 +74,33 @@ def ensure_subdir(base_dir, subdir_name):
     return path
 
 def generate_images_for_character():
-    storyline_files = [f for f in os.listdir(sdu.STORYLINES_PATH) if f.endswith('_summaries.json')]
-    if not storyline_files:
+    import torch
+    from diffusers import DPMSolverMultistepScheduler
+    seed = fixed_seed if not RANDOMIZE_SEED else random.randint(0, 2**32 - 1)
+    torch.manual_seed(seed)  # Set the global seed for reproducibility
+    pipe = get_pipeline()
+
+    storyline_path = find_summary_file(sdu.STORYLINES_PATH)
+    if not storyline_path:
         logging.error("No storyline files are found in storylines")
-        return
+        raise StageFailure("No storyline files are found in storylines")
 
-    latest_file = max(storyline_files, key=lambda f: os.path.getctime(os.path.join(sdu.STORYLINES_PATH, f)))
-    storyline_path = os.path.join(sdu.STORYLINES_PATH, latest_file)
-
-    with open(storyline_path, 'r') as f:
-        storyline_data = json.load(f)
+    journal = StoryJournal(storyline_path)
+    storyline_data = journal.data
 
     story_chapters = storyline_data['story_chapters']
 
     # Ensure sub-directory for model within ENHANCED_IMAGES_PATH
     model_subdir = re.sub(r'\W+', '_', SPECIFIC_SCHEDULER)
-    model_enhanced_path = ensure_subdir(ENHANCED_IMAGES_PATH, model_subdir)
+    model_enhanced_path = ensure_subdir(run_path(ENHANCED_IMAGES_PATH), model_subdir)
 
+    chapter_image_key = f"chapter_image_location_{model_subdir}"
     for i, scene in enumerate(story_chapters, start=1):
+        # Resume: skip scenes that already got an image before an interruption
+        if isinstance(scene, dict) and has_current_image(scene, chapter_image_key):
+            logging.info(f"Scene {i} already has an image: {scene[chapter_image_key]}. Skipping.")
+            continue
+
         prompt = f"{gv.USER_PROVIDED_EXACT_CHARACTER}, a superhero, {scene} Highly detailed, sharp, photorealism, cinematic lighting"
         
         pipe.scheduler = DPMSolverMultistepScheduler.from_config(pipe.scheduler.config)
@@ -103,22 +113,28 @@ def generate_images_for_character():
         if RANDOMIZE_SEED:
             generator_seed = random.randint(0, 2**32 - 1)
         generator = torch.Generator(device="cuda").manual_seed(generator_seed)
-        result = pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=guidance_scale,
-            generator=generator
-        )
+        with span("sdxl.generate", "diffusion", scene=i, steps=num_inference_steps):
+            result = pipe(
+                prompt=prompt,
+                negative_prompt=negative_prompt,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=guidance_scale,
+                generator=generator
+            )
         image = result.images[0]
         time_taken = time.time() - start_time
 
         timestamp = get_timestamp()
         output_image_name = f"scene_{i}_DPM++_2M_Karras_{timestamp}.png"
-        output_image_path = os.path.join(GENERATED_IMAGES_PATH, output_image_name)
+        # Without the enhancement pass (draft profile) the generated image is the chapter image, so it goes where stage 5 looks
+        output_image_path = run_path(GENERATED_IMAGES_PATH, output_image_name) if ENHANCE_IMAGES else os.path.join(model_enhanced_path, output_image_name)
         image.save(output_image_path)
         logging.info(f"Generated image for scene {i} with DPM++ 2M Karras saved as {output_image_path} (time taken: {time_taken:.2f}s)")
 
+        if not ENHANCE_IMAGES:
+            update_storyline_with_generated_image(journal, i-1, SPECIFIC_SCHEDULER, output_image_path)
+            continue
+
         # Enhance the image
         try:
             enhanced_image_result = enhance_image(output_image_path, model_enhanced_path)
@@ -129,9 +145,20 @@ def generate_images_for_character():
             logging.info(f"Enhanced image saved as {enhanced_image_result_path}")
             
             # Update the storyline with the generated image filename
-            update_storyline_with_generated_image(storyline_data, i-1, SPECIFIC_SCHEDULER, enhanced_image_result_path, storyline_path)
+            update_storyline_with_generated_image(journal, i-1, SPECIFIC_SCHEDULER, enhanced_image_result_path)
         
         except Exception as e:
             logging.error(f"Error enhancing image: {output_image_path}, error: {e}")
 
-generate_images_for_character()
\ No newline at end of file
+    journal.close()
+
+def main():
+    # Ensure the output directories exist
+    create_directories(run_path(GENERATED_IMAGES_PATH))
+    create_directories(run_path(ENHANCED_IMAGES_PATH))
+    create_directories(run_path(COMPARISONS_PATH))
+
+    generate_images_for_character()
+
+if __name__ == "__main__":
+    run_main(main)
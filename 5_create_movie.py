@@ -4,11 +4,11 @@ import shutil
 import argparse
 import subprocess
 import random
-import json
 import time
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from datetime import datetime
-import yt_dlp  # Import yt-dlp properly
 
 from utilities.rfm_music_utils import (
     create_directories, fetch_lilla_random_song, download_youtube_video,
@@ -16,6 +16,17 @@ from utilities.rfm_music_utils import (
     YOUTUBE_DIRECTORY, trim_audio_to_length
 )
 from utilities.google_tts_utils import generate_tts_audio, adjust_audio_speed  # Import adjust_audio_speed
+from utilities.run_index_utils import find_summary_file, record_artifact
+from utilities.profile_utils import ffmpeg_quality_args
+from utilities.run_context_utils import run_path
+from utilities.tracing_utils import traced_run, propagate
+from utilities.story_journal_utils import load_story, StoryJournal
+from utilities.story_model_utils import story_from_data
+from utilities import chapter_stream_utils
+from utilities.profiling_utils import run_main
+from utilities.scratch_utils import ScratchSpace
+from utilities.story_pack_utils import input_exists, input_size, copy_input, open_input
+from utilities.failure_utils import StageFailure, UnitFailure, run_unit, chapter_unit, record_placeholder
 
 try:
     from GLOBAL_VARIABLES import DEFAULT_VIDEO_LENGTH as GLOBAL_DEFAULT_VIDEO_LENGTH
@@ -23,6 +34,10 @@ try:
 except ImportError:
     GLOBAL_DEFAULT_VIDEO_LENGTH = 55
     USER_PROVIDED_YOUTUBE_MUSIC = ""
+try:
+    from GLOBAL_VARIABLES import STREAM_CHAPTER_SEGMENTS
+except ImportError:
+    STREAM_CHAPTER_SEGMENTS = False
 
 # Configurations
 output_folder = 'enhanced_images'
@@ -32,17 +47,22 @@ temp_group_folder = os.path.join(temp_tts_creation, 'temp_group_images')
 temp_image_folder = os.path.join(temp_tts_creation, 'temp_images_on_create_video')
 tts_durations_folder = os.path.join(temp_tts_creation, 'tts_durations')
 storylines_folder = 'storylines'
+placeholder_folder = 'placeholder_images'  # Title cards for chapters stage 4 has no image for
 
 # Speed of the speech (normal speed is 1.0)
 SPEED_OF_SPEECH = 1.4  # Recommended range: 0.5 to 2.0; lower for slower, higher for faster.
+PRERENDER_POLL_SECONDS = 1.0  # How often prerender_segments() looks for new chapter images
+SCRATCH_BYTES_PER_CHAPTER = 2 * 2**20  # TTS and atempo MP3s, on top of two copies of the image
+MOVIE_STAGE = "5_create_movie"
+IMAGE_STAGE = "4_create_images_from_ai_prompts"  # Where a missing chapter image is recorded, so stage 4 retries it
+PLACEHOLDER_COLOR = (24, 24, 32)
 
 def ensure_directory_exists(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def convert_images_to_jpeg(image_folder, temp_directory):
-    """Convert all images in the folder to JPEG and save with consistent naming, with retries."""
-    image_files = sorted(f for f in os.listdir(image_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+def convert_images_to_jpeg(image_files, temp_directory):
+    """Convert the images (in chapter order) to JPEG and save with consistent naming, with retries."""
     temp_image_paths = []
    
     def convert_image_with_retries(image_path, output_path, retry_attempts=3):
@@ -59,20 +79,20 @@ def convert_images_to_jpeg(image_folder, temp_directory):
                     time.sleep(attempt * 2)
         return False
 
-    for i, image_file in enumerate(image_files):
-        image_path = os.path.join(image_folder, image_file)
+    for i, image_path in enumerate(image_files):
         output_path = os.path.join(temp_directory, f'img{i:03d}.jpg')
         success = convert_image_with_retries(image_path, output_path)
         if not success:
-            print(f"Failed to convert {image_file} after multiple attempts.")
+            print(f"Failed to convert {image_path} after multiple attempts.")
     
     return temp_image_paths
 
-def generate_video_from_images(image_folder, audio_file, output_file, display_durations, temp_directory):
+def generate_video_from_images(image_files, audio_file, output_file, display_durations, temp_directory):
     # Ensure all directories exist
     ensure_directory_exists(temp_directory)
 
-    temp_jpeg_images = convert_images_to_jpeg(image_folder, temp_directory)
+    # The images stay in chapter order, matching display_durations (file names do not sort that way)
+    temp_jpeg_images = convert_images_to_jpeg(image_files, temp_directory)
     
     input_txt_path = os.path.join(temp_directory, 'input.txt')
     # Opening the input file within the context so it's properly handled
@@ -88,16 +108,12 @@ def generate_video_from_images(image_folder, audio_file, output_file, display_du
             f.write(f"duration {last_duration}\n")
 
     # Run ffmpeg to process the video
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-f', 'concat', '-safe', '0', '-i', input_txt_path, '-i', audio_file,
-        '-c:v', 'libx264', '-vf', 'scale=-2:720,setsar=1', 
+        '-c:v', 'libx264', *ffmpeg_quality_args(), '-vf', 'scale=-2:720,setsar=1', 
         '-shortest', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-b:a', '192k', output_file
     ], check=True)
-    
-    # Clean up the temporary JPEG files and input.txt
-    for temp_file in temp_jpeg_images:
-        os.remove(temp_file)
-    os.remove(input_txt_path)
+    # The JPEG files and input.txt go with the scratch space
 
 def sanitize_filename(filename):
     """Sanitize the filename to be alphanumeric with underscores, preserving extension."""
@@ -115,7 +131,7 @@ def convert_to_mp3(input_filepath, output_filepath):
     """Convert an audio file to mp3 using ffmpeg."""
     try:
         # Direct ffmpeg command to convert audio files
-        result = subprocess.run(
+        result = traced_run(
             ['ffmpeg', '-y', '-i', input_filepath, '-q:a', '0', '-map', 'a', output_filepath],
             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
         )
@@ -131,6 +147,7 @@ def convert_to_mp3(input_filepath, output_filepath):
 
 def download_youtube_video(url, output_dir, video_length):
     """Download a video from YouTube and sanitize the filename, converting audio to mp3 if necessary."""
+    import yt_dlp
     try:
         # Ensure the output directory exists
         ensure_directory_exists(output_dir)
@@ -201,46 +218,69 @@ def unique_filepath(filepath):
     base, ext = os.path.splitext(filepath)
     return f"{base}_{datetime.now().strftime('%H%M%S')}{ext}"
 
-def get_latest_summary_file(directory):
-    latest_file, latest_time = None, None
-    formats = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
-    for filename in os.listdir(directory):
-        if filename.endswith("_summaries.json"):
-            for fmt in formats:
-                try:
-                    file_time = datetime.strptime(filename[:16], fmt)
-                    if not latest_time or file_time > latest_time:
-                        latest_time, latest_file = file_time, os.path.join(directory, filename)
-                except ValueError:
-                    continue
-    return latest_file
-
 def read_json(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return load_story(file_path)  # Replays a journal left by a stage that crashed
     except Exception as e:
         print(f"[ERROR] Failed to read JSON file {file_path}: {e}")
         return None
 
 def write_json(data, file_path):
     try:
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        # Atomic snapshot; data already holds any journaled changes, so the journal is folded in and removed
+        StoryJournal(file_path, data=data, indent=4).compact()
         print(f"[INFO] JSON file {file_path} updated successfully.")
     except Exception as e:
         print(f"[ERROR] Failed to write to JSON file {file_path}: {e}")
 
-def find_enhanced_images(data):
+def placeholder_card(model_name, chapter, size):
+    """A title card standing in for a chapter image stage 4 could not make, so the chapter keeps its place and narration."""
+    from PIL import ImageDraw, ImageFont
+
+    card_path = run_path(placeholder_folder, model_name, f"chapter_{chapter.number}.png")
+    os.makedirs(os.path.dirname(card_path), exist_ok=True)
+    card = Image.new('RGB', size, PLACEHOLDER_COLOR)
+    draw = ImageDraw.Draw(card)
+    font_size = max(16, size[1] // 16)
+    try:
+        font = ImageFont.load_default(size=font_size)
+    except TypeError:  # Pillow before 10.1 only has the small bitmap font
+        font = ImageFont.load_default()
+    lines = [f"Chapter {chapter.number}", ""] + textwrap.wrap(chapter.summary or "", width=36)[:6]
+    y = size[1] // 4
+    for line in lines:
+        draw.text((size[0] // 10, y), line, fill=(235, 235, 235), font=font)
+        y += int(font_size * 1.4)
+    card.save(card_path)
+    return card_path
+
+def _image_size(image_path):
+    with open_input(image_path) as f:
+        return Image.open(f).size
+
+def find_enhanced_images(data, placeholders=False):
+    """{model: [(enhanced image, chapter summary, chapter dict in data)]} in chapter order.
+
+    With placeholders, every chapter is included: one whose image is missing gets a title card, and the missing image
+    is recorded so stage 4 retries that chapter the next time it runs.  Without, such chapters are left out.
+    """
+    story = story_from_data(data)
     enhanced_images = {}
-    for chapter in data.get("story_chapters", []):
-        for key, value in chapter.items():
-            if key.startswith("chapter_image_location_"):
-                if "_subtitled" not in key and "enhanced_images" in value:
-                    model_name = key.replace("chapter_image_location_", "")
-                    if model_name not in enhanced_images:
-                        enhanced_images[model_name] = []
-                    enhanced_images[model_name].append((value, chapter["chapter_summary"], chapter))
+    for model_name in story.models():
+        images = {chapter.index: image_path for chapter, image_path in story.images_for(model_name)
+                  if "enhanced_images" in image_path and (not placeholders or input_exists(image_path))}
+        if not images:
+            continue
+        card_size = None
+        for chapter in story.chapters:
+            image_path = images.get(chapter.index)
+            if image_path is None:
+                if not placeholders or chapter.text_only:
+                    continue
+                card_size = card_size or _image_size(next(iter(images.values())))
+                image_path = placeholder_card(model_name, chapter, card_size)
+                record_placeholder(IMAGE_STAGE, chapter_unit(model_name, chapter.index), image_path, chapter=chapter.index)
+            enhanced_images.setdefault(model_name, []).append((image_path, chapter.summary, data["story_chapters"][chapter.index]))
     return enhanced_images
 
 def sanitize_filename_component(component, length=20):
@@ -254,8 +294,9 @@ def generate_video_filename(model_name, chapter_summary, audio_file, group_time_
     return f"{model_name}_{chapter_part}_{audio_base}_{group_time_str}_{int(final_video_length)}s.mp4"
 
 def cleanup_temp_directories():
-    if os.path.exists(temp_tts_creation):
-        shutil.rmtree(temp_tts_creation)
+    temp_dir = run_path(temp_tts_creation)
+    if os.path.exists(temp_dir):
+        shutil.rmtree(temp_dir)
 
 def update_json_with_timings(data, enhanced_images, chapters_info):
     """Update the JSON data with start and end times for each chapter."""
@@ -267,110 +308,231 @@ def update_json_with_timings(data, enhanced_images, chapters_info):
             chapter["chapter_summary_end_time"] = end_time
     return data
 
-def main():
+def render_segments(model_name, images_and_summaries, executor):
+    """Streaming mode: every chapter's narration length and video segment, rendered in parallel and returned in chapter order.
+
+    Raises UnitFailure (after the other chapters finish) when a chapter's segment cannot be rendered.
+    """
+    futures = [executor.submit(propagate(run_unit), MOVIE_STAGE, chapter_unit(model_name, i, "segment"), chapter_stream_utils.chapter_segment,
+                               model_name, image_path, summary, SPEED_OF_SPEECH, chapter=i)
+               for i, (image_path, summary, _) in enumerate(images_and_summaries)]
+    results = [future.exception() or future.result() for future in futures]
+    failure = next((result for result in results if isinstance(result, BaseException)), None)
+    if failure:
+        raise failure
+    return results
+
+def narration_duration(summary, tts_audio_file, adjusted_tts_audio_file):
+    """Length of the chapter summary read aloud at SPEED_OF_SPEECH."""
+    generate_tts_audio(summary, output_file=tts_audio_file)
+
+    # Adjust the speed of the TTS audio
+    adjust_audio_speed(tts_audio_file, SPEED_OF_SPEECH, output_file=adjusted_tts_audio_file)
+
+    result = traced_run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', adjusted_tts_audio_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    return float(result.stdout)
+
+def music_cache_path(video_length):
+    return run_path(chapter_stream_utils.STREAM_FOLDER, f"music_{video_length:.3f}.txt")
+
+def take_prefetched_music(video_length):
+    """Music that prerender_segments() already downloaded for this length (each file is used for one movie only)."""
+    cache_file = music_cache_path(video_length)
+    if not os.path.exists(cache_file):
+        return None
+    with open(cache_file, 'r', encoding='utf-8') as f:
+        audio_file = f.read().strip()
+    os.remove(cache_file)
+    return audio_file if os.path.exists(audio_file) else None
+
+def prerender_chapter(model_name, image_path, summary):
+    try:
+        chapter_stream_utils.chapter_segment(model_name, image_path, summary, SPEED_OF_SPEECH)
+    except Exception as e:
+        print(f"[WARNING] Could not prerender the segment for {image_path}: {e}")  # main() renders it again
+
+def prefetch_music(summaries):
+    """Narrate every chapter (the summaries exist before the images do) and download music for the movie's length."""
+    try:
+        durations = [chapter_stream_utils.narration_seconds(summary, SPEED_OF_SPEECH) for summary in summaries]
+        video_length = sum(max(duration, chapter_stream_utils.MIN_DISPLAY_SECONDS) for duration in durations)
+        audio_file = download_audio(video_length)
+        if audio_file:
+            with open(music_cache_path(video_length), 'w', encoding='utf-8') as f:
+                f.write(audio_file)
+    except Exception as e:
+        print(f"[WARNING] Could not prefetch the music: {e}")
+
+def prerender_segments(stop_event, poll_seconds=PRERENDER_POLL_SECONDS):
+    """Render chapter segments while stage 4 is still generating images (run_all.py -stream), until stop_event is set.
+
+    main() -stream afterwards finds them cached, so the movie only needs the concat.
+    """
+    submitted = set()
+    music_prefetched = False
+    with ThreadPoolExecutor(max_workers=chapter_stream_utils.STREAM_WORKERS) as executor:
+        while True:
+            stopping = stop_event.is_set()  # Checked before the scan, so images written just before the stop are picked up
+            json_file_path = find_summary_file(storylines_folder)
+            try:
+                data = load_story(json_file_path) if json_file_path else None
+            except (OSError, ValueError):
+                data = None  # Caught mid-compaction; try again on the next poll
+            if data:
+                if not music_prefetched:
+                    music_prefetched = True
+                    summaries = [chapter["chapter_summary"] for chapter in data.get("story_chapters", []) if isinstance(chapter, dict)]
+                    executor.submit(propagate(prefetch_music), summaries)
+                for model_name, images_and_summaries in find_enhanced_images(data).items():
+                    for image_path, summary, _ in images_and_summaries:
+                        if (model_name, image_path) not in submitted and os.path.exists(image_path):
+                            submitted.add((model_name, image_path))
+                            executor.submit(propagate(prerender_chapter), model_name, image_path, summary)
+            if stopping:
+                break
+            stop_event.wait(poll_seconds)
+
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Create movie from enhanced images.")
     parser.add_argument('-length', type=int, default=GLOBAL_DEFAULT_VIDEO_LENGTH, help="Desired length of the video in seconds.")
-    args = parser.parse_args()
+    parser.add_argument('-stream', action='store_true', default=STREAM_CHAPTER_SEGMENTS,
+                        help="Render every chapter as its own segment (in parallel, reusing prerendered ones) and stream-copy concat them.")
+    args = parser.parse_args(argv)
     video_length = args.length
 
-    ensure_directory_exists(videos_folder)
-    ensure_directory_exists(temp_group_folder)
-    ensure_directory_exists(temp_image_folder)
-    ensure_directory_exists(tts_durations_folder)
+    create_directories()
+
+    # Resolve the working folders against the active run directory (if any)
+    videos_dir = run_path(videos_folder)
+    ensure_directory_exists(videos_dir)
 
-    json_file_path = get_latest_summary_file(storylines_folder)
+    json_file_path = find_summary_file(storylines_folder)
     if not json_file_path:
         print("[ERROR] No summary JSON file found.")
-        return
+        raise StageFailure("No summary JSON file found")
 
     data = read_json(json_file_path)
     if data is None:
-        return
+        raise StageFailure(f"Could not read {json_file_path}")
 
-    enhanced_images = find_enhanced_images(data)
+    enhanced_images = find_enhanced_images(data, placeholders=True)
     if not enhanced_images:
         print("[INFO] No enhanced images found.")
         return
 
     created_videos = {}
     chapters_info = {}
+    chapter_segments = {}
+
+    # Intermediates (image copies, JPEGs, TTS files) live in memory when /dev/shm has room for them
+    expected_bytes = sum((input_size(image) * 2 if input_exists(image) else 0) + SCRATCH_BYTES_PER_CHAPTER
+                         for images_and_summaries in enhanced_images.values() for image, _, _ in images_and_summaries)
+    executor = ThreadPoolExecutor(max_workers=chapter_stream_utils.STREAM_WORKERS) if args.stream else None
+    with ScratchSpace("stage5_intermediates", temp_tts_creation, expected_bytes) as scratch:
+        temp_group_dir = scratch.path(os.path.relpath(temp_group_folder, temp_tts_creation))
+        temp_image_dir = scratch.path(os.path.relpath(temp_image_folder, temp_tts_creation))
+        tts_durations_dir = scratch.path(os.path.relpath(tts_durations_folder, temp_tts_creation))
+        ensure_directory_exists(tts_durations_dir)
+
+        # Shut the chapter renderers down before the scratch space goes, also when a chapter fails
+        try:
+            for model_name, images_and_summaries in enhanced_images.items():
+                model_run_folder = f"{model_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+                model_run_path = run_path(output_folder, model_run_folder)
+                ensure_directory_exists(model_run_path)
+
+                temp_image_subfolder = os.path.join(temp_image_dir, model_name)
+                ensure_directory_exists(temp_image_subfolder)
+
+                image_files = [img for img, summary, _ in images_and_summaries]
+                num_images = len(image_files)
+                if not num_images:
+                    print(f"No image files found for '{model_name}'.")
+                    continue
 
-    for model_name, images_and_summaries in enhanced_images.items():
-        model_run_folder = f"{model_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        model_run_path = os.path.join(output_folder, model_run_folder)
-        ensure_directory_exists(model_run_path)
-
-        temp_image_subfolder = os.path.join(temp_image_folder, model_name)
-        ensure_directory_exists(temp_image_subfolder)
-
-        image_files = [img for img, summary, _ in images_and_summaries]
-        num_images = len(image_files)
-        if not num_images:
-            print(f"No image files found for '{model_name}'.")
-            continue
-
-        # Calculate and store adjusted TTS durations for each chapter summary
-        tts_durations = []
-        chapter_info_list = []  # To store start and end time for each chapter
-        current_time = 0.0  # Start time for the first chapter
-        for i, (_, summary, chapter) in enumerate(images_and_summaries):
-            tts_audio_file = os.path.join(tts_durations_folder, f"tts_{model_name}_{i}.mp3")
-            generate_tts_audio(summary, output_file=tts_audio_file)
-
-            # Adjust the speed of the TTS audio
-            adjusted_tts_audio_file = os.path.join(tts_durations_folder, f"tts_{model_name}_{i}_adjusted.mp3")
-            adjust_audio_speed(tts_audio_file, SPEED_OF_SPEECH, output_file=adjusted_tts_audio_file)
-            
-            result = subprocess.run(
-                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', adjusted_tts_audio_file],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT
-            )
-            tts_duration = float(result.stdout)
-            tts_durations.append(tts_duration)
-
-            # Store chapter summary start and end times
-            chapter_info = {
-                "chapter_summary_start_time": current_time,
-                "chapter_summary_end_time": current_time + tts_duration
-            }
-            chapter_info_list.append(chapter_info)
-
-            # Update current time for the next chapter
-            current_time += tts_duration
-
-        # Save chapter info for the current model
-        chapters_info[model_name] = chapter_info_list
-
-        # Calculate display duration for each image
-        display_durations = [max(duration, 5.0) for duration in tts_durations]  # Ensure minimum duration of 5 seconds
-
-        final_video_length = sum(display_durations)
-
-        audio_file = download_audio(final_video_length)
-        if not audio_file:
-            print(f"Failed to obtain audio for '{model_name}'. Keeping files for troubleshooting.")
-            continue
+                # Streaming mode renders each chapter's narration and segment together (cached ones are reused)
+                try:
+                    segments = render_segments(model_name, images_and_summaries, executor) if args.stream else None
+                except UnitFailure as e:
+                    print(f"[WARNING] Could not render every chapter segment for '{model_name}' ({e}); encoding the movie in one pass instead.")
+                    segments = None
+
+                # Calculate and store adjusted TTS durations for each chapter summary
+                tts_durations = []
+                chapter_info_list = []  # To store start and end time for each chapter
+                current_time = 0.0  # Start time for the first chapter
+                for i, (_, summary, chapter) in enumerate(images_and_summaries):
+                    if segments:
+                        tts_duration = segments[i][0]
+                    else:
+                        tts_audio_file = os.path.join(tts_durations_dir, f"tts_{model_name}_{i}.mp3")
+                        adjusted_tts_audio_file = os.path.join(tts_durations_dir, f"tts_{model_name}_{i}_adjusted.mp3")
+                        narration_unit = chapter_unit(model_name, i, "narration")
+                        try:
+                            tts_duration = run_unit(MOVIE_STAGE, narration_unit, narration_duration, summary, tts_audio_file, adjusted_tts_audio_file, chapter=i)
+                        except UnitFailure:
+                            # The chapter still gets its minimum screen time, so the chapters after it keep their timings
+                            tts_duration = chapter_stream_utils.MIN_DISPLAY_SECONDS
+                            record_placeholder(MOVIE_STAGE, narration_unit, f"{tts_duration:.0f} seconds without a measured narration", chapter=i)
+                    tts_durations.append(tts_duration)
+
+                    # Store chapter summary start and end times
+                    chapter_info = {
+                        "chapter_summary_start_time": current_time,
+                        "chapter_summary_end_time": current_time + tts_duration
+                    }
+                    chapter_info_list.append(chapter_info)
+
+                    # Update current time for the next chapter
+                    current_time += tts_duration
+
+                # Save chapter info for the current model
+                chapters_info[model_name] = chapter_info_list
+
+                # Calculate display duration for each image
+                display_durations = [max(duration, 5.0) for duration in tts_durations]  # Ensure minimum duration of 5 seconds
+
+                final_video_length = sum(display_durations)
+
+                audio_file = (args.stream and take_prefetched_music(final_video_length)) or download_audio(final_video_length)
+                if not audio_file:
+                    print(f"Failed to obtain audio for '{model_name}'. Keeping files for troubleshooting.")
+                    continue
 
-        group_time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
-        output_video = os.path.join(videos_folder, generate_video_filename(model_name, images_and_summaries[0][1], audio_file, group_time_str, final_video_length))
+                group_time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
+                output_video = os.path.join(videos_dir, generate_video_filename(model_name, images_and_summaries[0][1], audio_file, group_time_str, final_video_length))
 
-        print(f"Creating movie for model '{model_name}' at time '{group_time_str}' with {num_images} images, total video length: {final_video_length:.2f} seconds")
-        group_temp_dir = os.path.join(temp_group_folder, f"{model_name}_{group_time_str}")
-        ensure_directory_exists(group_temp_dir)
+                print(f"Creating movie for model '{model_name}' at time '{group_time_str}' with {num_images} images, total video length: {final_video_length:.2f} seconds")
+                if segments:
+                    chapter_segments[model_name] = [segment for _, _, segment in segments]
+                    chapter_stream_utils.concat_segments(chapter_segments[model_name], audio_file, output_video)
+                else:
+                    group_temp_dir = os.path.join(temp_group_dir, f"{model_name}_{group_time_str}")
+                    ensure_directory_exists(group_temp_dir)
 
-        for image_path, chapter_summary, _ in images_and_summaries:
-            shutil.copy(image_path, group_temp_dir)
+                    chapter_images = [copy_input(image_path, group_temp_dir)  # From disk or the story pack
+                                      for image_path, chapter_summary, _ in images_and_summaries]
 
-        generate_video_from_images(group_temp_dir, audio_file, output_video, display_durations, temp_image_subfolder)
-        print(f"Movie for model '{model_name}' created successfully at '{output_video}'.")
+                    generate_video_from_images(chapter_images, audio_file, output_video, display_durations, temp_image_subfolder)
+                print(f"Movie for model '{model_name}' created successfully at '{output_video}'.")
 
-        created_videos[f"created_video_location_{model_name.replace('/', '_')}"] = output_video
+                created_videos[f"created_video_location_{model_name.replace('/', '_')}"] = output_video
+                record_artifact(f"video_{model_name.replace('/', '_')}", output_video, stage="5_create_movie")
 
-        print(f"Suggestion: Remove images in '{model_run_path}' if successful.")
+                print(f"Suggestion: Remove images in '{model_run_path}' if successful.")
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
         
     # Update the JSON data with the timings
     updated_data = update_json_with_timings(data, enhanced_images, chapters_info)
+    for model_name, segment_paths in chapter_segments.items():
+        for (_, _, chapter), segment_path in zip(enhanced_images[model_name], segment_paths):
+            chapter[f"{chapter_stream_utils.SEGMENT_KEY_PREFIX}{model_name}"] = segment_path  # Reused by regenerate_chapter.py
 
     # Merge created videos into the original data
     updated_data.update(created_videos)
@@ -382,5 +544,4 @@ def main():
     cleanup_temp_directories()
 
 if __name__ == "__main__":
-    create_directories()
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
@@ -1,41 +1,24 @@
 import os
-from datetime import datetime
 from PIL import Image
 import json
+from utilities.run_index_utils import find_summary_file
+from utilities.run_context_utils import run_path
+from utilities.profiling_utils import run_main
+from utilities.failure_utils import StageFailure
+from utilities.story_pack_utils import input_exists, open_input, list_folder
 
 # Directory paths
 OUTPUT_FOLDER = 'mosaics'
 STORYLINES_FOLDER = 'storylines'
 GENERATED_IMAGES_BASE_PATH = 'enhanced_images'
 
-# Ensure the output folder exists
-os.makedirs(OUTPUT_FOLDER, exist_ok=True)
-
-def get_latest_summary_file(directory):
-    latest_file = None
-    latest_time = None
-    formats_to_try = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
-
-    for filename in os.listdir(directory):
-        if filename.endswith("_summaries.json"):
-            for fmt in formats_to_try:
-                try:
-                    file_time = datetime.strptime(filename[:16], fmt)
-                    if latest_time is None or file_time > latest_time:
-                        latest_time = file_time
-                        latest_file = os.path.join(directory, filename)
-                except ValueError:
-                    continue
-    
-    return latest_file
-
 def parse_summary_file(summary_file):
     with open(summary_file, 'r', encoding='utf-8') as file:
         data = json.load(file)
     return data
 
 def create_mosaic(image_paths, columns=3):
-    images = [Image.open(image_path) for image_path in sorted(image_paths)]
+    images = [Image.open(open_input(image_path)) for image_path in sorted(image_paths)]  # From disk or the story pack
     if not images:
         print("Warning: No images to create mosaic.")
         return None
@@ -61,22 +44,26 @@ def resize_image(image, max_width=1024, max_height=1024):
     image.thumbnail(thumbnail_size, Image.LANCZOS)
 
 def main():
+    # Ensure the output folder exists (archiving between runs moves it away)
+    output_folder = run_path(OUTPUT_FOLDER)
+    os.makedirs(output_folder, exist_ok=True)
     print("Starting processing of images.")
-    summary_file = get_latest_summary_file(STORYLINES_FOLDER)
+    summary_file = find_summary_file(STORYLINES_FOLDER)
     
     if not summary_file:
         print("No summary file found.")
-        return
+        raise StageFailure("No summary JSON file found")
     
     summary_data = parse_summary_file(summary_file)
     story_filename = os.path.splitext(os.path.basename(summary_file))[0]
     
     model_image_paths = {}
 
-    for model_run_folder in os.listdir(GENERATED_IMAGES_BASE_PATH):
-        model_run_path = os.path.join(GENERATED_IMAGES_BASE_PATH, model_run_folder)
+    images_base_path = run_path(GENERATED_IMAGES_BASE_PATH)
+    for model_run_folder in list_folder(images_base_path):
+        model_run_path = os.path.join(images_base_path, model_run_folder)
 
-        if not os.path.isdir(model_run_path):
+        if os.path.isfile(model_run_path):
             print(f"Skipping non-directory: {model_run_folder}")
             continue
 
@@ -91,7 +78,7 @@ def main():
 
                     filepath = os.path.normpath(image_file)
 
-                    if not os.path.exists(filepath):
+                    if not input_exists(filepath):
                         print(f"Image file {filepath} does not exist.")
                         continue
 
@@ -106,11 +93,11 @@ def main():
         if mosaic_image:
             resize_image(mosaic_image)
             mosaic_output_filename = f"{story_filename}_{model}.png"
-            mosaic_output_path = os.path.join(OUTPUT_FOLDER, mosaic_output_filename)
+            mosaic_output_path = os.path.join(output_folder, mosaic_output_filename)
             mosaic_image.save(mosaic_output_path, 'PNG')
             print(f"Mosaic saved to {mosaic_output_path}")
 
     print("Processing complete.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
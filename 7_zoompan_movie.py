@@ -2,6 +2,18 @@ import os
 import subprocess
 from datetime import datetime
 import json
+from utilities.run_index_utils import find_summary_file
+from utilities.run_context_utils import run_path
+from utilities.tracing_utils import traced_run
+from utilities.profile_utils import ffmpeg_quality_args
+from utilities.profiling_utils import run_main
+from utilities.failure_utils import StageFailure
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
 
 # Constants
 CREATED_VIDEOS_DIR = "created_videos"
@@ -9,27 +21,7 @@ PROCESSED_VIDEOS_DIR = os.path.join(CREATED_VIDEOS_DIR, "processed")
 STORYLINES_FOLDER = "storylines"
 GLOBAL_PAN_SPEED = 50  # Speed of the pan and zoom effects (10 is fast, 200 is slow)
 ZOOM_PATTERN = "1 + 0.2*sin(in/25)"  # Customize the zoom pattern here
-
-# Ensure the processed videos directory exists
-os.makedirs(PROCESSED_VIDEOS_DIR, exist_ok=True)
-
-def get_latest_summary_file(directory):
-    latest_file = None
-    latest_time = None
-    formats_to_try = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
-
-    for filename in os.listdir(directory):
-        if filename.endswith("_summaries.json"):
-            for fmt in formats_to_try:
-                try:
-                    file_time = datetime.strptime(filename[:16], fmt)
-                    if latest_time is None or file_time > latest_time:
-                        latest_time = file_time
-                        latest_file = os.path.join(directory, filename)
-                except ValueError:
-                    continue
-
-    return latest_file
+ZOOMPAN_ENABLED = getattr(gv, 'ZOOMPAN_ENABLED', True)  # The draft quality profile skips this stage
 
 def parse_summary_file(summary_file):
     with open(summary_file, 'r', encoding='utf-8') as file:
@@ -37,21 +29,28 @@ def parse_summary_file(summary_file):
     return data
 
 def process_videos():
-    summary_file = get_latest_summary_file(STORYLINES_FOLDER)
+    if not ZOOMPAN_ENABLED:
+        print("Zoompan is disabled for this quality profile; leaving the movies as they are.")
+        return
+    # Ensure the processed videos directory exists (archiving between runs moves it away)
+    created_videos_dir = run_path(CREATED_VIDEOS_DIR)
+    processed_videos_dir = run_path(PROCESSED_VIDEOS_DIR)
+    os.makedirs(processed_videos_dir, exist_ok=True)
+    summary_file = find_summary_file(STORYLINES_FOLDER)
     if not summary_file:
         print("No summary file found.")
-        return
+        raise StageFailure("No summary JSON file found")
 
     summary_data = parse_summary_file(summary_file)
     
-    for video_file in os.listdir(CREATED_VIDEOS_DIR):
-        video_path = os.path.join(CREATED_VIDEOS_DIR, video_file)
+    for video_file in os.listdir(created_videos_dir):
+        video_path = os.path.join(created_videos_dir, video_file)
         
         if not video_path.endswith(".mp4"):
             continue
         
         # Get the video length using ffprobe
-        result = subprocess.run(
+        result = traced_run(
             ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', video_path],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
@@ -59,7 +58,7 @@ def process_videos():
         video_duration = float(result.stdout.decode().strip())
         
         # Get the video dimensions using ffprobe
-        result = subprocess.run(
+        result = traced_run(
             ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', video_path],
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT
@@ -79,18 +78,18 @@ def process_videos():
         
         # Generate the temporary output filename
         temp_output_video_filename = f"{os.path.splitext(video_file)[0]}_temp_processed.mp4"
-        temp_output_video_path = os.path.join(PROCESSED_VIDEOS_DIR, temp_output_video_filename)
+        temp_output_video_path = os.path.join(processed_videos_dir, temp_output_video_filename)
         
         # Process the video with FFmpeg
         ffmpeg_command = [
-            'ffmpeg', '-y', '-i', video_path, '-vf', zoompan_filter, '-preset', 'fast', '-c:a', 'copy', temp_output_video_path
+            'ffmpeg', '-y', '-i', video_path, '-vf', zoompan_filter, *ffmpeg_quality_args('fast'), '-c:a', 'copy', temp_output_video_path
         ]
-        subprocess.run(ffmpeg_command, check=True)
+        traced_run(ffmpeg_command, check=True)
         
         # Generate the processed original filename with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         processed_original_filename = f"{os.path.splitext(video_file)[0]}_{timestamp}.mp4"
-        processed_original_path = os.path.join(PROCESSED_VIDEOS_DIR, processed_original_filename)
+        processed_original_path = os.path.join(processed_videos_dir, processed_original_filename)
         
         # Move the original video to the processed directory with timestamp
         os.rename(video_path, processed_original_path)
@@ -101,4 +100,4 @@ def process_videos():
         print(f"Processed video saved as {video_path}. Original video moved to {processed_original_path}.")
 
 if __name__ == "__main__":
-    process_videos()
\ No newline at end of file
+    run_main(process_videos)
\ No newline at end of file
@@ -1,10 +1,17 @@
 import os
 import subprocess
-import json
 from datetime import datetime
-import cv2
-import dlib
 import re
+from functools import lru_cache
+from utilities.run_index_utils import find_summary_file
+from utilities.run_context_utils import run_path
+from utilities.tracing_utils import traced_run
+from utilities.profile_utils import ffmpeg_quality_args
+from utilities.story_model_utils import story_from_data
+from utilities.story_journal_utils import load_story
+from utilities.profiling_utils import run_main
+from utilities.scratch_utils import ScratchSpace
+from utilities.failure_utils import StageFailure, UnitFailure, run_unit, record_placeholder
 
 # GLOBAL VARIABLES #
 FONT_SIZE = 24
@@ -13,18 +20,16 @@ BOX_COLOR = "black@0.5"
 BOX_BORDER_WIDTH = 5
 SPACE_BETWEEN_LINES = -2
 TEXT_ALIGNMENT = "center"
-FRAMES_DIR = "frames"
+FRAMES_DIR = "frames"  # On disk when the frames do not fit in /dev/shm
+FRAME_BYTES = 6 * 2**20  # Upper bound for one extracted PNG frame
 STORYLINES_FOLDER = 'storylines'
+SUBTITLE_STAGE = "8_add_ffmpeg_subtitles"
 
-# Ensure the frames directory exists and is empty
-if os.path.exists(FRAMES_DIR):
-    for file in os.listdir(FRAMES_DIR):
-        os.remove(os.path.join(FRAMES_DIR, file))
-else:
-    os.makedirs(FRAMES_DIR, exist_ok=True)
-
-# Load the dlib face detector
-detector = dlib.get_frontal_face_detector()
+@lru_cache(maxsize=None)
+def get_face_detector():
+    """Load the dlib face detector once per process (dlib is imported here, not at startup)."""
+    import dlib
+    return dlib.get_frontal_face_detector()
 
 def wrap_text(text, max_width, char_width):
     words = text.split()
@@ -40,12 +45,13 @@ def wrap_text(text, max_width, char_width):
     return lines
 
 def find_faces(frame_path):
+    import cv2
     image = cv2.imread(frame_path)
     if image is None:
         print(f"Error: Could not open image {frame_path}")
         return []
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = detector(gray)
+    faces = get_face_detector()(gray)
     return faces
 
 def extract_frame_at_timestamp(video_path, timestamp, output_path):
@@ -59,66 +65,61 @@ def extract_frame_at_timestamp(video_path, timestamp, output_path):
         '-frames:v', '1',
         output_path
     ]
-    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = traced_run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if result.returncode != 0:
         print(f"Error extracting frame at timestamp {timestamp}: {result.stderr}")
-        exit(1)
+        raise UnitFailure(f"Could not extract the frame at {timestamp} s from {video_path}")
 
 def read_json(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return load_story(file_path)  # Replays a journal left by a stage that crashed
     except Exception as e:
         print(f"[ERROR] Failed to read JSON file {file_path}: {e}")
         return None
 
-def get_latest_summary_file(directory):
-    latest_file, latest_time = None, None
-    formats = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
-    for filename in os.listdir(directory):
-        if filename.endswith("_summaries.json"):
-            for fmt in formats:
-                try:
-                    file_time = datetime.strptime(filename[:16], fmt)
-                    if not latest_time or file_time > latest_time:
-                        latest_time, latest_file = file_time, os.path.join(directory, filename)
-                except ValueError:
-                    continue
-    return latest_file
-
 def get_model_name_from_filename(filename):
     parts = filename.split('_')
     if parts:
         return parts[0]
     return None
 
-def find_chapter_info(data, model_name):
+def find_chapter_info(data, video_filename):
+    story = story_from_data(data)
+    # The story records which model made each video; otherwise match the model name the file name starts with
+    model_name = story.model_for_video(video_filename)
+    if not model_name:
+        prefix = get_model_name_from_filename(video_filename)
+        model_name = next((name for name in story.models() if name.split('_')[0] == prefix), None)
     chapters_info = []
-    for chapter in data["story_chapters"]:
-        for key in chapter.keys():
-            if key.startswith("chapter_image_location_") and model_name in chapter[key]:
-                chapters_info.append({
-                    "chapter_summary": chapter["chapter_summary"],
-                    "chapter_summary_start_time": chapter["chapter_summary_start_time"],
-                    "chapter_summary_end_time": chapter["chapter_summary_end_time"]
-                })
-                break
+    # Every timed chapter, including those stage 5 showed a placeholder card for
+    for chapter in story.chapters if model_name else []:
+        if chapter.start_time is None or chapter.end_time is None:
+            continue
+        chapters_info.append({
+            "chapter_summary": chapter.summary,
+            "chapter_summary_start_time": chapter.start_time,
+            "chapter_summary_end_time": chapter.end_time
+        })
     return chapters_info
 
 def sanitize_text(text):
     return re.sub(r'[^\w\s\.\,\:\;\!\?\-\(\)\[\]\&]', '`', text)
 
-def create_text_filters(input_video_path, video_width, video_height, chapter_timings, margin_x, margin_y, wrap_width, char_width):
+def create_text_filters(input_video_path, video_width, video_height, chapter_timings, margin_x, margin_y, wrap_width, char_width, frames):
     filters = []
     for i, chapter in enumerate(chapter_timings):
         start_time = chapter['chapter_summary_start_time']
         end_time = chapter['chapter_summary_end_time']
         summary_text = chapter['chapter_summary']
 
-        frame_path = os.path.join(FRAMES_DIR, f'frame_{i}.png')
-        extract_frame_at_timestamp(input_video_path, start_time, frame_path)
-
-        faces = find_faces(frame_path)
+        frame_path = frames.path(f'frame_{i}.png')
+        frame_unit = f"{os.path.basename(input_video_path)}/chapter_{i + 1}/frame"
+        try:
+            run_unit(SUBTITLE_STAGE, frame_unit, extract_frame_at_timestamp, input_video_path, start_time, frame_path, chapter=i)
+            faces = find_faces(frame_path)
+        except UnitFailure:
+            faces = []
+            record_placeholder(SUBTITLE_STAGE, frame_unit, "text placed at the bottom without face detection", chapter=i, retry=False)
 
         if faces:
             total_faces = len(faces)
@@ -153,82 +154,89 @@ def create_text_filters(input_video_path, video_width, video_height, chapter_tim
         print(f"Filter {i}: {filter_str}")
     return filters
 
-videos_dir = "created_videos"
-completed_videos_dir = os.path.join(videos_dir, "completed_videos")
-os.makedirs(completed_videos_dir, exist_ok=True)
-
-json_file_path = get_latest_summary_file(STORYLINES_FOLDER)
-if not json_file_path:
-    print("[ERROR] No summary JSON file found.")
-    exit()
-
-data = read_json(json_file_path)
-if data is None:
-    print("[ERROR] Failed to read the summary JSON file.")
-    exit()
-
-to_process_videos = []
-for video_filename in os.listdir(videos_dir):
-    if not video_filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):  # Assuming these file formats.
-        continue
-    input_video_path = os.path.join(videos_dir, video_filename)
-    if not os.path.isfile(input_video_path):
-        continue
-    to_process_videos.append((video_filename, input_video_path))
-
-for video_filename, input_video_path in to_process_videos:
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_video_filename = f"{timestamp}_{video_filename}"
-    output_video_path = os.path.join(completed_videos_dir, output_video_filename)
-
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', input_video_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT
-    )
-    video_dimensions = result.stdout.decode().strip().split(',')
-    video_width = int(video_dimensions[0])
-    video_height = int(video_dimensions[1])
-
-    wrap_width = int(video_width * (1.0 - 0.2))
-
-    margin_x = int(video_width * 0.1)
-    margin_y = int(video_height * 0.05)
-
-    char_width = 12
-
-    model_name = get_model_name_from_filename(video_filename)
-    if not model_name:
-        print(f"[ERROR] Could not extract model name from {video_filename}")
-        continue
+def main():
+    videos_dir = run_path("created_videos")
+    completed_videos_dir = os.path.join(videos_dir, "completed_videos")
+    os.makedirs(completed_videos_dir, exist_ok=True)
 
-    chapters_info = find_chapter_info(data, model_name)
-    if not chapters_info:
-        print(f"[ERROR] No chapter information found for model {model_name} in JSON data.")
-        continue
+    json_file_path = find_summary_file(STORYLINES_FOLDER)
+    if not json_file_path:
+        print("[ERROR] No summary JSON file found.")
+        raise StageFailure("No summary JSON file found")
 
-    filters = create_text_filters(input_video_path, video_width, video_height, chapters_info, margin_x, margin_y, wrap_width, char_width)
+    data = read_json(json_file_path)
+    if data is None:
+        print("[ERROR] Failed to read the summary JSON file.")
+        raise StageFailure(f"Could not read {json_file_path}")
 
-    full_filter = ','.join(filters)
+    to_process_videos = []
+    for video_filename in os.listdir(videos_dir):
+        if not video_filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):  # Assuming these file formats.
+            continue
+        input_video_path = os.path.join(videos_dir, video_filename)
+        if not os.path.isfile(input_video_path):
+            continue
+        to_process_videos.append((video_filename, input_video_path))
 
-    print(f"Full Filter String: {full_filter}")
+    # One PNG frame per chapter of every video, in memory when /dev/shm has room for them
+    chapter_count = len(data.get("story_chapters", []))
+    with ScratchSpace("stage8_frames", FRAMES_DIR, len(to_process_videos) * chapter_count * FRAME_BYTES) as frames:
+        for video_filename, input_video_path in to_process_videos:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_video_filename = f"{timestamp}_{video_filename}"
+            output_video_path = os.path.join(completed_videos_dir, output_video_filename)
 
-    ffmpeg_command = [
-        'ffmpeg', '-y', '-i', input_video_path, '-filter_complex', full_filter, '-preset', 'fast', '-c:a', 'copy', output_video_path
-    ]
-    subprocess.run(ffmpeg_command, check=True)
+            result = traced_run(
+                ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', input_video_path],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            video_dimensions = result.stdout.decode().strip().split(',')
+            video_width = int(video_dimensions[0])
+            video_height = int(video_dimensions[1])
+
+            wrap_width = int(video_width * (1.0 - 0.2))
+
+            margin_x = int(video_width * 0.1)
+            margin_y = int(video_height * 0.05)
+
+            char_width = 12
+
+            model_name = get_model_name_from_filename(video_filename)
+            if not model_name:
+                print(f"[ERROR] Could not extract model name from {video_filename}")
+                continue
+
+            chapters_info = find_chapter_info(data, video_filename)
+            if not chapters_info:
+                print(f"[ERROR] No chapter information found for model {model_name} in JSON data.")
+                continue
+
+            filters = create_text_filters(input_video_path, video_width, video_height, chapters_info, margin_x, margin_y, wrap_width, char_width, frames)
+
+            full_filter = ','.join(filters)
+
+            print(f"Full Filter String: {full_filter}")
+
+            ffmpeg_command = [
+                'ffmpeg', '-y', '-i', input_video_path, '-filter_complex', full_filter, *ffmpeg_quality_args('fast'), '-c:a', 'copy', output_video_path
+            ]
+            traced_run(ffmpeg_command, check=True)
+
+            print(f"Output video saved as {output_video_path}")
 
-    print(f"Output video saved as {output_video_path}")
+            # Move the original video to completed_videos with timestamp
+            completed_original_path = os.path.join(completed_videos_dir, f"original_{timestamp}_{video_filename}")
+            os.rename(input_video_path, completed_original_path)
 
-    # Move the original video to completed_videos with timestamp
-    completed_original_path = os.path.join(completed_videos_dir, f"original_{timestamp}_{video_filename}")
-    os.rename(input_video_path, completed_original_path)
+            # Move the new video to replace the original in created_videos
+            new_video_replacement_path = os.path.join(videos_dir, video_filename)
+            os.rename(output_video_path, new_video_replacement_path)
 
-    # Move the new video to replace the original in created_videos
-    new_video_replacement_path = os.path.join(videos_dir, video_filename)
-    os.rename(output_video_path, new_video_replacement_path)
+            print(f"Original video moved to {completed_original_path}")
+            print(f"New video moved to {new_video_replacement_path}")
 
-    print(f"Original video moved to {completed_original_path}")
-    print(f"New video moved to {new_video_replacement_path}")
+    print("All videos processed.")
 
-print("All videos processed.")
\ No newline at end of file
+if __name__ == "__main__":
+    run_main(main)
@@ -1,18 +1,24 @@
 import os
-import json
+import hashlib
 import argparse
-import shutil
-from datetime import datetime
 from utilities.ffmpeg_utils import get_length, add_text_to_video
 from utilities.google_tts_utils import generate_tts_audio, add_silence_to_audio, adjust_audio_speed, mix_audio_on_video
+from utilities.run_index_utils import find_summary_file
+from utilities.story_journal_utils import load_story, StoryJournal
+from utilities.run_context_utils import run_path
+from utilities.profiling_utils import run_main
+from utilities.failure_utils import StageFailure
+from utilities.scratch_utils import ScratchSpace
+from utilities.story_pack_utils import input_exists, input_size, local_input
 
 # Configurations
 storylines_folder = 'storylines'
 videos_folder = 'created_videos'
 final_videos_folder = 'final_voiceover_video'
 temp_tts_creation = 'temp_tts_creation'  # Folder to store all temporary files
-temp_ffmpeg_folder = os.path.join(temp_tts_creation, 'temp_ffmpeg')
-tts_audio_folder = os.path.join(temp_tts_creation, 'tts_audio_files')
+temp_ffmpeg_folder = os.path.join(temp_tts_creation, 'temp_ffmpeg')  # Scratch on disk when /dev/shm is short
+tts_audio_folder = os.path.join(temp_tts_creation, 'tts_audio_files')  # gTTS downloads, kept for reruns (keyed by text)
+SCRATCH_BYTES_PER_CHAPTER = 2 * 2**20  # atempo and apad MP3s
 
 # Volume settings (in decibels)
 TTS_VOLUME_DB = 7  # Range: -10 dB to 10 dB; Set higher to make TTS louder. 0 dB means no change.
@@ -25,48 +31,23 @@ def ensure_directory_exists(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-def get_latest_json_file(directory):
-    latest_file, latest_time = None, None
-    formats = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
-    for filename in os.listdir(directory):
-        if filename.endswith("_summaries.json"):
-            for fmt in formats:
-                try:
-                    file_time = datetime.strptime(filename[:16], fmt)
-                    if not latest_time or file_time > latest_time:
-                        latest_time, latest_file = file_time, os.path.join(directory, filename)
-                    break
-                except ValueError:
-                    continue
-    return latest_file
-
 def read_json(file_path):
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return load_story(file_path)  # Replays a journal left by a stage that crashed
     except Exception as e:
         print(f"[ERROR] Failed to read JSON file {file_path}: {e}")
         return None
 
 def write_json(data, file_path):
     try:
-        with open(file_path, 'w', encoding='utf-8') as file:
-            json.dump(data, file, ensure_ascii=False, indent=4)
+        # Atomic snapshot; data already holds any journaled changes, so the journal is folded in and removed
+        StoryJournal(file_path, data=data, indent=4).compact()
         print(f"[INFO] JSON file {file_path} updated successfully.")
     except Exception as e:
         print(f"[ERROR] Failed to write to JSON file {file_path}: {e}")
 
-def create_temp_ffmpeg_folder():
-    ensure_directory_exists(temp_ffmpeg_folder)
-    return temp_ffmpeg_folder
-
-def cleanup_temp_ffmpeg_folder():
-    if os.path.exists(temp_ffmpeg_folder):
-        shutil.rmtree(temp_ffmpeg_folder)
-
-
 def process_voiceover_for_storyline(json_file, final_folder):
-    temp_folder = create_temp_ffmpeg_folder()
+    tts_folder = run_path(tts_audio_folder)
     try:
         summary_data = read_json(json_file)
         if summary_data is None:
@@ -77,84 +58,92 @@ def process_voiceover_for_storyline(json_file, final_folder):
             print(f"[ERROR] No created video locations found in {json_file}")
             return False
 
-        for video_key in video_keys:
-            video_path = summary_data.get(video_key)
-            if not video_path or not os.path.exists(video_path):
-                print(f"[ERROR] Video file {video_path} does not exist.")
-                continue
+        # The derived MP3s and the intermediate MP4 live in memory when /dev/shm has room for them
+        expected_bytes = sum(input_size(summary_data[key]) * 2 if input_exists(summary_data[key] or "") else 0 for key in video_keys)
+        expected_bytes += len(video_keys) * len(summary_data.get("story_chapters", [])) * SCRATCH_BYTES_PER_CHAPTER
+        with ScratchSpace("stage9_voiceover", temp_ffmpeg_folder, expected_bytes) as scratch:
+            temp_folder = scratch.directory
+            for video_key in video_keys:
+                video_path = summary_data.get(video_key)
+                if not video_path or not input_exists(video_path):
+                    print(f"[ERROR] Video file {video_path} does not exist.")
+                    continue
+                video_input = local_input(video_path)  # ffmpeg needs a file; a video from a story pack is copied to scratch
 
-            base_video_name = os.path.basename(video_path)
-            base_name = os.path.splitext(base_video_name)[0]
-            model_name_suffix = video_key.replace("created_video_location_", "")
+                base_video_name = os.path.basename(video_path)
+                base_name = os.path.splitext(base_video_name)[0]
+                model_name_suffix = video_key.replace("created_video_location_", "")
             
-            story_chapters = summary_data.get("story_chapters", [])
-            if not story_chapters:
-                print(f"[ERROR] No story chapters found in {json_file}")
-                continue
-
-            tts_audio_files = []
-            for index, chapter in enumerate(story_chapters):
-                padded_index = f"{index + 1:03}"
-                summary_text = chapter['chapter_summary']
-                tts_audio_file = os.path.join(tts_audio_folder, f"tts_{model_name_suffix}_{padded_index}.mp3")
-
-                # Generate TTS audio if it doesn't already exist
-                if not os.path.exists(tts_audio_file):
-                    generate_tts_audio(summary_text, output_file=tts_audio_file)
-
-                # Adjust speed of TTS audio if necessary
-                adjusted_speed_audio_file = os.path.join(tts_audio_folder, f"tts_{model_name_suffix}_{padded_index}_adjusted.mp3")
-                adjust_audio_speed(tts_audio_file, SPEED_OF_SPEECH, output_file=adjusted_speed_audio_file)
+                story_chapters = summary_data.get("story_chapters", [])
+                if not story_chapters:
+                    print(f"[ERROR] No story chapters found in {json_file}")
+                    continue
+
+                tts_audio_files = []
+                for index, chapter in enumerate(story_chapters):
+                    padded_index = f"{index + 1:03}"
+                    summary_text = chapter['chapter_summary']
+                    # The name carries a hash of the text, so a changed summary (regenerate_chapter.py) is spoken anew
+                    text_key = hashlib.sha256(summary_text.encode("utf-8")).hexdigest()[:12]
+                    tts_audio_file = os.path.join(tts_folder, f"tts_{model_name_suffix}_{padded_index}_{text_key}.mp3")
+
+                    # Generate TTS audio if it doesn't already exist
+                    if not os.path.exists(tts_audio_file):
+                        generate_tts_audio(summary_text, output_file=tts_audio_file)
+
+                    # Adjust speed of TTS audio if necessary
+                    adjusted_speed_audio_file = scratch.path(f"tts_{model_name_suffix}_{padded_index}_adjusted.mp3")
+                    adjust_audio_speed(tts_audio_file, SPEED_OF_SPEECH, output_file=adjusted_speed_audio_file)
                 
-                # Ensure TTS audio is properly padded
-                segment_duration = get_length(video_path) / len(story_chapters)
-                final_tts_audio_file = os.path.join(tts_audio_folder, f"tts_{model_name_suffix}_{padded_index}_final.mp3")
-                add_silence_to_audio(adjusted_speed_audio_file, segment_duration, output_file=final_tts_audio_file)
+                    # Ensure TTS audio is properly padded
+                    segment_duration = get_length(video_input) / len(story_chapters)
+                    final_tts_audio_file = scratch.path(f"tts_{model_name_suffix}_{padded_index}_final.mp3")
+                    add_silence_to_audio(adjusted_speed_audio_file, segment_duration, output_file=final_tts_audio_file)
                 
-                tts_audio_files.append(final_tts_audio_file)
+                    tts_audio_files.append(final_tts_audio_file)
 
-            concatenated_audio_path = os.path.join(temp_folder, f"{base_name}_concatenated_tts_audio.mp3")
-            with open(concatenated_audio_path, 'wb') as outfile:
-                for audio_file in tts_audio_files:
-                    with open(audio_file, 'rb') as infile:
-                        outfile.write(infile.read())
+                concatenated_audio_path = os.path.join(temp_folder, f"{base_name}_concatenated_tts_audio.mp3")
+                with open(concatenated_audio_path, 'wb') as outfile:
+                    for audio_file in tts_audio_files:
+                        with open(audio_file, 'rb') as infile:
+                            outfile.write(infile.read())
 
-            intermediate_video_file = os.path.join(temp_folder, f"{base_name}_voiceover_intermediate.mp4")
-            mix_audio_on_video(video_path, concatenated_audio_path, intermediate_video_file, tts_volume=TTS_VOLUME_DB, background_volume=BACKGROUND_VOLUME_DB)
+                intermediate_video_file = os.path.join(temp_folder, f"{base_name}_voiceover_intermediate.mp4")
+                mix_audio_on_video(video_input, concatenated_audio_path, intermediate_video_file, tts_volume=TTS_VOLUME_DB, background_volume=BACKGROUND_VOLUME_DB)
             
-            output_video_file = os.path.join(final_folder, f"{base_name}_voiceover.mp4")
-            #add_text_to_video(intermediate_video_file, output_video_file, time_until_end=3, text_to_add="Full story in description!")
-            add_text_to_video(intermediate_video_file, output_video_file, time_until_end=3, text_to_add="")
+                output_video_file = os.path.join(final_folder, f"{base_name}_voiceover.mp4")
+                #add_text_to_video(intermediate_video_file, output_video_file, time_until_end=3, text_to_add="Full story in description!")
+                add_text_to_video(intermediate_video_file, output_video_file, time_until_end=3, text_to_add="")
 
-            summary_data[f"voiceover_created_video_location_{model_name_suffix}"] = output_video_file
+                summary_data[f"voiceover_created_video_location_{model_name_suffix}"] = output_video_file
 
         write_json(summary_data, json_file)
         return True
     except Exception as e:
         print(f"[ERROR] An error occurred while processing voiceover: {e}")
         return False
-    finally:
-        cleanup_temp_ffmpeg_folder()
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Create voiceover videos from storyline summaries.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    ensure_directory_exists(final_videos_folder)
-    ensure_directory_exists(tts_audio_folder)
+    final_folder = run_path(final_videos_folder)
+    ensure_directory_exists(final_folder)
+    ensure_directory_exists(run_path(tts_audio_folder))
 
-    latest_json_file = get_latest_json_file(storylines_folder)
+    latest_json_file = find_summary_file(storylines_folder)
     if not latest_json_file:
         print("[ERROR] No summary JSON file found.")
-        return
+        raise StageFailure("No summary JSON file found")
 
     print(f"[INFO] Processing {latest_json_file}")
-    success = process_voiceover_for_storyline(latest_json_file, final_videos_folder)
+    success = process_voiceover_for_storyline(latest_json_file, final_folder)
 
     if success:
         print("[INFO] Voiceover processing completed successfully.")
     else:
         print("[ERROR] Voiceover processing failed.")
+        raise StageFailure(f"Voiceover processing failed for {latest_json_file}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    run_main(main)
\ No newline at end of file
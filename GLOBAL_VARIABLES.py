@@ -6,6 +6,8 @@ GLOBAL_MODEL_NAME = 'llama3'
 NUMBER_OF_RUNS = 5
 # Used in 2_build_out_chapters.py to decide how many chapters to make per model
 NUMBER_OF_CHAPTERS_PER_STORY = 8
+# Used in 2_build_out_chapters.py: "sampled" sends 8 chapter lines for the synopsis, "hierarchical" map-reduces all chapters, "auto" switches to hierarchical for long stories
+SYNOPSIS_MODE = "auto"
 
 # Used in 6_create_movie.py for the default length of the video in seconds
 DEFAULT_VIDEO_LENGTH = 55
@@ -18,6 +20,19 @@ TOP_MODELS = [
 
 # Flag to indicate whether to archive all previous generations at the start of each script
 ARCHIVE_ALL_PREVIOUS_GENERATIONS = True
+# Used in run_all.py; True gives every run its own runs/<run_id>/ working folders (storylines, images, videos, temp files) so stories can be generated side by side, and nothing is archived
+USE_RUN_DIRECTORIES = False
+RUNS_ROOT = "runs"
+# Used in queue_worker.py; sqlite:///work_queue.sqlite for one machine, redis://host:6379/0 (pip install redis) to spread stages over several
+WORK_QUEUE_URL = "sqlite:///work_queue.sqlite"
+# Used in run_scheduler.py; concurrent jobs per resource class (CPU jobs are each pinned to SCHEDULER_CPU_CORES_PER_JOB cores)
+SCHEDULER_LLM_SLOTS = 1
+SCHEDULER_GPU_SLOTS = 1
+SCHEDULER_CPU_CORES_PER_JOB = 4
+# Record spans for every run (same as run_all.py -trace / STORY_TRACE=1); traces are written to traces/<run_id>.trace.json
+TRACING_ENABLED = False
+# Used in utilities/import_budget_utils.py; most milliseconds importing a stage or utility may take (torch & co. load on first use)
+IMPORT_BUDGET_MS = 750
 
 ADD_COMPARISONS_TO_ENHANCED_VS_GENERATED = True #this will show a side by side comparison of the enhanced image versus the regular generated image from the model
 NUM_SAMPLES = 1  # Number of images to generate per prompt.
@@ -36,8 +51,52 @@ CFG_SCALE = 1.13  # Configuration scaling factor that adjusts the influence of c
 NUMBER_OF_STEPS = 21  # The number of denoising steps used during image generation, which can impact the final image quality.
 RANDOMIZE_SEED_VALUE = True  # Set to True for varied image generation, creating different outputs on each run with the same prompt.
 DISABLE_SAFETY_CHECKER = True  # If false, will block anything over G rating.
+# Keep SD pipelines loaded between models and runs when stages share one process (run_all.py). Each SD 1.5 pipeline with its
+# IP-Adapter holds roughly 3-4 GB of VRAM (fp16), and all TOP_MODELS stay loaded next to the main character pipeline, so only
+# turn this on with 16 GB or more; on 8-12 GB cards it runs out of memory. False loads one model at a time.
+KEEP_MODELS_RESIDENT = False
+ENHANCE_IMAGES = True  # Run the face/upscale enhancement pass on every generated image; False uses the generated image as is.
+MAX_INFERENCE_STEPS = None  # Optional cap on the step count of pipelines with their own (4b's SDXL, the main character generator).
+# Used in 7_zoompan_movie.py; False leaves the movie without the zoom/pan pass
+ZOOMPAN_ENABLED = True
+# Used in 5_create_movie.py; True renders each chapter as its own segment and stream-copy concats them (run_all.py -stream also prerenders them during stage 4)
+STREAM_CHAPTER_SEGMENTS = False
+STREAM_WORKERS = 4  # Chapters rendered at the same time in streaming mode
+# x264 settings for the movie encodes (5, 7, 8); None keeps each stage's own preset and ffmpeg's default CRF
+FFMPEG_PRESET = None
+FFMPEG_CRF = None
+# Used by run_all.py -resources; seconds between samples of a stage's process tree (RSS, CPU, I/O, open files)
+RESOURCE_SAMPLE_INTERVAL = 0.5
+# Used with -profile on any stage or run_all.py; seconds between stack samples and rows in the top-functions table
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TOP_N = 25
+# Used by run_all.py: serve Prometheus metrics on this port (None = only with -metrics_port); METRICS_HOST 0.0.0.0 exposes it
+METRICS_PORT = None
+METRICS_HOST = "127.0.0.1"
+# Used by stages 5, 8 and 9 for intermediates: a tmpfs path (empty = always disk) and the MB to leave free in it
+SCRATCH_FAST_PATH = "/dev/shm"
+SCRATCH_HEADROOM_MB = 256
+# Used by run_all.py, queue_worker.py and run_scheduler.py: shared store for run files ("" = none; file:///path or s3://bucket/prefix)
+ARTIFACT_STORE_URL = ""
+ARTIFACT_STORE_ENDPOINT = None  # S3-compatible server URL (MinIO...); None = AWS or AWS_ENDPOINT_URL
+ARTIFACT_CACHE_DIR = "artifact_cache"
+ARTIFACT_TRANSFER_WORKERS = 8
+ARTIFACT_MULTIPART_MB = 16
+# Used by run_benchmark.py, run_all.py and run_all.ps1: timings history, and when a compare counts a change as real
+BENCHMARK_HISTORY_PATH = "benchmark_history.sqlite"
+BENCHMARK_NOISE_FLOOR_SECONDS = 0.05
+BENCHMARK_NOISE_PCT = 5.0
+BENCHMARK_NOISE_SIGMAS = 3.0
+BENCHMARK_MIN_TEST_SAMPLES = 5  # Runs per side before the Mann-Whitney U test is also required
+BENCHMARK_ALPHA = 0.05
+# Used by utilities/failure_utils.py: attempts per chapter unit and run (across reruns), and the backoff between retries
+UNIT_MAX_ATTEMPTS = 3
+UNIT_RETRY_BASE_SECONDS = 2.0
+UNIT_RETRY_MAX_SECONDS = 30.0
 # Added variable for deleting the initial JSON file via 3_summarize_chapters_add_ai_prompts.py
 DELETE_INITIAL_STORYLINE_JSON = True
+# Used in 3_summarize_chapters_add_ai_prompts.py; False builds negative prompts locally from a lexicon instead of one LLM call per chapter
+USE_LLM_NEGATIVE_PROMPTS = False
 
 #USER_PROVIDED_IMAGE_PATH = "user_images/andy.png"  # Default to an empty string, meaning no user-provided image by default
 
@@ -55,3 +114,10 @@ USER_PROVIDED_STORY_THEME = "Superhero saving planet from aliens"
 
 #USER_PROVIDED_YOUTUBE_MUSIC = "https://www.youtube.com/watch?v=rWulO_gttCI"
 USER_PROVIDED_ARTISTIC_STYLE = "Marvel"
+
+# Quality profile (utilities/profile_utils.py): "final" keeps the values above, "draft" cuts steps, image size,
+# chapters, enhancement, comparisons, zoompan and the x264 preset/CRF for fast iteration.  STORY_QUALITY_PROFILE
+# or run_all.py -quality override it; applied last so the profile's values win over the ones above.
+QUALITY_PROFILE = "final"
+from utilities.profile_utils import apply_profile
+apply_profile(globals())
@@ -0,0 +1,146 @@
+import os
+import sys
+import time
+import socket
+import atexit
+import argparse
+import threading
+
+from utilities.ollama_utils import stop_ollama_service
+from utilities import run_index_utils, run_context_utils, work_queue_utils, tracing_utils, profiling_utils, metrics_utils, artifact_store_utils
+import run_all
+
+# Queue-driven alternative to run_all.py for splitting the pipeline across machines.
+#   python queue_worker.py -enqueue 3                 # queue three stories (one job per stage)
+#   python queue_worker.py -resources llm gpu         # on the GPU box: stages 1-4
+#   python queue_worker.py -resources cpu             # on CPU nodes: stages 5-9
+# Every job runs in its run directory (runs/<run_id>/), so workers on different machines need
+# STORY_RUNS_ROOT on shared storage and the same STORY_QUEUE_URL (e.g. redis://queue-host:6379/0).
+
+POLL_SECONDS = 5
+# 4b is not part of run_all's pipeline, but can be queued explicitly (-stages ... 4b_unique_character)
+OPTIONAL_STAGES = [("4b_unique_character", "4b_unique_character", "main")]
+STAGES_BY_NAME = {name: (name, module_name, function_name) for name, module_name, function_name in run_all.PIPELINE_STAGES + OPTIONAL_STAGES}
+QUEUED_STAGES = [name for name, _, _ in run_all.PIPELINE_STAGES if name in work_queue_utils.RESOURCE_CLASSES]
+QUEUEABLE_STAGES = [name for name in STAGES_BY_NAME if name in work_queue_utils.RESOURCE_CLASSES]
+
+def parse_cpu_set(text):
+    """'0-3,6' -> {0, 1, 2, 3, 6}"""
+    cpus = set()
+    for part in text.split(","):
+        start, _, end = part.partition("-")
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
+
+def enqueue_runs(queue, number_of_runs, stages):
+    """Register number_of_runs new runs and queue their stages; returns the run ids."""
+    run_ids = []
+    for _ in range(number_of_runs):
+        run_id = run_index_utils.start_run(activate=False)
+        queue.enqueue_run(run_id, stages)
+        run_ids.append(run_id)
+    return run_ids
+
+def _keep_lease(queue, job, worker_id, stop):
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(job["job_id"], worker_id):
+            print(f"[WARNING] Job {job['job_id']} is no longer leased to {worker_id}")
+            return
+
+def run_job(queue, job, worker_id):
+    """Run one claimed job in its run directory and report the result to the queue."""
+    name, run_id = job["stage"], job["run_id"]
+    try:
+        run_index_utils.start_run(run_id)
+        run_context_utils.activate_run(run_id)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_keep_lease, args=(queue, job, worker_id, stop), daemon=True)
+        heartbeat.start()
+        try:
+            artifact_store_utils.pull_run(run_id)  # Upstream stages may have run on another node
+            run_index_utils.set_stage_status(name, "running", run_id)
+            elapsed, succeeded = run_all.run_stage(*STAGES_BY_NAME[name])
+            if succeeded:
+                artifact_store_utils.push_run(run_id, name)  # Before the job completes, so downstream jobs find the files
+            run_index_utils.set_stage_status(name, "done" if succeeded else "failed", run_id)
+        finally:
+            stop.set()
+            heartbeat.join()
+            run_context_utils.deactivate_run()
+            # Spans from every worker end up in traces/<run_id>.events.jsonl; run_scheduler.py exports them
+            tracing_utils.flush()
+    except Exception as e:
+        # An unknown stage or a failed artifact transfer fails this job, not the worker
+        print(f"[ERROR] Job {job['job_id']} ({name} for run {run_id}) failed on {worker_id}: {e!r}")
+        if not queue.fail(job["job_id"], worker_id, repr(e)):
+            print(f"[WARNING] Job {job['job_id']} was no longer leased to {worker_id}; its failure was not recorded")
+        return False
+    if succeeded:
+        reported = queue.complete(job["job_id"], worker_id)
+    else:
+        reported = queue.fail(job["job_id"], worker_id, f"{name} failed after {elapsed:.0f} seconds on {worker_id}")
+    if not reported:
+        # The lease expired mid-run and the job was handed to another worker, whose result counts
+        print(f"[WARNING] Job {job['job_id']} was no longer leased to {worker_id}; its result was not recorded")
+    return succeeded
+
+def run_worker(queue, resources, worker_id, poll_seconds=POLL_SECONDS, exit_when_idle=False):
+    """Claim and run jobs of the given resource classes until stopped; returns the number of jobs run."""
+    jobs_run = 0
+    print(f"Worker {worker_id} serving {', '.join(resources)}")
+    while True:
+        job = queue.claim(resources, worker_id)
+        if job is None:
+            if exit_when_idle and not queue.pending_count(resources):
+                print(f"Worker {worker_id}: no jobs left, exiting after {jobs_run} job(s).")
+                return jobs_run
+            time.sleep(poll_seconds)
+            continue
+        print(f"[{worker_id}] Job {job['job_id']}: {job['stage']} for run {job['run_id']} (attempt {job['attempts']})")
+        run_job(queue, job, worker_id)
+        jobs_run += 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue pipeline runs or work through queued stage jobs.")
+    parser.add_argument("-queue", type=str, default=work_queue_utils.QUEUE_URL, help="Queue URL: sqlite:///file.sqlite or redis://host:port/db.")
+    parser.add_argument("-enqueue", type=int, metavar="RUNS", help="Queue this many new runs and exit.")
+    parser.add_argument("-stages", nargs="+", default=QUEUED_STAGES, choices=QUEUEABLE_STAGES, help="Stages to queue per run (with -enqueue).")
+    parser.add_argument("-resources", nargs="+", default=work_queue_utils.ALL_RESOURCES, choices=work_queue_utils.ALL_RESOURCES,
+                        help="Resource classes this worker runs.")
+    parser.add_argument("-worker_id", type=str, default=f"{socket.gethostname()}-{os.getpid()}", help="Name of this worker in the queue.")
+    parser.add_argument("-poll", type=float, default=POLL_SECONDS, help="Seconds between polls when no job is ready.")
+    parser.add_argument("-exit_when_idle", action="store_true", help="Exit once no job for these resources is waiting, ready or running.")
+    parser.add_argument("-cpu_set", type=str, help="Only use these cores, e.g. 0-3 or 0,2,4 (Linux).")
+    parser.add_argument("-status", action="store_true", help="Print the queued jobs and exit.")
+    parser.add_argument("-profile", nargs="?", const="sample", choices=profiling_utils.PROFILE_MODES,
+                        help="Profile every stage job this worker runs into profiles/ (sample, the default, or cprofile).")
+    parser.add_argument("-metrics_port", type=int, help="Serve Prometheus metrics (stage jobs and queue depth) at http://127.0.0.1:<port>/metrics.")
+    parser.add_argument("-artifact_store", type=str, help="Share run files through this store instead of a shared RUNS_ROOT (file:///path or s3://bucket/prefix).")
+    args = parser.parse_args(argv)
+
+    queue = work_queue_utils.open_queue(args.queue)
+    if args.status:
+        print(work_queue_utils.format_jobs(queue.jobs()))
+        return 0
+    if args.enqueue:
+        for run_id in enqueue_runs(queue, args.enqueue, args.stages):
+            print(f"Queued run {run_id}")
+        return 0
+
+    if args.profile:
+        profiling_utils.enable(args.profile)
+    if args.metrics_port is not None:
+        metrics_utils.add_collector(metrics_utils.queue_depth_collector(args.queue))
+        metrics_utils.start_metrics_server(args.metrics_port)
+    if args.artifact_store:
+        artifact_store_utils.enable(args.artifact_store)
+    if args.cpu_set:
+        # Keep this worker and its ffmpeg children inside their share of the cores (run_scheduler.py)
+        os.sched_setaffinity(0, parse_cpu_set(args.cpu_set))
+    if "llm" in args.resources:
+        atexit.register(stop_ollama_service, force=True)
+    run_worker(queue, args.resources, args.worker_id, args.poll, args.exit_when_idle)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
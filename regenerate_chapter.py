@@ -0,0 +1,186 @@
+import os
+import sys
+import shutil
+import argparse
+import importlib
+from datetime import datetime
+
+from utilities import run_index_utils, run_context_utils, stage_cache_utils, chapter_stream_utils, profile_utils, profiling_utils
+from utilities.story_journal_utils import StoryJournal, load_story
+import run_all
+
+# Redo one chapter of a finished run instead of the whole story: its summary and image prompts (LLM),
+# its image (stage 4 for every model), its narration and video segment, and then the finishing stages.
+# The other chapters keep their stored start/end times and their chapter segments (chapter_segments/),
+# so the new movie is a stream-copy concat of the old segments and the new one over the old soundtrack;
+# only the chapters after the regenerated one shift by the change in its narration length.
+# Chapter segments are only stored by stage 5 with -stream (STREAM_CHAPTER_SEGMENTS); for a movie made in
+# one pass, the first regeneration renders every chapter's segment once and later ones reuse them.
+#   python regenerate_chapter.py -chapter 3
+#   python regenerate_chapter.py -run_id 20240101_120000_ab12cd -chapter 3 -steps image video finish
+#   python regenerate_chapter.py -chapter 3 -summary "Kumori finds the lantern." -steps video finish
+# Replaced videos are kept in created_videos/replaced/.
+
+REGEN_STEPS = ["prompt", "image", "video", "finish"]
+IMAGE_STAGE = "4_create_images_from_ai_prompts"
+MOVIE_STAGE = "5_create_movie"
+FINISH_STAGES = ["6_create_mosaic", "7_zoompan_movie", "8_add_ffmpeg_subtitles", "9_create_voiceover"]
+REPLACED_VIDEOS_FOLDER = os.path.join("created_videos", "replaced")  # Out of the way of stages 7/8, which process every video in created_videos
+
+def open_run(run_id):
+    """Make run_id the active run (in its runs/<run_id>/ folder if it has one) and return its summaries file."""
+    if os.path.isdir(run_context_utils.run_dir_for(run_id)):
+        run_context_utils.activate_run(run_id)
+    else:
+        os.environ[run_context_utils.RUN_ID_ENV] = run_id
+    summary_file = run_index_utils.find_summary_file(run_id=run_id)
+    if not summary_file:
+        raise ValueError(f"Run {run_id} has no chapter summaries (stage 3 has not finished for it)")
+    return summary_file
+
+def regenerate_prompt(summary_file, index, summary=None, use_llm=True):
+    """Ask the LLM again for the chapter's summary and image prompts; a given summary replaces the LLM's."""
+    updates = {}
+    if use_llm:
+        summarize_stage = importlib.import_module("3_summarize_chapters_add_ai_prompts")
+        data = load_story(summary_file)
+        chapters = data["story_chapters"]
+        previous_chapter_summary = chapters[index - 1]["chapter_summary"] if index > 0 else None
+        summarize_stage.start_model_service()
+        try:
+            updates = summarize_stage.summarize_chapter(summarize_stage.MODEL_NAME, chapters[index]["chapter"], data, previous_chapter_summary)
+        finally:
+            summarize_stage.stop_ollama_service()
+        del updates["chapter"]
+    if summary:
+        updates["chapter_summary"] = summary
+    with StoryJournal(summary_file) as journal:
+        for key, value in updates.items():
+            journal.set(["story_chapters", index, key], value)
+    for key, value in updates.items():
+        print(f"[INFO] {key}: {value}")
+
+def regenerate_image(summary_file, index, run_id):
+    """Forget the chapter's images and rerun stage 4, which only renders chapters without a current image."""
+    with StoryJournal(summary_file) as journal:
+        chapter = journal.data["story_chapters"][index]
+        for key in [key for key in chapter if key.startswith((profile_utils.IMAGE_KEY_PREFIX, profile_utils.IMAGE_PROFILE_PREFIX))]:
+            del chapter[key]
+        journal.compact()
+
+    input_digest = stage_cache_utils.compute_input_digest(IMAGE_STAGE, run_id)
+    elapsed, succeeded = run_all.run_stage(*run_all.select_stages([IMAGE_STAGE])[0])
+    if not succeeded:
+        raise RuntimeError(f"{IMAGE_STAGE} failed; the chapter has no new image")
+    stage_cache_utils.save_stamp(IMAGE_STAGE, run_id, input_digest)
+
+def retime_chapters(chapters, index, narration):
+    """Give chapter index its new narration length; the chapters after it shift by the difference."""
+    chapter = chapters[index]
+    delta = chapter["chapter_summary_start_time"] + narration - chapter["chapter_summary_end_time"]
+    chapter["chapter_summary_end_time"] += delta
+    for later_chapter in chapters[index + 1:]:
+        later_chapter["chapter_summary_start_time"] += delta
+        later_chapter["chapter_summary_end_time"] += delta
+    return delta
+
+def regenerate_video(summary_file, index, run_id):
+    """Re-render the chapter's narration and segment and concat them with the other chapters' segments for every model."""
+    movie_stage = importlib.import_module(MOVIE_STAGE)
+    journal = StoryJournal(summary_file)
+    data = journal.data
+    chapters = data["story_chapters"]
+    if "chapter_summary_start_time" not in chapters[index]:
+        raise ValueError(f"{MOVIE_STAGE} has not timed the chapters of run {run_id} yet; run it first")
+
+    narration = chapter_stream_utils.narration_seconds(chapters[index]["chapter_summary"], movie_stage.SPEED_OF_SPEECH)
+    delta = retime_chapters(chapters, index, narration)
+    print(f"[INFO] Chapter {index + 1} narration is now {narration:.2f} seconds ({delta:+.2f} s)")
+
+    replaced_dir = run_context_utils.run_path(REPLACED_VIDEOS_FOLDER)
+    for model_name, images_and_summaries in movie_stage.find_enhanced_images(data, placeholders=True).items():
+        model_key = model_name.replace('/', '_')
+        old_video = run_index_utils.get_artifact(f"video_{model_key}", run_id) or data.get(f"created_video_location_{model_key}")
+        if not old_video or not os.path.exists(old_video):
+            print(f"[WARNING] No movie for '{model_name}' to update; run {MOVIE_STAGE} for the run instead.")
+            continue
+
+        segment_key = f"{chapter_stream_utils.SEGMENT_KEY_PREFIX}{model_name}"
+        missing = sum(1 for _, _, chapter in images_and_summaries
+                      if chapter is not chapters[index] and not os.path.exists(chapter.get(segment_key) or ""))
+        if missing:
+            print(f"[WARNING] {missing} other chapter(s) of '{model_name}' have no stored segment (the movie was made without "
+                  f"-stream); rendering them too, so later regenerations of this run only redo their own chapter.")
+        segment_paths = []
+        final_video_length = 0.0
+        for image_path, summary, chapter in images_and_summaries:
+            narration = chapter["chapter_summary_end_time"] - chapter["chapter_summary_start_time"]
+            stored_segment = chapter.get(segment_key)
+            if chapter is chapters[index] or not stored_segment or not os.path.exists(stored_segment):
+                _, _, chapter[segment_key] = chapter_stream_utils.chapter_segment(model_name, image_path, summary, movie_stage.SPEED_OF_SPEECH, narration=narration)
+            segment_paths.append(chapter[segment_key])
+            final_video_length += max(narration, chapter_stream_utils.MIN_DISPLAY_SECONDS)
+
+        group_time_str = datetime.now().strftime('%Y%m%d_%H%M%S')
+        output_video = os.path.join(os.path.dirname(old_video), movie_stage.generate_video_filename(
+            model_name, images_and_summaries[0][1], f"chapter{index + 1}", group_time_str, final_video_length))
+        chapter_stream_utils.concat_segments(segment_paths, old_video, output_video, copy_audio=True)
+
+        os.makedirs(replaced_dir, exist_ok=True)
+        shutil.move(old_video, os.path.join(replaced_dir, os.path.basename(old_video)))
+        data[f"created_video_location_{model_key}"] = output_video
+        run_index_utils.record_artifact(f"video_{model_key}", output_video, stage="regenerate_chapter", run_id=run_id,
+                                        profile=profile_utils.active_profile())
+        print(f"[INFO] Movie for '{model_name}' updated: {output_video}")
+
+    journal.compact()
+    stage_cache_utils.save_stamp(MOVIE_STAGE, run_id, stage_cache_utils.compute_input_digest(MOVIE_STAGE, run_id))
+
+def regenerate_chapter(run_id, chapter_number, steps=REGEN_STEPS, summary=None):
+    """Redo the given steps for one chapter (1-based) of a run and return the finishing stages' timings, if run."""
+    summary_file = open_run(run_id)
+    index = chapter_number - 1
+    chapter_count = len(load_story(summary_file).get("story_chapters", []))
+    if not 0 <= index < chapter_count:
+        raise ValueError(f"Run {run_id} has chapters 1-{chapter_count}, not {chapter_number}")
+
+    print(f"Regenerating chapter {chapter_number} of run {run_id} ({', '.join(steps)})")
+    if "prompt" in steps or summary:
+        with profiling_utils.profiled("regenerate_chapter_prompt"):
+            regenerate_prompt(summary_file, index, summary, use_llm="prompt" in steps)
+    if "image" in steps:
+        regenerate_image(summary_file, index, run_id)
+    if "video" in steps:
+        with profiling_utils.profiled("regenerate_chapter_video"):
+            regenerate_video(summary_file, index, run_id)
+    if "finish" in steps:
+        return run_all.run_pipeline(1, run_all.select_stages(FINISH_STAGES), run_id, use_cache=False,
+                                    run_dirs=run_context_utils.is_run_scoped())
+    return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate one chapter of a run and rebuild its videos around it. Only the chapter "
+                                     "is re-rendered when stage 5 ran with -stream; otherwise the first regeneration renders every chapter's segment.")
+    parser.add_argument("-chapter", type=int, required=True, help="Chapter to regenerate (1-based).")
+    parser.add_argument("-run_id", type=str, help="Run to update (default: the most recent run).")
+    parser.add_argument("-steps", nargs="+", default=REGEN_STEPS, choices=REGEN_STEPS, help="Steps to redo, in this order.")
+    parser.add_argument("-summary", type=str, help="Use this chapter summary (the narration and subtitle) instead of the LLM's.")
+    parser.add_argument("-profile", nargs="?", const="sample", choices=profiling_utils.PROFILE_MODES,
+                        help="Write a function-level profile of every step and stage to profiles/ (sample, the default, or cprofile).")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profiling_utils.enable(args.profile)
+    run_id = args.run_id or run_index_utils.current_run_id()
+    if not run_id:
+        print("[ERROR] No runs in the run index.")
+        return 1
+    try:
+        regenerate_chapter(run_id, args.chapter, args.steps, args.summary)
+    except (ValueError, RuntimeError) as e:
+        print(f"[ERROR] {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,9 @@ $totalStart = [datetime]::Now
 
 # Array to store individual script times
 $scriptTimes = @{}
+# Per-run stage times, written to timings/ and recorded in the benchmark history at the end
+$runs = @()
+$currentRun = @{}
 
 
 # Get the directory where the PowerShell script is located
@@ -53,11 +56,17 @@ function Run-LogPythonScript {
         $scriptTimes[$scriptName] = 0
     }
     $scriptTimes[$scriptName] += $elapsed.TotalSeconds
+
+    # Same stage names as run_all.py, so the history can compare the two
+    $stageName = [System.IO.Path]::GetFileNameWithoutExtension($scriptName)
+    if ($stageName -eq "archive_utils") { $stageName = "archive" }
+    $currentRun[$stageName] = @{ seconds = [math]::Round($elapsed.TotalSeconds, 3); succeeded = ($process.ExitCode -eq 0) }
 }
 
 # Loop through the specified number of runs
 for ($i = 1; $i -le $number_of_runs; $i++) {
     Write-Output "`nRun $i of $number_of_runs..."
+    $currentRun = @{}
     
     # Run each script
     Run-LogPythonScript "utilities/archive_utils.py"
@@ -70,6 +79,7 @@ for ($i = 1; $i -le $number_of_runs; $i++) {
     Run-LogPythonScript "7_zoompan_movie.py"
     Run-LogPythonScript "8_add_ffmpeg_subtitles.py"
     Run-LogPythonScript "9_create_voiceover.py"
+    $runs += @{ run_id = "run_$i"; stages = $currentRun }
 }
 
 # Total end time
@@ -82,4 +92,13 @@ foreach ($script in $scriptTimes.Keys) {
     Write-Output "${script}: $($scriptTimes[$script]) seconds"
 }
 Write-Output "Total runs: $number_of_runs"
-Write-Output "Total time: $($totalElapsed.TotalSeconds) seconds."
\ No newline at end of file
+Write-Output "Total time: $($totalElapsed.TotalSeconds) seconds."
+
+# Keep the timings and record them in the benchmark history (utilities/benchmark_history_utils.py -compare)
+$timingsFolder = Join-Path $scriptDirectory "timings"
+New-Item -ItemType Directory -Force -Path $timingsFolder | Out-Null
+$timingsFile = Join-Path $timingsFolder "run_all_ps1_$($totalStart.ToString('yyyy-MM-dd_HH-mm')).json"
+@{ total_runs = $number_of_runs; total_seconds = [math]::Round($totalElapsed.TotalSeconds, 3); runs = $runs } |
+    ConvertTo-Json -Depth 5 | Set-Content -Path $timingsFile
+Write-Output "Timings written to $timingsFile"
+& python (Join-Path $scriptDirectory "utilities/benchmark_history_utils.py") -record $timingsFile -source run_all.ps1
\ No newline at end of file
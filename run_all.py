@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import importlib
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+from utilities.ollama_utils import stop_ollama_service
+from utilities import run_index_utils, stage_cache_utils, run_context_utils, tracing_utils, profile_utils, resource_sampler_utils, profiling_utils, metrics_utils, scratch_utils, story_pack_utils, artifact_store_utils, benchmark_history_utils, failure_utils
+
+try:
+    import GLOBAL_VARIABLES
+except ImportError:
+    class GLOBAL_VARIABLES:
+        pass
+
+# Runs every stage of the pipeline inside one Python process (the same order as run_all.ps1).
+# Stage modules are imported once, so the interpreter, torch/diffusers and any pipelines cached
+# by the stages stay resident between stages and between runs instead of being reloaded.
+
+NUMBER_OF_RUNS = getattr(GLOBAL_VARIABLES, 'NUMBER_OF_RUNS', 1)
+TIMINGS_FOLDER = "timings"
+
+# (stage name, module, entry point)
+PIPELINE_STAGES = [
+    ("archive", "utilities.archive_utils", "archive_previous_generations"),
+    ("1_dream_up_a_story", "1_dream_up_a_story", "main"),
+    ("2_build_out_chapters", "2_build_out_chapters", "main"),
+    ("3_summarize_chapters_add_ai_prompts", "3_summarize_chapters_add_ai_prompts", "main"),
+    ("4_create_images_from_ai_prompts", "4_create_images_from_ai_prompts", "main"),
+    ("5_create_movie", "5_create_movie", "main"),
+    ("6_create_mosaic", "6_create_mosaic", "main"),
+    ("7_zoompan_movie", "7_zoompan_movie", "process_videos"),
+    ("8_add_ffmpeg_subtitles", "8_add_ffmpeg_subtitles", "main"),
+    ("9_create_voiceover", "9_create_voiceover", "main"),
+]
+
+def select_stages(stage_names=None):
+    """Return the PIPELINE_STAGES entries to run, keeping pipeline order."""
+    if not stage_names:
+        return PIPELINE_STAGES
+    wanted = set(stage_names)
+    unknown = wanted - {name for name, _, _ in PIPELINE_STAGES}
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+    return [stage for stage in PIPELINE_STAGES if stage[0] in wanted]
+
+def run_stage(name, module_name, function_name):
+    """Run one stage in-process; returns (elapsed seconds, succeeded)."""
+    print(f"Running {name}")
+    start = time.perf_counter()
+    succeeded = True
+    try:
+        module = importlib.import_module(module_name)
+        # Stage argument parsers must not see run_all's own arguments
+        saved_argv = sys.argv
+        sys.argv = [f"{module_name}.py"]
+        try:
+            with metrics_utils.in_stage(name), tracing_utils.span(name, "stage"), profiling_utils.profiled(name):
+                getattr(module, function_name)()
+        finally:
+            sys.argv = saved_argv
+    except SystemExit as e:
+        # Stages still exit() on some fatal errors; like run_all.ps1, keep going with the next stage
+        if e.code not in (None, 0):
+            succeeded = False
+            print(f"{name} exited with status {e.code}")
+    except failure_utils.StageFailure as e:
+        succeeded = False
+        print(f"{name} failed: {e}")
+    except Exception as e:
+        succeeded = False
+        print(f"{name} failed: {e}")
+        traceback.print_exc()
+    elapsed = time.perf_counter() - start
+    print(f"{name} completed in {elapsed:.2f} seconds")
+    print("----------------------------------------")
+    return elapsed, succeeded
+
+@contextmanager
+def segment_prerender(enabled):
+    """While stage 4 generates images, let stage 5 render each chapter's segment as soon as its image lands."""
+    if not enabled:
+        yield
+        return
+    movie_stage = importlib.import_module("5_create_movie")
+    stop_event = threading.Event()
+    thread = threading.Thread(target=tracing_utils.propagate(movie_stage.prerender_segments), args=(stop_event,), daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop_event.set()
+        thread.join()
+
+def export_trace(run_id):
+    """Write the run's Chrome trace (open in https://ui.perfetto.dev) and OTLP JSON next to each other."""
+    trace_file = tracing_utils.export_chrome_trace(run_id)
+    if trace_file:
+        tracing_utils.export_otlp_json(run_id)
+        print(f"Trace written to {trace_file}")
+    return trace_file
+
+def run_pipeline(number_of_runs, stages, run_id_override=None, use_cache=True, run_dirs=False, stream=False, resources=False):
+    """Run the selected stages number_of_runs times (each as a new run in the run index) and return the per-stage timings.
+
+    With use_cache, stages whose declared inputs are unchanged since their last success for the run are skipped.
+    With run_dirs, each run works in its own runs/<run_id>/ folder instead of the shared folders.
+    With stream, stage 5's chapter segments are rendered while stage 4 runs, so stage 5 only concatenates them.
+    With resources, each stage's process tree is sampled and its peaks and totals are added to its timings.
+    """
+    stage_names = [name for name, _, _ in stages]
+    stage_times = {name: 0.0 for name, _, _ in stages}
+    runs = []
+    for run_number in range(1, number_of_runs + 1):
+        run_id = run_index_utils.start_run(run_id_override)
+        print(f"\nRun {run_number} of {number_of_runs} (run id {run_id})...")
+        if run_dirs:
+            print(f"Working directory: {run_context_utils.activate_run(run_id)}")
+        artifact_store_utils.pull_run(run_id)  # Files other nodes produced for this run (no-op without a store)
+        with tracing_utils.span("run", "run", run_id=run_id):
+            run_timings = {}
+            forced = stage_cache_utils.plan_forced_stages(stage_names, run_id) if use_cache else set()
+            for name, module_name, function_name in stages:
+                # Computed right before the stage, after upstream stages have refreshed their stamps
+                input_digest = stage_cache_utils.compute_input_digest(name, run_id)
+                cached = use_cache and name not in forced and stage_cache_utils.is_stage_current(name, run_id, input_digest)
+                if use_cache:
+                    metrics_utils.count_cache("stage", cached)
+                if cached:
+                    print(f"Skipping {name}: inputs unchanged since its last run")
+                    print("----------------------------------------")
+                    run_index_utils.set_stage_status(name, "skipped", run_id)
+                    run_timings[name] = {"seconds": 0.0, "succeeded": True, "skipped": True}
+                    continue
+                run_index_utils.set_stage_status(name, "running", run_id)
+                prerender = stream and name == "4_create_images_from_ai_prompts" and "5_create_movie" in stage_names
+                sampler = resource_sampler_utils.ResourceSampler(label=name).start() if resources else None
+                with segment_prerender(prerender):
+                    elapsed, succeeded = run_stage(name, module_name, function_name)
+                run_index_utils.set_stage_status(name, "done" if succeeded else "failed", run_id)
+                if succeeded:
+                    stage_cache_utils.save_stamp(name, run_id, input_digest)
+                    artifact_store_utils.push_run(run_id, name)
+                stage_times[name] += elapsed
+                run_timings[name] = {"seconds": round(elapsed, 3), "succeeded": succeeded}
+                failed_units = failure_utils.open_failures(run_id, name)
+                if failed_units:
+                    # The stage went on without these; "failed" ones are retried the next time the run is processed
+                    run_timings[name]["failed_units"] = {record["unit"]: record["status"] for record in failed_units}
+                    print(f"{name}: {len(failed_units)} unit(s) failed or replaced by placeholders:")
+                    print(failure_utils.format_failures(failed_units))
+                scratch = scratch_utils.take_usage()
+                if scratch["spaces"]:
+                    run_timings[name]["scratch"] = scratch  # Bytes of intermediates kept in memory vs. on disk
+                if sampler:
+                    run_timings[name]["resources"] = sampler.stop()
+                    print(f"{name} resources: {resource_sampler_utils.format_summary(run_timings[name]['resources'])}")
+        run_succeeded = all(timing["succeeded"] for timing in run_timings.values())
+        run_index_utils.finish_run("done" if run_succeeded else "failed", run_id)
+        runs.append({"run_id": run_id, "stages": run_timings})
+        if tracing_utils.is_enabled():
+            export_trace(run_id)
+    if run_dirs:
+        run_context_utils.deactivate_run()
+    return stage_times, runs
+
+def promote_run(run_id, use_cache=True, run_dirs=False, stream=False, resources=False):
+    """Re-render a draft run with the final profile: stages 4-9 run again on the story the LLM stages already wrote."""
+    if not run_index_utils.get_artifact("summaries", run_id):
+        raise ValueError(f"Run {run_id} has no chapter summaries to promote (stage 3 has not finished for it)")
+    profile_utils.use_profile("final")
+    run_dirs = run_dirs or os.path.isdir(run_context_utils.run_dir_for(run_id))  # The draft ran in its own runs/<run_id>/
+    if run_dirs:
+        run_context_utils.activate_run(run_id)
+    for draft_video in profile_utils.set_aside_draft_outputs(run_id):
+        print(f"Draft video moved to {draft_video}")
+    return run_pipeline(1, select_stages(profile_utils.PROMOTE_STAGES), run_id, use_cache=use_cache, run_dirs=run_dirs, stream=stream,
+                        resources=resources)
+
+def timings_config(args):
+    """The settings that shape a run's timings; the benchmark history only compares runs with the same ones."""
+    return {
+        "quality_profile": profile_utils.active_profile(),
+        "chapters": getattr(GLOBAL_VARIABLES, 'NUMBER_OF_CHAPTERS_PER_STORY', None),
+        "models": getattr(GLOBAL_VARIABLES, 'TOP_MODELS', None),
+        "video_length": getattr(GLOBAL_VARIABLES, 'DEFAULT_VIDEO_LENGTH', None),
+        "stream": args.stream,
+        "promote": bool(args.promote),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the full story-to-video pipeline in a single process.")
+    parser.add_argument("-runs", type=int, default=NUMBER_OF_RUNS, help="Number of stories to generate.")
+    parser.add_argument("-stages", nargs="+", help="Only run these stages (e.g. 5_create_movie 6_create_mosaic).")
+    parser.add_argument("-run_id", type=str, help="Continue an existing run (e.g. rerun -stages 5_create_movie for it) instead of starting new ones.")
+    parser.add_argument("-resume", action="store_true", help="Continue the most recent run (same as -run_id <latest>).")
+    parser.add_argument("-force", action="store_true", help="Run every selected stage even if its inputs are unchanged.")
+    parser.add_argument("-run_dirs", action="store_true", default=run_context_utils.USE_RUN_DIRECTORIES,
+                        help="Give every run its own runs/<run_id>/ working folders (no archiving; runs can go side by side).")
+    parser.add_argument("-timings_file", type=str, help="Where to write the timings JSON (default: timings/run_all_<timestamp>.json).")
+    parser.add_argument("-no_history", action="store_true", help="Do not record the timings in the benchmark history.")
+    parser.add_argument("-trace", action="store_true", help="Record spans and write traces/<run_id>.trace.json per run.")
+    parser.add_argument("-profile", nargs="?", const="sample", choices=profiling_utils.PROFILE_MODES,
+                        help="Write a function-level profile of every stage to profiles/ (sample, the default, or cprofile).")
+    parser.add_argument("-metrics_port", type=int, default=getattr(GLOBAL_VARIABLES, 'METRICS_PORT', None),
+                        help="Serve Prometheus metrics at http://127.0.0.1:<port>/metrics while the pipeline runs.")
+    parser.add_argument("-quality", choices=list(profile_utils.PROFILES), help="Quality profile (default: QUALITY_PROFILE); draft is fast and rough.")
+    parser.add_argument("-stream", action="store_true", help="Render stage 5's chapter segments as stage 4's images land; stage 5 then only concatenates.")
+    parser.add_argument("-resources", action="store_true", help="Sample each stage's process tree (RSS, CPU, I/O, open files of every child) into the timings.")
+    parser.add_argument("-pack", type=str, help="Run stages on a story pack from another node; inputs not on disk are read from the pack.")
+    parser.add_argument("-artifact_store", type=str, help="Pull each run's files from and push them to this store (file:///path or s3://bucket/prefix); implies -run_dirs.")
+    parser.add_argument("-promote", type=str, metavar="RUN_ID", help="Re-render a draft run with the final profile, keeping its story (stages 4-9).")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracing_utils.enable()
+    if args.profile:
+        profiling_utils.enable(args.profile)
+    if args.metrics_port is not None:
+        metrics_utils.start_metrics_server(args.metrics_port)
+    if args.artifact_store:
+        artifact_store_utils.enable(args.artifact_store)
+    if artifact_store_utils.is_enabled():
+        args.run_dirs = True  # Only a run's own directory is pushed to and pulled from the store
+    if args.quality:
+        profile_utils.use_profile(args.quality)
+    if args.stream:
+        GLOBAL_VARIABLES.STREAM_CHAPTER_SEGMENTS = True  # Read by 5_create_movie.py when it is imported
+
+    atexit.register(stop_ollama_service)
+
+    if args.pack:
+        args.run_id = story_pack_utils.use_pack(args.pack)
+        args.run_dirs = args.run_dirs or run_context_utils.is_run_scoped()
+
+    total_start = time.perf_counter()
+    if args.promote:
+        args.runs = 1
+        stage_times, runs = promote_run(args.promote, use_cache=not args.force, run_dirs=args.run_dirs, stream=args.stream, resources=args.resources)
+    else:
+        stages = select_stages(args.stages)
+        # Stages after stage 1 read an earlier run's story, so without -run_id they continue the latest run (like -resume)
+        continues_run = args.resume or "1_dream_up_a_story" not in {name for name, _, _ in stages}
+        run_id = args.run_id or (run_index_utils.current_run_id() if continues_run else None)
+        if run_id:
+            args.runs = 1  # A continued run is processed once, not NUMBER_OF_RUNS times over the same run id
+        stage_times, runs = run_pipeline(args.runs, stages, run_id, use_cache=not args.force, run_dirs=args.run_dirs, stream=args.stream,
+                                         resources=args.resources)
+    total_elapsed = time.perf_counter() - total_start
+
+    print("\n=== SUMMARY ===")
+    for name, seconds in stage_times.items():
+        print(f"{name}: {seconds:.2f} seconds")
+    print(f"Total runs: {args.runs}")
+    print(f"Total time: {total_elapsed:.2f} seconds.")
+
+    timings_file = args.timings_file
+    if not timings_file:
+        os.makedirs(TIMINGS_FOLDER, exist_ok=True)
+        timings_file = os.path.join(TIMINGS_FOLDER, f"run_all_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json")
+    timings = {
+        "total_runs": args.runs,
+        "quality_profile": profile_utils.active_profile(),
+        "config": timings_config(args),
+        "total_seconds": round(total_elapsed, 3),
+        "stage_seconds": {name: round(seconds, 3) for name, seconds in stage_times.items()},
+        "runs": runs,
+    }
+    with open(timings_file, 'w') as f:
+        json.dump(timings, f, indent=4)
+    print(f"Timings written to {timings_file}")
+    if not args.no_history:
+        benchmark_history_utils.record_report(timings, "run_all", report_path=timings_file)
+
+if __name__ == "__main__":
+    sys.exit(main())
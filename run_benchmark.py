@@ -0,0 +1,213 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import statistics
+import subprocess
+from datetime import datetime
+
+from utilities import benchmark_utils, benchmark_history_utils, run_context_utils, run_index_utils
+from utilities.fake_ollama_server import start_fake_server
+import run_all
+
+# Hermetic end-to-end benchmark: runs stages 1-9 offline with stand-ins for Ollama, the diffusion models,
+# gTTS and the music download (utilities/benchmark_utils.py), so the numbers only move when the pipeline
+# code does.  Every stage runs in its own process inside a throwaway benchmarks/<timestamp>/ folder (its
+# own run directory, run index and music cache) and reports its latency, peak RSS (itself and its largest
+# subprocess), bytes written and the subprocesses it started.
+#   python run_benchmark.py -chapters 4 -models 2 -runs 3
+# The report is written to benchmarks/benchmark_<timestamp>.json and recorded in the benchmark history
+# (utilities/benchmark_history_utils.py) for comparison across revisions.
+
+BENCHMARKS_FOLDER = "benchmarks"
+DEFAULT_CHAPTERS = 4
+DEFAULT_MODELS = 1
+DEFAULT_IMAGE_SIZE = (512, 512)
+DEFAULT_VIDEO_LENGTH = 30
+BENCHMARK_STAGES = [name for name, _, _ in run_all.PIPELINE_STAGES if name != "archive"]
+
+def benchmark_overrides(config):
+    """GLOBAL_VARIABLES values every benchmark stage sees, whatever the local GLOBAL_VARIABLES.py says."""
+    return {
+        "NUMBER_OF_CHAPTERS_PER_STORY": config["chapters"],
+        "TOP_MODELS": [f"benchmark/fake-model-{i + 1}" for i in range(config["models"])],
+        "DEFAULT_VIDEO_LENGTH": config["video_length"],
+        "USER_PROVIDED_EXACT_CHARACTER": "",  # 4b needs CUDA generators; the benchmark covers the TOP_MODELS path
+        "USER_PROVIDED_IMAGE_PATH": None,
+        "USER_PROVIDED_YOUTUBE_MUSIC": "",
+        "ARCHIVE_ALL_PREVIOUS_GENERATIONS": False,
+        "RANDOMIZE_SEED_VALUE": False,
+    }
+
+def run_stage_child(stage_name, run_id, result_file):
+    """Run one stage with the stand-ins installed and write its measurements to result_file (child process)."""
+    config = json.loads(os.environ[benchmark_utils.BENCHMARK_CONFIG_ENV])
+    import GLOBAL_VARIABLES
+    for key, value in benchmark_overrides(config).items():
+        setattr(GLOBAL_VARIABLES, key, value)
+
+    benchmark_utils.count_subprocesses()
+    benchmark_utils.install_stand_ins(stage_name, config)
+    run_index_utils.start_run(run_id)
+    run_dir = run_context_utils.activate_run(run_id)
+
+    before = benchmark_utils.snapshot_files(run_dir)
+    stage = next(stage for stage in run_all.PIPELINE_STAGES if stage[0] == stage_name)
+    elapsed, succeeded = run_all.run_stage(*stage)
+    peak_rss, child_peak_rss = benchmark_utils.peak_rss_bytes()
+
+    with open(result_file, "w") as f:
+        json.dump({
+            "stage": stage_name,
+            "seconds": round(elapsed, 3),
+            "succeeded": succeeded,
+            "peak_rss_bytes": peak_rss,
+            "subprocess_peak_rss_bytes": child_peak_rss,
+            "bytes_written": benchmark_utils.bytes_written(before, benchmark_utils.snapshot_files(run_dir)),
+            "io_write_bytes": benchmark_utils.io_write_bytes(),
+            "subprocesses": benchmark_utils.subprocess_counts(),
+        }, f)
+    return 0 if succeeded else 1
+
+def run_stage_process(stage_name, run_id, work_dir, env):
+    """Start a child for one stage and return its measurements (plus the wall time including interpreter start-up)."""
+    result_file = os.path.join(work_dir, f"{run_id}_{stage_name}.json")
+    log_file = os.path.join(work_dir, "logs", f"{run_id}_{stage_name}.log")
+    start = time.perf_counter()
+    with open(log_file, "w") as log:
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "-child_stage", stage_name, "-run_id", run_id, "-result_file", result_file],
+                                 cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    wall_seconds = time.perf_counter() - start
+    if os.path.exists(result_file):
+        with open(result_file) as f:
+            result = json.load(f)
+    else:
+        result = {"stage": stage_name, "seconds": None, "succeeded": False, "error": f"stage process exited with status {process.returncode}"}
+    result["process_seconds"] = round(wall_seconds, 3)
+    result["log"] = log_file
+    return result
+
+def summarize(runs):
+    """Per stage across runs: median/min/max seconds, the highest peak RSS and the mean bytes and subprocesses."""
+    summary = {}
+    for stage_name in dict.fromkeys(result["stage"] for run in runs for result in run["stages"]):
+        results = [result for run in runs for result in run["stages"] if result["stage"] == stage_name]
+        seconds = [result["seconds"] for result in results if result["seconds"] is not None]
+        subprocess_totals = {}
+        for result in results:
+            for program, count in result.get("subprocesses", {}).items():
+                subprocess_totals[program] = subprocess_totals.get(program, 0) + count
+        summary[stage_name] = {
+            "runs": len(results),
+            "failures": sum(1 for result in results if not result["succeeded"]),
+            "median_seconds": round(statistics.median(seconds), 3) if seconds else None,
+            "min_seconds": min(seconds) if seconds else None,
+            "max_seconds": max(seconds) if seconds else None,
+            "peak_rss_bytes": max((result.get("peak_rss_bytes") or 0 for result in results), default=0),
+            "subprocess_peak_rss_bytes": max((result.get("subprocess_peak_rss_bytes") or 0 for result in results), default=0),
+            "mean_bytes_written": round(statistics.mean(result.get("bytes_written") or 0 for result in results)),
+            "mean_subprocesses": {program: round(count / len(results), 2) for program, count in sorted(subprocess_totals.items())},
+        }
+    return summary
+
+def run_benchmark(config, stages, runs, keep_files=False):
+    """Run the benchmark and return the report dict."""
+    timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+    work_dir = os.path.abspath(os.path.join(BENCHMARKS_FOLDER, timestamp))
+    os.makedirs(os.path.join(work_dir, "logs"), exist_ok=True)
+
+    server = start_fake_server(0, config["llm_prompt_eval_cost"], config["llm_eval_cost"])
+    env = dict(os.environ, **{
+        "OLLAMA_HOST": f"http://127.0.0.1:{server.server_address[1]}",
+        "STORY_RUNS_ROOT": os.path.join(work_dir, "runs"),
+        "STORY_RUN_INDEX": os.path.join(work_dir, "run_index.sqlite"),
+        benchmark_utils.BENCHMARK_CONFIG_ENV: json.dumps(config),
+    })
+    for name in (run_context_utils.RUN_DIR_ENV, run_context_utils.RUN_ID_ENV):
+        env.pop(name, None)
+
+    results = []
+    try:
+        for run_number in range(1, runs + 1):
+            run_id = f"benchmark_{run_number}"
+            print(f"\nBenchmark run {run_number} of {runs}")
+            run_stages = []
+            for stage_name in stages:
+                result = run_stage_process(stage_name, run_id, work_dir, env)
+                status = "ok" if result["succeeded"] else "FAILED"
+                print(f"  {stage_name}: {result['seconds']} s, peak RSS {(result.get('peak_rss_bytes') or 0) / 2**20:.0f} MB, "
+                      f"{result.get('bytes_written', 0) / 2**20:.1f} MB written, {sum(result.get('subprocesses', {}).values())} subprocesses [{status}]")
+                run_stages.append(result)
+            results.append({"run_id": run_id, "total_seconds": round(sum(r["seconds"] or 0 for r in run_stages), 3), "stages": run_stages})
+    finally:
+        server.shutdown()
+
+    report = {
+        "created_at": timestamp,
+        "config": config,
+        "stages": stages,
+        "environment": benchmark_history_utils.machine_fingerprint(),
+        "summary": summarize(results),
+        "median_total_seconds": round(statistics.median(run["total_seconds"] for run in results), 3) if results else None,
+        "runs": results,
+    }
+    if not keep_files:
+        shutil.rmtree(os.path.join(work_dir, "runs"), ignore_errors=True)
+    report["work_dir"] = work_dir
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pipeline offline against stand-ins and report per-stage costs.")
+    parser.add_argument("-chapters", type=int, default=DEFAULT_CHAPTERS, help="Chapters per story.")
+    parser.add_argument("-models", type=int, default=DEFAULT_MODELS, help="Number of (fake) diffusion models, i.e. videos per story.")
+    parser.add_argument("-runs", type=int, default=1, help="Stories to generate; the summary uses the median.")
+    parser.add_argument("-stages", nargs="+", default=BENCHMARK_STAGES, choices=BENCHMARK_STAGES, help="Stages to benchmark, in pipeline order.")
+    parser.add_argument("-image_size", type=int, nargs=2, default=DEFAULT_IMAGE_SIZE, metavar=("WIDTH", "HEIGHT"), help="Size of the fake diffusion images.")
+    parser.add_argument("-video_length", type=int, default=DEFAULT_VIDEO_LENGTH, help="DEFAULT_VIDEO_LENGTH for the stages.")
+    parser.add_argument("-diffusion_step_cost", type=float, default=0.0, help="Simulated seconds per diffusion step.")
+    parser.add_argument("-llm_prompt_eval_cost", type=float, default=0.0, help="Simulated seconds per prompt token at the fake Ollama server.")
+    parser.add_argument("-llm_eval_cost", type=float, default=0.0, help="Simulated seconds per generated token at the fake Ollama server.")
+    parser.add_argument("-music_file", type=str, help="Local music file to use instead of a generated tone.")
+    parser.add_argument("-keep_files", action="store_true", help="Keep the generated stories, images and videos.")
+    parser.add_argument("-output", type=str, help="Report path (default: benchmarks/benchmark_<timestamp>.json).")
+    parser.add_argument("-no_history", action="store_true", help="Do not record the report in the benchmark history.")
+    parser.add_argument("-child_stage", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("-run_id", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("-result_file", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child_stage:
+        return run_stage_child(args.child_stage, args.run_id, args.result_file)
+
+    config = {
+        "chapters": args.chapters,
+        "models": args.models,
+        "image_size": list(args.image_size),
+        "video_length": args.video_length,
+        "diffusion_seconds_per_step": args.diffusion_step_cost,
+        "llm_prompt_eval_cost": args.llm_prompt_eval_cost,
+        "llm_eval_cost": args.llm_eval_cost,
+        "music_file": os.path.abspath(args.music_file) if args.music_file else None,
+    }
+    stages = [name for name in BENCHMARK_STAGES if name in args.stages]
+    report = run_benchmark(config, stages, args.runs, args.keep_files)
+
+    print("\n=== BENCHMARK SUMMARY ===")
+    for stage_name, stage in report["summary"].items():
+        print(f"{stage_name}: median {stage['median_seconds']} s, peak RSS {stage['peak_rss_bytes'] / 2**20:.0f} MB, "
+              f"{stage['mean_bytes_written'] / 2**20:.1f} MB written, subprocesses {stage['mean_subprocesses']}"
+              + (f", {stage['failures']} failure(s)" if stage['failures'] else ""))
+    print(f"Median total: {report['median_total_seconds']} s")
+
+    output = args.output or os.path.join(BENCHMARKS_FOLDER, f"benchmark_{report['created_at']}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {output}")
+    if not args.no_history:
+        benchmark_history_utils.record_report(report, "run_benchmark", report_path=output)
+    return 0 if not any(stage["failures"] for stage in report["summary"].values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
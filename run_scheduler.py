@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+
+from utilities import work_queue_utils, tracing_utils, profile_utils, profiling_utils, metrics_utils, artifact_store_utils
+from utilities.ollama_utils import SHARED_GPU_ENV
+import queue_worker
+import run_all
+
+try:
+    import GLOBAL_VARIABLES
+except ImportError:
+    class GLOBAL_VARIABLES:
+        pass
+
+# Runs several stories at once so the LLM, the GPU and the CPU are busy at the same time: while story N+1
+# is in the LLM stages, story N is in diffusion and story N-1 in the FFmpeg/TTS stages.  The runs are
+# queued (work_queue_utils) and worked off by local queue_worker.py processes, one per slot: LLM_SLOTS
+# for the Ollama stages, GPU_SLOTS (one diffusion job per GPU) and CPU_SLOTS FFmpeg jobs, each pinned to
+# CPU_CORES_PER_JOB cores.  Workers stay up between stories, so their models stay loaded.
+
+NUMBER_OF_RUNS = getattr(GLOBAL_VARIABLES, 'NUMBER_OF_RUNS', 1)
+LLM_SLOTS = getattr(GLOBAL_VARIABLES, 'SCHEDULER_LLM_SLOTS', 1)
+GPU_SLOTS = getattr(GLOBAL_VARIABLES, 'SCHEDULER_GPU_SLOTS', 1)
+CPU_CORES_PER_JOB = getattr(GLOBAL_VARIABLES, 'SCHEDULER_CPU_CORES_PER_JOB', 4)
+CPU_SLOTS = getattr(GLOBAL_VARIABLES, 'SCHEDULER_CPU_SLOTS', max(1, (os.cpu_count() or 1) // CPU_CORES_PER_JOB))
+TIMINGS_FOLDER = "timings"
+POLL_SECONDS = 1
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queue_worker.py")
+
+def cpu_sets(slots, cores_per_job):
+    """Split the cores this process may use into one '-cpu_set' per CPU slot (None where pinning is unavailable)."""
+    if not hasattr(os, "sched_getaffinity"):
+        return [None] * slots
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < slots * cores_per_job:
+        cores_per_job = max(1, len(cores) // slots)
+    sets = []
+    for slot in range(slots):
+        chunk = cores[slot * cores_per_job:(slot + 1) * cores_per_job] or cores
+        sets.append(",".join(str(core) for core in chunk))
+    return sets
+
+def start_workers(queue_url, slots, log_folder, cores_per_job=CPU_CORES_PER_JOB, metrics_port=None):
+    """Start one queue_worker.py process per slot; returns [(worker id, process, log file)].
+    With metrics_port, the workers serve their metrics on the ports after it."""
+    env = dict(os.environ, **{SHARED_GPU_ENV: "1", "STORY_QUEUE_URL": queue_url})
+    cpu_pins = cpu_sets(slots.get("cpu", 0), cores_per_job)
+    workers = []
+    for resource, count in slots.items():
+        for slot in range(count):
+            worker_id = f"{resource}-{slot}"
+            command = [sys.executable, WORKER_SCRIPT, "-queue", queue_url, "-resources", resource,
+                       "-worker_id", worker_id, "-poll", str(POLL_SECONDS), "-exit_when_idle"]
+            if resource == "cpu" and cpu_pins[slot]:
+                command += ["-cpu_set", cpu_pins[slot]]
+            if metrics_port is not None:
+                command += ["-metrics_port", str(metrics_port + 1 + len(workers))]
+            log_file = open(os.path.join(log_folder, f"{worker_id}.log"), "w")
+            process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+            workers.append((worker_id, process, log_file))
+            print(f"Started worker {worker_id} (pid {process.pid})")
+    return workers
+
+def utilisation_report(jobs, slots, wall_start, wall_end):
+    """Busy seconds and utilisation per resource class plus stories/hour, from the queue's job timestamps."""
+    wall_seconds = max(wall_end - wall_start, 1e-9)
+    busy = {resource: 0.0 for resource in slots}
+    for job in jobs:
+        if job["started_at"] and job["finished_at"] and job["resource"] in busy:
+            busy[job["resource"]] += job["finished_at"] - job["started_at"]
+
+    runs = {}
+    for job in jobs:
+        runs.setdefault(job["run_id"], []).append(job["status"])
+    completed = [run_id for run_id, statuses in runs.items() if all(status == work_queue_utils.DONE for status in statuses)]
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "slots": slots,
+        "busy_seconds": {resource: round(seconds, 3) for resource, seconds in busy.items()},
+        "utilisation": {resource: round(busy[resource] / (wall_seconds * slots[resource]), 3) if slots[resource] else 0.0 for resource in slots},
+        "stories_completed": len(completed),
+        "stories_failed": len(runs) - len(completed),
+        "stories_per_hour": round(len(completed) * 3600 / wall_seconds, 3),
+    }
+
+def run_scheduled(number_of_runs, stages, queue_url, slots, cores_per_job=CPU_CORES_PER_JOB, metrics_port=None):
+    """Queue number_of_runs stories, work them off with overlapping workers and return (run ids, report)."""
+    queue = work_queue_utils.open_queue(queue_url)
+    run_ids = queue_worker.enqueue_runs(queue, number_of_runs, stages)
+    log_folder = os.path.join(TIMINGS_FOLDER, f"scheduler_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}")
+    os.makedirs(log_folder, exist_ok=True)
+
+    wall_start = time.time()
+    if metrics_port is not None:
+        metrics_utils.add_collector(metrics_utils.queue_depth_collector(queue_url))
+        metrics_utils.start_metrics_server(metrics_port)
+    workers = start_workers(queue_url, slots, log_folder, cores_per_job, metrics_port)
+    try:
+        for worker_id, process, log_file in workers:
+            process.wait()
+            log_file.close()
+            print(f"Worker {worker_id} finished with status {process.returncode}")
+    finally:
+        for worker_id, process, log_file in workers:
+            if process.poll() is None:
+                process.terminate()
+    wall_end = time.time()
+
+    jobs = [job for job in queue.jobs() if job["run_id"] in set(run_ids)]
+    report = utilisation_report(jobs, slots, wall_start, wall_end)
+    report["runs"] = run_ids
+    report["logs"] = log_folder
+    if tracing_utils.is_enabled():
+        report["traces"] = [trace for trace in map(run_all.export_trace, run_ids) if trace]
+    return run_ids, report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run several stories with overlapping LLM, GPU and CPU stages.")
+    parser.add_argument("-runs", type=int, default=NUMBER_OF_RUNS, help="Number of stories to generate.")
+    parser.add_argument("-stages", nargs="+", default=queue_worker.QUEUED_STAGES, choices=queue_worker.QUEUEABLE_STAGES, help="Stages to run per story.")
+    parser.add_argument("-queue", type=str, default=work_queue_utils.QUEUE_URL, help="Queue URL: sqlite:///file.sqlite or redis://host:port/db.")
+    parser.add_argument("-llm_slots", type=int, default=LLM_SLOTS, help="Concurrent Ollama stage jobs.")
+    parser.add_argument("-gpu_slots", type=int, default=GPU_SLOTS, help="Concurrent diffusion jobs (one per GPU).")
+    parser.add_argument("-cpu_slots", type=int, default=CPU_SLOTS, help="Concurrent FFmpeg/TTS jobs.")
+    parser.add_argument("-cores_per_job", type=int, default=CPU_CORES_PER_JOB, help="Cores each CPU job is pinned to.")
+    parser.add_argument("-report_file", type=str, help="Where to write the report JSON (default: timings/scheduler_<timestamp>.json).")
+    parser.add_argument("-trace", action="store_true", help="Record spans in every worker and write traces/<run_id>.trace.json per story.")
+    parser.add_argument("-profile", nargs="?", const="sample", choices=profiling_utils.PROFILE_MODES,
+                        help="Profile every stage job in every worker into profiles/ (sample, the default, or cprofile).")
+    parser.add_argument("-metrics_port", type=int, help="Serve queue depth metrics on this port and each worker's metrics on the ports after it.")
+    parser.add_argument("-quality", choices=list(profile_utils.PROFILES), help="Quality profile for every story (default: QUALITY_PROFILE).")
+    parser.add_argument("-artifact_store", type=str, help="Artifact store every worker pulls run files from and pushes them to.")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        tracing_utils.enable()  # Inherited by the workers through the environment
+    if args.profile:
+        profiling_utils.enable(args.profile)  # STORY_PROFILE, inherited by the workers too
+    if args.quality:
+        profile_utils.use_profile(args.quality)  # STORY_QUALITY_PROFILE, inherited by the workers too
+    if args.artifact_store:
+        artifact_store_utils.enable(args.artifact_store)  # STORY_ARTIFACT_STORE, inherited by the workers too
+    slots = {"llm": args.llm_slots, "gpu": args.gpu_slots, "cpu": args.cpu_slots}
+    run_ids, report = run_scheduled(args.runs, args.stages, args.queue, slots, args.cores_per_job, args.metrics_port)
+
+    print("\n=== SCHEDULER SUMMARY ===")
+    print(f"Stories: {report['stories_completed']} completed, {report['stories_failed']} failed in {report['wall_seconds']:.2f} seconds")
+    for resource in slots:
+        print(f"{resource}: {slots[resource]} slot(s), busy {report['busy_seconds'][resource]:.2f} s, utilisation {report['utilisation'][resource]:.0%}")
+    print(f"Stories/hour: {report['stories_per_hour']:.2f}")
+
+    report_file = args.report_file or os.path.join(TIMINGS_FOLDER, f"scheduler_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.json")
+    with open(report_file, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {report_file}")
+    return 0 if not report["stories_failed"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
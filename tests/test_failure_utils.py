@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utilities import failure_utils, run_index_utils
+from utilities.failure_utils import RetryPolicy, StageFailure, TransientError, UnitFailure
+
+STAGE = "4_create_images_from_ai_prompts"
+RUN_ID = "test_run"
+NO_WAIT = RetryPolicy(max_attempts=3, base_seconds=0, max_seconds=0)
+
+class Flaky:
+    """Raises the given errors in turn, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+class RunUnitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(run_index_utils, "RUN_INDEX_PATH", os.path.join(self.directory, "run_index.sqlite"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_unit(self, function, unit="sdxl/chapter_1"):
+        return failure_utils.run_unit(STAGE, unit, function, chapter=0, policy=NO_WAIT, run_id=RUN_ID)
+
+    def record(self, unit="sdxl/chapter_1"):
+        return failure_utils.get_record(STAGE, unit, RUN_ID)
+
+    def test_transient_errors_are_retried_in_place(self):
+        function = Flaky(TransientError("503"), TimeoutError("slow"))
+        self.assertEqual(self.run_unit(function), "ok")
+        self.assertEqual(function.calls, 3)
+        self.assertIsNone(self.record())
+
+    def test_permanent_error_is_recorded_for_the_next_stage_run(self):
+        function = Flaky(ValueError("bad prompt"))
+        with self.assertRaises(UnitFailure):
+            self.run_unit(function)
+        self.assertEqual(function.calls, 1)
+        self.assertEqual((self.record()["status"], self.record()["attempts"]), ("failed", 1))
+        self.assertTrue(failure_utils.can_retry(STAGE, "sdxl/chapter_1", NO_WAIT, RUN_ID))
+        self.assertTrue(failure_utils.has_retryable(STAGE, RUN_ID))
+
+    def test_attempts_count_across_stage_runs_until_exhausted(self):
+        for _ in range(NO_WAIT.max_attempts):
+            with self.assertRaises(UnitFailure):
+                self.run_unit(Flaky(ValueError("bad prompt")))
+        self.assertEqual((self.record()["status"], self.record()["attempts"]), ("exhausted", 3))
+        self.assertFalse(failure_utils.can_retry(STAGE, "sdxl/chapter_1", NO_WAIT, RUN_ID))
+        self.assertFalse(failure_utils.has_retryable(STAGE, RUN_ID))
+        self.assertEqual(failure_utils.reset(STAGE, RUN_ID), 1)
+        self.assertEqual((self.record()["status"], self.record()["attempts"]), ("failed", 0))
+
+    def test_success_after_a_failure_is_recovered(self):
+        with self.assertRaises(UnitFailure):
+            self.run_unit(Flaky(ValueError("bad prompt")))
+        self.assertEqual(self.run_unit(Flaky()), "ok")
+        self.assertEqual(self.record()["status"], "recovered")
+        self.assertEqual(failure_utils.open_failures(RUN_ID, STAGE), [])
+
+    def test_stage_failure_passes_through_unrecorded(self):
+        with self.assertRaises(StageFailure):
+            self.run_unit(Flaky(StageFailure("no main character")))
+        self.assertIsNone(self.record())
+
+    def test_placeholders(self):
+        failure_utils.record_placeholder(STAGE, "sdxl/chapter_1", "title card", chapter=0, run_id=RUN_ID)
+        self.assertEqual(self.record()["status"], "failed")
+        failure_utils.record_placeholder(STAGE, "sdxl/chapter_2", "title card", chapter=1, retry=False, run_id=RUN_ID)
+        self.assertEqual(self.record("sdxl/chapter_2")["status"], "degraded")
+        self.assertFalse(failure_utils.can_retry(STAGE, "sdxl/chapter_2", NO_WAIT, RUN_ID))
+
+    def test_placeholder_keeps_an_exhausted_unit_exhausted(self):
+        for _ in range(NO_WAIT.max_attempts):
+            with self.assertRaises(UnitFailure):
+                self.run_unit(Flaky(ValueError("bad prompt")))
+        failure_utils.record_placeholder(STAGE, "sdxl/chapter_1", "title card", chapter=0, run_id=RUN_ID)
+        self.assertEqual((self.record()["status"], self.record()["placeholder"]), ("exhausted", "title card"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from utilities import failure_utils, run_index_utils, stage_cache_utils
+from utilities.story_journal_utils import write_json_atomic
+
+RUN_ID = "test_run"
+MOSAIC = "6_create_mosaic"  # Inputs: chapter image paths and their contents; no outputs check
+
+class StageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        patcher = mock.patch.object(run_index_utils, "RUN_INDEX_PATH", os.path.join(self.directory, "run_index.sqlite"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.image = os.path.join(self.directory, "sdxl_1.png")
+        self.write_image(b"first image")
+        self.story_path = os.path.join(self.directory, "story_summaries.json")
+        write_json_atomic({"story_chapters": [{"chapter_summary": "one", "chapter_image_location_sdxl": self.image}]}, self.story_path)
+        run_index_utils.start_run(RUN_ID, activate=False)
+        run_index_utils.record_artifact("summaries", self.story_path, run_id=RUN_ID)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write_image(self, data):
+        with open(self.image, "wb") as f:
+            f.write(data)
+        # A different mtime as well, so the size + mtime fast path cannot hide the change
+        stat = os.stat(self.image)
+        os.utime(self.image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def stamp(self, stage):
+        stage_cache_utils.save_stamp(stage, RUN_ID, stage_cache_utils.compute_input_digest(stage, RUN_ID))
+
+    def test_unstamped_stage_is_not_current(self):
+        self.assertFalse(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+
+    def test_stamp_holds_until_an_input_file_changes(self):
+        self.stamp(MOSAIC)
+        self.assertTrue(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+        self.write_image(b"other image")
+        self.assertFalse(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+
+    def test_story_field_change_invalidates(self):
+        self.stamp(MOSAIC)
+        write_json_atomic({"story_chapters": [{"chapter_summary": "one", "chapter_image_location_sdxl": self.image + ".new"}]},
+                          self.story_path)
+        self.assertFalse(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+
+    def test_upstream_rerun_invalidates_downstream(self):
+        self.stamp("5_create_movie")
+        before = stage_cache_utils.compute_input_digest("7_zoompan_movie", RUN_ID)
+        self.assertEqual(stage_cache_utils.compute_input_digest("7_zoompan_movie", RUN_ID), before)
+        self.stamp("5_create_movie")  # A rerun gets a fresh token
+        self.assertNotEqual(stage_cache_utils.compute_input_digest("7_zoompan_movie", RUN_ID), before)
+
+    def test_retryable_units_keep_the_stage_due(self):
+        self.stamp(MOSAIC)
+        failure_utils.record_placeholder(MOSAIC, "sdxl/chapter_1", "blank tile", chapter=0, run_id=RUN_ID)
+        self.assertFalse(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+
+    def test_clear_stamps(self):
+        self.stamp(MOSAIC)
+        stage_cache_utils.clear_stamps(RUN_ID, [MOSAIC])
+        self.assertFalse(stage_cache_utils.is_stage_current(MOSAIC, RUN_ID))
+
+    def test_changed_in_place_stage_forces_a_rerun_from_its_source(self):
+        with mock.patch.dict(stage_cache_utils.STAGE_INPUTS["7_zoompan_movie"], outputs=None):
+            self.stamp("7_zoompan_movie")
+            stages = ["5_create_movie", "7_zoompan_movie"]
+            self.assertEqual(stage_cache_utils.plan_forced_stages(stages, RUN_ID), set())
+            self.stamp("5_create_movie")  # 7's upstream token changed, so 7 must redo the movie from 5
+            self.assertEqual(stage_cache_utils.plan_forced_stages(stages, RUN_ID), {"5_create_movie"})
+
+if __name__ == "__main__":
+    unittest.main()
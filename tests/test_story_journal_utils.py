@@ -0,0 +1,73 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from utilities.story_journal_utils import StoryJournal, journal_path_for, load_story, read_journal, write_json_atomic
+
+class StoryJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.json_path = os.path.join(self.directory, "story.json")
+        write_json_atomic({"title": "Old", "story_chapters": ["one"]}, self.json_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def read_snapshot(self):
+        with open(self.json_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_changes_are_journaled_then_compacted_on_close(self):
+        with StoryJournal(self.json_path, compact_every=100) as journal:
+            journal.set(["title"], "New")
+            journal.append(["story_chapters"], "two")
+            self.assertEqual(self.read_snapshot()["title"], "Old")
+            self.assertEqual(len(list(read_journal(self.json_path))), 2)
+        self.assertEqual(self.read_snapshot(), {"title": "New", "story_chapters": ["one", "two"]})
+        self.assertFalse(os.path.exists(journal_path_for(self.json_path)))
+
+    def test_crash_leaves_the_journal_for_replay(self):
+        with self.assertRaises(RuntimeError):
+            with StoryJournal(self.json_path, compact_every=100) as journal:
+                journal.append(["story_chapters"], "two")
+                journal.update({"title": "New"})
+                raise RuntimeError("stage crashed")
+        self.assertEqual(self.read_snapshot()["title"], "Old")
+        self.assertEqual(load_story(self.json_path), {"title": "New", "story_chapters": ["one", "two"]})
+
+    def test_torn_last_line_is_ignored(self):
+        with open(journal_path_for(self.json_path), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"path": ["story_chapters", 1], "value": "two"}) + "\n")
+            f.write('{"path": ["title"], "val')
+        self.assertEqual(load_story(self.json_path), {"title": "Old", "story_chapters": ["one", "two"]})
+
+    def test_reopening_after_a_crash_folds_the_journal_into_the_snapshot(self):
+        with self.assertRaises(RuntimeError):
+            with StoryJournal(self.json_path, compact_every=100) as journal:
+                journal.append(["story_chapters"], "two")
+                raise RuntimeError("stage crashed")
+        with StoryJournal(self.json_path, compact_every=100) as journal:
+            self.assertFalse(os.path.exists(journal.journal_path))
+            self.assertEqual(self.read_snapshot()["story_chapters"], ["one", "two"])
+            journal.append(["story_chapters"], "three")
+        self.assertEqual(self.read_snapshot()["story_chapters"], ["one", "two", "three"])
+
+    def test_replaying_entries_already_in_the_snapshot_is_harmless(self):
+        with StoryJournal(self.json_path, compact_every=100) as journal:
+            journal.append(["story_chapters"], "two")
+            entries = list(read_journal(self.json_path))
+        with open(journal_path_for(self.json_path), "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries)
+        self.assertEqual(load_story(self.json_path)["story_chapters"], ["one", "two"])
+
+    def test_compacts_every_n_entries(self):
+        with StoryJournal(self.json_path, compact_every=2) as journal:
+            journal.set(["title"], "A")
+            journal.set(["title"], "B")
+            self.assertEqual(self.read_snapshot()["title"], "B")
+            self.assertFalse(os.path.exists(journal.journal_path))
+
+if __name__ == "__main__":
+    unittest.main()
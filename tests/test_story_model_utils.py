@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utilities.story_journal_utils import write_json_atomic
+from utilities.story_model_utils import (
+    SCHEMA_VERSION, Story, check_round_trip, dumps_story, loads_json, migrate, story_from_data,
+)
+
+LEGACY_STORY = {
+    "movie_title": "The Lantern",
+    "story_tone": "hopeful",
+    "tone": "wistful",
+    "story_chapters": [
+        {
+            "chapter": "Mira finds a lantern.",
+            "chapter_summary": "Mira finds a lantern",
+            "positive_ai_prompt": "a girl holding a lantern",
+            "chapter_summary_start_time": 0.0,
+            "chapter_summary_end_time": 4.5,
+            "chapter_image_location_sdxl": "enhanced_images/sdxl_1.png",
+            "chapter_image_profile_sdxl": "draft",
+            "chapter_image_location_sdxl_subtitled": "enhanced_images/sdxl_1_sub.png",
+            "chapter_segment_location_sdxl": "created_videos/segments/sdxl_001.mp4",
+            "custom_note": {"kept": True},
+        },
+        {
+            "chapter": "The lantern goes out.",
+            "chapter_image_location_dreamshaper": "enhanced_images/dreamshaper_2.png",
+        },
+    ],
+    "created_video_location_sdxl": "created_videos/sdxl.mp4",
+    "voiceover_created_video_location_sdxl": "final_voiceover_video/sdxl.mp4",
+}
+
+class StoryModelTest(unittest.TestCase):
+    def test_legacy_round_trip(self):
+        story = story_from_data(LEGACY_STORY)
+        self.assertEqual(story.to_legacy(), LEGACY_STORY)
+        self.assertEqual(story.models(), ["sdxl", "dreamshaper"])
+        self.assertEqual(story.chapter(1).duration, 4.5)
+        self.assertEqual(story.chapter(1).extra["chapter_image_location_sdxl_subtitled"], "enhanced_images/sdxl_1_sub.png")
+        self.assertEqual(story.model_for_video("elsewhere/sdxl.mp4"), "sdxl")
+
+    def test_schema_2_round_trip(self):
+        story = story_from_data(LEGACY_STORY)
+        data = loads_json(dumps_story(story, legacy=False))
+        self.assertEqual(data["schema_version"], SCHEMA_VERSION)
+        self.assertEqual(story_from_data(data).to_legacy(), LEGACY_STORY)
+
+    def test_text_only_chapters_round_trip(self):
+        legacy = {"storyline": "A girl and a lantern.", "story_chapters": ["One.", "Two."]}
+        story = story_from_data(legacy)
+        self.assertTrue(all(chapter.text_only for chapter in story.chapters))
+        self.assertEqual(Story.from_dict(story.to_dict()).to_legacy(), legacy)
+
+    def test_migrate_upgrades_legacy_and_rejects_newer_schemas(self):
+        self.assertEqual(migrate(dict(LEGACY_STORY))["schema_version"], SCHEMA_VERSION)
+        with self.assertRaises(ValueError):
+            migrate({"schema_version": SCHEMA_VERSION + 1})
+
+    def test_check_round_trip_on_a_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            json_path = os.path.join(directory, "story.json")
+            write_json_atomic(LEGACY_STORY, json_path)
+            self.assertEqual(check_round_trip(json_path), [])
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    unittest.main()
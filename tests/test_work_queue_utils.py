@@ -0,0 +1,106 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from utilities.fake_redis_server import FakeRedisStore
+from utilities.work_queue_utils import (
+    CANCELLED, DONE, FAILED, READY, RUNNING, WAITING, RedisWorkQueue, SqliteWorkQueue, plan_jobs,
+)
+
+STAGES = ["1_dream_up_a_story", "2_build_out_chapters", "3_summarize_chapters_add_ai_prompts", "4_create_images_from_ai_prompts"]
+
+class FakeRedisClient:
+    """Calls FakeRedisStore in-process with the redis-py methods RedisWorkQueue uses (decode_responses=True)."""
+
+    def __init__(self):
+        self.store = FakeRedisStore()
+
+    def _call(self, name, *args):
+        return self.store.execute(name, *(str(arg) for arg in args))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        pairs = [item for pair in (mapping or {}).items() for item in pair]
+        if field is not None:
+            pairs += [field, value]
+        return self._call("hset", key, *pairs)
+
+    def __getattr__(self, name):
+        return lambda *args: self._call(name, *args)
+
+class QueueContract:
+    """Behaviour both queue backends share; subclasses provide make_queue()."""
+
+    def statuses(self, queue, run_id="run"):
+        return {job["stage"]: job["status"] for job in queue.jobs(run_id)}
+
+    def test_plan_jobs_skips_to_the_nearest_listed_ancestor(self):
+        self.assertEqual(plan_jobs(["1_dream_up_a_story", "5_create_movie"]),
+                         [("1_dream_up_a_story", "llm", None), ("5_create_movie", "cpu", "1_dream_up_a_story")])
+
+    def test_claim_follows_dependencies_and_resources(self):
+        queue = self.make_queue()
+        queue.enqueue_run("run", STAGES)
+        self.assertIsNone(queue.claim(["gpu"], "gpu-worker"))
+        job = queue.claim(["llm"], "A")
+        self.assertEqual((job["stage"], job["status"], job["attempts"]), ("1_dream_up_a_story", RUNNING, 1))
+        self.assertIsNone(queue.claim(["llm"], "B"))  # Stage 2 waits for stage 1
+        self.assertTrue(queue.complete(job["job_id"], "A"))
+        self.assertEqual(self.statuses(queue)["2_build_out_chapters"], READY)
+        self.assertEqual(queue.claim(["llm"], "B")["stage"], "2_build_out_chapters")
+        self.assertEqual(queue.pending_count(), 3)
+
+    def test_expired_lease_is_reclaimed_and_the_old_holder_cannot_report(self):
+        queue = self.make_queue(lease_seconds=0.05)
+        queue.enqueue_run("run", STAGES[:2])
+        stale = queue.claim(["llm"], "A")
+        time.sleep(0.1)
+        job = queue.claim(["llm"], "B")
+        self.assertEqual((job["job_id"], job["attempts"]), (stale["job_id"], 2))
+        self.assertFalse(queue.heartbeat(job["job_id"], "A"))
+        self.assertFalse(queue.complete(job["job_id"], "A"))
+        self.assertFalse(queue.fail(job["job_id"], "A", "late"))
+        self.assertEqual(self.statuses(queue)["2_build_out_chapters"], WAITING)
+        self.assertTrue(queue.heartbeat(job["job_id"], "B"))
+        self.assertTrue(queue.complete(job["job_id"], "B"))
+        self.assertEqual(self.statuses(queue)["1_dream_up_a_story"], DONE)
+
+    def test_failure_is_retried_then_cancels_every_dependent(self):
+        queue = self.make_queue(max_attempts=2)
+        queue.enqueue_run("run", STAGES)
+        for attempt in range(2):
+            job = queue.claim(["llm"], "A")
+            self.assertEqual(job["attempts"], attempt + 1)
+            self.assertTrue(queue.fail(job["job_id"], "A", "model crashed"))
+        self.assertEqual(self.statuses(queue), {
+            "1_dream_up_a_story": FAILED, "2_build_out_chapters": CANCELLED,
+            "3_summarize_chapters_add_ai_prompts": CANCELLED, "4_create_images_from_ai_prompts": CANCELLED})
+        self.assertEqual(queue.pending_count(), 0)
+
+    def test_runs_are_independent(self):
+        queue = self.make_queue(max_attempts=1)
+        queue.enqueue_run("bad", STAGES[:2])
+        queue.enqueue_run("good", STAGES[:2])
+        queue.fail(queue.claim(["llm"], "A")["job_id"], "A", "model crashed")
+        self.assertEqual(queue.claim(["llm"], "A")["run_id"], "good")
+        self.assertEqual(self.statuses(queue, "good")["2_build_out_chapters"], WAITING)
+
+class SqliteWorkQueueTest(QueueContract, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def make_queue(self, **kwargs):
+        queue = SqliteWorkQueue(os.path.join(self.directory, "queue.sqlite"), **kwargs)
+        self.addCleanup(queue.connection.close)
+        return queue
+
+class RedisWorkQueueTest(QueueContract, unittest.TestCase):
+    def make_queue(self, **kwargs):
+        return RedisWorkQueue(FakeRedisClient(), **kwargs)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,11 @@ import shutil
 import platform
 from datetime import datetime
 
+try:
+    from utilities.run_context_utils import is_run_scoped, get_run_dir
+except ImportError:  # Run as a script from utilities/
+    from run_context_utils import is_run_scoped, get_run_dir
+
 # Whitelist of directories that should never be deleted
 WHITELIST_HUB_DIRECTORIES = [
     'models--h94--IP-Adapter-FaceID',
@@ -72,6 +77,11 @@ def archive_previous_generations():
     """
     Archive various folders containing previous generations.
     """
+    if is_run_scoped():
+        # Every run writes into its own runs/<run_id>/ folder, so there is nothing shared to clear
+        print(f"Run directory {get_run_dir()} is in use; skipping archiving.")
+        return
+
     script_directory = os.path.dirname(os.path.abspath(__file__))
     base_directory = os.path.abspath(os.path.join(script_directory, os.pardir))
 
@@ -86,7 +96,9 @@ def archive_previous_generations():
         'comparisons',
         'temp_ffmpeg',
         'final_voiceover_video',
-        'frames'
+        'frames',
+        'chapter_segments',
+        'drafts'
     ]
     destination_directory = 'archive'
 
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities import run_context_utils
+except ImportError:  # Run as a script from utilities/
+    import run_context_utils
+
+# Shared storage for the files a run produces (story JSON, images, chapter segments, videos, mosaics), so
+# workers on different machines no longer need RUNS_ROOT on a shared mount.  Files are stored by content
+# (objects/<sha256>), so a file is uploaded once however many runs, stages or nodes produce it; after a
+# stage, its run's files are pushed and a manifest runs/<run_id>/<stage>.json maps their paths to digests.
+# Each manifest lists every file the run has at that point, so before a stage only the newest manifest is
+# read (a file deleted by a later stage stays deleted) and every file in it that is missing or different
+# locally is fetched.  Downloads go through a local read-through cache (ARTIFACT_CACHE_DIR) keyed by digest.
+# Transfers run ARTIFACT_TRANSFER_WORKERS files at a time; on S3, files above ARTIFACT_MULTIPART_MB are
+# also split into parts that move in parallel.  Only run directories (runs/<run_id>/) are pushed and
+# pulled: the shared working folders hold every earlier run's files, so run_all.py -artifact_store
+# implies -run_dirs, and queue workers always work in run directories.
+#   file:///mnt/shared/story_artifacts (or a plain path)   local or mounted filesystem
+#   s3://bucket/prefix                                     S3 or any S3-compatible server (MinIO...)
+# S3 needs boto3; ARTIFACT_STORE_ENDPOINT (or AWS_ENDPOINT_URL) points it at a non-AWS server, e.g.
+# utilities/fake_s3_server.py for testing.  Credentials come from the usual AWS environment variables.
+#   python run_all.py -artifact_store s3://stories/prod
+#   python queue_worker.py -artifact_store s3://stories/prod -resources cpu
+#   python utilities/artifact_store_utils.py -store s3://stories/prod -pull <run_id>
+
+STORE_ENV = "STORY_ARTIFACT_STORE"
+ARTIFACT_STORE_URL = getattr(gv, 'ARTIFACT_STORE_URL', "")  # Empty: no shared store, runs stay on local disk
+ARTIFACT_STORE_ENDPOINT = os.environ.get("AWS_ENDPOINT_URL", getattr(gv, 'ARTIFACT_STORE_ENDPOINT', None))
+ARTIFACT_CACHE_DIR = os.environ.get("STORY_ARTIFACT_CACHE", getattr(gv, 'ARTIFACT_CACHE_DIR', "artifact_cache"))
+ARTIFACT_TRANSFER_WORKERS = getattr(gv, 'ARTIFACT_TRANSFER_WORKERS', 8)  # Files in flight at once
+ARTIFACT_MULTIPART_MB = getattr(gv, 'ARTIFACT_MULTIPART_MB', 16)  # S3 part size and multipart threshold
+ARTIFACT_FOLDERS = getattr(gv, 'ARTIFACT_FOLDERS', ["storylines", "generated_images", "enhanced_images", "chapter_segments",
+                                                    "created_videos", "final_voiceover_video", "mosaics"])
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def object_key(digest):
+    return f"objects/{digest[:2]}/{digest}"
+
+class LocalBackend:
+    """Objects as files under a directory (local disk or a mounted share)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def upload(self, path, key):
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, destination)  # Readers never see a half-written object
+
+    def download(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def put_bytes(self, key, data):
+        destination = self._path(key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with open(f"{destination}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{destination}.tmp", destination)
+
+    def get_bytes(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+    def list(self, prefix):
+        directory = self._path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return [f"{prefix.rstrip('/')}/{name}" for name in sorted(os.listdir(directory)) if not name.endswith(".tmp")]
+
+class S3Backend:
+    """Objects in an S3 bucket (or any S3-compatible server) under a key prefix."""
+
+    def __init__(self, bucket, prefix="", endpoint_url=ARTIFACT_STORE_ENDPOINT):
+        import boto3  # Optional dependency, only needed for the S3 backend
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # Checksums only where S3 requires them, so S3-compatible servers without trailer support work too
+        config = Config(max_pool_connections=ARTIFACT_TRANSFER_WORKERS * 4,
+                        request_checksum_calculation="when_required", response_checksum_validation="when_required")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, config=config)
+        part_size = ARTIFACT_MULTIPART_MB * 2**20
+        self.transfer_config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size, max_concurrency=4)
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def upload(self, path, key):
+        self.client.upload_file(path, self.bucket, self._key(key), Config=self.transfer_config)
+
+    def download(self, key, path):
+        self.client.download_file(self.bucket, self._key(key), path, Config=self.transfer_config)
+
+    def put_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def get_bytes(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"].read()
+
+    def list(self, prefix):
+        keys = []
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self._key(prefix)):
+            keys += [item["Key"][len(self._key("")):] for item in page.get("Contents", [])]
+        return sorted(keys)
+
+class ArtifactStore:
+    """Content-addressed files plus per-stage run manifests, with a local read-through cache."""
+
+    def __init__(self, backend, cache_dir=ARTIFACT_CACHE_DIR, workers=ARTIFACT_TRANSFER_WORKERS):
+        self.backend = backend
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self._stored = set()  # Digests known to be in the store
+        self._digests = {}  # (path, size, mtime_ns) -> digest, so unchanged files are hashed once
+        self._lock = threading.Lock()
+        self.stats = {"uploaded": 0, "skipped": 0, "downloaded": 0, "cached": 0, "bytes_up": 0, "bytes_down": 0}
+
+    def _count(self, **amounts):
+        with self._lock:
+            for name, amount in amounts.items():
+                self.stats[name] += amount
+
+    def digest(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = file_digest(path)
+        return self._digests[key]
+
+    def put(self, path):
+        """Store a file unless the store already has its content; returns its digest."""
+        digest = self.digest(path)
+        if digest in self._stored or self.backend.exists(object_key(digest)):
+            self._count(skipped=1)
+        else:
+            self.backend.upload(path, object_key(digest))
+            self._count(uploaded=1, bytes_up=os.path.getsize(path))
+        with self._lock:
+            self._stored.add(digest)
+        return digest
+
+    def fetch(self, digest, destination):
+        """Copy an object to destination through the local cache; returns destination."""
+        cached = os.path.join(self.cache_dir, digest[:2], digest)
+        if os.path.exists(cached):
+            self._count(cached=1)
+        else:
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            temp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+            self.backend.download(object_key(digest), temp_path)
+            if file_digest(temp_path) != digest:
+                os.remove(temp_path)
+                raise ValueError(f"Artifact {digest} is corrupt in the store")
+            os.replace(temp_path, cached)
+            self._count(downloaded=1, bytes_down=os.path.getsize(cached))
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        # A copy, not a link: stages rewrite some files in place and must not touch the cache
+        shutil.copyfile(cached, f"{destination}.tmp")
+        os.replace(f"{destination}.tmp", destination)
+        return destination
+
+    def _parallel(self, function, items):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(function, items))
+
+    def push_run(self, run_id, stage, folders=ARTIFACT_FOLDERS):
+        """Store the run's files and write the stage's manifest; returns the manifest."""
+        root = run_context_utils.get_run_dir() or ""
+        paths = []
+        for folder in folders:
+            for directory, _, files in os.walk(os.path.join(root, folder) if root else folder):
+                paths += [os.path.join(directory, name) for name in sorted(files) if not name.endswith((".tmp", ".part.mp4"))]
+        digests = self._parallel(self.put, paths)
+        manifest = {
+            "run_id": run_id,
+            "stage": stage,
+            "pushed_at": time.time(),
+            "files": {os.path.relpath(path, root or ".").replace(os.sep, "/"): {"digest": digest, "size": os.path.getsize(path)}
+                      for path, digest in zip(paths, digests)},
+        }
+        self.backend.put_bytes(f"runs/{run_id}/{stage}.json", json.dumps(manifest, indent=2).encode("utf-8"))
+        return manifest
+
+    def run_files(self, run_id):
+        """{relative path: {digest, size}} of the run's newest manifest, which holds its full current file set."""
+        manifests = [json.loads(self.backend.get_bytes(key)) for key in self.backend.list(f"runs/{run_id}")]
+        return max(manifests, key=lambda manifest: manifest["pushed_at"])["files"] if manifests else {}
+
+    def pull_run(self, run_id):
+        """Fetch the run's files that are missing or different here; returns the paths fetched."""
+        root = run_context_utils.get_run_dir() or ""
+        wanted = []
+        for relative_path, entry in self.run_files(run_id).items():
+            path = os.path.join(root, *relative_path.split("/"))
+            if not os.path.exists(path) or os.path.getsize(path) != entry["size"] or self.digest(path) != entry["digest"]:
+                wanted.append((entry["digest"], path))
+        return self._parallel(lambda item: self.fetch(*item), wanted)
+
+def open_store(url):
+    """ArtifactStore for file:///path, a plain path or s3://bucket/prefix."""
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return ArtifactStore(S3Backend(bucket, prefix))
+    if url.startswith("file://"):
+        url = url[len("file://"):]
+    return ArtifactStore(LocalBackend(url))
+
+_store = {}
+
+def enable(url):
+    """Use the store at url in this process and the processes it starts."""
+    os.environ[STORE_ENV] = url
+
+def is_enabled():
+    return bool(os.environ.get(STORE_ENV, ARTIFACT_STORE_URL))
+
+def get_store():
+    """The configured ArtifactStore (STORY_ARTIFACT_STORE, else ARTIFACT_STORE_URL), or None."""
+    url = os.environ.get(STORE_ENV, ARTIFACT_STORE_URL)
+    if not url:
+        return None
+    if url not in _store:
+        _store[url] = open_store(url)
+    return _store[url]
+
+def _run_scoped(run_id):
+    if run_context_utils.is_run_scoped():
+        return True
+    print(f"[WARNING] Artifact store skipped for run {run_id}: it needs the run's own directory (-run_dirs), "
+          "not the shared folders that hold every run's files")
+    return False
+
+def pull_run(run_id):
+    """Bring the run's files from the shared store before a stage (no-op without a store or a run directory)."""
+    store = get_store()
+    if store and run_id and _run_scoped(run_id):
+        fetched = store.pull_run(run_id)
+        if fetched:
+            print(f"[INFO] Fetched {len(fetched)} file(s) of run {run_id} from the artifact store")
+
+def push_run(run_id, stage):
+    """Publish the run's files after a stage (no-op without a store or a run directory)."""
+    store = get_store()
+    if store and run_id and _run_scoped(run_id):
+        before = dict(store.stats)
+        manifest = store.push_run(run_id, stage)
+        uploaded = store.stats["uploaded"] - before["uploaded"]
+        print(f"[INFO] Artifact store: {len(manifest['files'])} file(s) of run {run_id}, {uploaded} uploaded, "
+              f"{(store.stats['bytes_up'] - before['bytes_up']) / 2**20:.1f} MB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Push or pull a run's files to or from the artifact store.")
+    parser.add_argument("-store", type=str, default=os.environ.get(STORE_ENV, ARTIFACT_STORE_URL), help="Store URL (file:///path or s3://bucket/prefix).")
+    parser.add_argument("-push", type=str, metavar="RUN_ID", help="Store the run's files (from runs/<run_id>/ when it exists).")
+    parser.add_argument("-pull", type=str, metavar="RUN_ID", help="Fetch the run's files into runs/<run_id>/.")
+    parser.add_argument("-list", type=str, metavar="RUN_ID", help="List the run's files in the store.")
+    args = parser.parse_args()
+    if not args.store:
+        parser.error("no store given (-store or ARTIFACT_STORE_URL)")
+    enable(args.store)
+    run_id = args.push or args.pull or args.list
+    if run_id and (args.pull or os.path.isdir(run_context_utils.run_dir_for(run_id))):
+        run_context_utils.activate_run(run_id)
+    if args.push:
+        push_run(args.push, "manual")
+    elif args.pull:
+        pull_run(args.pull)
+    elif args.list:
+        for path, entry in sorted(get_store().run_files(args.list).items()):
+            print(f"{entry['size']:>12}  {entry['digest'][:12]}  {path}")
+    else:
+        parser.print_help()
+        sys.exit(1)
+    print(json.dumps(get_store().stats))
@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import math
+import socket
+import sqlite3
+import hashlib
+import argparse
+import platform
+import statistics
+import subprocess
+import threading
+from datetime import datetime
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Local history of benchmark and pipeline timings, so numbers from one run can be compared with the next
+# instead of scrolling back through "=== SUMMARY ===" prints.  run_benchmark.py, run_all.py and run_all.ps1
+# record every report in a SQLite file together with the git revision (and whether the tree was dirty),
+# a fingerprint of the machine (CPU, memory, OS, Python, ffmpeg) and a hash of the config that shaped the
+# run (chapters, models, quality profile...).  Each stage's per-run values are kept as samples.
+# compare puts two revisions (or two recorded results) side by side per stage.  A change only counts when
+# the medians differ by more than the noise threshold: the larger of BENCHMARK_NOISE_FLOOR_SECONDS,
+# BENCHMARK_NOISE_PCT of the baseline and BENCHMARK_NOISE_SIGMAS robust standard errors (from the median
+# absolute deviation of both sides).  With BENCHMARK_MIN_TEST_SAMPLES runs or more on each side, a
+# Mann-Whitney U test must also give p < BENCHMARK_ALPHA.  compare exits with 1 when a stage got slower.
+#   python utilities/benchmark_history_utils.py -list
+#   python utilities/benchmark_history_utils.py -compare HEAD~1 HEAD -source run_benchmark
+#   python utilities/benchmark_history_utils.py -compare 12 15
+#   python utilities/benchmark_history_utils.py -record timings/run_all_2024-06-01_10-00.json -source run_all
+
+HISTORY_PATH = os.environ.get("STORY_BENCHMARK_HISTORY", getattr(gv, 'BENCHMARK_HISTORY_PATH', "benchmark_history.sqlite"))
+NOISE_FLOOR_SECONDS = getattr(gv, 'BENCHMARK_NOISE_FLOOR_SECONDS', 0.05)  # Timer and scheduling jitter
+NOISE_PCT = getattr(gv, 'BENCHMARK_NOISE_PCT', 5.0)
+NOISE_SIGMAS = getattr(gv, 'BENCHMARK_NOISE_SIGMAS', 3.0)
+MIN_TEST_SAMPLES = getattr(gv, 'BENCHMARK_MIN_TEST_SAMPLES', 5)  # Below this the U test cannot reach p < 0.05
+ALPHA = getattr(gv, 'BENCHMARK_ALPHA', 0.05)
+TOTAL_STAGE = "total"
+SAMPLE_METRICS = ["seconds", "peak_rss_bytes", "subprocess_peak_rss_bytes", "bytes_written"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    recorded_at TEXT NOT NULL,
+    git_revision TEXT,
+    git_dirty INTEGER,
+    machine_id TEXT NOT NULL,
+    machine TEXT NOT NULL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL,
+    report_path TEXT
+);
+CREATE INDEX IF NOT EXISTS results_revision ON results (git_revision);
+CREATE TABLE IF NOT EXISTS samples (
+    result_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    run_number INTEGER NOT NULL,
+    value REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_result ON samples (result_id, metric);
+"""
+
+_local = threading.local()
+
+def get_connection(db_path=None):
+    """Return this thread's connection to the history database, creating the schema on first use."""
+    db_path = db_path or HISTORY_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if db_path not in connections:
+        connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connections[db_path] = connection
+    return connections[db_path]
+
+# ---------------------------------------------------------------- what a result was measured on
+
+def _git(*args):
+    try:
+        process = subprocess.run(["git", *args], cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return process.stdout.strip() if process.returncode == 0 else None
+
+def git_revision():
+    """(commit hash, tree has uncommitted changes) of the checkout, or (None, None) outside git."""
+    revision = _git("rev-parse", "HEAD")
+    if revision is None:
+        return None, None
+    return revision, bool(_git("status", "--porcelain", "--untracked-files=no"))
+
+def _cpu_model():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+def _memory_bytes():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):  # Not available on Windows
+        return None
+
+def _ffmpeg_version():
+    try:
+        output = subprocess.run(["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, timeout=30).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return output.splitlines()[0] if output else None
+
+def machine_fingerprint():
+    """What the numbers depend on besides the code: host, CPU, memory, OS, Python and ffmpeg."""
+    return {
+        "hostname": socket.gethostname(),
+        "cpu": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "memory_bytes": _memory_bytes(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "ffmpeg": _ffmpeg_version(),
+    }
+
+def short_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+# ---------------------------------------------------------------- recording
+
+def samples_from_report(report):
+    """[(stage, metric, run number, value)] from a run_benchmark.py report or a run_all.py/run_all.ps1 timings file.
+
+    Failed and cache-skipped stages are left out; "total" is each run's summed stage time."""
+    samples = []
+    for run_number, run in enumerate(report.get("runs", []), start=1):
+        stages = run.get("stages", [])
+        if isinstance(stages, dict):  # run_all.py timings: {stage: {"seconds", "succeeded", "skipped"}}
+            stages = [dict(result, stage=name) for name, result in stages.items()]
+        total = 0.0
+        for result in stages:
+            total += result.get("seconds") or 0
+            if not result.get("succeeded", True) or result.get("skipped"):
+                continue
+            for metric in SAMPLE_METRICS:
+                if isinstance(result.get(metric), (int, float)):
+                    samples.append((result["stage"], metric, run_number, float(result[metric])))
+        if stages and all(result.get("succeeded", True) for result in stages):
+            samples.append((TOTAL_STAGE, "seconds", run_number, run.get("total_seconds", total)))
+    return samples
+
+def record_report(report, source, config=None, report_path=None, db_path=None):
+    """Store a report's per-stage samples with the revision, machine and config; returns the result id."""
+    config = report.get("config", {}) if config is None else config
+    machine = machine_fingerprint()
+    revision, dirty = git_revision()
+    samples = samples_from_report(report)
+    connection = get_connection(db_path)
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        result_id = connection.execute(
+            "INSERT INTO results (source, recorded_at, git_revision, git_dirty, machine_id, machine, config_hash, config, report_path) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (source, datetime.now().isoformat(timespec="seconds"), revision, None if dirty is None else int(dirty), short_hash(machine),
+             json.dumps(machine), short_hash(config), json.dumps(config, sort_keys=True, default=str),
+             os.path.abspath(report_path) if report_path else None)).lastrowid
+        connection.executemany("INSERT INTO samples (result_id, stage, metric, run_number, value) VALUES (?, ?, ?, ?, ?)",
+                               [(result_id, *sample) for sample in samples])
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    print(f"[INFO] Recorded {len(samples)} samples as benchmark history result {result_id} "
+          f"(revision {(revision or 'unknown')[:10]}{' dirty' if dirty else ''}, machine {short_hash(machine)}, config {short_hash(config)})")
+    return result_id
+
+# ---------------------------------------------------------------- selecting results
+
+def list_results(source=None, limit=20, db_path=None):
+    query = "SELECT * FROM results" + (" WHERE source = ?" if source else "") + " ORDER BY result_id DESC LIMIT ?"
+    return [dict(row) for row in get_connection(db_path).execute(query, ((source,) if source else ()) + (limit,))]
+
+def resolve(selector, source=None, db_path=None):
+    """Result ids for a selector: a result id, "latest", or a git revision (hash prefix, HEAD~1, a branch or tag).
+
+    A revision selects every result recorded at that commit, so repeated benchmark invocations pool their samples."""
+    connection = get_connection(db_path)
+    source_filter, source_args = (" AND source = ?", (source,)) if source else ("", ())
+    if selector == "latest":
+        row = connection.execute(f"SELECT result_id FROM results WHERE 1 = 1{source_filter} ORDER BY result_id DESC LIMIT 1", source_args).fetchone()
+        return [row["result_id"]] if row else []
+    if selector.isdigit() and len(selector) < 7:
+        return [row["result_id"] for row in connection.execute(f"SELECT result_id FROM results WHERE result_id = ?{source_filter}",
+                                                               (int(selector),) + source_args)]
+    revision = _git("rev-parse", "--verify", "--quiet", f"{selector}^{{commit}}") or selector
+    return [row["result_id"] for row in connection.execute(f"SELECT result_id FROM results WHERE git_revision LIKE ?{source_filter} ORDER BY result_id",
+                                                           (revision + "%",) + source_args)]
+
+def load_samples(result_ids, metric="seconds", db_path=None):
+    """{stage: [values]} pooled over the given results."""
+    samples = {}
+    if not result_ids:
+        return samples
+    placeholders = ",".join("?" * len(result_ids))
+    for row in get_connection(db_path).execute(f"SELECT stage, value FROM samples WHERE metric = ? AND result_id IN ({placeholders}) "
+                                               "ORDER BY result_id, run_number", (metric, *result_ids)):
+        samples.setdefault(row["stage"], []).append(row["value"])
+    return samples
+
+def _distinct(result_ids, column, db_path=None):
+    placeholders = ",".join("?" * len(result_ids))
+    return {row[0] for row in get_connection(db_path).execute(f"SELECT DISTINCT {column} FROM results WHERE result_id IN ({placeholders})", result_ids)}
+
+# ---------------------------------------------------------------- comparing
+
+def robust_sigma(values):
+    """Standard deviation estimated from the median absolute deviation (not thrown off by one slow outlier)."""
+    if len(values) < 2:
+        return 0.0
+    median = statistics.median(values)
+    return 1.4826 * statistics.median(abs(value - median) for value in values)
+
+def mann_whitney_p(base, head):
+    """Two-sided p-value of the Mann-Whitney U test (normal approximation with tie correction)."""
+    pooled = sorted((value, side) for side, values in ((0, base), (1, head)) for value in values)
+    ranks, ties, i = [0.0] * len(pooled), 0.0, 0
+    while i < len(pooled):
+        j = i
+        while j + 1 < len(pooled) and pooled[j + 1][0] == pooled[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    n1, n2 = len(base), len(head)
+    u = sum(rank for rank, (_, side) in zip(ranks, pooled) if side == 0) - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return min(1.0, math.erfc(max(z, 0.0) / math.sqrt(2)))
+
+def compare_samples(base, head, metric="seconds", noise_pct=NOISE_PCT, noise_sigmas=NOISE_SIGMAS, alpha=ALPHA):
+    """Compare one stage's samples; returns the medians, delta, noise threshold, p-value and verdict."""
+    base_median, head_median = statistics.median(base), statistics.median(head)
+    delta = head_median - base_median
+    standard_error = math.sqrt(robust_sigma(base) ** 2 / len(base) + robust_sigma(head) ** 2 / len(head))
+    floor = NOISE_FLOOR_SECONDS if metric == "seconds" else 0.0
+    noise = max(floor, abs(base_median) * noise_pct / 100, noise_sigmas * standard_error)
+    p_value = mann_whitney_p(base, head) if min(len(base), len(head)) >= MIN_TEST_SAMPLES else None
+    if abs(delta) <= noise or (p_value is not None and p_value >= alpha):
+        verdict = "same"
+    else:
+        verdict = "slower" if delta > 0 else "faster"
+        if metric != "seconds":
+            verdict = "higher" if delta > 0 else "lower"
+    return {
+        "base_median": base_median,
+        "head_median": head_median,
+        "delta": delta,
+        "delta_pct": delta / base_median * 100 if base_median else None,
+        "noise": noise,
+        "p_value": p_value,
+        "base_runs": len(base),
+        "head_runs": len(head),
+        "verdict": verdict,
+    }
+
+def compare(base_ids, head_ids, metric="seconds", noise_pct=NOISE_PCT, noise_sigmas=NOISE_SIGMAS, alpha=ALPHA, db_path=None):
+    """{stage: compare_samples(...)} for the stages both sides have samples for, in the head's order."""
+    base, head = load_samples(base_ids, metric, db_path), load_samples(head_ids, metric, db_path)
+    return {stage: compare_samples(base[stage], values, metric, noise_pct, noise_sigmas, alpha)
+            for stage, values in head.items() if stage in base}
+
+def comparison_warnings(base_ids, head_ids, db_path=None):
+    """Reasons the two sides may not be comparable (different machines or configs, uncommitted changes)."""
+    warnings = []
+    for column, what in (("machine_id", "machines"), ("config_hash", "configs")):
+        base, head = _distinct(base_ids, column, db_path), _distinct(head_ids, column, db_path)
+        if base != head or len(base) > 1:
+            warnings.append(f"the results were recorded with different {what} ({', '.join(sorted(base))} vs {', '.join(sorted(head))})")
+    if 1 in _distinct(base_ids + head_ids, "git_dirty", db_path):
+        warnings.append("some results were recorded with uncommitted changes")
+    return warnings
+
+def _format_value(value, metric):
+    if value is None:
+        return "-"
+    return f"{value:.3f}" if metric == "seconds" else f"{value / 2**20:.1f}M"
+
+def format_comparison(rows, metric="seconds"):
+    lines = [f"{'stage':<38} {'base':>10} {'head':>10} {'delta':>10} {'delta %':>8} {'noise':>9} {'p':>6} {'runs':>7}  verdict"]
+    for stage, row in rows.items():
+        delta_pct = f"{row['delta_pct']:+.1f}" if row["delta_pct"] is not None else "-"
+        p_value = f"{row['p_value']:.3f}" if row["p_value"] is not None else "-"
+        delta = ("+" if row["delta"] >= 0 else "-") + _format_value(abs(row["delta"]), metric)
+        lines.append(f"{stage:<38} {_format_value(row['base_median'], metric):>10} {_format_value(row['head_median'], metric):>10} {delta:>10} "
+                     f"{delta_pct:>8} {_format_value(row['noise'], metric):>9} {p_value:>6} {row['base_runs']:>3}/{row['head_runs']:<3}  {row['verdict']}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record benchmark and run timings and compare them across revisions.")
+    parser.add_argument("-history", type=str, default=HISTORY_PATH, help="History database (default: BENCHMARK_HISTORY_PATH).")
+    parser.add_argument("-list", action="store_true", help="List the most recent results.")
+    parser.add_argument("-record", type=str, metavar="REPORT", help="Record a run_benchmark.py report or a run_all timings JSON.")
+    parser.add_argument("-compare", nargs=2, metavar=("BASE", "HEAD"), help="Result ids, 'latest' or git revisions (hash, HEAD~1, branch).")
+    parser.add_argument("-source", type=str, help="Only results from this source (run_benchmark, run_all, run_all.ps1).")
+    parser.add_argument("-metric", type=str, default="seconds", choices=SAMPLE_METRICS, help="Metric to compare.")
+    parser.add_argument("-noise_pct", type=float, default=NOISE_PCT, help="Changes below this share of the baseline median are noise.")
+    parser.add_argument("-noise_sigmas", type=float, default=NOISE_SIGMAS, help="Changes below this many robust standard errors are noise.")
+    parser.add_argument("-alpha", type=float, default=ALPHA, help="Significance level of the Mann-Whitney U test.")
+    parser.add_argument("-limit", type=int, default=20, help="Results shown by -list.")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        with open(args.record) as f:
+            report = json.load(f)
+        source = args.source or ("run_benchmark" if "summary" in report else "run_all")
+        record_report(report, source, report_path=args.record, db_path=args.history)
+        return 0
+    if args.compare:
+        base_ids, head_ids = (resolve(selector, args.source, args.history) for selector in args.compare)
+        for selector, ids in zip(args.compare, (base_ids, head_ids)):
+            if not ids:
+                print(f"[ERROR] No recorded results match {selector}" + (f" (source {args.source})" if args.source else ""))
+                return 2
+        for warning in comparison_warnings(base_ids, head_ids, args.history):
+            print(f"[WARNING] {warning.capitalize()}")
+        rows = compare(base_ids, head_ids, args.metric, args.noise_pct, args.noise_sigmas, args.alpha, args.history)
+        print(f"Base: results {', '.join(map(str, base_ids))}  Head: results {', '.join(map(str, head_ids))}  Metric: {args.metric}")
+        print(format_comparison(rows, args.metric))
+        regressions = [stage for stage, row in rows.items() if row["verdict"] in ("slower", "higher")]
+        if regressions:
+            print(f"[WARNING] Regressed beyond noise: {', '.join(regressions)}")
+        return 1 if regressions else 0
+    for result in list_results(args.source, args.limit, args.history):
+        revision = (result["git_revision"] or "unknown")[:10] + ("+" if result["git_dirty"] else "")
+        print(f"{result['result_id']:>5}  {result['recorded_at']}  {result['source']:<14} {revision:<12} machine {result['machine_id']}  config {result['config_hash']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+import os
+import sys
+import time
+import random
+import hashlib
+import importlib
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stand-ins for every external dependency of the pipeline, used by run_benchmark.py to run stages 1-9
+# offline and deterministically, plus the per-stage measurements (peak RSS, bytes written, subprocesses).
+#   LLM        -> utilities/fake_ollama_server.py (OLLAMA_HOST); installing/starting Ollama becomes a no-op
+#   diffusion  -> FakeDiffusionPipeline: a tiny CPU "model" that draws a deterministic image per prompt/seed
+#   face/enhance -> fake embeddings and a plain 2x upscale instead of insightface/MTCNN/dlib downloads
+#   gTTS       -> FakeTTS: a sine MP3 whose length is proportional to the text
+#   music      -> a local file (or a generated tone) instead of the Amacha/YouTube download
+# Stand-in work (e.g. the ffmpeg call that writes a fake TTS file) is not counted as a pipeline subprocess.
+
+WORDS_PER_SECOND = 2.5  # Roughly gTTS's speaking rate
+MIN_TTS_SECONDS = 0.5
+TONE_FREQUENCY = 440
+TTS_SAMPLE_RATE = 24000  # gTTS writes 24 kHz mono MP3s
+UPSCALE_FACTOR = 2  # enhance_image upscales to ~2048 px; the stand-in keeps the output size comparable
+BENCHMARK_CONFIG_ENV = "STORY_BENCHMARK_CONFIG"
+
+_subprocess_counts = {}
+_counts_lock = threading.Lock()
+_uncounted = contextvars.ContextVar("benchmark_uncounted", default=False)
+_Popen = subprocess.Popen
+
+# ---------------------------------------------------------------- stand-ins
+
+def fake_image(prompt, seed, width, height):
+    """A deterministic image for a prompt and seed: a background colour and a few shapes."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(hashlib.sha256(f"{prompt}|{seed}".encode("utf-8")).hexdigest())
+    image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = min(width, x0 + rng.randrange(16, width // 2 + 17)), min(height, y0 + rng.randrange(16, height // 2 + 17))
+        shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+        shape((x0, y0, x1, y1), fill=tuple(rng.randrange(256) for _ in range(3)))
+    return image
+
+class FakeDiffusionPipeline:
+    """Stands in for both a diffusers pipeline (called) and an IP-Adapter model (.generate())."""
+
+    def __init__(self, model_name, seconds_per_step=0.0, width=512, height=512):
+        self.model_name = model_name
+        self.seconds_per_step = seconds_per_step
+        self.width = width
+        self.height = height
+        self.scheduler = SimpleNamespace(config=SimpleNamespace())
+
+    def _images(self, prompt, seed, width, height, steps, count):
+        time.sleep(self.seconds_per_step * steps)
+        return [fake_image(f"{self.model_name}|{prompt}", seed + i, width or self.width, height or self.height) for i in range(count)]
+
+    def __call__(self, prompt, negative_prompt=None, num_inference_steps=30, width=None, height=None, generator=None, **kwargs):
+        seed = generator.initial_seed() if hasattr(generator, "initial_seed") else 0
+        return SimpleNamespace(images=self._images(prompt, seed, width, height, num_inference_steps, 1))
+
+    def generate(self, prompt, negative_prompt=None, num_samples=1, width=None, height=None, num_inference_steps=30, seed=0, **kwargs):
+        return self._images(prompt, seed or 0, width, height, num_inference_steps, num_samples)
+
+def fake_extract_embeddings(image_path):
+    """(embedding, aligned face) like faceid_utils, without insightface."""
+    from PIL import Image
+
+    digest = hashlib.sha256(image_path.encode("utf-8")).digest()
+    return [byte / 255 for byte in digest], Image.open(image_path).convert("RGB").resize((224, 224))
+
+def fake_enhance_image(input_image_path, output_dir):
+    """enhance_image() without face detection or model downloads: a plain upscale."""
+    from PIL import Image
+
+    image = Image.open(input_image_path).convert("RGB")
+    return image.resize((image.width * UPSCALE_FACTOR, image.height * UPSCALE_FACTOR), Image.LANCZOS)
+
+def tone_mp3(path, seconds, frequency=TONE_FREQUENCY, sample_rate=TTS_SAMPLE_RATE):
+    """Write a sine-tone MP3 of the given length with ffmpeg (not counted as a pipeline subprocess)."""
+    with uncounted():
+        subprocess.run([
+            'ffmpeg', '-y', '-v', 'error', '-f', 'lavfi',
+            '-i', f"sine=frequency={frequency}:sample_rate={sample_rate}:duration={seconds:.3f}",
+            '-af', 'volume=0.2', '-ac', '1', '-b:a', '64k', path
+        ], check=True)
+    return path
+
+def tts_seconds(text):
+    return max(MIN_TTS_SECONDS, len(text.split()) / WORDS_PER_SECOND)
+
+class FakeTTS:
+    """Drop-in for gtts.gTTS: save() writes a tone as long as reading the text aloud would take."""
+
+    def __init__(self, text, lang="en", tld="com", **kwargs):
+        self.text = text
+
+    def save(self, output_file):
+        tone_mp3(output_file, tts_seconds(self.text))
+
+def fake_download_audio_for(music_file, music_folder):
+    """Build a download_audio() for stage 5 that returns music_file, or a generated tone of the requested length."""
+    def download_audio(video_length):
+        if music_file:
+            return music_file
+        os.makedirs(music_folder, exist_ok=True)
+        seconds = int(video_length) + 1
+        path = os.path.join(music_folder, f"benchmark_tone_{seconds}s.mp3")
+        if not os.path.exists(path):
+            tone_mp3(path, seconds, frequency=220, sample_rate=44100)
+        return path
+    return download_audio
+
+def _no_op(*args, **kwargs):
+    return True
+
+def install_llm_stand_ins():
+    """Ollama is served by fake_ollama_server.py (OLLAMA_HOST); skip installing, starting and killing it."""
+    from utilities import ollama_utils
+    for name in ("install_and_setup_ollama", "kill_existing_ollama_service", "clear_gpu_memory",
+                 "start_ollama_service_windows", "stop_ollama_service"):
+        setattr(ollama_utils, name, _no_op)
+
+def install_diffusion_stand_ins(config):
+    """Stage 4 with fake pipelines; must run before the stage module is imported."""
+    import utilities.stablediffusion_utils as sdu
+    import utilities.main_character_generator_utils as mcg
+
+    seconds_per_step = config.get("diffusion_seconds_per_step", 0.0)
+    width, height = config.get("image_size") or (sdu.DEFAULT_WIDTH, sdu.DEFAULT_HEIGHT)
+    sdu.DEFAULT_WIDTH, sdu.DEFAULT_HEIGHT = width, height
+    mcg.get_pipeline = lambda: FakeDiffusionPipeline(mcg.model_id, seconds_per_step, width, height)
+    sdu.get_ip_model = lambda selected_model, file_path: (FakeDiffusionPipeline(selected_model, seconds_per_step, width, height),) * 2
+    sdu.check_and_download = lambda repo_id, filename: filename
+    sdu.extract_embeddings = fake_extract_embeddings
+    sdu.enhance_image = fake_enhance_image
+
+    stage = importlib.import_module("4_create_images_from_ai_prompts")
+    stage.check_and_clear_cache_if_needed = _no_op  # Never prune the real Hugging Face cache from a benchmark
+
+def install_tts_stand_ins():
+    from utilities import google_tts_utils
+    google_tts_utils.gTTS = FakeTTS
+
+def install_music_stand_in(config):
+    stage = importlib.import_module("5_create_movie")
+    stage.download_audio = fake_download_audio_for(config.get("music_file"), os.path.abspath("music_downloads"))
+
+def install_stand_ins(stage_name, config):
+    """Install the stand-ins the given stage needs (only those, so each stage imports what it would anyway)."""
+    install_llm_stand_ins()
+    if stage_name == "4_create_images_from_ai_prompts":
+        install_diffusion_stand_ins(config)
+    if stage_name in ("5_create_movie", "9_create_voiceover"):
+        install_tts_stand_ins()
+    if stage_name == "5_create_movie":
+        install_music_stand_in(config)
+
+# ---------------------------------------------------------------- measurements
+
+@contextmanager
+def uncounted():
+    token = _uncounted.set(True)
+    try:
+        yield
+    finally:
+        _uncounted.reset(token)
+
+class CountingPopen(_Popen):
+    """subprocess.Popen that tallies the programs the pipeline starts (subprocess.run() and ffmpeg-python use it)."""
+
+    def __init__(self, args, *pargs, **kwargs):
+        if not _uncounted.get():
+            program = args[0] if isinstance(args, (list, tuple)) else str(args).split()[0]
+            program = os.path.splitext(os.path.basename(str(program)))[0]
+            with _counts_lock:
+                _subprocess_counts[program] = _subprocess_counts.get(program, 0) + 1
+        super().__init__(args, *pargs, **kwargs)
+
+def count_subprocesses():
+    subprocess.Popen = CountingPopen
+
+def subprocess_counts():
+    with _counts_lock:
+        return dict(_subprocess_counts)
+
+def peak_rss_bytes():
+    """(peak RSS of this process, peak RSS of its largest finished child) in bytes; None where unknown."""
+    if resource is not None:
+        scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale or None)
+    try:
+        import psutil
+        return getattr(psutil.Process().memory_info(), "peak_wset", None), None
+    except ImportError:
+        return None, None
+
+def io_write_bytes():
+    """Bytes this process wrote through the OS (includes files it later deleted), where the platform reports it."""
+    try:
+        import psutil
+        return psutil.Process().io_counters().write_bytes
+    except (ImportError, AttributeError, NotImplementedError):
+        return None
+
+def snapshot_files(root):
+    """{path: (size, mtime_ns)} for every file under root."""
+    files = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+def bytes_written(before, after):
+    """Size of the files that are new or changed between two snapshots."""
+    return sum(size for path, (size, mtime) in after.items() if before.get(path) != (size, mtime))
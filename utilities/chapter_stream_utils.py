@@ -0,0 +1,142 @@
+import os
+import hashlib
+import threading
+import subprocess
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities.google_tts_utils import generate_tts_audio, adjust_audio_speed
+    from utilities.profile_utils import ffmpeg_quality_args
+    from utilities.run_context_utils import run_path
+    from utilities.tracing_utils import traced_run, span
+    from utilities.metrics_utils import count_cache
+    from utilities.story_pack_utils import local_input
+except ImportError:  # Run as a script from utilities/
+    from google_tts_utils import generate_tts_audio, adjust_audio_speed
+    from profile_utils import ffmpeg_quality_args
+    from run_context_utils import run_path
+    from tracing_utils import traced_run, span
+    from metrics_utils import count_cache
+    from story_pack_utils import local_input
+
+# Per-chapter building blocks for stage 5's streaming mode (5_create_movie.py -stream).  Each chapter is
+# rendered on its own as soon as its image exists: narration (gTTS + atempo) to measure how long the
+# image stays on screen, then a short x264 segment of the still image.  Every segment is encoded with the
+# same frame rate, height and pixel format, so the movie is a stream-copy concat of the segments with the
+# music laid underneath; only the audio is encoded at the end.
+#
+# Narration durations are cached by text under temp_tts_creation/stream/ and segments by image + length +
+# encoder settings under chapter_segments/<model>/, so a chapter rendered ahead of time (run_all.py -stream
+# renders them while stage 4 is still generating images) is not rendered again.  The segments outlive
+# stage 5: regenerate_chapter.py re-renders one chapter and concatenates it with the others' segments.
+
+STREAM_FOLDER = os.path.join("temp_tts_creation", "stream")  # Removed with the rest of temp_tts_creation after stage 5
+SEGMENTS_FOLDER = "chapter_segments"
+SEGMENT_KEY_PREFIX = "chapter_segment_location_"  # + model name; a chapter's segment in the story JSON
+STREAM_WORKERS = getattr(gv, 'STREAM_WORKERS', 4)  # Chapters rendered at the same time
+SEGMENT_FPS = 25
+SEGMENT_HEIGHT = 720
+MIN_DISPLAY_SECONDS = 5.0  # Same minimum as the one-pass encode
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+def _lock_for(key):
+    """One lock per cache key, so two threads asking for the same narration or segment render it once."""
+    with _key_locks_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+def _cache_key(*parts):
+    return hashlib.sha256("|".join(str(part) for part in parts).encode("utf-8")).hexdigest()[:16]
+
+def _write_atomic(path, text):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+def narration_seconds(summary, speed):
+    """Length of a chapter summary read aloud at the given speed; synthesized once per text."""
+    folder = run_path(STREAM_FOLDER, "tts")
+    os.makedirs(folder, exist_ok=True)
+    key = _cache_key(summary, speed)
+    with _lock_for(key):
+        return _narration_seconds(summary, speed, folder, key)
+
+def _narration_seconds(summary, speed, folder, key):
+    duration_file = os.path.join(folder, f"tts_{key}.duration")
+    count_cache("narration", os.path.exists(duration_file))
+    if os.path.exists(duration_file):
+        with open(duration_file, 'r', encoding='utf-8') as f:
+            return float(f.read())
+
+    tts_audio_file = os.path.join(folder, f"tts_{key}.mp3")
+    adjusted_tts_audio_file = os.path.join(folder, f"tts_{key}_adjusted.mp3")
+    generate_tts_audio(summary, output_file=tts_audio_file)
+    adjust_audio_speed(tts_audio_file, speed, output_file=adjusted_tts_audio_file)
+    result = traced_run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', adjusted_tts_audio_file],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT
+    )
+    duration = float(result.stdout)
+    _write_atomic(duration_file, str(duration))
+    return duration
+
+def encode_image_segment(image_path, seconds, output_path):
+    """Encode a still image as a silent video segment of the given length."""
+    temp_output_path = f"{os.path.splitext(output_path)[0]}.part.mp4"
+    traced_run([
+        'ffmpeg', '-y', '-v', 'error', '-loop', '1', '-framerate', str(SEGMENT_FPS), '-i', image_path,
+        '-t', f"{seconds:.3f}", '-vf', f'scale=-2:{SEGMENT_HEIGHT},setsar=1,format=yuv420p',
+        '-c:v', 'libx264', *ffmpeg_quality_args(), '-tune', 'stillimage', '-r', str(SEGMENT_FPS), '-an', temp_output_path
+    ], check=True)
+    os.replace(temp_output_path, output_path)
+    return output_path
+
+def chapter_segment(model_name, image_path, summary, speed, narration=None):
+    """(narration seconds, display seconds, segment path) for one chapter, rendering whatever is not cached yet.
+
+    A known narration length (e.g. from the chapter's stored start/end times) skips the TTS.
+    """
+    if narration is None:
+        narration = narration_seconds(summary, speed)
+    display = max(narration, MIN_DISPLAY_SECONDS)
+    image_path = local_input(image_path)  # ffmpeg needs a file; images from a story pack are copied to scratch
+    stat = os.stat(image_path)
+    key = _cache_key(image_path, stat.st_size, stat.st_mtime_ns, f"{display:.3f}", *ffmpeg_quality_args())
+    folder = run_path(SEGMENTS_FOLDER, model_name)
+    os.makedirs(folder, exist_ok=True)
+    segment_path = os.path.join(folder, f"segment_{key}.mp4")
+    with _lock_for(key):
+        count_cache("segment", os.path.exists(segment_path))
+        if not os.path.exists(segment_path):
+            with span("chapter.segment", "video", model=model_name, seconds=round(display, 3)):
+                encode_image_segment(image_path, display, segment_path)
+    return narration, display, segment_path
+
+def concat_segments(segment_paths, audio_file, output_file, copy_audio=False):
+    """Join the segments without re-encoding the video and lay the audio under them.
+
+    With copy_audio, audio_file is a finished movie whose soundtrack is copied over as is (looped if the new cut is longer).
+    """
+    list_file = f"{os.path.splitext(output_file)[0]}_segments.txt"
+    with open(list_file, 'w', encoding='utf-8') as f:
+        for segment_path in segment_paths:
+            escaped_path = os.path.abspath(segment_path).replace("'", "'\\''")
+            f.write(f"file '{escaped_path}'\n")
+    audio_input = ['-stream_loop', '-1', '-i', audio_file] if copy_audio else ['-i', audio_file]
+    audio_codec = ['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac', '-b:a', '192k']
+    try:
+        traced_run([
+            'ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_file, *audio_input,
+            '-map', '0:v', '-map', '1:a', '-c:v', 'copy', *audio_codec, '-shortest', output_file
+        ], check=True)
+    finally:
+        os.remove(list_file)
+    return output_file
@@ -5,9 +5,15 @@ from PIL import Image, ImageEnhance, ExifTags
 import numpy as np
 import shutil
 from datetime import datetime
-from mtcnn import MTCNN
-import dlib
+from functools import lru_cache
+try:
+    from utilities.run_context_utils import run_path
+    from utilities.tracing_utils import traced
+except ImportError:  # Run as a script from utilities/
+    from run_context_utils import run_path
+    from tracing_utils import traced
 import psutil
+# mtcnn (TensorFlow) and dlib are imported when the detectors are first built
 
 # Global enhancement settings for regular faces
 TARGET_SIZE = 2048
@@ -74,7 +80,10 @@ def safe_save(filepath, img):
     img.save(filepath)
     print(f'Saved: {filepath}')
 
-def enhance_image(input_image_path, output_dir):
+@lru_cache(maxsize=None)
+def get_landmark_predictor():
+    """Download (if needed) and load the dlib landmark predictor once per process."""
+    import dlib
     face_predictor_path = 'shape_predictor_68_face_landmarks.dat'
     
     if not os.path.exists(face_predictor_path):
@@ -82,8 +91,19 @@ def enhance_image(input_image_path, output_dir):
         print(f"{face_predictor_path} not found. Downloading from {download_url}...")
         download_file(download_url, face_predictor_path)
     
-    landmark_predictor = dlib.shape_predictor(face_predictor_path)
-    face_detector = MTCNN()
+    return dlib.shape_predictor(face_predictor_path)
+
+@lru_cache(maxsize=None)
+def get_face_detector():
+    """Create the MTCNN detector once per process."""
+    from mtcnn import MTCNN
+    return MTCNN()
+
+@traced("enhance_image", "image")
+def enhance_image(input_image_path, output_dir):
+    import dlib
+    landmark_predictor = get_landmark_predictor()
+    face_detector = get_face_detector()
 
     try:
         print(f'Opening image: {input_image_path}')
@@ -158,7 +178,7 @@ def enhance_image(input_image_path, output_dir):
 
             if ADD_COMPARISONS:
                 print("Creating comparison image...")
-                comparison_dir = 'comparisons'
+                comparison_dir = run_path('comparisons')
                 os.makedirs(comparison_dir, exist_ok=True)
                 with Image.open(input_image_path) as orig_img:
                     common_height = min(orig_img.height, img.height)
@@ -192,4 +212,4 @@ def enhance_image(input_image_path, output_dir):
         return None
 
 if __name__ == '__main__':
-    enhance_image('path/to/input_image.png', 'path/to/output_dir')
\ No newline at end of file
+    enhance_image('path/to/input_image.png', 'path/to/output_dir')
\ No newline at end of file
@@ -8,6 +8,7 @@ from insightface.utils import face_align
 import re
 import numpy as np
 import logging
+from functools import lru_cache
 
 # Initialize logging
 logging.basicConfig(level=logging.DEBUG)
@@ -68,12 +69,18 @@ def add_padding(image, padding_factor=0.25):
     logging.debug(f"[add_padding] Padding added. New dimensions: {new_width}x{new_height}")
     return new_image
 
+@lru_cache(maxsize=None)
+def get_face_analysis_app():
+    """Prepare the FaceAnalysis app once per process and reuse it for every image."""
+    app = FaceAnalysis(name="buffalo_l", providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
+    app.prepare(ctx_id=0, det_size=(640, 640))
+    logging.debug("[get_face_analysis_app] FaceAnalysis app prepared.")
+    return app
+
 def extract_face_embedding(image_path):
     logging.info(f"[extract_face_embedding] Extracting face embedding from {image_path}")
     
-    app = FaceAnalysis(name="buffalo_l", providers=['CUDAExecutionProvider', 'CPUExecutionProvider'])
-    app.prepare(ctx_id=0, det_size=(640, 640))
-    logging.debug("[extract_face_embedding] FaceAnalysis app prepared.")
+    app = get_face_analysis_app()
 
     for attempt in range(2):  # Try up to two times
         logging.debug(f"[extract_face_embedding] Attempt {attempt + 1} to extract face embedding.")
@@ -0,0 +1,233 @@
+import sys
+import time
+import random
+import argparse
+import subprocess
+from datetime import datetime
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities import run_index_utils
+except ImportError:  # Run as a script from utilities/
+    import run_index_utils
+
+# Per-unit failure records, so one bad chapter does not sink a whole run.  A unit is the smallest piece
+# of a stage that can fail and be redone on its own: a chapter image of a model, a chapter's narration,
+# a frame for subtitle placement, an upload.  run_unit() calls it, retries transient errors (timeouts,
+# dropped connections, 5xx) with exponential backoff, and on a final failure records it in the run index
+# and raises UnitFailure; the stage carries on with the healthy units.  Attempts are counted per run
+# across stage runs: a unit with attempts left stays "failed", and stage_cache_utils reruns its stage the
+# next time the run is processed (stages skip the units that already succeeded, so only the failed ones
+# are redone).  After UNIT_MAX_ATTEMPTS it is "exhausted" and left alone until -reset.  Downstream stages
+# substitute an explicit placeholder for a missing unit (stage 5 uses a title card for a missing chapter
+# image) and record it with record_placeholder(), so chapters stay aligned with their narration.
+# StageFailure is for errors no unit can work around (no main character, no story); it fails the stage.
+#   python utilities/failure_utils.py -run_id <run_id>
+#   python utilities/failure_utils.py -run_id <run_id> -reset 4_create_images_from_ai_prompts
+
+UNIT_MAX_ATTEMPTS = getattr(gv, 'UNIT_MAX_ATTEMPTS', 3)  # Per unit and run, across stage reruns
+UNIT_RETRY_BASE_SECONDS = getattr(gv, 'UNIT_RETRY_BASE_SECONDS', 2.0)
+UNIT_RETRY_MAX_SECONDS = getattr(gv, 'UNIT_RETRY_MAX_SECONDS', 30.0)
+TRANSIENT_MODULES = ("requests", "urllib3", "httplib2", "gtts", "http.client", "socket")
+
+FAILURE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS unit_failures (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    chapter INTEGER,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    transient INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    placeholder TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, stage, unit)
+);
+"""
+# failed: retried the next time its stage runs; exhausted: out of attempts; degraded: a stand-in was used for
+# good; recovered: succeeded after failing
+OPEN_STATUSES = ("failed", "exhausted", "degraded")
+
+_schema_ready = set()
+
+class StageFailure(Exception):
+    """The stage cannot go on at all; raised instead of exit(1) so the orchestrators record it and move on."""
+
+class UnitFailure(Exception):
+    """One unit of a stage failed for good this time; the stage carries on without it."""
+
+    def __init__(self, message, unit=None, transient=False):
+        super().__init__(message)
+        self.unit = unit
+        self.transient = transient
+
+class TransientError(Exception):
+    """Raise for an error worth retrying right away (rate limit, timeout, server error)."""
+
+class RetryPolicy:
+    def __init__(self, max_attempts=UNIT_MAX_ATTEMPTS, base_seconds=UNIT_RETRY_BASE_SECONDS, max_seconds=UNIT_RETRY_MAX_SECONDS):
+        self.max_attempts = max_attempts
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+
+    def delay(self, retry):
+        """Seconds to wait before the retry-th retry: exponential backoff with jitter, capped."""
+        return min(self.max_seconds, self.base_seconds * 2 ** (retry - 1)) * random.uniform(0.5, 1.0)
+
+DEFAULT_POLICY = RetryPolicy()
+
+def get_connection():
+    connection = run_index_utils.get_connection()
+    if id(connection) not in _schema_ready:
+        connection.executescript(FAILURE_SCHEMA)
+        _schema_ready.add(id(connection))
+    return connection
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def chapter_unit(model_name, index, step=None):
+    """Unit name for a chapter (0-based index) of a model, e.g. 'sdxl/chapter_3' or 'sdxl/chapter_3/narration'."""
+    unit = f"{model_name}/chapter_{index + 1}"
+    return f"{unit}/{step}" if step else unit
+
+def is_transient(error):
+    """Whether retrying the same call soon has a fair chance of working."""
+    if isinstance(error, (TransientError, ConnectionError, TimeoutError, subprocess.TimeoutExpired)):
+        return True
+    if isinstance(error, UnitFailure):
+        return error.transient
+    return type(error).__module__.split(".")[0] in TRANSIENT_MODULES
+
+def get_record(stage, unit, run_id=None):
+    run_id = run_id or run_index_utils.current_run_id()
+    if not run_id:
+        return None
+    row = get_connection().execute(
+        "SELECT run_id, stage, unit, chapter, status, attempts, transient, error, placeholder, updated_at FROM unit_failures "
+        "WHERE run_id = ? AND stage = ? AND unit = ?", (run_id, stage, unit)).fetchone()
+    return _as_dict(row) if row else None
+
+def _as_dict(row):
+    keys = ("run_id", "stage", "unit", "chapter", "status", "attempts", "transient", "error", "placeholder", "updated_at")
+    return dict(zip(keys, row))
+
+def can_retry(stage, unit, policy=DEFAULT_POLICY, run_id=None):
+    """False once the unit has used up its attempts in this run (or was given a stand-in for good)."""
+    record = get_record(stage, unit, run_id)
+    return record is None or (record["status"] in ("failed", "recovered") and record["attempts"] < policy.max_attempts)
+
+def record_failure(stage, unit, error, attempts, chapter=None, transient=False, policy=DEFAULT_POLICY, run_id=None):
+    run_id = run_id or run_index_utils.current_run_id()
+    status = "exhausted" if attempts >= policy.max_attempts else "failed"
+    print(f"[ERROR] {stage}: {unit} failed ({type(error).__name__}: {error}); attempt {attempts} of {policy.max_attempts}"
+          + (", giving up on it for this run" if status == "exhausted" else ", will be retried the next time the stage runs"))
+    if not run_id:
+        return status
+    get_connection().execute(
+        "INSERT INTO unit_failures (run_id, stage, unit, chapter, status, attempts, transient, error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (run_id, stage, unit) DO UPDATE SET chapter = excluded.chapter, status = excluded.status, attempts = excluded.attempts, "
+        "transient = excluded.transient, error = excluded.error, updated_at = excluded.updated_at",
+        (run_id, stage, unit, chapter, status, attempts, int(transient), f"{type(error).__name__}: {error}"[:2000], _now()))
+    return status
+
+def record_placeholder(stage, unit, placeholder, chapter=None, retry=True, run_id=None):
+    """Note what stood in for a failed or missing unit.  With retry, the unit is still redone when its stage runs again."""
+    run_id = run_id or run_index_utils.current_run_id()
+    print(f"[WARNING] {stage}: {unit} replaced by a placeholder: {placeholder}")
+    if not run_id:
+        return
+    # An exhausted unit stays exhausted; a recovered one whose output went missing is due again
+    status_update = "CASE WHEN unit_failures.status = 'exhausted' THEN 'exhausted' ELSE 'failed' END" if retry else "'degraded'"
+    get_connection().execute(
+        "INSERT INTO unit_failures (run_id, stage, unit, chapter, status, placeholder, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        f"ON CONFLICT (run_id, stage, unit) DO UPDATE SET status = {status_update}, placeholder = excluded.placeholder, updated_at = excluded.updated_at",
+        (run_id, stage, unit, chapter, "failed" if retry else "degraded", str(placeholder), _now()))
+
+def record_success(stage, unit, run_id=None):
+    run_id = run_id or run_index_utils.current_run_id()
+    if run_id:
+        get_connection().execute("UPDATE unit_failures SET status = 'recovered', placeholder = NULL, updated_at = ? "
+                                 "WHERE run_id = ? AND stage = ? AND unit = ?", (_now(), run_id, stage, unit))
+
+def run_unit(stage, unit, function, *args, chapter=None, policy=DEFAULT_POLICY, run_id=None, **kwargs):
+    """Call function(*args, **kwargs) as one unit of stage: transient errors are retried with backoff, a final failure
+    is recorded and raised as UnitFailure.  StageFailure passes straight through."""
+    record = get_record(stage, unit, run_id)
+    previous = record["attempts"] if record else 0
+    attempt = previous
+    while True:
+        attempt += 1
+        try:
+            result = function(*args, **kwargs)
+        except (StageFailure, KeyboardInterrupt):
+            raise
+        except Exception as e:
+            transient = is_transient(e)
+            if transient and attempt < policy.max_attempts:
+                delay = policy.delay(attempt - previous)
+                print(f"[WARNING] {stage}: {unit} hit a transient error ({e}); retry {attempt - previous} in {delay:.1f} seconds")
+                time.sleep(delay)
+                continue
+            record_failure(stage, unit, e, attempt, chapter, transient, policy, run_id)
+            raise UnitFailure(f"{unit}: {e}", unit, transient) from e
+        if record and record["status"] != "recovered":
+            record_success(stage, unit, run_id)
+            print(f"[INFO] {stage}: {unit} recovered on attempt {attempt}")
+        return result
+
+def open_failures(run_id=None, stage=None):
+    """Failed, exhausted and degraded units of the run (optionally one stage), in stage and unit order."""
+    run_id = run_id or run_index_utils.current_run_id()
+    if not run_id:
+        return []
+    query = ("SELECT run_id, stage, unit, chapter, status, attempts, transient, error, placeholder, updated_at FROM unit_failures "
+             f"WHERE run_id = ? AND status IN ({','.join('?' * len(OPEN_STATUSES))})")
+    params = [run_id, *OPEN_STATUSES]
+    if stage:
+        query += " AND stage = ?"
+        params.append(stage)
+    return [_as_dict(row) for row in get_connection().execute(query + " ORDER BY stage, chapter, unit", params)]
+
+def has_retryable(stage, run_id=None):
+    """True when the stage has units of the run waiting for another attempt (stage_cache_utils reruns it then)."""
+    return any(record["status"] == "failed" for record in open_failures(run_id, stage))
+
+def reset(stage, run_id=None, units=None):
+    """Give exhausted (or degraded) units another UNIT_MAX_ATTEMPTS; returns how many were reset."""
+    run_id = run_id or run_index_utils.current_run_id()
+    records = [record for record in open_failures(run_id, stage) if units is None or record["unit"] in units]
+    get_connection().executemany("UPDATE unit_failures SET status = 'failed', attempts = 0, updated_at = ? WHERE run_id = ? AND stage = ? AND unit = ?",
+                                 [(_now(), run_id, record["stage"], record["unit"]) for record in records])
+    return len(records)
+
+def format_failures(records):
+    if not records:
+        return "No failed units."
+    lines = [f"{'stage':<38} {'unit':<48} {'status':<10} {'tries':>5}  error / placeholder"]
+    for record in records:
+        detail = record["error"] or ""
+        if record["placeholder"]:
+            detail = f"{detail} -> {record['placeholder']}" if detail else f"-> {record['placeholder']}"
+        lines.append(f"{record['stage']:<38} {record['unit']:<48} {record['status']:<10} {record['attempts']:>5}  {detail[:120]}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or reset the failed units of a run.")
+    parser.add_argument("-run_id", type=str, help="Run to show (default: the active or most recent run).")
+    parser.add_argument("-stage", type=str, help="Only this stage.")
+    parser.add_argument("-reset", type=str, metavar="STAGE", help="Give the stage's exhausted units another round of attempts.")
+    args = parser.parse_args()
+    run_id = args.run_id or run_index_utils.current_run_id()
+    if not run_id:
+        print("[ERROR] No run found.")
+        sys.exit(1)
+    if args.reset:
+        print(f"Reset {reset(args.reset, run_id)} unit(s) of {args.reset} for run {run_id}; they run again the next time the stage does.")
+    print(format_failures(open_failures(run_id, args.stage)))
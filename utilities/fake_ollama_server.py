@@ -0,0 +1,171 @@
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A tiny stand-in for the Ollama HTTP API (/api/chat, /api/generate, /api/tags).
+# Responses are deterministic for a given prompt and the simulated latency scales with
+# the prompt and response token counts, so prompt changes can be compared offline.
+
+DEFAULT_PORT = 11435
+PROMPT_EVAL_SECONDS_PER_TOKEN = 0.0005  # Simulated prompt-eval cost per input token
+EVAL_SECONDS_PER_TOKEN = 0.002  # Simulated generation cost per output token
+DEFAULT_RESPONSE_WORDS = 40
+
+FILLER_WORDS = [
+    "the", "hero", "city", "light", "storm", "quietly", "rises", "against", "shadow", "hope",
+    "alien", "sky", "courage", "friends", "gather", "under", "bright", "stars", "secret", "plan",
+    "mountain", "river", "claws", "shield", "whisper", "future", "ancient", "signal", "glows", "home"
+]
+
+def count_tokens(text):
+    """Approximate a BPE token count: one token per ~4 characters of each word, plus punctuation."""
+    tokens = 0
+    for piece in re.findall(r"\w+|[^\w\s]", text or ""):
+        tokens += max(1, -(-len(piece) // 4))
+    return tokens
+
+def _prompt_from_request(body):
+    if "messages" in body:
+        return " ".join(message.get("content", "") for message in body["messages"])
+    return body.get("prompt", "")
+
+def generate_fake_response(prompt):
+    """Build a deterministic, roughly well-formed response for one of the pipeline prompts."""
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+
+    if "male or female" in prompt:
+        return rng.choice(["male", "female"])
+
+    letter_match = re.search(r"starts? with the letter (\w)", prompt)
+    if letter_match:
+        letter = letter_match.group(1).upper()
+        return letter + rng.choice(["ndrea", "lba", "rlo", "mara", "osei"])
+
+    word_limit = DEFAULT_RESPONSE_WORDS
+    limit_match = re.search(r"(?:maximum of|up to|in|less than) (\d+) words", prompt)
+    if limit_match:
+        word_limit = max(3, int(limit_match.group(1)))
+
+    words = [rng.choice(FILLER_WORDS) for _ in range(word_limit)]
+    if "comma-separated" in prompt or "comma separated" in prompt:
+        return ", ".join(words[:min(word_limit, 10)])
+
+    sentences = []
+    for start in range(0, len(words), 12):
+        sentence = " ".join(words[start:start + 12])
+        sentences.append(sentence[0].upper() + sentence[1:] + ".")
+    return " ".join(sentences)
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    prompt_eval_seconds_per_token = PROMPT_EVAL_SECONDS_PER_TOKEN
+    eval_seconds_per_token = EVAL_SECONDS_PER_TOKEN
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self._send_json({"models": [{"name": "llama3:latest", "model": "llama3:latest", "size": 0}]})
+        elif self.path in ("/", ""):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"Ollama is running")
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self._send_json({"error": "not found"}, status=404)
+            return
+
+        is_chat = self.path == "/api/chat"
+        prompt = _prompt_from_request(body)
+        response_text = generate_fake_response(prompt)
+        prompt_tokens = count_tokens(prompt)
+        response_tokens = count_tokens(response_text)
+
+        prompt_eval_seconds = prompt_tokens * self.prompt_eval_seconds_per_token
+        eval_seconds = response_tokens * self.eval_seconds_per_token
+        time.sleep(prompt_eval_seconds)
+
+        model = body.get("model", "llama3")
+        created_at = datetime.now(timezone.utc).isoformat()
+        final_stats = {
+            "done": True,
+            "total_duration": int((prompt_eval_seconds + eval_seconds) * 1e9),
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_eval_seconds * 1e9),
+            "eval_count": response_tokens,
+            "eval_duration": int(eval_seconds * 1e9),
+        }
+
+        def chunk(content, done=False):
+            payload = {"model": model, "created_at": created_at, "done": done}
+            if is_chat:
+                payload["message"] = {"role": "assistant", "content": content}
+            else:
+                payload["response"] = content
+            return payload
+
+        if body.get("stream", True):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            pieces = re.findall(r"\S+\s*", response_text)
+            for piece in pieces:
+                time.sleep(eval_seconds / max(1, len(pieces)))
+                self.wfile.write((json.dumps(chunk(piece)) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            final = chunk("", done=True)
+            final.update(final_stats)
+            self.wfile.write((json.dumps(final) + "\n").encode("utf-8"))
+        else:
+            time.sleep(eval_seconds)
+            final = chunk(response_text, done=True)
+            final.update(final_stats)
+            self._send_json(final)
+
+def start_fake_server(port=DEFAULT_PORT, prompt_eval_seconds_per_token=PROMPT_EVAL_SECONDS_PER_TOKEN, eval_seconds_per_token=EVAL_SECONDS_PER_TOKEN):
+    """Start the fake server on a background thread and return it; call shutdown() when done."""
+    handler = type("ConfiguredFakeOllamaHandler", (FakeOllamaHandler,), {
+        "prompt_eval_seconds_per_token": prompt_eval_seconds_per_token,
+        "eval_seconds_per_token": eval_seconds_per_token,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Fake Ollama server listening on http://127.0.0.1:{server.server_address[1]}")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a deterministic stand-in for the Ollama HTTP API.")
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("-prompt_eval_cost", type=float, default=PROMPT_EVAL_SECONDS_PER_TOKEN, help="Simulated seconds per prompt token.")
+    parser.add_argument("-eval_cost", type=float, default=EVAL_SECONDS_PER_TOKEN, help="Simulated seconds per generated token.")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.port, args.prompt_eval_cost, args.eval_cost)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import time
+import fnmatch
+import argparse
+import threading
+import socketserver
+
+# A tiny in-memory stand-in for a Redis server (RESP2/RESP3), covering the commands the Redis
+# work queue backend uses (strings, hashes, lists).  Commands run one at a time under a lock, so
+# RPOPLPUSH is atomic just like on a real server.  Point STORY_QUEUE_URL at redis://127.0.0.1:<port>/0.
+
+DEFAULT_PORT = 6380
+
+class FakeRedisError(Exception):
+    pass
+
+class SimpleString(str):
+    """Reply sent as a RESP simple string (+OK) rather than a bulk string."""
+
+OK = SimpleString("OK")
+
+class FakeRedisStore:
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def _get(self, key, kind):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise FakeRedisError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _list(self, key, create=False):
+        value = self._get(key, list)
+        if value is None and create:
+            value = self.data[key] = []
+        return value
+
+    def _hash(self, key, create=False):
+        value = self._get(key, dict)
+        if value is None and create:
+            value = self.data[key] = {}
+        return value
+
+    def _drop_if_empty(self, key):
+        if key in self.data and not self.data[key]:
+            del self.data[key]
+
+    def execute(self, name, *args):
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise FakeRedisError(f"ERR unknown command '{name}'")
+        with self.lock:
+            return handler(*args)
+
+    # Connection / server
+    def cmd_ping(self, message=None):
+        return message if message is not None else SimpleString("PONG")
+
+    def cmd_echo(self, message):
+        return message
+
+    def cmd_select(self, index):
+        return OK
+
+    def cmd_client(self, *args):
+        return OK
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        return OK
+
+    def cmd_flushall(self, *args):
+        return self.cmd_flushdb()
+
+    def cmd_keys(self, pattern="*"):
+        return [key for key in self.data if fnmatch.fnmatchcase(key, pattern)]
+
+    def cmd_del(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    # Strings
+    def cmd_get(self, key):
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *args):
+        self.data[key] = value
+        return OK
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, str) or 0) + int(amount)
+        self.data[key] = str(value)
+        return value
+
+    # Hashes
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise FakeRedisError("ERR wrong number of arguments for 'hset' command")
+        target = self._hash(key, create=True)
+        added = 0
+        for field, value in zip(pairs[::2], pairs[1::2]):
+            added += field not in target
+            target[field] = value
+        return added
+
+    def cmd_hget(self, key, field):
+        return (self._hash(key) or {}).get(field)
+
+    def cmd_hgetall(self, key):
+        return dict(self._hash(key) or {})
+
+    def cmd_hincrby(self, key, field, amount):
+        target = self._hash(key, create=True)
+        value = int(target.get(field) or 0) + int(amount)
+        target[field] = str(value)
+        return value
+
+    # Lists
+    def cmd_lpush(self, key, *values):
+        target = self._list(key, create=True)
+        for value in values:
+            target.insert(0, value)
+        return len(target)
+
+    def cmd_rpush(self, key, *values):
+        target = self._list(key, create=True)
+        target.extend(values)
+        return len(target)
+
+    def cmd_rpop(self, key):
+        target = self._list(key)
+        if not target:
+            return None
+        value = target.pop()
+        self._drop_if_empty(key)
+        return value
+
+    def cmd_rpoplpush(self, source, destination):
+        value = self.cmd_rpop(source)
+        if value is not None:
+            self.cmd_lpush(destination, value)
+        return value
+
+    def cmd_lrem(self, key, count, value):
+        target = self._list(key) or []
+        count = int(count)
+        indexes = [i for i, item in enumerate(target) if item == value]
+        if count < 0:
+            indexes = indexes[::-1]
+        if count:
+            indexes = indexes[:abs(count)]
+        for i in sorted(indexes, reverse=True):
+            del target[i]
+        self._drop_if_empty(key)
+        return len(indexes)
+
+    def cmd_lrange(self, key, start, stop):
+        target = self._list(key) or []
+        start, stop = int(start), int(stop)
+        stop = len(target) + stop if stop < 0 else stop
+        start = max(0, len(target) + start if start < 0 else start)
+        return target[start:stop + 1]
+
+    def cmd_llen(self, key):
+        return len(self._list(key) or [])
+
+def encode_reply(value, protocol=2):
+    """Encode a reply; dicts become RESP3 maps, or flat field/value arrays for RESP2 clients."""
+    if value is None:
+        return b"_\r\n" if protocol == 3 else b"$-1\r\n"
+    if isinstance(value, FakeRedisError):
+        return f"-{value}\r\n".encode("utf-8")
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return f":{value}\r\n".encode("utf-8")
+    if isinstance(value, dict):
+        if protocol == 3:
+            return f"%{len(value)}\r\n".encode("utf-8") + b"".join(
+                encode_reply(field, protocol) + encode_reply(item, protocol) for field, item in value.items())
+        value = [entry for pair in value.items() for entry in pair]
+    if isinstance(value, list):
+        return f"*{len(value)}\r\n".encode("utf-8") + b"".join(encode_reply(item, protocol) for item in value)
+    if isinstance(value, SimpleString):
+        return f"+{value}\r\n".encode("utf-8")
+    data = value.encode("utf-8")
+    return b"$" + str(len(data)).encode("ascii") + b"\r\n" + data + b"\r\n"
+
+def read_command(stream):
+    """Read one RESP array of bulk strings (or an inline command); None at end of stream."""
+    line = stream.readline()
+    if not line:
+        return None
+    line = line.rstrip(b"\r\n")
+    if not line.startswith(b"*"):
+        return line.decode("utf-8").split()
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(stream.readline().rstrip(b"\r\n")[1:])
+        args.append(stream.read(length + 2)[:-2].decode("utf-8"))
+    return args
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    def hello(self, protover=None, *args):
+        """HELLO switches this connection's protocol version (RESP2 or RESP3)."""
+        if protover is not None:
+            if protover not in ("2", "3"):
+                raise FakeRedisError("NOPROTO unsupported protocol version")
+            self.protocol = int(protover)
+        return {"server": "redis", "version": "7.0.0", "proto": self.protocol, "id": 1,
+                "mode": "standalone", "role": "master", "modules": []}
+
+    def handle(self):
+        self.protocol = 2
+        while True:
+            command = read_command(self.rfile)
+            if command is None:
+                return
+            if not command:
+                continue
+            try:
+                if command[0].lower() == "hello":
+                    reply = self.hello(*command[1:])
+                else:
+                    reply = self.server.store.execute(*command)
+            except FakeRedisError as e:
+                reply = e
+            except (TypeError, ValueError) as e:
+                reply = FakeRedisError(f"ERR {e}")
+            self.wfile.write(encode_reply(reply, self.protocol))
+            self.wfile.flush()
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, FakeRedisHandler)
+        self.store = FakeRedisStore()
+
+def start_fake_server(port=DEFAULT_PORT):
+    """Start the fake server on a background thread and return it; call shutdown() when done."""
+    server = FakeRedisServer(("127.0.0.1", port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Fake Redis server listening on redis://127.0.0.1:{server.server_address[1]}/0")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an in-memory stand-in for a Redis server.")
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.port)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import re
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs, unquote
+from xml.sax.saxutils import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# A tiny in-memory stand-in for an S3-compatible object store (path-style requests, no auth checks),
+# covering what the artifact store's S3 backend uses: buckets, PUT/GET (with Range)/HEAD/DELETE of
+# objects, ListObjectsV2 and multipart uploads.  Point the artifact store at it with
+#   AWS_ENDPOINT_URL=http://127.0.0.1:9010 AWS_ACCESS_KEY_ID=x AWS_SECRET_ACCESS_KEY=x STORY_ARTIFACT_STORE=s3://stories/test
+
+DEFAULT_PORT = 9010
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>'
+
+class FakeS3Store:
+    def __init__(self):
+        self.buckets = {}  # bucket -> {key: (data, etag, last modified)}
+        self.uploads = {}  # upload id -> {part number: data}
+        self.lock = threading.Lock()
+
+def _decode_aws_chunked(body):
+    """Strip aws-chunked framing (size;ext CRLF data CRLF ... 0 CRLF trailers)."""
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)
+        data += body[line_end + 2:line_end + 2 + size]
+        position = line_end + 2 + size + 2
+
+class FakeS3Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    store = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _parse(self):
+        url = urlparse(self.path)
+        bucket, _, key = url.path.lstrip("/").partition("/")
+        return unquote(bucket), unquote(key), {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+
+    def _body(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if "aws-chunked" in self.headers.get("Content-Encoding", "") or self.headers.get("x-amz-decoded-content-length"):
+            body = _decode_aws_chunked(body)
+        return body
+
+    def _send(self, status, body=b"", headers=None, content_type="application/xml"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _error(self, status, code, message):
+        self._send(status, f"{XML_HEADER}<Error><Code>{code}</Code><Message>{escape(message)}</Message></Error>".encode())
+
+    def _object(self, bucket, key):
+        with self.store.lock:
+            return self.store.buckets.get(bucket, {}).get(key)
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        with self.store.lock:
+            if not key:
+                self.store.buckets.setdefault(bucket, {})
+                return self._send(200)
+            if bucket not in self.store.buckets:
+                return self._error(404, "NoSuchBucket", bucket)
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            if "uploadId" in query:
+                if query["uploadId"] not in self.store.uploads:
+                    return self._error(404, "NoSuchUpload", query["uploadId"])
+                self.store.uploads[query["uploadId"]][int(query["partNumber"])] = body
+            else:
+                self.store.buckets[bucket][key] = (body, etag, datetime.now(timezone.utc))
+        self._send(200, headers={"ETag": etag})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body = self._body()
+        with self.store.lock:
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self.store.uploads[upload_id] = {}
+                return self._send(200, (f"{XML_HEADER}<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket>"
+                                        f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>").encode())
+            parts = self.store.uploads.pop(query.get("uploadId"), None)
+            if parts is None:
+                return self._error(404, "NoSuchUpload", query.get("uploadId", ""))
+            numbers = [int(number) for number in re.findall(rb"<PartNumber>(\d+)</PartNumber>", body)]
+            data = b"".join(parts[number] for number in numbers)
+            digests = b"".join(hashlib.md5(parts[number]).digest() for number in numbers)
+            etag = f'"{hashlib.md5(digests).hexdigest()}-{len(numbers)}"'
+            self.store.buckets[bucket][key] = (data, etag, datetime.now(timezone.utc))
+        self._send(200, (f"{XML_HEADER}<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                         f"<ETag>{escape(etag)}</ETag></CompleteMultipartUploadResult>").encode())
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        with self.store.lock:
+            if "uploadId" in query:
+                self.store.uploads.pop(query["uploadId"], None)
+            else:
+                self.store.buckets.get(bucket, {}).pop(key, None)
+        self._send(204)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if bucket not in self.store.buckets:
+            return self._error(404, "NoSuchBucket", bucket)
+        if not key:
+            return self._list(bucket, query) if self.command == "GET" else self._send(200)
+        entry = self._object(bucket, key)
+        if entry is None:
+            return self._error(404, "NoSuchKey", key)
+        data, etag, modified = entry
+        headers = {"ETag": etag, "Last-Modified": modified.strftime("%a, %d %b %Y %H:%M:%S GMT"), "Accept-Ranges": "bytes"}
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            return self._send(206, data[start:end + 1], headers, "application/octet-stream")
+        self._send(200, data, headers, "application/octet-stream")
+
+    def _list(self, bucket, query):
+        prefix = query.get("prefix", "")
+        with self.store.lock:
+            items = sorted((key, entry) for key, entry in self.store.buckets[bucket].items() if key.startswith(prefix))
+        contents = "".join(f"<Contents><Key>{escape(key)}</Key><Size>{len(data)}</Size><ETag>{escape(etag)}</ETag>"
+                           f"<LastModified>{modified.strftime('%Y-%m-%dT%H:%M:%S.000Z')}</LastModified></Contents>"
+                           for key, (data, etag, modified) in items)
+        self._send(200, (f"{XML_HEADER}<ListBucketResult><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+                         f"<KeyCount>{len(items)}</KeyCount><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>").encode())
+
+def start_fake_server(port=DEFAULT_PORT, buckets=()):
+    """Start the fake server on a background thread (creating buckets) and return it; call shutdown() when done."""
+    handler = type("ConfiguredFakeS3Handler", (FakeS3Handler,), {"store": FakeS3Store()})
+    for bucket in buckets:
+        handler.store.buckets[bucket] = {}
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print(f"Fake S3 server listening on http://127.0.0.1:{server.server_address[1]}")
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an in-memory stand-in for an S3-compatible object store.")
+    parser.add_argument("-port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("-buckets", nargs="*", default=["stories"], help="Buckets to create at startup.")
+    args = parser.parse_args()
+
+    server = start_fake_server(args.port, args.buckets)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
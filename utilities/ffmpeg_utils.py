@@ -8,10 +8,13 @@ import requests
 from mutagen.mp3 import MP3
 import shutil
 
+from utilities.run_context_utils import scratch_file
+from utilities.tracing_utils import traced_run, span
+
 
 # Function to get the length of a media file using ffprobe
 def get_length(filename):
-    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
+    result = traced_run(["ffprobe", "-v", "error", "-show_entries",
                              "format=duration", "-of",
                              "default=noprint_wrappers=1:nokey=1", filename],
                             stdout=subprocess.PIPE,
@@ -74,7 +77,8 @@ def create_captioned_images(image_files, captions, image_output_dir, video_width
             fix_bounds=True
         )
 
-        video_filter.output(new_filepath_with_caption).run(overwrite_output=True)
+        with span("ffmpeg", "subprocess", output=new_filepath_with_caption):
+            video_filter.output(new_filepath_with_caption).run(overwrite_output=True)
 
 
 # Function to generate a video from images and an audio file
@@ -82,17 +86,17 @@ def generate_video_from_images(input_folder, audio_file, output_video, display_d
     # Get the sorted list of image files
     image_files = get_image_files(input_folder)
     
-    # Create a temporary file list
-    list_file = 'file_list.txt'
+    # Create a temporary file list in the run's scratch space; concat resolves relative entries against the list's folder
+    list_file = scratch_file('file_list_', '.txt')
     with open(list_file, 'w') as f:
         for image_file in image_files:
-            f.write(f"file '{image_file}'\n")
+            f.write(f"file '{os.path.abspath(image_file)}'\n")
             f.write(f"duration {display_duration_per_image}\n")
     
     # Add the last image file without duration (required by FFmpeg)
     if image_files:
         with open(list_file, 'a') as f:
-            f.write(f"file '{image_files[-1]}'\n")
+            f.write(f"file '{os.path.abspath(image_files[-1])}'\n")
 
     # Prepare FFmpeg command
     ffmpeg_cmd = [
@@ -113,7 +117,7 @@ def generate_video_from_images(input_folder, audio_file, output_video, display_d
     
     # Run FFmpeg command
     try:
-        subprocess.run(ffmpeg_cmd, check=True)
+        traced_run(ffmpeg_cmd, check=True)
     except subprocess.CalledProcessError as e:
         print(f"An FFmpeg error occurred while creating the video: {e}")
     finally:
@@ -129,7 +133,7 @@ def trim_audio_to_exact_length(filename, target_length):
         audio = MP3(filename)
         audio_length = int(audio.info.length)
     elif file_extension == ".mp4":
-        result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
+        result = traced_run(["ffprobe", "-v", "error", "-show_entries",
                                  "format=duration", "-of",
                                  "default=noprint_wrappers=1:nokey=1", filename],
                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -142,7 +146,7 @@ def trim_audio_to_exact_length(filename, target_length):
         return True
     elif audio_length > target_length:
         trimmed_filename = f"{os.path.splitext(filename)[0]}_trimmed{file_extension}"
-        subprocess.run([
+        traced_run([
             "ffmpeg", "-i", filename,
             "-ss", "0", "-to", str(target_length),
             "-c", "copy", trimmed_filename,
@@ -171,7 +175,7 @@ def add_text_to_video(input_path, output_path, time_until_end=3, text_to_add="th
     start_time = duration - time_until_end
     
     # Using ffmpeg to add the text with drawtext
-    subprocess.run([
+    traced_run([
         'ffmpeg', 
         '-i', input_path, 
         '-vf', f"drawtext=fontfile=/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf:text='{text_to_add}':fontcolor=white:fontsize=24:box=1:boxcolor=black@0.5:boxborderw=5:x=(w-text_w)/2:y=(h-text_h)/2:enable='gte(t,{start_time})'", 
@@ -3,6 +3,11 @@ import argparse
 from gtts import gTTS
 import subprocess
 
+try:
+    from utilities.tracing_utils import traced, traced_run
+except ImportError:  # Run as a script from utilities/
+    from tracing_utils import traced, traced_run
+
 # VOICES WE CAN USE #
 # Below are the different English language options and how to reference them in gTTS:
 # 'en'    : 'English (default)'
@@ -22,6 +27,7 @@ DEFAULT_SAMPLE_TEXT = """Hello, this is a test voice generated using Google Text
                          Let's see how it sounds when overlaid on a video."""
 
 # Function to generate TTS audio from text
+@traced("gtts", "tts")
 def generate_tts_audio(text, output_file='temp_tts_audio.mp3', lang=DEFAULT_LANGUAGE, tld=DEFAULT_TLD):
     tts = gTTS(text, lang=lang, tld=tld)
     tts.save(output_file)
@@ -30,7 +36,7 @@ def generate_tts_audio(text, output_file='temp_tts_audio.mp3', lang=DEFAULT_LANG
 
 # Function to adjust the speed of the TTS audio
 def adjust_audio_speed(input_audio_file, rate, output_file='temp_adjusted_tts_audio.mp3'):
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-i', input_audio_file, '-filter:a', f"atempo={rate}", output_file
     ], check=True)
     print(f"Adjusted audio speed and saved as {output_file}")
@@ -38,7 +44,7 @@ def adjust_audio_speed(input_audio_file, rate, output_file='temp_adjusted_tts_au
 
 def add_silence_to_audio(input_audio_file, target_duration, output_file='temp_final_tts_audio.mp3'):
     # Get the duration of the input audio
-    result = subprocess.run(
+    result = traced_run(
         ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_audio_file],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT
@@ -50,7 +56,7 @@ def add_silence_to_audio(input_audio_file, target_duration, output_file='temp_fi
     silence_duration = max(0, target_duration - audio_duration)
     
     # Adjust the audio by adding silence
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-i', input_audio_file,
         '-filter_complex', f'apad=pad_dur={silence_duration}',
         '-t', str(target_duration),
@@ -66,7 +72,7 @@ def mix_audio_on_video(video_file, tts_audio_file, output_video_file, tts_volume
         background_volume_str = f'volume={background_volume}dB'
 
         # FFmpeg command to mix original and TTS audio
-        subprocess.run([
+        traced_run([
             'ffmpeg', '-y', '-i', video_file, '-i', tts_audio_file,
             '-filter_complex', f'[1:a]{tts_volume_str}[a1];[0:a]{background_volume_str}[a0];[a0][a1]amerge=inputs=2,pan=stereo|c0<c0+c2|c1<c1+c3[a]', 
             '-map', '0:v', '-map', '[a]',
@@ -88,7 +94,7 @@ def pad_audio_to_video_duration(video_file, audio_file):
     padded_audio_file = 'temp_padded_tts_audio.mp3'
 
     # Get the duration of the video
-    result = subprocess.run(
+    result = traced_run(
         ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', video_file],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT
@@ -97,7 +103,7 @@ def pad_audio_to_video_duration(video_file, audio_file):
     print(f"Video duration: {video_duration} seconds")
     
     # Pad the TTS audio to match the video duration
-    subprocess.run([
+    traced_run([
         'ffmpeg', '-y', '-i', audio_file, 
         '-af', f'apad=pad_dur={video_duration}', 
         '-t', str(video_duration), 
@@ -0,0 +1,128 @@
+import os
+import re
+import sys
+import json
+import argparse
+import subprocess
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Startup cost of the pipeline's entry points, measured with `python -X importtime`.  Heavy libraries
+# (torch, diffusers, TensorFlow via mtcnn, dlib, insightface, OpenCV, sklearn, yt-dlp) are imported by
+# the functions that use them, so importing a stage or utility must stay cheap.  This check imports each
+# entry point in a fresh interpreter and fails when one takes longer than its budget or pulls in a heavy
+# library at import time.
+#   python utilities/import_budget_utils.py
+#   python utilities/import_budget_utils.py -modules 8_add_ffmpeg_subtitles -budget_ms 300
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENTRY_POINTS = [
+    "run_all",
+    "queue_worker",
+    "run_scheduler",
+    "1_dream_up_a_story",
+    "2_build_out_chapters",
+    "3_summarize_chapters_add_ai_prompts",
+    "4_create_images_from_ai_prompts",
+    "4b_unique_character",
+    "5_create_movie",
+    "6_create_mosaic",
+    "7_zoompan_movie",
+    "8_add_ffmpeg_subtitles",
+    "9_create_voiceover",
+    "utilities.stablediffusion_utils",
+    "utilities.main_character_generator_utils",
+    "utilities.enhance_image_via_import",
+]
+DEFAULT_BUDGET_MS = getattr(gv, 'IMPORT_BUDGET_MS', 750)
+IMPORT_BUDGETS_MS = getattr(gv, 'IMPORT_BUDGETS_MS', {})  # Per entry point overrides, e.g. {"run_all": 1000}
+HEAVY_MODULES = ["torch", "diffusers", "transformers", "tensorflow", "keras", "mtcnn", "dlib", "insightface",
+                 "onnxruntime", "cv2", "sklearn", "scipy", "yt_dlp"]
+ALLOWED_HEAVY_MODULES = {
+    "utilities.enhance_image_via_import": {"cv2"},  # Its whole job is OpenCV image processing
+}
+REPEATS = 3
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def parse_importtime(stderr):
+    """[(level, module, self µs, cumulative µs)] from -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((len(indent) // 2, module, int(self_us), int(cumulative_us)))
+    return rows
+
+def measure_import(module_name, python=sys.executable):
+    """Import module_name in a fresh interpreter; returns its cumulative import time and what it pulled in."""
+    process = subprocess.run([python, "-X", "importtime", "-c", f"__import__({module_name!r})"],
+                             cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = parse_importtime(process.stderr)
+    if process.returncode != 0:
+        error = [line for line in process.stderr.splitlines() if not line.startswith("import time:")]
+        return {"module": module_name, "error": error[-1] if error else f"exit status {process.returncode}"}
+
+    # The entry point is the top-level row with its name; rows nested under it are what it imported
+    end = next((i for i in range(len(rows) - 1, -1, -1) if rows[i][0] == 0 and rows[i][1] == module_name), None)
+    if end is None:
+        return {"module": module_name, "error": "no -X importtime entry (already imported at interpreter startup?)"}
+    start = end
+    while start > 0 and rows[start - 1][0] > 0:
+        start -= 1
+    children = [row for row in rows[start:end] if row[0] == 1]
+    imported = {row[1] for row in rows[start:end + 1]}
+    return {
+        "module": module_name,
+        "ms": round(rows[end][3] / 1000, 1),
+        "heaviest": [{"module": name, "ms": round(cumulative / 1000, 1)} for _, name, _, cumulative in sorted(children, key=lambda row: -row[3])[:5]],
+        "heavy_imports": sorted({name.split(".")[0] for name in imported} & set(HEAVY_MODULES)),
+    }
+
+def check_entry_point(module_name, budget_ms=None, repeats=REPEATS):
+    """Best of `repeats` measurements (the first one may compile .pyc files) checked against the budget."""
+    budget_ms = budget_ms or IMPORT_BUDGETS_MS.get(module_name, DEFAULT_BUDGET_MS)
+    results = [measure_import(module_name) for _ in range(repeats)]
+    if any("error" in result for result in results):
+        result = next(result for result in results if "error" in result)
+        return dict(result, budget_ms=budget_ms, problems=[f"import failed: {result['error']}"])
+    result = min(results, key=lambda result: result["ms"])
+    problems = []
+    if result["ms"] > budget_ms:
+        problems.append(f"{result['ms']:.0f} ms is over the {budget_ms} ms budget")
+    unexpected = sorted(set(result["heavy_imports"]) - ALLOWED_HEAVY_MODULES.get(module_name, set()))
+    if unexpected:
+        problems.append(f"imports {', '.join(unexpected)} at startup")
+    return dict(result, budget_ms=budget_ms, problems=problems)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of each entry point and check it against a budget.")
+    parser.add_argument("-modules", nargs="+", default=ENTRY_POINTS, help="Entry points to check (module names).")
+    parser.add_argument("-budget_ms", type=float, help=f"Budget for every module (default: IMPORT_BUDGETS_MS, else {DEFAULT_BUDGET_MS} ms).")
+    parser.add_argument("-repeats", type=int, default=REPEATS, help="Measurements per module; the fastest counts.")
+    parser.add_argument("-json", type=str, help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    results = [check_entry_point(module_name, args.budget_ms, args.repeats) for module_name in args.modules]
+    for result in results:
+        status = "FAIL" if result["problems"] else "ok"
+        timing = f"{result['ms']:8.1f} ms" if "ms" in result else "       - ms"
+        print(f"[{status:4}] {result['module']:45} {timing} (budget {result['budget_ms']:.0f} ms)")
+        for problem in result["problems"]:
+            print(f"         {problem}")
+        for child in result.get("heaviest", [])[:3] if result["problems"] else []:
+            print(f"         {child['ms']:8.1f} ms  {child['module']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+    failures = sum(1 for result in results if result["problems"])
+    print(f"\n{len(results) - failures} of {len(results)} entry points within budget.")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,20 @@
-from diffusers import DiffusionPipeline
-import torch
 from datetime import datetime
 import os
 import argparse
 from PIL import Image
 import random
+from functools import lru_cache
+try:
+    from utilities.run_context_utils import run_path
+    from utilities.tracing_utils import span
+    from utilities.profile_utils import capped_steps
+except ImportError:  # Run as a script from utilities/
+    from run_context_utils import run_path
+    from tracing_utils import span
+    from profile_utils import capped_steps
 
-# Create the ai_generated_characters directory if it doesn't exist
-os.makedirs('ai_generated_characters', exist_ok=True)
+# Folder for generated main characters (inside the run directory when one is active)
+AI_GENERATED_CHARACTERS_PATH = 'ai_generated_characters'
 
 # Define the model ID
 model_id = "digiplay/Photon_v1"
@@ -19,7 +26,7 @@ USE_RANDOM_SEED = True
 SAFETY_CHECKER = False
 
 # Recommended settings and these examples' commonalities
-sampling_steps = 35
+sampling_steps = capped_steps(35)  # MAX_INFERENCE_STEPS (draft profile) caps it
 guidance_scale = 6  # Assuming a middle value; adjust as needed
 
 # Prompts
@@ -28,15 +35,18 @@ female_prompt_template = "portrait photo of {} y.o woman, perfect face, extremel
 negative_prompt = "extra limbs, cross eyes, ugly, (worst quality, low quality, normal quality:2)"
 
 def generate_image(pipeline, prompt, negative_prompt, base_file_name):
+    import torch
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    file_name = f"ai_generated_characters/{base_file_name}_{timestamp}.png"
+    output_dir = run_path(AI_GENERATED_CHARACTERS_PATH)
+    os.makedirs(output_dir, exist_ok=True)
+    file_name = os.path.join(output_dir, f"{base_file_name}_{timestamp}.png")
     
     # Set seed for reproducibility if not using random seed
     seed = random.randint(0, 2**32 - 1) if USE_RANDOM_SEED else 1060
     torch.manual_seed(seed)
 
     # Generate image
-    with torch.no_grad():
+    with torch.no_grad(), span("character.generate", "diffusion", steps=sampling_steps):
         result = pipeline(prompt=prompt, negative_prompt=negative_prompt, num_inference_steps=sampling_steps, guidance_scale=guidance_scale)
 
     # Extract the image
@@ -47,8 +57,11 @@ def generate_image(pipeline, prompt, negative_prompt, base_file_name):
     print(f"Generated and saved: {file_name}")
     return file_name
 
-def create_main_character_image(description="blonde tall beautiful", age=15, gender="female"):
-    # Load the model pipeline
+@lru_cache(maxsize=None)
+def get_pipeline():
+    """Load the portrait pipeline once per process; retries and later runs reuse it."""
+    import torch
+    from diffusers import DiffusionPipeline
     pipeline = DiffusionPipeline.from_pretrained(model_id)
     
     # Disable the safety checker
@@ -56,6 +69,11 @@ def create_main_character_image(description="blonde tall beautiful", age=15, gen
         pipeline.safety_checker = None
         
     pipeline.to('cuda' if torch.cuda.is_available() else 'cpu')  # Use GPU if available
+    return pipeline
+
+def create_main_character_image(description="blonde tall beautiful", age=15, gender="female"):
+    # Load the model pipeline
+    pipeline = get_pipeline()
     
     # Select the appropriate prompt
     if gender.lower() == 'male':
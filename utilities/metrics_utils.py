@@ -0,0 +1,256 @@
+import os
+import sys
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities import run_context_utils, tracing_utils
+except ImportError:  # Run as a script from utilities/
+    import run_context_utils
+    import tracing_utils
+
+# Live throughput metrics for a long-running worker in the Prometheus text format, served at
+# http://<METRICS_HOST>:<port>/metrics.  Nothing is measured until start_metrics_server() runs; then the
+# spans the stages already open (tracing_utils) feed the counters and histograms, whether or not tracing
+# is on: LLM calls per template, images per model, enhance_image and diffusion time, ffmpeg/ffprobe time
+# and chapter encode speed, gTTS requests and stage durations.  Cache lookups (stage cache, narration and
+# segment caches) are counted where they happen and queue depth is read on every scrape.  Every sample is
+# labelled with run_id and stage.
+#   python run_all.py -metrics_port 9464
+#   python queue_worker.py -metrics_port 9464
+#   curl http://127.0.0.1:9464/metrics
+
+METRICS_PORT_ENV = "STORY_METRICS_PORT"
+METRICS_HOST = getattr(gv, 'METRICS_HOST', "127.0.0.1")  # 0.0.0.0 to let a Prometheus server on another host scrape
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+SPEED_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)  # Seconds of video encoded per second
+NO_LABEL = "none"
+
+_stage = contextvars.ContextVar("metrics_stage", default=None)
+_server = None
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}" if pairs else ""
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            lines += [f"{self.name}{_format_labels(key)} {_number(value)}" for key, value in self.values.items()]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.values = {}  # labels -> [per-bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            entry = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, entry in self.values.items():
+                for bound, count in zip(self.buckets, entry):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', _number(bound))])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {entry[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_number(entry[-2])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {entry[-1]}")
+        return lines
+
+STAGE_SECONDS = Histogram("story_stage_duration_seconds", "Wall time of a pipeline stage.")
+STAGE_RUNS = Counter("story_stage_runs_total", "Stage runs by outcome (ok, error).")
+LLM_CALLS = Counter("story_llm_calls_total", "LLM chat requests by prompt template (the function that built the prompt).")
+LLM_SECONDS = Histogram("story_llm_call_duration_seconds", "Duration of an LLM chat request, streaming included.")
+IMAGES = Counter("story_images_generated_total", "Images generated by diffusion model.")
+DIFFUSION_SECONDS = Histogram("story_diffusion_duration_seconds", "Duration of one diffusion call.")
+ENHANCE_SECONDS = Histogram("story_enhance_image_duration_seconds", "Duration of enhance_image (face restore and upscale).")
+SUBPROCESS_SECONDS = Histogram("story_subprocess_duration_seconds", "Duration of an ffmpeg/ffprobe/other subprocess.")
+ENCODE_SPEED = Histogram("story_ffmpeg_encode_speed_ratio", "Seconds of video encoded per wall second (chapter segments).", SPEED_BUCKETS)
+TTS_REQUESTS = Counter("story_tts_requests_total", "gTTS synthesis requests.")
+TTS_SECONDS = Histogram("story_tts_duration_seconds", "Duration of a gTTS synthesis request.")
+CACHE_LOOKUPS = Counter("story_cache_lookups_total", "Cache lookups by cache and result (hit, miss).")
+METRICS = [STAGE_SECONDS, STAGE_RUNS, LLM_CALLS, LLM_SECONDS, IMAGES, DIFFUSION_SECONDS, ENHANCE_SECONDS,
+           SUBPROCESS_SECONDS, ENCODE_SPEED, TTS_REQUESTS, TTS_SECONDS, CACHE_LOOKUPS]
+_collectors = []  # Functions returning extra exposition lines on every scrape (queue depth)
+
+def is_enabled():
+    return _server is not None
+
+def current_stage():
+    """The stage run_all.run_stage() is running, else this script's name."""
+    return _stage.get() or os.path.splitext(os.path.basename(sys.argv[0]))[0] or NO_LABEL
+
+@contextmanager
+def in_stage(name):
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+def _labels(**extra):
+    return dict(extra, run_id=run_context_utils.get_run_id() or NO_LABEL, stage=current_stage())
+
+def count_cache(cache, hit):
+    """Count a lookup in one of the pipeline's caches (no-op until the metrics server runs)."""
+    if _server is not None:
+        CACHE_LOOKUPS.inc(**_labels(cache=cache, result="hit" if hit else "miss"))
+
+def observe_span(span, seconds):
+    """tracing_utils observer: turn a finished span into metric samples."""
+    attributes = span.attributes
+    outcome = "error" if "error" in attributes else "ok"
+    if span.category == "stage":
+        STAGE_SECONDS.observe(seconds, **_labels())
+        STAGE_RUNS.inc(**_labels(outcome=outcome))
+    elif span.category == "llm":
+        template = attributes.get("template", NO_LABEL)
+        LLM_CALLS.inc(**_labels(template=template, model=attributes.get("model", NO_LABEL), outcome=outcome))
+        LLM_SECONDS.observe(seconds, **_labels(template=template))
+    elif span.category == "diffusion":
+        model = attributes.get("model", span.name)
+        if outcome == "ok":
+            IMAGES.inc(attributes.get("images", 1), **_labels(model=model))
+        DIFFUSION_SECONDS.observe(seconds, **_labels(model=model))
+    elif span.name == "enhance_image":
+        ENHANCE_SECONDS.observe(seconds, **_labels())
+    elif span.category == "subprocess":
+        SUBPROCESS_SECONDS.observe(seconds, **_labels(program=span.name))
+    elif span.name == "chapter.segment" and seconds > 0:
+        ENCODE_SPEED.observe(attributes.get("seconds", 0) / seconds, **_labels())
+    elif span.category == "tts":
+        TTS_REQUESTS.inc(**_labels(outcome=outcome))
+        TTS_SECONDS.observe(seconds, **_labels())
+
+def add_collector(collector):
+    """Call collector() on every scrape; it returns exposition lines (e.g. from gauge_lines())."""
+    _collectors.append(collector)
+
+def gauge_lines(name, help_text, samples):
+    """Exposition lines for a gauge from [(labels dict, value)]."""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    return lines + [f"{name}{_format_labels(sorted(labels.items()))} {_number(value)}" for labels, value in samples]
+
+def _cache_hit_ratios():
+    totals = {}
+    for key, value in list(CACHE_LOOKUPS.values.items()):
+        labels = dict(key)
+        group = tuple(sorted((name, value) for name, value in labels.items() if name != "result"))
+        hits, lookups = totals.get(group, (0, 0))
+        totals[group] = (hits + (value if labels["result"] == "hit" else 0), lookups + value)
+    return gauge_lines("story_cache_hit_ratio", "Share of cache lookups that hit, per cache.",
+                       [(dict(group), hits / lookups) for group, (hits, lookups) in totals.items() if lookups])
+
+def render():
+    """The whole exposition text."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    lines += _cache_hit_ratios()
+    for collector in _collectors:
+        try:
+            lines += collector()
+        except Exception as e:  # A broken collector must not take the endpoint down
+            lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {e!r}".replace("\n", " "))
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404, "Only /metrics is served")
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # Scrapes every few seconds would flood the stage output
+        pass
+
+def start_metrics_server(port=None, host=METRICS_HOST):
+    """Serve /metrics on a daemon thread and start measuring; port 0 picks a free port.  Returns the server."""
+    global _server
+    if _server is not None:
+        return _server
+    port = int(port if port is not None else os.environ.get(METRICS_PORT_ENV, 0))
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    _server = server
+    tracing_utils.add_observer(observe_span)
+    print(f"Metrics at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+def queue_depth_collector(queue_url):
+    """Collector reporting the jobs in a work queue by resource class and status."""
+    queue = []  # Opened on the first scrape and reused, so scrapes do not pile up connections
+    lock = threading.Lock()
+
+    def collect():
+        try:
+            from utilities import work_queue_utils
+        except ImportError:  # Run as a script from utilities/
+            import work_queue_utils
+        counts = {}
+        with lock:  # Scrapes may run on several server threads; they share the collector's own connection
+            if not queue:
+                queue.append(work_queue_utils.open_queue(queue_url))
+            jobs = queue[0].jobs()
+        for job in jobs:
+            key = (job["resource"], job["status"])
+            counts[key] = counts.get(key, 0) + 1
+        return gauge_lines("story_queue_jobs", "Jobs in the work queue by resource class and status.",
+                           [({"resource": resource, "status": status}, count) for (resource, status), count in sorted(counts.items())])
+    return collect
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve queue depth metrics for a work queue (the workers serve their own).")
+    parser.add_argument("-port", type=int, default=int(os.environ.get(METRICS_PORT_ENV, 9464)), help="Port to serve /metrics on.")
+    parser.add_argument("-queue", type=str, help="Work queue URL (default: WORK_QUEUE_URL).")
+    args = parser.parse_args()
+    add_collector(queue_depth_collector(args.queue))
+    start_metrics_server(args.port)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
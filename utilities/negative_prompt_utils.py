@@ -0,0 +1,89 @@
+import re
+from functools import lru_cache
+
+# Local replacement for the per-chapter LLM negative prompt.  The output only depends on the
+# chapter text, so identical chapters always produce identical strings (and cache hits).
+
+MAX_NEGATIVE_PROMPT_CHARS = 300  # Same limit the LLM response used to be truncated to
+
+# Always included, in this order
+NEGATIVE_LEXICON = [
+    "nsfw",
+    "nudity",
+    "gore",
+    "blood",
+    "graphic violence",
+    "inappropriate",
+    "extra hands",
+    "extra limbs",
+    "extra fingers",
+    "deformed face",
+    "duplicate heads",
+    "disfigured",
+    "text",
+    "watermark",
+]
+
+# Extra terms added when the chapter text mentions one of the keywords
+KEYWORD_RULES = [
+    (r"\b(battle|fight|fought|war|attack|combat|clash|strike|claws?)\b", ["severed limbs", "wounds", "dead bodies"]),
+    (r"\b(gun|guns|weapon|weapons|rifle|sword|blade|knife|bomb)\b", ["weapon pointed at viewer", "firearms"]),
+    (r"\b(alien|aliens|monster|monsters|creature|creatures|beast)\b", ["horror", "disturbing creature", "grotesque"]),
+    (r"\b(explosion|explode|exploded|fire|flames|burning|destroy|destroyed)\b", ["burn injuries", "charred bodies"]),
+    (r"\b(crowd|crowds|people|citizens|villagers|army|soldiers|friends)\b", ["duplicate faces", "cloned people", "merged bodies"]),
+    (r"\b(ocean|sea|river|lake|swim|swimming|beach|water)\b", ["swimsuit", "drowning"]),
+    (r"\b(night|dark|darkness|shadow|shadows|storm)\b", ["underexposed", "muddy colors"]),
+    (r"\b(kiss|romance|romantic|love|lover)\b", ["suggestive", "sexual content"]),
+    (r"\b(drink|drinks|drunk|bar|tavern|beer|wine|smoke|smoking|cigarette)\b", ["alcohol", "smoking"]),
+    (r"\b(child|children|kid|kids|boy|girl|teen|teenager|young)\b", ["revealing clothing", "adult themes"]),
+]
+COMPILED_KEYWORD_RULES = [(re.compile(pattern, re.IGNORECASE), terms) for pattern, terms in KEYWORD_RULES]
+
+def split_terms(prompt):
+    """Split a comma-separated prompt into trimmed, non-empty terms."""
+    return [term.strip() for term in (prompt or "").split(",") if term.strip()]
+
+def dedupe_terms(terms, exclude=()):
+    """Drop repeated terms (case-insensitive) while keeping the first occurrence's order."""
+    seen = {term.lower() for term in exclude}
+    unique_terms = []
+    for term in terms:
+        key = term.lower()
+        if key not in seen:
+            seen.add(key)
+            unique_terms.append(term)
+    return unique_terms
+
+def join_terms(terms, max_chars=MAX_NEGATIVE_PROMPT_CHARS):
+    """Join terms with ', ', dropping whole terms from the end instead of cutting words in half."""
+    joined = ""
+    for term in terms:
+        candidate = f"{joined}, {term}" if joined else term
+        if len(candidate) > max_chars:
+            break
+        joined = candidate
+    return joined
+
+def detect_keyword_terms(text):
+    """Return the lexicon terms triggered by keywords in the text, in rule order."""
+    terms = []
+    for pattern, rule_terms in COMPILED_KEYWORD_RULES:
+        if pattern.search(text or ""):
+            terms.extend(rule_terms)
+    return terms
+
+@lru_cache(maxsize=1024)
+def build_negative_prompt(chapter_text, max_chars=MAX_NEGATIVE_PROMPT_CHARS):
+    """Compose a deterministic negative prompt from the base lexicon plus terms detected in the chapter."""
+    return join_terms(dedupe_terms(NEGATIVE_LEXICON + detect_keyword_terms(chapter_text)), max_chars)
+
+def merge_negative_prompts(*prompts):
+    """Combine negative prompts (e.g. the model default and the chapter prompt) without repeating terms."""
+    terms = []
+    for prompt in prompts:
+        terms.extend(split_terms(prompt))
+    return ", ".join(dedupe_terms(terms))
+
+if __name__ == "__main__":
+    sample = "Wolverine's claws flash as alien ships attack Helena and the crowd runs for the river."
+    print(build_negative_prompt(sample))
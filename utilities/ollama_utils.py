@@ -7,12 +7,22 @@ import requests
 import time
 import socket
 
+try:
+    from utilities.tracing_utils import span
+except ImportError:  # Run as a script from utilities/
+    from tracing_utils import span
+
 OLLAMA_EXE_PATH = os.path.join(os.getcwd(), "ollama.exe")
+if platform.system() != "Windows":
+    OLLAMA_EXE_PATH = shutil.which("ollama") or OLLAMA_EXE_PATH
 OLLAMA_RUNNERS_DIR = os.path.join(os.getcwd(), "ollama", "ollama_runners")
 OLLAMA_TEMP_DIR = os.path.join(os.getcwd(), "ollama_temp")
 OLLAMA_ZIP_PATH = os.path.join(os.getcwd(), "ollama-windows.zip")
 OLLAMA_PROCESS = None
 OLLAMA_PORT = 11434  # Define the port used by Ollama
+# Set to "1" by run_scheduler.py: other pipeline workers use the GPU and the Ollama server at the same time,
+# so stages must not kill GPU processes or stop the server between stages
+SHARED_GPU_ENV = "STORY_SHARED_GPU"
 
 DEFAULT_MODELS_DIR = os.path.join(os.path.expanduser("~"), ".ollama", "models")
 
@@ -20,6 +30,10 @@ def is_windows():
     """Check if the current OS is Windows."""
     return platform.system() == "Windows"
 
+def is_gpu_shared():
+    """True when this stage shares the GPU and Ollama with other concurrently running workers."""
+    return os.environ.get(SHARED_GPU_ENV) == "1"
+
 def is_ollama_installed(ollama_path):
     """Check if the Ollama executable is available."""
     return os.path.isfile(ollama_path)
@@ -83,6 +97,8 @@ def install_ollama_pkg():
 
 def kill_existing_ollama_service():
     """Kill any existing Ollama service instances to free up the port."""
+    if is_gpu_shared():
+        return  # Other workers may be in the middle of a request
     for process in psutil.process_iter(['pid', 'name', 'username']):
         try:
             if process.info['name'] == 'ollama.exe' and process.info['username'] == os.getlogin():
@@ -102,11 +118,17 @@ def kill_existing_ollama_service():
 
 def clear_gpu_memory():
     """Clear the GPU memory by killing processes using GPU."""
+    if is_gpu_shared():
+        print("GPU is shared with other pipeline workers; not clearing GPU memory.")
+        return
     try:
         result = subprocess.run(["nvidia-smi", "--query-compute-apps=pid", "--format=csv,noheader"], capture_output=True, text=True, check=True)
         pids = result.stdout.strip().split("\n")
         for pid in pids:
             if pid:
+                # Never terminate ourselves when stages run in-process (run_all.py) and hold the GPU
+                if int(pid) == os.getpid():
+                    continue
                 try:
                     proc = psutil.Process(int(pid))
                     if proc.username() == os.getlogin():
@@ -116,7 +138,7 @@ def clear_gpu_memory():
                     print(f"Skipping PID {pid}: {e}")
 
         # Additional checks to ensure processes are terminated
-        remaining_pids = [pid for pid in pids if psutil.pid_exists(int(pid))]
+        remaining_pids = [pid for pid in pids if pid and int(pid) != os.getpid() and psutil.pid_exists(int(pid))]
         for pid in remaining_pids:
             try:
                 proc = psutil.Process(int(pid))
@@ -134,7 +156,7 @@ def is_port_in_use(port):
         return s.connect_ex(('127.0.0.1', port)) == 0
 
 def start_ollama_service_windows():
-    """Start Ollama service on Windows."""
+    """Start Ollama service (the same `ollama serve` launch also works outside Windows)."""
     global OLLAMA_PROCESS
     print("Starting Ollama service...")
 
@@ -159,9 +181,11 @@ def start_ollama_service_windows():
     print("Failed to start Ollama service. Please check and try again.")
     return False
 
-def stop_ollama_service():
-    """Stop Ollama service if it was started by this script."""
+def stop_ollama_service(force=False):
+    """Stop Ollama service if it was started by this script (with a shared GPU only when forced, e.g. at exit)."""
     global OLLAMA_PROCESS
+    if is_gpu_shared() and not force:
+        return
     if OLLAMA_PROCESS is not None:
         OLLAMA_PROCESS.terminate()
         OLLAMA_PROCESS.wait()
@@ -182,6 +206,7 @@ def install_and_setup_ollama(model_name):
     if is_windows():
         kill_existing_ollama_service()  # Ensure no leftover processes are running
 
+    if is_windows() or not is_port_in_use(OLLAMA_PORT):
         if not start_ollama_service_windows():
             print("Error: Failed to start Ollama service. Exiting.")
             return
@@ -200,13 +225,19 @@ def install_and_setup_ollama(model_name):
             print(f"Unexpected error occurred: {e}")
             raise
 
-def get_story_response_from_model(model_name, user_message):
-    """Get response content from the model specifically for story writing."""
+def get_story_response_from_model(model_name, user_message, template=None):
+    """Get response content from the model specifically for story writing.  template labels the call in
+    traces and metrics; callers pass the name of the prompt template they filled in."""
+    template = template or "unlabelled"
     user_messages = [{'role': 'user', 'content': user_message}]
     import ollama
     try:
-        responses = ollama.chat(model=model_name, messages=user_messages, stream=True)
-        return ''.join(chunk['message']['content'] for chunk in responses if 'message' in chunk and 'content' in chunk['message'])
+        with span("llm.chat", "llm", model=model_name, template=template, prompt_chars=len(user_message)) as current:
+            responses = ollama.chat(model=model_name, messages=user_messages, stream=True)
+            response = ''.join(chunk['message']['content'] for chunk in responses if 'message' in chunk and 'content' in chunk['message'])
+            if current is not None:
+                current.set("response_chars", len(response))
+            return response
     except Exception as e:
         print(f"An error occurred while retrieving the model's response: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,153 @@
+import os
+import sys
+import shutil
+import argparse
+
+# Named quality profiles layered on GLOBAL_VARIABLES.  "final" keeps the values in GLOBAL_VARIABLES.py;
+# "draft" trades quality for speed while iterating on a story: fewer diffusion steps, smaller images,
+# fewer chapters, no enhancement pass, no comparison images, no zoompan and a fast, lossy x264 encode.
+# GLOBAL_VARIABLES.py applies the active profile (STORY_QUALITY_PROFILE, else QUALITY_PROFILE) as its
+# last step, so every stage reads the profile's values through GLOBAL_VARIABLES as usual.
+#
+# The run index records the profile that produced each artifact and the story JSON the profile of each
+# chapter image, so a draft can be promoted to a final render (stages 4-9) without redoing the LLM stages:
+#   python run_all.py -promote <run_id>
+#   python utilities/profile_utils.py -run_id <run_id>     # show which profile produced what
+
+PROFILE_ENV = "STORY_QUALITY_PROFILE"
+DEFAULT_PROFILE = "final"
+PROFILES = {
+    "final": {},
+    "draft": {
+        "NUMBER_OF_STEPS": 10,
+        "MAX_INFERENCE_STEPS": 12,  # Caps the pipelines with their own step counts (SDXL in 4b, the character generator)
+        "DEFAULT_WIDTH": 384,
+        "DEFAULT_HEIGHT": 512,
+        "NUMBER_OF_CHAPTERS_PER_STORY": 4,
+        "ENHANCE_IMAGES": False,
+        "ADD_COMPARISONS_TO_ENHANCED_VS_GENERATED": False,
+        "ZOOMPAN_ENABLED": False,
+        "FFMPEG_PRESET": "ultrafast",
+        "FFMPEG_CRF": 30,
+    },
+}
+# Stages a promotion reruns; stages 1-3 (the LLM work) are kept
+PROMOTE_STAGES = ["4_create_images_from_ai_prompts", "5_create_movie", "6_create_mosaic", "7_zoompan_movie",
+                  "8_add_ffmpeg_subtitles", "9_create_voiceover"]
+DRAFTS_FOLDER = "drafts"
+IMAGE_KEY_PREFIX = "chapter_image_location_"
+IMAGE_PROFILE_PREFIX = "chapter_image_profile_"
+
+def requested_profile(config=None):
+    """The profile asked for by STORY_QUALITY_PROFILE, else config['QUALITY_PROFILE'], else 'final'."""
+    return os.environ.get(PROFILE_ENV) or (config or {}).get("QUALITY_PROFILE") or DEFAULT_PROFILE
+
+def apply_profile(config, name=None):
+    """Overlay a profile on a GLOBAL_VARIABLES namespace (its globals() or vars()); returns the profile name.
+
+    The values the profiles override are remembered on first use, so switching back to 'final' restores them.
+    """
+    name = name or requested_profile(config)
+    if name not in PROFILES:
+        raise ValueError(f"Unknown quality profile '{name}' (choose from {', '.join(PROFILES)})")
+    base = config.setdefault("_PROFILE_BASE", {})
+    for profile in PROFILES.values():
+        for key in profile:
+            if key not in base:
+                base[key] = config.get(key)
+    config.update(base)
+    config.update(PROFILES[name])
+    config["QUALITY_PROFILE"] = name
+    return name
+
+def use_profile(name):
+    """Switch this process (and the processes it starts) to a profile; call before the stages are imported."""
+    import GLOBAL_VARIABLES
+    os.environ[PROFILE_ENV] = name
+    return apply_profile(vars(GLOBAL_VARIABLES), name)
+
+def active_profile():
+    try:
+        import GLOBAL_VARIABLES
+    except ImportError:
+        return requested_profile()
+    return getattr(GLOBAL_VARIABLES, 'QUALITY_PROFILE', DEFAULT_PROFILE)
+
+def ffmpeg_quality_args(default_preset=None):
+    """x264 '-preset'/'-crf' arguments for the active profile; a stage's own default preset applies under 'final'."""
+    try:
+        import GLOBAL_VARIABLES as gv
+    except ImportError:
+        gv = None
+    preset = getattr(gv, 'FFMPEG_PRESET', None) or default_preset
+    crf = getattr(gv, 'FFMPEG_CRF', None)
+    args = ['-preset', preset] if preset else []
+    if crf is not None:
+        args += ['-crf', str(crf)]
+    return args
+
+def capped_steps(steps):
+    """A pipeline's own step count, capped by the active profile's MAX_INFERENCE_STEPS."""
+    try:
+        import GLOBAL_VARIABLES as gv
+    except ImportError:
+        return steps
+    cap = getattr(gv, 'MAX_INFERENCE_STEPS', None)
+    return min(steps, cap) if cap else steps
+
+def image_profile_key(image_key):
+    return IMAGE_PROFILE_PREFIX + image_key[len(IMAGE_KEY_PREFIX):]
+
+def has_current_image(chapter, image_key):
+    """True when the chapter already has an image for image_key rendered with the active profile (resume)."""
+    existing_image = chapter.get(image_key)
+    if not existing_image or not os.path.exists(existing_image):
+        return False
+    return chapter.get(image_profile_key(image_key), DEFAULT_PROFILE) == active_profile()
+
+def record_image(journal, index, image_key, image_path):
+    """Journal a chapter image together with the profile that rendered it."""
+    journal.set(['story_chapters', index, image_key], image_path)
+    journal.set(['story_chapters', index, image_profile_key(image_key)], active_profile())
+
+def set_aside_draft_outputs(run_id):
+    """Move a run's rendered videos into drafts/ so the stages that process every video in created_videos skip them."""
+    try:
+        from utilities import run_index_utils, run_context_utils
+    except ImportError:  # Run as a script from utilities/
+        import run_index_utils
+        import run_context_utils
+    drafts_folder = run_context_utils.run_path(DRAFTS_FOLDER)
+    moved = []
+    for kind, path in run_index_utils.get_artifacts("video_", run_id).items():
+        if os.path.exists(path):
+            os.makedirs(drafts_folder, exist_ok=True)
+            destination = os.path.join(drafts_folder, os.path.basename(path))
+            shutil.move(path, destination)
+            run_index_utils.record_artifact(kind, destination, stage="promote", run_id=run_id,
+                                            profile=run_index_utils.get_artifact_profile(kind, run_id))
+            moved.append(destination)
+    return moved
+
+def describe_run(run_id):
+    """[(kind, profile, path)] for every artifact the run index has for the run."""
+    try:
+        from utilities import run_index_utils
+    except ImportError:  # Run as a script from utilities/
+        import run_index_utils
+    rows = run_index_utils.get_connection().execute(
+        "SELECT kind, profile, path FROM artifacts WHERE run_id = ? ORDER BY created_at", (run_id,)).fetchall()
+    return [(kind, profile or DEFAULT_PROFILE, path) for kind, profile, path in rows]
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser = argparse.ArgumentParser(description="Show the quality profiles or which profile produced a run's artifacts.")
+    parser.add_argument("-run_id", type=str, help="Run whose artifacts to list.")
+    args = parser.parse_args()
+    if args.run_id:
+        for kind, profile, path in describe_run(args.run_id):
+            print(f"{kind:40} {profile:8} {path}")
+    else:
+        print(f"Active profile: {active_profile()}")
+        for name, overrides in PROFILES.items():
+            print(f"{name}: " + (", ".join(f"{key}={value}" for key, value in overrides.items()) or "GLOBAL_VARIABLES.py as is"))
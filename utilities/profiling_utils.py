@@ -0,0 +1,169 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Function-level profiles of a stage without editing it.  Every stage script takes -profile [sample|cprofile]
+# (run_main() strips it before the stage parses its own arguments); run_all.py, run_scheduler.py and
+# queue_worker.py take it too and profile each stage they run.  STORY_PROFILE carries the mode to child
+# processes.  Each profiled stage writes two files to profiles/:
+#   <stage>_<timestamp>_<pid>.collapsed  one "frame;frame;frame count" line per stack (flamegraph.pl, speedscope,
+#                                        https://www.speedscope.app or inferno read it)
+#   <stage>_<timestamp>_<pid>.txt        the top PROFILE_TOP_N functions by own and cumulative time
+# "sample" (the default) is a stack sampler thread reading sys._current_frames() every PROFILE_SAMPLE_INTERVAL
+# seconds; it sees every thread at a small fixed cost.  "cprofile" traces every call of the main thread (exact
+# call counts, more overhead) and is used where the sampler is unavailable.  Without -profile nothing runs.
+#   python 4_create_images_from_ai_prompts.py -profile
+#   python run_all.py -profile cprofile -stages 5_create_movie
+
+PROFILE_ENV = "STORY_PROFILE"
+PROFILE_MODES = ["sample", "cprofile"]
+PROFILES_FOLDER = "profiles"
+PROFILE_SAMPLE_INTERVAL = getattr(gv, 'PROFILE_SAMPLE_INTERVAL', 0.005)  # Seconds between stack samples
+PROFILE_TOP_N = getattr(gv, 'PROFILE_TOP_N', 25)
+
+_active = threading.Lock()  # Held while a profile is recording; nested profiled() blocks are no-ops
+
+def enable(mode="sample"):
+    """Profile the stages of this process and of the processes it starts."""
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode '{mode}' (choose from {', '.join(PROFILE_MODES)})")
+    os.environ[PROFILE_ENV] = mode
+
+def profile_mode():
+    """The enabled mode, or None when profiling is off."""
+    mode = os.environ.get(PROFILE_ENV)
+    if mode == "sample" and not hasattr(sys, "_current_frames"):
+        return "cprofile"
+    return mode if mode in PROFILE_MODES else None
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+class StackSampler:
+    """Counts the call stacks of every thread (except its own) at a fixed interval."""
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+def collapsed_from_cprofile(profiler):
+    """caller;callee lines weighted by microseconds of the callee's own time (cProfile keeps no deeper stacks)."""
+    import pstats
+    stacks = Counter()
+    for (filename, line, name), (_, _, own_time, _, callers) in pstats.Stats(profiler).stats.items():
+        callee = f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+        if not callers:
+            stacks[callee] += int(own_time * 1e6)
+        for (caller_file, caller_line, caller_name), caller_stats in callers.items():
+            caller = f"{caller_name} ({os.path.basename(caller_file)}:{caller_line})".replace(";", ":")
+            stacks[f"{caller};{callee}"] += int(caller_stats[2] * 1e6)
+    return stacks
+
+def top_functions(stacks, top_n=PROFILE_TOP_N):
+    """[(function, own weight, cumulative weight)] sorted by own weight, from collapsed stacks."""
+    own = Counter()
+    cumulative = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            cumulative[frame] += count
+    return [(frame, weight, cumulative[frame]) for frame, weight in own.most_common(top_n)]
+
+def write_profile(label, stacks, mode, seconds, top_n=PROFILE_TOP_N):
+    """Write <label>_<timestamp>_<pid>.collapsed and .txt to profiles/; returns the .collapsed path."""
+    os.makedirs(PROFILES_FOLDER, exist_ok=True)
+    base = os.path.join(PROFILES_FOLDER, f"{label}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.getpid()}")
+    with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            if count:
+                f.write(f"{stack} {count}\n")
+
+    total = sum(stacks.values()) or 1
+    unit = "samples" if mode == "sample" else "µs"
+    with open(f"{base}.txt", "w", encoding="utf-8") as f:
+        f.write(f"{label}: {seconds:.2f} s, {mode} profile, {sum(stacks.values())} {unit}\n\n")
+        f.write(f"{'own %':>7} {'cum %':>7}  function\n")
+        for frame, own_weight, cumulative_weight in top_functions(stacks, top_n):
+            f.write(f"{own_weight / total:7.1%} {cumulative_weight / total:7.1%}  {frame}\n")
+    return f"{base}.collapsed"
+
+@contextmanager
+def profiled(label):
+    """Profile the block when profiling is enabled (and no outer block is already recording)."""
+    mode = profile_mode()
+    if not mode or not _active.acquire(blocking=False):
+        yield
+        return
+    start = time.perf_counter()
+    if mode == "sample":
+        profiler = StackSampler().start()
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if mode == "sample":
+            profiler.stop()
+            stacks = profiler.stacks
+        else:
+            profiler.disable()
+            stacks = collapsed_from_cprofile(profiler)
+        _active.release()
+        collapsed_file = write_profile(label, stacks, mode, time.perf_counter() - start)
+        print(f"Profile written to {collapsed_file} (top functions in {os.path.splitext(collapsed_file)[0]}.txt)")
+
+def pop_profile_argument(argv):
+    """Remove '-profile [mode]' from an argument list; returns the mode (None when absent)."""
+    if "-profile" not in argv:
+        return None
+    position = argv.index("-profile")
+    del argv[position]
+    if position < len(argv) and argv[position] in PROFILE_MODES:
+        return argv.pop(position)
+    return "sample"
+
+def run_main(main, label=None):
+    """Entry point of a stage script: honour -profile, then run main() (profiled when enabled)."""
+    mode = pop_profile_argument(sys.argv)
+    if mode:
+        enable(mode)
+    label = label or os.path.splitext(os.path.basename(sys.argv[0]))[0]
+    with profiled(label):
+        return main()
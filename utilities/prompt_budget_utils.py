@@ -0,0 +1,352 @@
+import os
+import re
+import ast
+import sys
+import json
+import time
+import string
+import argparse
+import statistics
+
+# Adjust the sys.path to include the parent directory for GLOBAL_VARIABLES and the stage scripts
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(BASE_DIR)
+
+from utilities.fake_ollama_server import count_tokens, start_fake_server, DEFAULT_PORT
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:  # A dummy class to act as a placeholder for missing GLOBAL_VARIABLES
+        GLOBAL_MODEL_NAME = 'llama3'
+        NUMBER_OF_CHAPTERS_PER_STORY = 8
+
+MODEL_NAME = getattr(gv, 'GLOBAL_MODEL_NAME', 'llama3')
+CHAPTERS_PER_STORY = getattr(gv, 'NUMBER_OF_CHAPTERS_PER_STORY', 8)
+USE_LLM_NEGATIVE_PROMPTS = getattr(gv, 'USE_LLM_NEGATIVE_PROMPTS', False)
+SYNOPSIS_MODE = getattr(gv, 'SYNOPSIS_MODE', 'auto')
+# As in 2_build_out_chapters.py (not imported: importing a stage script starts its services)
+HIERARCHICAL_SYNOPSIS_MIN_CHAPTERS = 16
+SYNOPSIS_GROUP_SIZE = 4
+
+# Stage scripts whose module-level prompt templates are analyzed.  Templates are read
+# with ast so the stage scripts (which start services and archive folders) never execute.
+TEMPLATE_SOURCES = [
+    "1_dream_up_a_story.py",
+    "2_build_out_chapters.py",
+    "3_summarize_chapters_add_ai_prompts.py",
+]
+TEMPLATE_NAME_PATTERN = re.compile(r".*_(TEMPLATE|PROMPT)$")
+
+def use_hierarchical_synopsis(chapters):
+    """Whether stage 2 builds the synopsis from a map-reduce summary (SYNOPSIS_MODE and the auto threshold)."""
+    if SYNOPSIS_MODE == "hierarchical":
+        return True
+    return SYNOPSIS_MODE == "auto" and chapters >= HIERARCHICAL_SYNOPSIS_MIN_CHAPTERS
+
+def synopsis_group_calls(chapters):
+    """Chapter group summaries in the map step of the hierarchical synopsis."""
+    return -(-chapters // SYNOPSIS_GROUP_SIZE) if use_hierarchical_synopsis(chapters) else 0
+
+def synopsis_merge_calls(chapters):
+    """Merge calls in the reduce steps; a group of one summary is passed up without a call."""
+    level, calls = synopsis_group_calls(chapters), 0
+    while level > 1:
+        calls += level // SYNOPSIS_GROUP_SIZE + (1 if level % SYNOPSIS_GROUP_SIZE > 1 else 0)
+        level = -(-level // SYNOPSIS_GROUP_SIZE)
+    return calls
+
+# How many times each template is sent per story, as a function of the chapter count.
+# Stage 3 also summarizes the initial prompt, hence chapters + 1.
+CALLS_PER_STORY = {
+    "1_dream_up_a_story:STORYLINE_TEMPLATE": lambda chapters: 1,
+    "1_dream_up_a_story:INITIAL_PROMPT_TEMPLATE": lambda chapters: 1,
+    "1_dream_up_a_story:AUTHOR_TEMPLATE": lambda chapters: 1,
+    "1_dream_up_a_story:MOVIE_TYPE_PROMPT": lambda chapters: 1,
+    "2_build_out_chapters:USER_MESSAGE_TEMPLATE": lambda chapters: chapters,
+    "2_build_out_chapters:SUMMARY_UPDATE_TEMPLATE": lambda chapters: chapters,
+    "2_build_out_chapters:COMPLETE_SYNOPSIS_TEMPLATE": lambda chapters: 1,  # Made in both modes, from sampled lines or the hierarchical summary
+    "2_build_out_chapters:CHAPTER_GROUP_SUMMARY_TEMPLATE": synopsis_group_calls,
+    "2_build_out_chapters:SUMMARY_MERGE_TEMPLATE": synopsis_merge_calls,
+    "2_build_out_chapters:CHARACTER_DESCRIPTION_TEMPLATE": lambda chapters: 2,
+    "2_build_out_chapters:MAIN_CHARACTER_GENDER_TEMPLATE": lambda chapters: 2,
+    "2_build_out_chapters:MOVIE_TITLE_TEMPLATE": lambda chapters: 1,
+    "3_summarize_chapters_add_ai_prompts:SUMMARY_REQUEST_TEMPLATE": lambda chapters: chapters + 1,
+    "3_summarize_chapters_add_ai_prompts:CHAPTER_REQUEST_TEMPLATE": lambda chapters: chapters + 1,
+    "3_summarize_chapters_add_ai_prompts:POSITIVE_AI_PROMPT_TEMPLATE": lambda chapters: chapters + 1,
+    "3_summarize_chapters_add_ai_prompts:NEGATIVE_AI_PROMPT_TEMPLATE": lambda chapters: chapters + 1 if USE_LLM_NEGATIVE_PROMPTS else 0,
+    "3_summarize_chapters_add_ai_prompts:KEYWORDS_REQUEST_TEMPLATE": lambda chapters: 1,
+}
+
+# Compressed variants keep every placeholder of the original but drop repeated instructions
+# and example lists.  Compare them with -compare before switching a stage over.
+COMPRESSED_TEMPLATES = {
+    "1_dream_up_a_story:STORYLINE_TEMPLATE": (
+        "One-sentence storyline naming the main character. Character: {main_character}, {gender}, {age}, {nationality}, "
+        "from {place}. Superpower: {superpower}. Description: {main_character_description}. Theme: {theme}. Genre: {movie_type}."
+    ),
+    "1_dream_up_a_story:INITIAL_PROMPT_TEMPLATE": (
+        "Write one sentence that opens this story without spoiling it: \"{storyline}\". Main character: {main_character} ({gender}). "
+        "Reply with the sentence only."
+    ),
+    "1_dream_up_a_story:AUTHOR_TEMPLATE": (
+        "Name one author or director known for stories like '{storyline}' with a '{tone}' tone, plus their best-known work. Reply with that only."
+    ),
+    "2_build_out_chapters:USER_MESSAGE_TEMPLATE": (
+        "Continue this story in the style of {persona}, tone '{tone}'. Main character: {main_character_name}, {main_character_description}; "
+        "weave in their superpower ({main_character_superpower}) positively. Story so far: {current_story}. Summary: {summary}. "
+        "{phase_instructions} End with {ending}. Reply with 3-5 sentences, max 150 words, no quotes."
+    ),
+    "2_build_out_chapters:SUMMARY_UPDATE_TEMPLATE": (
+        "Summary: \"{current_summary}\". New text: \"{latest_addition}\". Update the summary only if the new text adds value; "
+        "max 5 sentences, 750 characters. Reply with the summary only."
+    ),
+    "2_build_out_chapters:COMPLETE_SYNOPSIS_TEMPLATE": (
+        "Story excerpts: \"{selected_lines}\". Summary: \"{summary}\". Write a book-cover synopsis, 6-7 sentences, under 900 characters. "
+        "Reply with the synopsis only."
+    ),
+    "2_build_out_chapters:CHARACTER_DESCRIPTION_TEMPLATE": (
+        "Describe the main character in at most 250 characters. Synopsis: {complete_synopsis}. Opening: {initial_prompt}. "
+        "Reply with the description only."
+    ),
+    "2_build_out_chapters:MAIN_CHARACTER_GENDER_TEMPLATE": (
+        "Main character: \"{character_description}\". Reply with one word: male or female."
+    ),
+    "2_build_out_chapters:MOVIE_TITLE_TEMPLATE": (
+        "Summary: \"{summary}\". Character: \"{character_description}\". Reply with a captivating movie title only."
+    ),
+    "3_summarize_chapters_add_ai_prompts:SUMMARY_REQUEST_TEMPLATE": (
+        "Synopsis: \"{synopsis}\". Previous chapter: \"{preceding_chapter_summary}\". Summarize this chapter in one sentence of "
+        "at most 15 words for teens: \"{line}\". Reply with the sentence only."
+    ),
+    "3_summarize_chapters_add_ai_prompts:CHAPTER_REQUEST_TEMPLATE": (
+        "Comma-separated list, max 15 words and 100 characters, summarizing: \"{line}\". Reply with the list only."
+    ),
+    "3_summarize_chapters_add_ai_prompts:POSITIVE_AI_PROMPT_TEMPLATE": (
+        "Comma-separated visual descriptors (max 20 words, 100 characters) for this scene, mentioning the main character: \"{line}\". "
+        "Reply with the list only."
+    ),
+    "3_summarize_chapters_add_ai_prompts:NEGATIVE_AI_PROMPT_TEMPLATE": (
+        "Comma-separated list of things a family-friendly image of this scene must not show: \"{line}\". Reply with the list only."
+    ),
+    "3_summarize_chapters_add_ai_prompts:KEYWORDS_REQUEST_TEMPLATE": (
+        "Up to 10 sfw comma-separated keywords for: \"{summary}\". Include 'kumori'. Reply with the keywords only."
+    ),
+}
+
+# Word counts used to build representative inputs for each placeholder
+SAMPLE_INPUT_WORDS = {
+    "current_story": 300,
+    "summary": 120,
+    "current_summary": 120,
+    "latest_addition": 100,
+    "selected_lines": 800,
+    "complete_synopsis": 140,
+    "line": 100,
+    "synopsis": 30,
+    "storyline": 30,
+    "initial_prompt": 30,
+    "preceding_chapter_summary": 15,
+    "main_character_description": 40,
+    "character_description": 40,
+    "phase_instructions": 15,
+}
+DEFAULT_SAMPLE_WORDS = 3
+SAMPLE_TEXT = (
+    "Wolverine walks the quiet streets of Helena while alien ships hover over the mountains and "
+    "the people look to him for courage as the storm gathers above the river"
+).split()
+
+def _evaluate_string_expression(node, names):
+    """Evaluate a string expression built from constants, names and + without executing code."""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Name) and node.id in names:
+        return names[node.id]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _evaluate_string_expression(node.left, names)
+        right = _evaluate_string_expression(node.right, names)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+def load_templates(sources=TEMPLATE_SOURCES):
+    """Return {"<stage>:<NAME>": template} for every module-level prompt template in the stage scripts."""
+    templates = {}
+    for source in sources:
+        stage = os.path.splitext(source)[0]
+        with open(os.path.join(BASE_DIR, source), 'r', encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=source)
+        names = {}
+        for node in tree.body:
+            if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+                continue
+            value = _evaluate_string_expression(node.value, names)
+            if value is None:
+                continue
+            name = node.targets[0].id
+            names[name] = value
+            if TEMPLATE_NAME_PATTERN.match(name):
+                templates[f"{stage}:{name}"] = value
+    return templates
+
+def get_placeholders(template):
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field}
+
+def build_sample_inputs(template, story_data=None):
+    """Fill every placeholder with representative text, preferring values from a real story file."""
+    story_values = {}
+    if story_data:
+        chapters = [c["chapter"] if isinstance(c, dict) else c for c in story_data.get("story_chapters", [])]
+        story_values = {
+            "current_story": " ".join(chapters[-3:]),
+            "selected_lines": " ".join(chapters[:8]),
+            "line": chapters[-1] if chapters else "",
+            "latest_addition": chapters[-1] if chapters else "",
+            "summary": story_data.get("story_summary", ""),
+            "current_summary": story_data.get("story_summary", ""),
+            "complete_synopsis": story_data.get("complete_synopsis", ""),
+            "synopsis": story_data.get("initial_prompt", ""),
+            "initial_prompt": story_data.get("initial_prompt", ""),
+            "storyline": story_data.get("storyline", ""),
+            "main_character_description": story_data.get("main_character_description", ""),
+            "character_description": story_data.get("main_character_description", ""),
+            "main_character_name": story_data.get("main_character", ""),
+            "main_character": story_data.get("main_character", ""),
+            "persona": story_data.get("author", ""),
+        }
+
+    inputs = {}
+    for field in get_placeholders(template):
+        if story_values.get(field):
+            inputs[field] = story_values[field]
+            continue
+        word_count = SAMPLE_INPUT_WORDS.get(field, DEFAULT_SAMPLE_WORDS)
+        inputs[field] = " ".join(SAMPLE_TEXT[i % len(SAMPLE_TEXT)] for i in range(word_count))
+    return inputs
+
+def get_tokenizer(tokenizer_name=None):
+    """Return a token counting function; a Hugging Face tokenizer is used when a name is given."""
+    if not tokenizer_name:
+        return count_tokens
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+def analyze_templates(templates, chapters=CHAPTERS_PER_STORY, story_data=None, tokenizer=count_tokens):
+    """Tokenize every template with representative inputs and compute per-call and per-story token counts."""
+    rows = []
+    for key, template in sorted(templates.items()):
+        prompt = template.format(**build_sample_inputs(template, story_data))
+        calls = CALLS_PER_STORY.get(key, lambda n: 1)(chapters)
+        row = {
+            "template": key,
+            "template_tokens": tokenizer(template),
+            "tokens_per_call": tokenizer(prompt),
+            "calls_per_story": calls,
+        }
+        row["tokens_per_story"] = row["tokens_per_call"] * calls
+
+        compressed = COMPRESSED_TEMPLATES.get(key)
+        if compressed:
+            if get_placeholders(compressed) != get_placeholders(template):
+                print(f"[WARNING] Compressed variant of {key} has different placeholders than the original.")
+            compressed_prompt = compressed.format(**build_sample_inputs(compressed, story_data))
+            row["compressed_tokens_per_call"] = tokenizer(compressed_prompt)
+            row["compressed_tokens_per_story"] = row["compressed_tokens_per_call"] * calls
+        rows.append(row)
+    return rows
+
+def print_token_report(rows, chapters):
+    print(f"\n=== PROMPT TOKEN BUDGET ({chapters} chapters per story) ===")
+    print(f"{'template':<62} {'tok/call':>9} {'calls':>6} {'tok/story':>10} {'compressed':>11} {'saved':>7}")
+    total, total_compressed = 0, 0
+    for row in rows:
+        compressed = row.get("compressed_tokens_per_story", row["tokens_per_story"])
+        saved = 1 - compressed / row["tokens_per_story"] if row["tokens_per_story"] else 0
+        total += row["tokens_per_story"]
+        total_compressed += compressed
+        compressed_label = str(row.get("compressed_tokens_per_call", "-"))
+        print(f"{row['template']:<62} {row['tokens_per_call']:>9} {row['calls_per_story']:>6} {row['tokens_per_story']:>10} {compressed_label:>11} {saved:>6.0%}")
+    saved_total = 1 - total_compressed / total if total else 0
+    print(f"{'TOTAL':<62} {'':>9} {'':>6} {total:>10} {total_compressed:>11} {saved_total:>6.0%}")
+
+def compare_against_server(templates, model_name, samples=3, story_data=None):
+    """Send the original and compressed variant of each template and record latency and output length."""
+    from utilities.ollama_utils import get_story_response_from_model
+
+    results = []
+    for key, compressed in sorted(COMPRESSED_TEMPLATES.items()):
+        if key not in templates:
+            continue
+        row = {"template": key}
+        for label, template in (("original", templates[key]), ("compressed", compressed)):
+            prompt = template.format(**build_sample_inputs(template, story_data))
+            latencies, output_chars, output_words = [], [], []
+            for _ in range(samples):
+                start = time.perf_counter()
+                response = get_story_response_from_model(model_name, prompt, template=f"{key}.{label}") or ""
+                latencies.append(time.perf_counter() - start)
+                output_chars.append(len(response))
+                output_words.append(len(response.split()))
+            row[label] = {
+                "latency_mean_seconds": statistics.mean(latencies),
+                "latency_stdev_seconds": statistics.stdev(latencies) if len(latencies) > 1 else 0.0,
+                "output_chars_mean": statistics.mean(output_chars),
+                "output_words_mean": statistics.mean(output_words),
+            }
+        results.append(row)
+    return results
+
+def print_comparison_report(results):
+    print("\n=== ORIGINAL vs COMPRESSED (mean over samples) ===")
+    print(f"{'template':<62} {'lat orig':>9} {'lat comp':>9} {'speedup':>8} {'chars orig':>11} {'chars comp':>11}")
+    for row in results:
+        original, compressed = row["original"], row["compressed"]
+        speedup = original["latency_mean_seconds"] / compressed["latency_mean_seconds"] if compressed["latency_mean_seconds"] else 0
+        print(f"{row['template']:<62} {original['latency_mean_seconds']:>8.2f}s {compressed['latency_mean_seconds']:>8.2f}s "
+              f"{speedup:>7.2f}x {original['output_chars_mean']:>11.0f} {compressed['output_chars_mean']:>11.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Report prompt token usage per call and per story, and compare compressed templates.")
+    parser.add_argument("-chapters", type=int, default=CHAPTERS_PER_STORY, help="Chapters per story used for the per-story totals.")
+    parser.add_argument("-story", type=str, help="Optional story JSON to take representative inputs from.")
+    parser.add_argument("-tokenizer", type=str, help="Optional Hugging Face tokenizer name; defaults to a built-in approximation.")
+    parser.add_argument("-compare", action="store_true", help="Send original and compressed templates to the server and compare.")
+    parser.add_argument("-samples", type=int, default=3, help="Calls per template variant when comparing.")
+    parser.add_argument("-host", type=str, help="Ollama host to compare against (sets OLLAMA_HOST).")
+    parser.add_argument("-fake_server", action="store_true", help="Compare against the built-in fake Ollama server.")
+    parser.add_argument("-output", type=str, help="Write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    story_data = None
+    if args.story:
+        with open(args.story, 'r', encoding='utf-8') as f:
+            story_data = json.load(f)
+
+    templates = load_templates()
+    rows = analyze_templates(templates, args.chapters, story_data, get_tokenizer(args.tokenizer))
+    print_token_report(rows, args.chapters)
+    report = {"chapters_per_story": args.chapters, "templates": rows}
+
+    if args.compare:
+        server = None
+        if args.fake_server:
+            server = start_fake_server(DEFAULT_PORT)
+            os.environ['OLLAMA_HOST'] = f"http://127.0.0.1:{DEFAULT_PORT}"
+        elif args.host:
+            os.environ['OLLAMA_HOST'] = args.host
+        try:
+            report["comparison"] = compare_against_server(templates, MODEL_NAME, args.samples, story_data)
+            print_comparison_report(report["comparison"])
+        finally:
+            if server:
+                server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
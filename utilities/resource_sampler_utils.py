@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+import psutil
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Samples a stage's process tree (this process and every child it starts: ffmpeg, ollama, yt-dlp...)
+# every RESOURCE_SAMPLE_INTERVAL seconds on a background thread and reports per-process peaks and
+# totals: RSS, CPU %, bytes read/written and open files.  run_all.py -resources wraps every stage in a
+# sampler and adds the summary to the timings JSON; the peaks are what to size worker concurrency on.
+#   python run_all.py -resources
+#   python utilities/resource_sampler_utils.py -interval 0.2 -- ffmpeg -i in.mp4 out.mp4
+# Children that live shorter than one interval may be missed; lower the interval for short stages.
+
+RESOURCE_SAMPLE_INTERVAL = getattr(gv, 'RESOURCE_SAMPLE_INTERVAL', 0.5)  # Seconds between samples
+SAMPLE_OPEN_FILES = getattr(gv, 'RESOURCE_SAMPLE_OPEN_FILES', True)  # open_files() is the slowest call on Windows
+
+def _io_bytes(process):
+    try:
+        counters = process.io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except (AttributeError, NotImplementedError, psutil.AccessDenied):  # Not available on macOS
+        return None, None
+
+def _open_files(process):
+    if not SAMPLE_OPEN_FILES:
+        return None
+    try:
+        return len(process.open_files())
+    except (psutil.AccessDenied, NotImplementedError):
+        return None
+
+class ResourceSampler:
+    """Samples a process tree on a thread; use as a context manager and read summary() afterwards."""
+
+    def __init__(self, pid=None, interval=RESOURCE_SAMPLE_INTERVAL, label=None):
+        self.root = psutil.Process(pid or os.getpid())
+        self.interval = interval
+        self.label = label
+        self.processes = {}  # (pid, create_time) -> stats
+        self.samples = 0
+        self.peak_tree_rss = 0
+        self.peak_tree_cpu = 0.0
+        self.tree_cpu_total = 0.0
+        self._handles = {}  # Same Process objects between samples, so cpu_percent() measures the interval
+        self._baseline_io = _io_bytes(self.root)  # The root process read and wrote before the stage started
+        self._stop = threading.Event()
+        self._thread = None
+        self._start = None
+        self._elapsed = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self.root.cpu_percent(None)
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sample()  # Catch the children's final I/O counters
+        self._elapsed = time.perf_counter() - self._start
+        return self.summary()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def _tree(self):
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def sample(self):
+        tree_rss = 0
+        tree_cpu = 0.0
+        for process in self._tree():
+            try:
+                key = (process.pid, process.create_time())
+                handle = self._handles.setdefault(key, process)
+                with handle.oneshot():
+                    rss = handle.memory_info().rss
+                    cpu = handle.cpu_percent(None)  # 0.0 on the first sample of a process
+                    read_bytes, write_bytes = _io_bytes(handle)
+                    open_files = _open_files(handle)
+                    name = handle.name()
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+                continue
+            if handle is self.root and read_bytes is not None:
+                read_bytes -= self._baseline_io[0]
+                write_bytes -= self._baseline_io[1]
+            stats = self.processes.setdefault(key, {
+                "pid": process.pid, "name": name, "first_seen": time.perf_counter(), "samples": 0,
+                "peak_rss_bytes": 0, "peak_cpu_percent": 0.0, "cpu_percent_total": 0.0,
+                "read_bytes": None, "write_bytes": None, "peak_open_files": None,
+            })
+            stats["last_seen"] = time.perf_counter()
+            stats["samples"] += 1
+            stats["peak_rss_bytes"] = max(stats["peak_rss_bytes"], rss)
+            stats["peak_cpu_percent"] = max(stats["peak_cpu_percent"], cpu)
+            stats["cpu_percent_total"] += cpu
+            if read_bytes is not None:
+                stats["read_bytes"], stats["write_bytes"] = read_bytes, write_bytes  # Cumulative; the last value is the total
+            if open_files is not None:
+                stats["peak_open_files"] = max(stats["peak_open_files"] or 0, open_files)
+            tree_rss += rss
+            tree_cpu += cpu
+        self.samples += 1
+        self.peak_tree_rss = max(self.peak_tree_rss, tree_rss)
+        self.peak_tree_cpu = max(self.peak_tree_cpu, tree_cpu)
+        self.tree_cpu_total += tree_cpu
+
+    def summary(self):
+        """Peaks and totals for the tree, per process and per program name."""
+        processes = []
+        by_program = {}
+        for stats in self.processes.values():
+            process = {
+                "pid": stats["pid"],
+                "name": stats["name"],
+                "seconds": round(stats["last_seen"] - stats["first_seen"], 3),
+                "peak_rss_bytes": stats["peak_rss_bytes"],
+                "peak_cpu_percent": round(stats["peak_cpu_percent"], 1),
+                "mean_cpu_percent": round(stats["cpu_percent_total"] / stats["samples"], 1),
+                "read_bytes": stats["read_bytes"],
+                "write_bytes": stats["write_bytes"],
+                "peak_open_files": stats["peak_open_files"],
+            }
+            processes.append(process)
+            program = by_program.setdefault(process["name"], {"processes": 0, "peak_rss_bytes": 0, "peak_cpu_percent": 0.0,
+                                                               "read_bytes": 0, "write_bytes": 0, "peak_open_files": 0})
+            program["processes"] += 1
+            program["peak_rss_bytes"] = max(program["peak_rss_bytes"], process["peak_rss_bytes"])
+            program["peak_cpu_percent"] = max(program["peak_cpu_percent"], process["peak_cpu_percent"])
+            program["read_bytes"] += process["read_bytes"] or 0
+            program["write_bytes"] += process["write_bytes"] or 0
+            program["peak_open_files"] = max(program["peak_open_files"], process["peak_open_files"] or 0)
+        return {
+            "label": self.label,
+            "seconds": round(self._elapsed if self._elapsed is not None else time.perf_counter() - self._start, 3),
+            "interval": self.interval,
+            "samples": self.samples,
+            "peak_tree_rss_bytes": self.peak_tree_rss,
+            "peak_tree_cpu_percent": round(self.peak_tree_cpu, 1),
+            "mean_tree_cpu_percent": round(self.tree_cpu_total / self.samples, 1) if self.samples else 0.0,
+            "read_bytes": sum(process["read_bytes"] or 0 for process in processes),
+            "write_bytes": sum(process["write_bytes"] or 0 for process in processes),
+            "child_processes": len(processes) - 1 if processes else 0,
+            "by_program": by_program,
+            "processes": sorted(processes, key=lambda process: -process["peak_rss_bytes"]),
+        }
+
+def format_summary(summary):
+    """One line of peaks and totals, plus one per program."""
+    lines = [f"peak RSS {summary['peak_tree_rss_bytes'] / 2**20:.0f} MB, peak CPU {summary['peak_tree_cpu_percent']:.0f}%, "
+             f"mean CPU {summary['mean_tree_cpu_percent']:.0f}%, read {summary['read_bytes'] / 2**20:.1f} MB, "
+             f"written {summary['write_bytes'] / 2**20:.1f} MB, {summary['child_processes']} child process(es)"]
+    for name, program in sorted(summary["by_program"].items(), key=lambda item: -item[1]["peak_rss_bytes"]):
+        lines.append(f"    {name:20} x{program['processes']:<3} peak RSS {program['peak_rss_bytes'] / 2**20:7.0f} MB, "
+                     f"peak CPU {program['peak_cpu_percent']:5.0f}%, open files {program['peak_open_files']}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a command and report the peak memory, CPU and I/O of its process tree.")
+    parser.add_argument("-interval", type=float, default=RESOURCE_SAMPLE_INTERVAL, help="Seconds between samples.")
+    parser.add_argument("-json", type=str, help="Also write the summary to this JSON file.")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run (after --).")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("no command given")
+
+    process = subprocess.Popen(command)
+    sampler = ResourceSampler(process.pid, args.interval, label=" ".join(command)).start()
+    returncode = process.wait()
+    summary = sampler.stop()
+    print(format_summary(summary))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=4)
+    sys.exit(returncode)
@@ -2,15 +2,20 @@ import sys
 import os
 import re
 import requests
-from bs4 import BeautifulSoup
 import random
 import subprocess
 import argparse
-import yt_dlp as youtube_dl
 from urllib.parse import urlparse, parse_qs
 import logging
 import time
 
+try:
+    from utilities.run_context_utils import scratch_file
+    from utilities.tracing_utils import traced_run
+except ImportError:  # Run as a script from utilities/
+    from run_context_utils import scratch_file
+    from tracing_utils import traced_run
+
 # Constants
 BASE_DOWNLOAD_DIRECTORY = "music_downloads"
 AMACHA_DIRECTORY = os.path.join(BASE_DOWNLOAD_DIRECTORY, "amacha")
@@ -46,21 +51,23 @@ def trim_audio_to_length(filename, target_length):
 
     if remainder_length > 0:
         partial_filename = f"{os.path.splitext(filename)[0]}_part_{remainder_length}s.mp3"
-        subprocess.run(
+        traced_run(
             ["ffmpeg", "-i", filename, "-ss", "0", "-t", str(remainder_length), "-c", "copy", partial_filename, "-y"]
         )
         looped_filenames.append(partial_filename)
     
-    with open("filelist.txt", "w") as f:
+    # Per-run scratch file so concurrent runs never share a concat list
+    list_file = scratch_file("filelist_", ".txt")
+    with open(list_file, "w") as f:
         for file in looped_filenames:
             f.write(f"file '{os.path.abspath(file)}'\n")
     
     trimmed_filename = f"{os.path.splitext(filename)[0]}_{target_length}s.mp3"
-    subprocess.run(
-        ["ffmpeg", "-f", "concat", "-safe", "0", "-i", "filelist.txt", "-c", "copy", trimmed_filename, "-y"]
+    traced_run(
+        ["ffmpeg", "-f", "concat", "-safe", "0", "-i", list_file, "-c", "copy", trimmed_filename, "-y"]
     )
 
-    os.remove("filelist.txt")
+    os.remove(list_file)
     for partial_file in looped_filenames:
         if partial_file != filename:
             os.remove(partial_file)
@@ -70,7 +77,7 @@ def trim_audio_to_length(filename, target_length):
 
 def get_length(filename):
     """ Get the length of an audio file using ffprobe. """
-    result = subprocess.run(
+    result = traced_run(
         ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", filename],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT
@@ -86,6 +93,7 @@ def on_progress(d):
 
 def get_youtube_video_details(video_link):
     """ Get the details of a YouTube video without downloading. """
+    import yt_dlp as youtube_dl
     ydl_opts = {}
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
         info = ydl.extract_info(video_link, download=False)
@@ -110,12 +118,14 @@ AMACHA_GENRES = [
 GENRE_DICT = {genre.split('_')[1].split('.')[0]: genre for genre in AMACHA_GENRES}
 
 def get_amacha_mp3_links(genre_page_url):
+    from bs4 import BeautifulSoup
     page = requests.get(genre_page_url)
     soup = BeautifulSoup(page.content, 'html.parser')
     mp3_links = [AMACHA_BASE_URL + a_tag['href'] for a_tag in soup.find_all('a', href=True) if a_tag['href'].endswith('.mp3')]
     return mp3_links
 
 def get_amacha_all_pages(genre_url):
+    from bs4 import BeautifulSoup
     page_urls = [genre_url]
     page = requests.get(genre_url)
     soup = BeautifulSoup(page.content, 'html.parser')
@@ -160,6 +170,7 @@ def download_amacha_mp3(mp3_url, download_directory):
 
 # YouTube Functions
 def download_youtube_video(youtube_url, download_directory, length, retries=3):
+    import yt_dlp as youtube_dl  # yt-dlp and bs4 take a while to import and only matter when downloading
     video_id = standardize_youtube_url(youtube_url).split('=')[-1]
 
     retry_count = 0
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Run-scoped working directories.  Stages name their folders the way they always have
+# ("storylines", "generated_images", ...) and resolve them through run_path() when they use them.
+# Without an active run directory that is the folder in the current directory (the legacy layout
+# that archive_previous_generations() clears between runs).  With one, every folder lives under
+# runs/<run_id>/, so several stories can be generated side by side without touching each other.
+#
+# The active run directory comes from use_run() (threads / in-process workers) or from the
+# STORY_RUN_DIR environment variable (child processes).  Shared caches such as music_downloads/,
+# the Hugging Face cache and the run index stay global.
+
+RUNS_ROOT = os.environ.get("STORY_RUNS_ROOT", getattr(gv, 'RUNS_ROOT', "runs"))  # Shared storage when workers run on several machines
+USE_RUN_DIRECTORIES = getattr(gv, 'USE_RUN_DIRECTORIES', False)  # Default for run_all.py's -run_dirs
+RUN_DIR_ENV = "STORY_RUN_DIR"
+RUN_ID_ENV = "STORY_RUN_ID"
+SCRATCH_FOLDER = "scratch"
+
+_run_id = contextvars.ContextVar("story_run_id", default=None)
+_run_dir = contextvars.ContextVar("story_run_dir", default=None)
+
+def run_dir_for(run_id):
+    return os.path.join(RUNS_ROOT, run_id)
+
+def get_run_id():
+    """The active run id: use_run() in this context, else STORY_RUN_ID, else None."""
+    return _run_id.get() or os.environ.get(RUN_ID_ENV) or None
+
+def get_run_dir():
+    """The active run directory, or None when stages use the legacy shared folders."""
+    return _run_dir.get() or os.environ.get(RUN_DIR_ENV) or None
+
+def is_run_scoped():
+    return get_run_dir() is not None
+
+def run_path(*parts):
+    """Resolve a working folder/file name against the active run directory (no-op without one)."""
+    path = os.path.join(*parts)
+    run_dir = get_run_dir()
+    if not run_dir or os.path.isabs(path):
+        return path
+    # Already resolved (e.g. a path read back from the story JSON)
+    if os.path.normpath(path).startswith(os.path.normpath(run_dir) + os.sep):
+        return path
+    return os.path.join(run_dir, path)
+
+def scratch_dir():
+    """Per-run directory for temporary files (ffmpeg concat lists etc.), created on demand."""
+    directory = run_path(SCRATCH_FOLDER) if is_run_scoped() else tempfile.gettempdir()
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def scratch_file(prefix, suffix=""):
+    """Create a uniquely named, empty scratch file and return its path; the caller removes it."""
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=scratch_dir())
+    os.close(fd)
+    return path
+
+def activate_run(run_id):
+    """Make runs/<run_id>/ the working directory of this process and of any child process it starts."""
+    run_dir = run_dir_for(run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    os.environ[RUN_DIR_ENV] = run_dir
+    os.environ[RUN_ID_ENV] = run_id
+    return run_dir
+
+def deactivate_run():
+    os.environ.pop(RUN_DIR_ENV, None)
+
+@contextmanager
+def use_run(run_id, run_dir=None):
+    """Scope run_path()/get_run_id() to one run for the current thread or task only."""
+    run_dir = run_dir or run_dir_for(run_id)
+    os.makedirs(run_dir, exist_ok=True)
+    run_id_token = _run_id.set(run_id)
+    run_dir_token = _run_dir.set(run_dir)
+    try:
+        yield run_dir
+    finally:
+        _run_dir.reset(run_dir_token)
+        _run_id.reset(run_id_token)
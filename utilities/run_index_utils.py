@@ -0,0 +1,219 @@
+import os
+import uuid
+import sqlite3
+import threading
+from datetime import datetime
+
+try:
+    from utilities import run_context_utils, profile_utils
+except ImportError:  # Run as a script from utilities/
+    import run_context_utils
+    import profile_utils
+
+# SQLite index of pipeline runs: which run produced which artifact (story JSON, summaries, videos)
+# and how far each stage got.  Stages look their input up by run id instead of scanning storylines/.
+# The database lives outside the archived folders, so it survives archive_previous_generations().
+
+RUN_INDEX_PATH = os.environ.get("STORY_RUN_INDEX", "run_index.sqlite")
+RUN_ID_ENV = run_context_utils.RUN_ID_ENV  # The active run; set by 1_dream_up_a_story.py / run_all.py
+STORYLINES_FOLDER = "storylines"
+TIMESTAMP_FORMATS = ["%Y-%m-%d_%H-%M", "%Y%m%d_%H%M%S"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'running'
+);
+CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at);
+CREATE TABLE IF NOT EXISTS stages (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT,
+    PRIMARY KEY (run_id, stage)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    run_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    stage TEXT,
+    created_at TEXT NOT NULL,
+    profile TEXT,
+    PRIMARY KEY (run_id, kind)
+);
+"""
+# Columns added after the first release: (table, column, type); added to existing databases on connect
+MIGRATIONS = [
+    ("artifacts", "profile", "TEXT"),
+]
+
+_local = threading.local()
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def get_connection(db_path=None):
+    """Return this thread's connection to the run index, creating the schema on first use."""
+    db_path = db_path or RUN_INDEX_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if db_path not in connections:
+        connection = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        _migrate(connection)
+        connections[db_path] = connection
+    return connections[db_path]
+
+def _migrate(connection):
+    for table, column, column_type in MIGRATIONS:
+        columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            try:
+                connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            except sqlite3.OperationalError:  # Another process added it first
+                pass
+
+def new_run_id():
+    """Sortable, collision-free run id: timestamp plus a short random suffix."""
+    return f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{uuid.uuid4().hex[:6]}"
+
+def start_run(run_id=None, activate=True):
+    """Register a run (a new one unless run_id is given); with activate, make it the active run for this process."""
+    run_id = run_id or new_run_id()
+    get_connection().execute("INSERT OR IGNORE INTO runs (run_id, created_at) VALUES (?, ?)", (run_id, _now()))
+    if activate:
+        os.environ[RUN_ID_ENV] = run_id
+    return run_id
+
+def ensure_run():
+    """Return the active run (use_run() or STORY_RUN_ID), registering it if needed, or start a new run."""
+    run_id = run_context_utils.get_run_id()
+    return start_run(run_id, activate=not run_id)
+
+def current_run_id():
+    """The active run: use_run()/STORY_RUN_ID if set, otherwise the most recently started run (or None)."""
+    run_id = run_context_utils.get_run_id()
+    if run_id:
+        return run_id
+    row = get_connection().execute("SELECT run_id FROM runs ORDER BY created_at DESC, rowid DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+def finish_run(status="done", run_id=None):
+    run_id = run_id or current_run_id()
+    if run_id:
+        get_connection().execute("UPDATE runs SET status = ? WHERE run_id = ?", (status, run_id))
+
+def set_stage_status(stage, status, run_id=None):
+    """Record a stage as 'running', 'done' or 'failed' for the run."""
+    run_id = run_id or current_run_id()
+    if not run_id:
+        return
+    timestamp = _now()
+    if status == "running":
+        get_connection().execute(
+            "INSERT OR REPLACE INTO stages (run_id, stage, status, started_at, finished_at) VALUES (?, ?, ?, ?, NULL)",
+            (run_id, stage, status, timestamp))
+    else:
+        get_connection().execute(
+            "INSERT INTO stages (run_id, stage, status, started_at, finished_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (run_id, stage) DO UPDATE SET status = excluded.status, finished_at = excluded.finished_at",
+            (run_id, stage, status, timestamp, timestamp))
+
+def get_stage_status(stage, run_id=None):
+    run_id = run_id or current_run_id()
+    row = get_connection().execute("SELECT status FROM stages WHERE run_id = ? AND stage = ?", (run_id, stage)).fetchone()
+    return row[0] if row else None
+
+def record_artifact(kind, path, stage=None, run_id=None, profile=None):
+    """Remember where a stage wrote an artifact (e.g. 'story', 'summaries', 'video_<model>') and under which quality profile."""
+    run_id = run_id or current_run_id()
+    if not run_id:
+        return
+    get_connection().execute(
+        "INSERT OR REPLACE INTO artifacts (run_id, kind, path, stage, created_at, profile) VALUES (?, ?, ?, ?, ?, ?)",
+        (run_id, kind, path, stage, _now(), profile or profile_utils.active_profile()))
+
+def get_artifact(kind, run_id=None):
+    """Path of an artifact for the run, or None if unknown or no longer on disk (e.g. archived)."""
+    run_id = run_id or current_run_id()
+    if not run_id:
+        return None
+    row = get_connection().execute("SELECT path FROM artifacts WHERE run_id = ? AND kind = ?", (run_id, kind)).fetchone()
+    if row and os.path.exists(row[0]):
+        return row[0]
+    return None
+
+def get_artifact_profile(kind, run_id=None):
+    """Quality profile ('draft', 'final') that produced an artifact; artifacts from before profiles count as 'final'."""
+    run_id = run_id or current_run_id()
+    row = get_connection().execute("SELECT profile FROM artifacts WHERE run_id = ? AND kind = ?", (run_id, kind)).fetchone()
+    if not row:
+        return None
+    return row[0] or profile_utils.DEFAULT_PROFILE
+
+def get_artifacts(prefix, run_id=None):
+    """All artifacts of the run whose kind starts with prefix, as {kind: path}."""
+    run_id = run_id or current_run_id()
+    rows = get_connection().execute(
+        "SELECT kind, path FROM artifacts WHERE run_id = ? AND kind LIKE ?", (run_id, prefix + "%")).fetchall()
+    return dict(rows)
+
+def find_latest_timestamped_file(directory, suffix):
+    """Legacy lookup: newest file in directory whose name starts with a timestamp and ends with suffix."""
+    latest_file, latest_time = None, None
+    if not os.path.isdir(directory):
+        return None
+    for filename in os.listdir(directory):
+        if filename.endswith(suffix):
+            for fmt in TIMESTAMP_FORMATS:
+                try:
+                    file_time = datetime.strptime(filename[:16], fmt)
+                    if not latest_time or file_time > latest_time:
+                        latest_time, latest_file = file_time, os.path.join(directory, filename)
+                except ValueError:
+                    continue
+    return latest_file
+
+def _scan_allowed(run_id):
+    # With an explicit run (concurrent runs) another run's newest file must never be picked up,
+    # unless the folder being scanned is the run's own directory (e.g. a queue worker on another machine)
+    return run_context_utils.is_run_scoped() or not (run_id or run_context_utils.get_run_id())
+
+def find_story_file(directory=STORYLINES_FOLDER, run_id=None):
+    """The run's story JSON (stages 2-3), falling back to the newest non-summary JSON in directory."""
+    story_file = get_artifact("story", run_id)
+    if story_file or not _scan_allowed(run_id):
+        return story_file
+    directory = run_context_utils.run_path(directory)
+    if not os.path.isdir(directory):
+        return None
+    json_files = [f for f in os.listdir(directory) if f.endswith('.json') and "_summaries" not in f]
+    if not json_files:
+        return None
+    return os.path.join(directory, max(json_files, key=lambda f: os.path.getmtime(os.path.join(directory, f))))
+
+def find_summary_file(directory=STORYLINES_FOLDER, run_id=None):
+    """The run's *_summaries.json (stages 4-9), falling back to the newest timestamped one in directory."""
+    summary_file = get_artifact("summaries", run_id)
+    if summary_file or not _scan_allowed(run_id):
+        return summary_file
+    return find_latest_timestamped_file(run_context_utils.run_path(directory), "_summaries.json")
+
+def list_runs(limit=10):
+    """Most recent runs with their stage statuses, newest first."""
+    connection = get_connection()
+    runs = connection.execute("SELECT run_id, created_at, status FROM runs ORDER BY created_at DESC, rowid DESC LIMIT ?", (limit,)).fetchall()
+    result = []
+    for run_id, created_at, status in runs:
+        stages = connection.execute("SELECT stage, status FROM stages WHERE run_id = ? ORDER BY started_at", (run_id,)).fetchall()
+        result.append({"run_id": run_id, "created_at": created_at, "status": status, "stages": dict(stages)})
+    return result
+
+if __name__ == "__main__":
+    for run in list_runs():
+        print(f"{run['run_id']}  {run['status']:<8}  " + ", ".join(f"{stage}={status}" for stage, status in run["stages"].items()))
@@ -0,0 +1,163 @@
+import os
+import sys
+import shutil
+import atexit
+import argparse
+import threading
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities.run_context_utils import get_run_id, run_path
+except ImportError:  # Run as a script from utilities/
+    from run_context_utils import get_run_id, run_path
+
+# Memory-backed scratch space for the short-lived files stages 5, 8 and 9 churn through (JPEG conversions,
+# TTS/atempo/apad MP3s, extracted frames, intermediate MP4s).  A ScratchSpace lives on SCRATCH_FAST_PATH
+# (/dev/shm, a tmpfs) when that has room for the stage's estimate plus SCRATCH_HEADROOM_MB, and in the
+# stage's usual folder on disk otherwise, so nothing changes where there is no tmpfs (Windows, macOS).
+# Spaces are removed when their with-block ends, whatever happened inside it; directories left in the fast
+# path by a killed process are swept the next time a space is opened.  Closing a space reports how many
+# bytes it held in memory or on disk; run_all.py adds each stage's totals to its timings.
+#   with ScratchSpace("stage8_frames", FRAMES_DIR, expected_bytes=...) as scratch:
+#       frame_path = scratch.path("frame_0.png")
+#   python utilities/scratch_utils.py -sweep
+# STORY_SCRATCH_PATH overrides SCRATCH_FAST_PATH; set it to "" to keep every scratch space on disk.
+
+SCRATCH_PATH_ENV = "STORY_SCRATCH_PATH"
+SCRATCH_FAST_PATH = os.environ.get(SCRATCH_PATH_ENV, getattr(gv, 'SCRATCH_FAST_PATH', "/dev/shm"))
+SCRATCH_HEADROOM_MB = getattr(gv, 'SCRATCH_HEADROOM_MB', 256)  # Left free in the fast path for everything else using it
+SCRATCH_PREFIX = "story_scratch_"
+
+_usage = {"memory_bytes": 0, "disk_bytes": 0, "spaces": 0}
+_usage_lock = threading.Lock()
+_open_spaces = set()
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+def sweep_stale(fast_path=None):
+    """Remove scratch directories in the fast path whose process is gone; returns the removed paths."""
+    fast_path = SCRATCH_FAST_PATH if fast_path is None else fast_path
+    if not fast_path or not os.path.isdir(fast_path):
+        return []
+    removed = []
+    for entry in os.listdir(fast_path):
+        pid = entry.rsplit("_", 1)[-1]
+        if entry.startswith(SCRATCH_PREFIX) and pid.isdigit() and not _pid_alive(int(pid)):
+            shutil.rmtree(os.path.join(fast_path, entry), ignore_errors=True)
+            removed.append(os.path.join(fast_path, entry))
+    return removed
+
+def fast_path_fits(expected_bytes, fast_path=None):
+    """True when the fast path exists, is writable and has room for expected_bytes plus the headroom."""
+    fast_path = SCRATCH_FAST_PATH if fast_path is None else fast_path
+    if not fast_path or not os.path.isdir(fast_path) or not os.access(fast_path, os.W_OK):
+        return False
+    return shutil.disk_usage(fast_path).free >= expected_bytes + SCRATCH_HEADROOM_MB * 2**20
+
+def _tree_bytes(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class ScratchSpace:
+    """A directory for a stage's intermediates, in memory when it fits; use as a context manager."""
+
+    def __init__(self, label, fallback_folder, expected_bytes=0):
+        self.label = label
+        self.fallback_folder = fallback_folder  # Relative to the run directory, like the stage's old temp folder
+        self.expected_bytes = expected_bytes
+        self.directory = None
+        self.in_memory = False
+        self.bytes_used = 0
+
+    def open(self):
+        sweep_stale()
+        if fast_path_fits(self.expected_bytes):
+            owner = f"{SCRATCH_PREFIX}{get_run_id() or 'shared'}_{os.getpid()}"
+            self.directory = os.path.join(SCRATCH_FAST_PATH, owner, self.label)
+            self.in_memory = True
+        else:
+            self.directory = run_path(self.fallback_folder)
+            self.in_memory = False
+        os.makedirs(self.directory, exist_ok=True)
+        _open_spaces.add(self)
+        print(f"[INFO] Scratch '{self.label}' {'in memory' if self.in_memory else 'on disk'}: {self.directory}")
+        return self
+
+    def path(self, *parts):
+        """A path inside the space (subfolders are created)."""
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def close(self):
+        if self not in _open_spaces:
+            return self.bytes_used
+        _open_spaces.discard(self)
+        self.bytes_used = _tree_bytes(self.directory)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        if self.in_memory:
+            owner_dir = os.path.dirname(self.directory)
+            if os.path.isdir(owner_dir) and not os.listdir(owner_dir):
+                os.rmdir(owner_dir)
+        with _usage_lock:
+            _usage["memory_bytes" if self.in_memory else "disk_bytes"] += self.bytes_used
+            _usage["spaces"] += 1
+        print(f"[INFO] Scratch '{self.label}' released: {self.bytes_used / 2**20:.1f} MB {'served from memory' if self.in_memory else 'on disk'}")
+        return self.bytes_used
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+@atexit.register
+def _close_open_spaces():
+    for space in list(_open_spaces):
+        space.close()
+
+def usage():
+    """Bytes held by the scratch spaces closed so far in this process, in memory and on disk."""
+    with _usage_lock:
+        return dict(_usage)
+
+def take_usage():
+    """usage(), then start counting again (per-stage totals)."""
+    with _usage_lock:
+        current = dict(_usage)
+        _usage.update(memory_bytes=0, disk_bytes=0, spaces=0)
+    return current
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show or clean the scratch fast path.")
+    parser.add_argument("-sweep", action="store_true", help="Remove scratch directories left by processes that are gone.")
+    args = parser.parse_args()
+    if not SCRATCH_FAST_PATH or not os.path.isdir(SCRATCH_FAST_PATH):
+        print(f"No fast path ({SCRATCH_FAST_PATH or 'disabled'}); scratch spaces use the stages' folders on disk.")
+        sys.exit(0)
+    disk = shutil.disk_usage(SCRATCH_FAST_PATH)
+    print(f"{SCRATCH_FAST_PATH}: {disk.free / 2**20:.0f} MB free of {disk.total / 2**20:.0f} MB (headroom {SCRATCH_HEADROOM_MB} MB)")
+    for entry in sorted(os.listdir(SCRATCH_FAST_PATH)):
+        if entry.startswith(SCRATCH_PREFIX):
+            print(f"  {entry}: {_tree_bytes(os.path.join(SCRATCH_FAST_PATH, entry)) / 2**20:.1f} MB")
+    if args.sweep:
+        for path in sweep_stale():
+            print(f"Removed {path}")
@@ -1,25 +1,28 @@
 import os
 import logging
-import json
 import random
 import re
+import gc
 import sys
 import shutil
 import time
 from datetime import datetime
 from PIL import Image
-from diffusers import DiffusionPipeline, StableDiffusionPipeline, AutoencoderKL, DDIMScheduler
-from huggingface_hub import hf_hub_download
-import torch
+# torch, diffusers, huggingface_hub, insightface (faceid_utils) and mtcnn/dlib (enhance_image_via_import)
+# are imported by the functions that use them, so importing this module stays cheap
 
 # Adjust the sys.path to include the parent directory for GLOBAL_VARIABLES
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 # Importing global variables and utilities
 import GLOBAL_VARIABLES as gv
-import utilities.faceid_utils as faceid_utils
-from enhance_image_via_import import enhance_image
 import utilities.main_character_generator_utils as mcg  # Importing the main character generator module
+from utilities.negative_prompt_utils import merge_negative_prompts
+from utilities.story_journal_utils import StoryJournal
+from utilities.run_context_utils import run_path
+from utilities.tracing_utils import span, traced
+from utilities.profile_utils import has_current_image, record_image
+from utilities.failure_utils import StageFailure, UnitFailure, run_unit, can_retry, chapter_unit, record_placeholder
 
 # Constants from GLOBAL_VARIABLES with defaults
 TOP_MODELS = getattr(gv, 'TOP_MODELS', ["runwayml/stable-diffusion-v1-5"])
@@ -36,6 +39,14 @@ IP_CKPT_FILENAME = "ip-adapter-faceid-plusv2_sd15.bin"
 NEGATIVE_PROMPTS = getattr(gv, 'NEGATIVE_PROMPTS', {
     "default": "nsfw, portrait, inactive, closeup, nsfw"
 })
+# Keep pipelines loaded between models and runs when the stages share one process (run_all.py).  Every
+# TOP_MODELS pipeline then stays on the GPU next to the main character pipeline, so it needs a large card;
+# off by default, when every model (and the main character pipeline) is dropped before the next one loads.
+KEEP_MODELS_RESIDENT = getattr(gv, 'KEEP_MODELS_RESIDENT', False)
+ENHANCE_IMAGES = getattr(gv, 'ENHANCE_IMAGES', True)
+IMAGE_STAGE = "4_create_images_from_ai_prompts"  # Chapter image failures are recorded under this stage
+_IP_MODEL_CACHE = {}
+_VAE = None
 
 # Other Constants
 STORYLINES_PATH = "storylines"  # Ensure this is defined
@@ -59,7 +70,13 @@ def clear_cache_if_disk_space_low(min_free_space_bytes):
         logging.info("Low disk space, clearing cache")
         shutil.rmtree("path/to/cache")
 
+def enhance_image(input_image_path, output_dir):
+    """enhance_image_via_import.enhance_image(), imported on first use (it loads mtcnn/TensorFlow and dlib)."""
+    from utilities.enhance_image_via_import import enhance_image as _enhance_image
+    return _enhance_image(input_image_path, output_dir)
+
 def check_and_download(repo_id, filename):
+    from huggingface_hub import hf_hub_download
     logging.info(f"Checking for {filename} in the cache or downloading if not present from repo: {repo_id}...")
     try:
         file_path = hf_hub_download(repo_id=repo_id, filename=filename)
@@ -71,6 +88,8 @@ def check_and_download(repo_id, filename):
         return None
 
 def load_pipeline(model_id, disable_safety_checker):
+    import torch
+    from diffusers import DiffusionPipeline
     try:
         logging.info(f"Loading pipeline for model: {model_id}")
         pipeline = DiffusionPipeline.from_pretrained(
@@ -85,7 +104,9 @@ def load_pipeline(model_id, disable_safety_checker):
         logging.error(f"Failed to load model {model_id}: {e}")
         return None
 
+@traced("pipeline.generate", "diffusion")
 def generate_image(prompt, negative_prompt, seed, width, height, pipeline):
+    import torch
     generator = torch.manual_seed(seed)
     try:
         logging.info(f"Generating image with prompt: {prompt}, negative_prompt: {negative_prompt}, seed: {seed}")
@@ -116,6 +137,7 @@ def find_correct_image_path(image_path):
 
 def extract_embeddings(image_path):
     logging.info(f"[extract_face_embedding] Extracting face embedding from {image_path}")
+    import utilities.faceid_utils as faceid_utils
 
     try:
         embeddings, aligned_face = faceid_utils.extract_face_embedding(image_path)
@@ -171,7 +193,7 @@ def combine_images(image1_path, image2_path, output_path):
     
     combined_image.save(output_path)
 
-def initialize_main_character(main_character_description, main_character_gender, storyline_data, storyline_path):
+def initialize_main_character(main_character_description, main_character_gender, storyline_data, storyline_path, journal=None):
     user_provided_image_path = storyline_data.get('user_image_path', None)
 
     if user_provided_image_path and user_provided_image_path.lower() != 'null':
@@ -182,7 +204,7 @@ def initialize_main_character(main_character_description, main_character_gender,
             return user_image, corrected_image_path
         else:
             logging.error("Main character image not found or not valid.")
-            exit(1)
+            raise StageFailure(f"Main character image {user_provided_image_path} not found or not valid")
     else:
         logging.info("No user-provided image. Generating main character image...")
 
@@ -205,45 +227,62 @@ def initialize_main_character(main_character_description, main_character_gender,
         if not success:
             logging.error("Failed to extract embedding from main character image after 5 attempts. Exiting.")
             print("Failed to extract embedding from main character image after 5 attempts. Exiting.")
-            exit(1)
+            raise StageFailure("No face embedding could be extracted from 5 generated main character images")
 
-        storyline_data['user_image_path'] = main_character_image_path
-        with open(storyline_path, 'w') as f:
-            json.dump(storyline_data, f, indent=4)
+        # Journaled so a rerun after a crash reuses this image instead of generating a new character
+        if journal is None:
+            with StoryJournal(storyline_path, data=storyline_data, indent=4) as journal:
+                journal.set(['user_image_path'], main_character_image_path)
+        else:
+            journal.set(['user_image_path'], main_character_image_path)
         
         return load_main_character_image(main_character_image_path), main_character_image_path
 
 def remove_extra_spaces_in_prompts(prompt):
     return ','.join(part.strip() for part in prompt.split(','))
 
-def process_model(selected_model, storyline_data, storyline_path, initial_embedding, initial_aligned_face, total_images_generated, total_generation_time, file_path):
-    logging.info(f"Downloading model '{selected_model}' from the hub.")
-    pipeline = load_pipeline(selected_model, DISABLE_SAFETY_CHECKER)
-
-    if not pipeline:
-        logging.error(f"Failed to load model '{selected_model}'. Skipping.")
-        return total_images_generated, total_generation_time
-
+def get_vae():
+    """Load the shared VAE once; every SD1.5 model in TOP_MODELS reuses it."""
+    global _VAE
+    if _VAE is None:
+        import torch
+        from diffusers import AutoencoderKL
+        _VAE = AutoencoderKL.from_pretrained("stabilityai/sd-vae-ft-mse").to(dtype=torch.float16)
+    return _VAE
+
+def get_ip_model(selected_model, file_path):
+    """Return (pipe, ip_model) for a model, reusing the resident copy when KEEP_MODELS_RESIDENT is set."""
+    cache_key = (selected_model, file_path)
+    if cache_key in _IP_MODEL_CACHE:
+        logging.info(f"Reusing resident pipeline and IP-Adapter for model: {selected_model}")
+        return _IP_MODEL_CACHE[cache_key]
+
+    if not KEEP_MODELS_RESIDENT:
+        release_models()  # One pipeline on the GPU at a time, as on 8-12 GB cards
     logging.info(f"Setting up Stable Diffusion pipeline using model: '{selected_model}'.")
-    vae_model_path = "stabilityai/sd-vae-ft-mse"
-    noise_scheduler = DDIMScheduler(
-        num_train_timesteps=1000,
-        beta_start=0.00085,
-        beta_end=0.012,
-        beta_schedule="scaled_linear",
-        clip_sample=False,
-        set_alpha_to_one=False,
-        steps_offset=1,
-    )
-    vae = AutoencoderKL.from_pretrained(vae_model_path).to(dtype=torch.float16)
-    pipe = StableDiffusionPipeline.from_pretrained(
-        selected_model,
-        torch_dtype=torch.float16,
-        scheduler=noise_scheduler,
-        vae=vae,
-        feature_extractor=None,
-        safety_checker=None 
-    ).to("cuda")
+    import torch
+    from diffusers import StableDiffusionPipeline, DDIMScheduler
+    try:
+        noise_scheduler = DDIMScheduler(
+            num_train_timesteps=1000,
+            beta_start=0.00085,
+            beta_end=0.012,
+            beta_schedule="scaled_linear",
+            clip_sample=False,
+            set_alpha_to_one=False,
+            steps_offset=1,
+        )
+        pipe = StableDiffusionPipeline.from_pretrained(
+            selected_model,
+            torch_dtype=torch.float16,
+            scheduler=noise_scheduler,
+            vae=get_vae(),
+            feature_extractor=None,
+            safety_checker=None 
+        ).to("cuda")
+    except Exception as e:
+        logging.error(f"Failed to load model {selected_model}: {e}")
+        return None, None
     logging.info(f"Stable Diffusion pipeline set up using model: {selected_model}")
 
     from ip_adapter.ip_adapter_faceid import IPAdapterFaceIDPlus
@@ -254,6 +293,31 @@ def process_model(selected_model, storyline_data, storyline_path, initial_embedd
     ip_model = IPAdapterFaceIDPlus(pipe, image_encoder_path, file_path, device)
     logging.info("IP-Adapter loaded successfully.")
 
+    if KEEP_MODELS_RESIDENT:
+        _IP_MODEL_CACHE[cache_key] = (pipe, ip_model)
+    return pipe, ip_model
+
+def release_models():
+    """Drop every resident pipeline (and the main character pipeline) and free the GPU memory they held."""
+    global _VAE
+    _IP_MODEL_CACHE.clear()
+    _VAE = None
+    for module_name in ("utilities.main_character_generator_utils", "main_character_generator_utils"):
+        if module_name in sys.modules:
+            sys.modules[module_name].get_pipeline.cache_clear()
+    gc.collect()
+    torch = sys.modules.get("torch")  # Nothing to free if no model was ever loaded
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+def process_model(selected_model, storyline_data, storyline_path, initial_embedding, initial_aligned_face, total_images_generated, total_generation_time, file_path, journal=None):
+    logging.info(f"Loading model '{selected_model}' from the hub or the resident cache.")
+    pipeline, ip_model = get_ip_model(selected_model, file_path)
+
+    if not pipeline:
+        logging.error(f"Failed to load model '{selected_model}'. Skipping.")
+        return total_images_generated, total_generation_time
+
     logging.info("Processing chapter images...")
     
     for chapter in storyline_data['story_chapters']:
@@ -270,49 +334,70 @@ def process_model(selected_model, storyline_data, storyline_path, initial_embedd
         initial_aligned_face,
         NEGATIVE_PROMPTS,
         total_images_generated,
-        total_generation_time
+        total_generation_time,
+        journal
     )
     
     return total_images_generated, total_generation_time
-def process_chapter_images(model_name, storyline_data, storyline_path, pipeline, ip_model, initial_embedding, initial_aligned_face, NEGATIVE_PROMPTS, total_images_generated, total_generation_time):
+def process_chapter_images(model_name, storyline_data, storyline_path, pipeline, ip_model, initial_embedding, initial_aligned_face, NEGATIVE_PROMPTS, total_images_generated, total_generation_time, journal=None):
+    # Each image path is journaled instead of rewriting the whole summaries file per image
+    owns_journal = journal is None
+    if owns_journal:
+        journal = StoryJournal(storyline_path, data=storyline_data)
     artistic_style = storyline_data.get("artistic_style", "default style")
     sanitized_model_name = sanitize_model_name(model_name)
-    model_generated_images_path = os.path.join(GENERATED_IMAGES_PATH, sanitized_model_name)
+    model_generated_images_path = run_path(GENERATED_IMAGES_PATH, sanitized_model_name)
     os.makedirs(model_generated_images_path, exist_ok=True)
 
-    model_enhanced_images_path = os.path.join(ENHANCED_IMAGES_PATH, sanitized_model_name)
+    model_enhanced_images_path = run_path(ENHANCED_IMAGES_PATH, sanitized_model_name)
     os.makedirs(model_enhanced_images_path, exist_ok=True)
 
-    model_comparisons_path = os.path.join(COMPARISONS_PATH, sanitized_model_name)
+    model_comparisons_path = run_path(COMPARISONS_PATH, sanitized_model_name)
     os.makedirs(model_comparisons_path, exist_ok=True)
 
+    chapter_image_key = f"chapter_image_location_{sanitized_model_name}"
     for idx, chapter in enumerate(storyline_data['story_chapters']):  # fixed the loop
+        # Resume: chapters that already have an image from an interrupted run (same quality profile) are skipped
+        if has_current_image(chapter, chapter_image_key):
+            logging.info(f"Chapter {idx + 1} already has an image for {model_name}: {chapter[chapter_image_key]}. Skipping.")
+            continue
+        # Chapters that failed in an earlier run are tried again until they run out of attempts; stage 5 puts a placeholder in their place
+        unit = chapter_unit(sanitized_model_name, idx)
+        if not can_retry(IMAGE_STAGE, unit):
+            logging.warning(f"Chapter {idx + 1} is out of attempts for {model_name} in this run. Skipping (see utilities/failure_utils.py -reset).")
+            continue
+
         image_start_time = time.time()
         positive_prompt = f"in the style of {artistic_style}, {chapter['positive_ai_prompt']}"
-        negative_prompt = f"{NEGATIVE_PROMPTS['default']}, {chapter['negative_ai_prompt']}"
+        negative_prompt = merge_negative_prompts(NEGATIVE_PROMPTS['default'], chapter['negative_ai_prompt'])
 
         if RANDOMIZE_SEED_VALUE:
             seed = random.randint(0, 100000)
         else:
             seed = SEED + idx
 
-        try:
-            images = ip_model.generate(
-                prompt=positive_prompt,
-                negative_prompt=negative_prompt,
-                faceid_embeds=initial_embedding,
-                face_image=initial_aligned_face,
-                shortcut=True,
-                s_scale=CFG_SCALE,
-                num_samples=NUM_SAMPLES,
-                width=DEFAULT_WIDTH,
-                height=DEFAULT_HEIGHT,
-                num_inference_steps=NUMBER_OF_STEPS,
-                seed=seed
-            )
+        def generate_chapter_image():
+            with span("ip_model.generate", "diffusion", model=model_name, chapter=idx, steps=NUMBER_OF_STEPS, images=NUM_SAMPLES):
+                images = ip_model.generate(
+                    prompt=positive_prompt,
+                    negative_prompt=negative_prompt,
+                    faceid_embeds=initial_embedding,
+                    face_image=initial_aligned_face,
+                    shortcut=True,
+                    s_scale=CFG_SCALE,
+                    num_samples=NUM_SAMPLES,
+                    width=DEFAULT_WIDTH,
+                    height=DEFAULT_HEIGHT,
+                    num_inference_steps=NUMBER_OF_STEPS,
+                    seed=seed
+                )
             if images is None or len(images) == 0:
                 raise ValueError("Generated image is None or empty.")
-        except Exception as e:
+            return images
+
+        try:
+            images = run_unit(IMAGE_STAGE, unit, generate_chapter_image, chapter=idx)
+        except UnitFailure as e:
             logging.error(f"Error generating image: {e}")
             continue
 
@@ -321,29 +406,39 @@ def process_chapter_images(model_name, storyline_data, storyline_path, pipeline,
         sanitized_activity = sanitize_filename(chapter.get('chapter', 'chapter'))
 
         filename_prefix = f"{timestamp_str}_{sanitized_model_name}_{sanitized_activity}_{seed}"
-        result_image_path = os.path.join(model_generated_images_path, f"{filename_prefix}.png")
+        # Without the enhancement pass (draft profile) the generated image is the chapter image, so it goes where stage 5 looks
+        output_images_path = model_generated_images_path if ENHANCE_IMAGES else model_enhanced_images_path
+        result_image_path = os.path.join(output_images_path, f"{filename_prefix}.png")
         adjusted_image.save(result_image_path)
         
-        try:
-            enhanced_image_result = enhance_image(result_image_path, model_enhanced_images_path)
-            enhanced_image_result_path = os.path.join(model_enhanced_images_path, f"{filename_prefix}_enhanced.png")
-            enhanced_image_result.save(enhanced_image_result_path)
-            chapter_image_key = f"chapter_image_location_{sanitized_model_name}"
-            storyline_data['story_chapters'][idx][chapter_image_key] = enhanced_image_result_path
-
-            with open(storyline_path, 'w') as json_file:
-                json.dump(storyline_data, json_file, indent=2)
-
-            if ADD_COMPARISONS_TO_ENHANCED_VS_GENERATED:
-                comparison_image_path = os.path.join(model_comparisons_path, f"{filename_prefix}_comparison.png")
-                combine_images(result_image_path, enhanced_image_result_path, comparison_image_path)
-                logging.info(f"Comparison image saved to {comparison_image_path}")
-
-        except Exception as e:
-            logging.error(f"Error enhancing image: {result_image_path}, error: {e}")
+        if ENHANCE_IMAGES:
+            enhance_unit = chapter_unit(sanitized_model_name, idx, "enhance")
+            try:
+                enhanced_image_result = run_unit(IMAGE_STAGE, enhance_unit, enhance_image, result_image_path, model_enhanced_images_path, chapter=idx)
+                enhanced_image_result_path = os.path.join(model_enhanced_images_path, f"{filename_prefix}_enhanced.png")
+                enhanced_image_result.save(enhanced_image_result_path)
+                record_image(journal, idx, chapter_image_key, enhanced_image_result_path)
+
+                if ADD_COMPARISONS_TO_ENHANCED_VS_GENERATED:
+                    comparison_image_path = os.path.join(model_comparisons_path, f"{filename_prefix}_comparison.png")
+                    combine_images(result_image_path, enhanced_image_result_path, comparison_image_path)
+                    logging.info(f"Comparison image saved to {comparison_image_path}")
+
+            except UnitFailure:
+                # The unenhanced image stands in, so the chapter keeps its own picture rather than stage 5's placeholder
+                fallback_image_path = os.path.join(model_enhanced_images_path, f"{filename_prefix}_unenhanced.png")
+                shutil.copyfile(result_image_path, fallback_image_path)
+                record_image(journal, idx, chapter_image_key, fallback_image_path)
+                record_placeholder(IMAGE_STAGE, enhance_unit, fallback_image_path, chapter=idx, retry=False)
+            except Exception as e:
+                logging.error(f"Error enhancing image: {result_image_path}, error: {e}")
+        else:
+            record_image(journal, idx, chapter_image_key, result_image_path)
 
         total_images_generated += 1
         elapsed_time = time.time() - image_start_time
         total_generation_time += elapsed_time
 
+    if owns_journal:
+        journal.close()
     return total_images_generated, total_generation_time
\ No newline at end of file
@@ -0,0 +1,285 @@
+import os
+import ast
+import json
+import uuid
+import hashlib
+from datetime import datetime
+
+from utilities import run_index_utils, failure_utils
+from utilities.story_journal_utils import load_story
+
+try:
+    import GLOBAL_VARIABLES
+except ImportError:
+    class GLOBAL_VARIABLES:
+        pass
+
+# Content-hash stage skipping.  Every stage declares what it depends on: upstream stages, config keys
+# (GLOBAL_VARIABLES names or "script.py:CONSTANT"), model ids, fields of the run's story JSON and the
+# files those fields point to.  After a stage succeeds its input digest is stamped in the run index;
+# the next time the same run is processed the stage is skipped when the digest and its outputs still match.
+#
+# Files are fingerprinted by size + mtime first and only re-hashed (sha256) when those change.  Each
+# successful stage also gets a fresh token that downstream stages include in their digest, so any rerun
+# of a stage invalidates everything that consumed its output.  Stages 7 and 8 rewrite the movie in place,
+# so a change to their own inputs has to restart from 5_create_movie ("rerun_from").  A stage with units
+# failure_utils still has attempts for is never current, so rerunning the run retries just those units.
+
+HASH_CHUNK_SIZE = 1024 * 1024
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stage_stamps (
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    input_digest TEXT NOT NULL,
+    token TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (run_id, stage)
+);
+CREATE TABLE IF NOT EXISTS file_digests (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+USER_CONFIG_KEYS = [
+    "USER_PROVIDED_EXACT_CHARACTER", "USER_PROVIDED_MAIN_CHARACTER_DESCRIPTION", "USER_PROVIDED_MAIN_CHARACTER_SUPERPOWER",
+    "USER_PROVIDED_GENDER", "USER_PROVIDED_NAME", "USER_PROVIDED_AGE", "USER_PROVIDED_NATIONALITY",
+    "USER_PROVIDED_MAIN_CHARACTER_HOME", "USER_PROVIDED_STORY_THEME", "USER_PROVIDED_ARTISTIC_STYLE", "USER_PROVIDED_IMAGE_PATH",
+]
+IMAGE_CONFIG_KEYS = [
+    "TOP_MODELS", "USER_PROVIDED_EXACT_CHARACTER", "USER_PROVIDED_IMAGE_PATH", "NUM_SAMPLES", "GUIDANCE_SCALE",
+    "DEFAULT_WIDTH", "DEFAULT_HEIGHT", "SEED", "CFG_SCALE", "NUMBER_OF_STEPS", "RANDOMIZE_SEED_VALUE",
+    "DISABLE_SAFETY_CHECKER", "NEGATIVE_PROMPTS", "ADD_COMPARISONS_TO_ENHANCED_VS_GENERATED", "ENHANCE_IMAGES", "MAX_INFERENCE_STEPS",
+]
+ENCODE_CONFIG_KEYS = ["FFMPEG_PRESET", "FFMPEG_CRF"]
+
+def _run_has_story(run_id):
+    return bool(run_index_utils.get_artifact("story", run_id) or run_index_utils.get_artifact("summaries", run_id))
+
+def _run_has_summaries(run_id):
+    return bool(run_index_utils.get_artifact("summaries", run_id))
+
+def _chapter_images_exist(run_id):
+    data = _load_run_story(run_id)
+    if not data or not data.get("story_chapters"):
+        return False
+    for chapter in data["story_chapters"]:
+        images = [value for key, value in chapter.items() if key.startswith("chapter_image_location_")]
+        if not images or not all(os.path.exists(image) for image in images):
+            return False
+    return True
+
+def _videos_exist(run_id):
+    videos = run_index_utils.get_artifacts("video_", run_id)
+    return bool(videos) and all(os.path.exists(path) for path in videos.values())
+
+def _voiceovers_exist(run_id):
+    data = _load_run_story(run_id) or {}
+    voiceovers = [value for key, value in data.items() if key.startswith("voiceover_created_video_location_")]
+    return bool(voiceovers) and all(os.path.exists(path) for path in voiceovers)
+
+# stage name -> declared inputs; "outputs" must hold for the stage to be skipped
+STAGE_INPUTS = {
+    "archive": {
+        "outputs": _run_has_story,
+    },
+    "1_dream_up_a_story": {
+        "config": ["GLOBAL_MODEL_NAME"] + USER_CONFIG_KEYS,
+        "models": ["GLOBAL_MODEL_NAME"],
+        "outputs": _run_has_story,
+    },
+    "2_build_out_chapters": {
+        "upstream": ["1_dream_up_a_story"],
+        "config": ["NUMBER_OF_CHAPTERS_PER_STORY", "SYNOPSIS_MODE", "USER_PROVIDED_TONE"],
+        "models": ["GLOBAL_MODEL_NAME"],
+        "outputs": _run_has_story,
+        "rerun_from": "1_dream_up_a_story",  # Stage 3 deletes the story JSON this stage extends
+    },
+    "3_summarize_chapters_add_ai_prompts": {
+        "upstream": ["2_build_out_chapters"],
+        "config": ["USE_LLM_NEGATIVE_PROMPTS", "DELETE_INITIAL_STORYLINE_JSON"],
+        "models": ["GLOBAL_MODEL_NAME"],
+        "outputs": _run_has_summaries,
+        "rerun_from": "1_dream_up_a_story",
+    },
+    "4_create_images_from_ai_prompts": {
+        "upstream": ["3_summarize_chapters_add_ai_prompts"],
+        "config": IMAGE_CONFIG_KEYS + ["4b_unique_character.py:SPECIFIC_SCHEDULER"],
+        "models": ["TOP_MODELS"],
+        "story_fields": ["artistic_style", "main_character_description", "main_character_gender", "main_character_age"],
+        "chapter_fields": ["positive_ai_prompt", "negative_ai_prompt"],
+        "outputs": _chapter_images_exist,
+    },
+    "5_create_movie": {
+        "config": ["DEFAULT_VIDEO_LENGTH", "USER_PROVIDED_YOUTUBE_MUSIC", "5_create_movie.py:SPEED_OF_SPEECH"] + ENCODE_CONFIG_KEYS,
+        "chapter_fields": ["chapter_summary", "chapter_image_location_"],
+        "chapter_files": ["chapter_image_location_"],
+        "outputs": _videos_exist,
+    },
+    "6_create_mosaic": {
+        "chapter_fields": ["chapter_image_location_"],
+        "chapter_files": ["chapter_image_location_"],
+    },
+    "7_zoompan_movie": {
+        "upstream": ["5_create_movie"],
+        "config": ["7_zoompan_movie.py:GLOBAL_PAN_SPEED", "7_zoompan_movie.py:ZOOM_PATTERN", "ZOOMPAN_ENABLED"] + ENCODE_CONFIG_KEYS,
+        "outputs": _videos_exist,
+        "rerun_from": "5_create_movie",
+    },
+    "8_add_ffmpeg_subtitles": {
+        "upstream": ["7_zoompan_movie"],
+        "config": [f"8_add_ffmpeg_subtitles.py:{name}" for name in
+                   ["FONT_SIZE", "FONT_COLOR", "BOX_COLOR", "BOX_BORDER_WIDTH", "SPACE_BETWEEN_LINES", "TEXT_ALIGNMENT"]] + ENCODE_CONFIG_KEYS,
+        "chapter_fields": ["chapter_summary"],
+        "outputs": _videos_exist,
+        "rerun_from": "5_create_movie",
+    },
+    "9_create_voiceover": {
+        "upstream": ["8_add_ffmpeg_subtitles"],
+        "config": [f"9_create_voiceover.py:{name}" for name in ["TTS_VOLUME_DB", "BACKGROUND_VOLUME_DB", "SPEED_OF_SPEECH"]],
+        "chapter_fields": ["chapter_summary"],
+        "outputs": _voiceovers_exist,
+    },
+}
+
+_module_constants_cache = {}
+_schema_ready = set()
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def get_connection():
+    connection = run_index_utils.get_connection()
+    if id(connection) not in _schema_ready:
+        connection.executescript(CACHE_SCHEMA)
+        _schema_ready.add(id(connection))
+    return connection
+
+def _load_run_story(run_id):
+    story_file = run_index_utils.get_artifact("summaries", run_id) or run_index_utils.get_artifact("story", run_id)
+    if not story_file:
+        return None
+    try:
+        return load_story(story_file)
+    except (OSError, ValueError):
+        return None
+
+def read_module_constants(script_path):
+    """Literal module-level constants of a stage script, read with ast so the stage is not imported."""
+    try:
+        mtime_ns = os.stat(script_path).st_mtime_ns
+    except OSError:
+        return {}
+    cached = _module_constants_cache.get(script_path)
+    if cached and cached[0] == mtime_ns:
+        return cached[1]
+    with open(script_path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=script_path)
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except (ValueError, TypeError, SyntaxError):
+                continue
+    _module_constants_cache[script_path] = (mtime_ns, constants)
+    return constants
+
+def get_config_value(key):
+    if ":" in key:
+        script_name, name = key.split(":", 1)
+        return read_module_constants(os.path.join(REPO_ROOT, script_name)).get(name)
+    return getattr(GLOBAL_VARIABLES, key, None)
+
+def file_digest(path):
+    """sha256 of a file, reusing the stored digest while its size and mtime are unchanged."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    connection = get_connection()
+    row = connection.execute("SELECT size, mtime_ns, sha256 FROM file_digests WHERE path = ?", (path,)).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+        return row[2]
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    digest = sha256.hexdigest()
+    connection.execute("INSERT OR REPLACE INTO file_digests (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                       (path, stat.st_size, stat.st_mtime_ns, digest))
+    return digest
+
+def _matches(key, prefixes):
+    return any(key == prefix or (prefix.endswith("_") and key.startswith(prefix)) for prefix in prefixes)
+
+def get_stamp(stage, run_id):
+    row = get_connection().execute(
+        "SELECT input_digest, token FROM stage_stamps WHERE run_id = ? AND stage = ?", (run_id, stage)).fetchone()
+    return row if row else (None, None)
+
+def compute_input_digest(stage, run_id):
+    """Digest of everything the stage declares as input for this run."""
+    spec = STAGE_INPUTS.get(stage, {})
+    inputs = {
+        "upstream": {name: get_stamp(name, run_id)[1] for name in spec.get("upstream", [])},
+        "config": {key: get_config_value(key) for key in spec.get("config", [])},
+        "models": {key: get_config_value(key) for key in spec.get("models", [])},
+    }
+    if spec.get("story_fields") or spec.get("chapter_fields"):
+        data = _load_run_story(run_id) or {}
+        inputs["story"] = {key: data.get(key) for key in spec.get("story_fields", [])}
+        chapters = []
+        for chapter in data.get("story_chapters", []):
+            if not isinstance(chapter, dict):
+                chapters.append(chapter)
+                continue
+            fields = {key: value for key, value in chapter.items() if _matches(key, spec.get("chapter_fields", []))}
+            files = {key: file_digest(value) for key, value in chapter.items()
+                     if _matches(key, spec.get("chapter_files", [])) and isinstance(value, str)}
+            chapters.append({"fields": fields, "files": files})
+        inputs["chapters"] = chapters
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def is_stage_current(stage, run_id, input_digest=None):
+    """True when the stage's stamp matches its current inputs, its outputs are still there and none of its units
+    is waiting for a retry (the stage then runs again and redoes just those units)."""
+    if stage not in STAGE_INPUTS or not run_id:
+        return False
+    if failure_utils.has_retryable(stage, run_id):
+        return False
+    stored_digest, _ = get_stamp(stage, run_id)
+    if stored_digest is None:
+        return False
+    if stored_digest != (input_digest or compute_input_digest(stage, run_id)):
+        return False
+    outputs = STAGE_INPUTS[stage].get("outputs")
+    return outputs(run_id) if outputs else True
+
+def save_stamp(stage, run_id, input_digest):
+    """Record a successful stage run; the new token invalidates downstream stamps."""
+    if stage not in STAGE_INPUTS or not run_id:
+        return
+    get_connection().execute(
+        "INSERT OR REPLACE INTO stage_stamps (run_id, stage, input_digest, token, created_at) VALUES (?, ?, ?, ?, ?)",
+        (run_id, stage, input_digest, uuid.uuid4().hex, _now()))
+
+def clear_stamps(run_id, stages=None):
+    if stages:
+        get_connection().executemany("DELETE FROM stage_stamps WHERE run_id = ? AND stage = ?", [(run_id, stage) for stage in stages])
+    else:
+        get_connection().execute("DELETE FROM stage_stamps WHERE run_id = ?", (run_id,))
+
+def plan_forced_stages(stage_names, run_id):
+    """Stages that must rerun although their own inputs are unchanged, because a later stage needs them to."""
+    forced = set()
+    for stage in stage_names:
+        rerun_from = STAGE_INPUTS.get(stage, {}).get("rerun_from")
+        if rerun_from in stage_names and rerun_from not in forced and get_stamp(stage, run_id)[0] is not None \
+                and not is_stage_current(stage, run_id):
+            forced.add(rerun_from)
+    return forced
@@ -0,0 +1,142 @@
+import os
+import json
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities.story_model_utils import dumps_json, loads_json
+except ImportError:  # Run as a script from utilities/
+    from story_model_utils import dumps_json, loads_json
+
+# Append-only journal of story JSON mutations.  Instead of rewriting the whole story/summaries file
+# after every chapter or image, each change is appended as one line to "<json file>.journal" and the
+# JSON snapshot is rewritten atomically (temp file + os.replace) every COMPACT_EVERY changes and on close.
+# load_story() replays the journal over the snapshot, so a crashed stage resumes from its last change.
+#
+# Every journal entry is a "set" of a key path; appends are recorded as a set at an explicit list index,
+# so replaying entries that already made it into the snapshot is harmless.  Snapshots are read and
+# written through story_model_utils' codec (orjson when installed).
+
+JOURNAL_SUFFIX = ".journal"
+COMPACT_EVERY = getattr(gv, 'STORY_JOURNAL_COMPACT_EVERY', 50)  # Journal entries between snapshot rewrites
+JOURNAL_FSYNC = getattr(gv, 'STORY_JOURNAL_FSYNC', False)  # fsync every entry (survives power loss, slower)
+
+def journal_path_for(json_path):
+    return json_path + JOURNAL_SUFFIX
+
+def _set_path(data, path, value):
+    """Set data[path[0]][path[1]]... = value; an int index equal to the list length appends."""
+    target = data
+    for key in path[:-1]:
+        target = target[key]
+    last = path[-1]
+    if isinstance(target, list) and last == len(target):
+        target.append(value)
+    else:
+        target[last] = value
+
+def read_journal(json_path):
+    """Yield the journal entries for a story file, ignoring a torn last line from a crash."""
+    journal_path = journal_path_for(json_path)
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[WARNING] Ignoring incomplete journal entry in {journal_path}")
+                return
+
+def load_story(json_path):
+    """Read a story JSON snapshot and replay any journaled changes on top of it."""
+    with open(json_path, 'rb') as f:
+        data = loads_json(f.read())
+    for entry in read_journal(json_path):
+        _set_path(data, entry["path"], entry["value"])
+    return data
+
+def write_json_atomic(data, json_path, indent=2, ensure_ascii=False):
+    """Write JSON to a temp file next to json_path and rename it over the original."""
+    temp_path = f"{json_path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(dumps_json(data, indent=indent, ensure_ascii=ensure_ascii))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, json_path)
+
+class StoryJournal:
+    """Journaled view of a story JSON file; mutate through set()/append()/update(), then close()."""
+
+    def __init__(self, json_path, data=None, compact_every=COMPACT_EVERY, indent=2):
+        self.json_path = json_path
+        self.journal_path = journal_path_for(json_path)
+        self.data = data if data is not None else load_story(json_path)
+        self.compact_every = compact_every
+        self.indent = indent
+        self.pending = 0
+        self._file = None
+        if data is None and os.path.exists(self.journal_path):
+            # Fold a crashed run's journal into the snapshot first, so new entries never follow a torn line
+            self.compact()
+
+    def _write_entry(self, path, value):
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({"path": path, "value": value}, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self._file.fileno())
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def set(self, path, value):
+        """Set a value at a key path, e.g. ["story_chapters", 3, "chapter_image_location_x"]."""
+        path = list(path)
+        _set_path(self.data, path, value)
+        self._write_entry(path, value)
+
+    def append(self, path, value):
+        """Append to the list at a key path."""
+        target = self.data
+        for key in path:
+            target = target[key]
+        self.set(list(path) + [len(target)], value)
+
+    def update(self, values):
+        """Set several top-level keys."""
+        for key, value in values.items():
+            self.set([key], value)
+
+    def compact(self):
+        """Fold the journal into the JSON snapshot atomically and start a new, empty journal."""
+        write_json_atomic(self.data, self.json_path, indent=self.indent)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.pending = 0
+
+    def close(self):
+        if self.pending or os.path.exists(self.journal_path):
+            self.compact()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On a crash the journal is left in place so the next load_story() replays it
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import argparse
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import orjson  # Optional; several times faster than json for the story files
+except ImportError:
+    orjson = None
+
+# Typed view of the story JSON the stages pass along.  On disk every stage still reads and writes the
+# legacy (schema 1) layout: per-model keys such as chapter_image_location_<model> on each chapter and
+# created_video_location_<model> / voiceover_created_video_location_<model> on the story.  Story.from_legacy()
+# folds those keys into per-model artifact records indexed by model (and by video file), and to_legacy()
+# writes them back, so a legacy story round-trips unchanged.
+#
+# Schema 2 is the compact layout of the same model ("chapters" with an "artifacts" map per model, "videos"
+# per model).  load_story_model() reads either layout and upgrades older ones through MIGRATIONS, one
+# version at a time, so a stage can move to the model without the files changing under the others.
+#   python utilities/story_model_utils.py -check storylines/story_x_summaries.json
+#   python utilities/story_model_utils.py -convert storylines/story_x_summaries.json
+
+LEGACY_SCHEMA_VERSION = 1  # Files without "schema_version"
+SCHEMA_VERSION = 2
+
+# Per-model chapter keys (prefix + model name) -> ChapterArtifacts attribute
+CHAPTER_ARTIFACT_PREFIXES = {
+    "chapter_image_location_": "image",
+    "chapter_image_profile_": "image_profile",
+    "chapter_segment_location_": "segment",
+}
+# Per-model story keys -> ModelVideos attribute; the longer prefix first, it contains the shorter one
+VIDEO_PREFIXES = {
+    "voiceover_created_video_location_": "voiceover",
+    "created_video_location_": "video",
+}
+# Legacy chapter keys -> Chapter attribute
+CHAPTER_FIELDS = {
+    "chapter": "text",
+    "chapter_summary": "summary",
+    "positive_ai_prompt": "positive_prompt",
+    "negative_ai_prompt": "negative_prompt",
+    "chapter_summary_start_time": "start_time",
+    "chapter_summary_end_time": "end_time",
+}
+
+# __slots__ keeps a long story's chapters compact; dataclass(slots=True) needs Python 3.10
+slotted = dataclass(slots=True) if sys.version_info >= (3, 10) else dataclass
+
+# ---------------------------------------------------------------- codec
+
+def dumps_json(data, indent=2, ensure_ascii=False):
+    """Serialize to UTF-8 JSON bytes (orjson when installed; it only indents by 2 and never escapes non-ASCII)."""
+    if orjson is not None and indent in (None, 2) and not ensure_ascii:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(data, indent=indent, ensure_ascii=ensure_ascii).encode("utf-8")
+
+def loads_json(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+# ---------------------------------------------------------------- model
+
+@slotted
+class ChapterArtifacts:
+    """What one diffusion model produced for a chapter."""
+    image: Optional[str] = None          # chapter_image_location_<model>
+    image_profile: Optional[str] = None  # chapter_image_profile_<model> (quality profile of the image)
+    segment: Optional[str] = None        # chapter_segment_location_<model> (stage 5 -stream)
+
+@slotted
+class ModelVideos:
+    """A model's finished videos for the whole story."""
+    video: Optional[str] = None      # created_video_location_<model> (stage 5)
+    voiceover: Optional[str] = None  # voiceover_created_video_location_<model> (stage 9)
+
+@slotted
+class Chapter:
+    index: int
+    text: Optional[str] = None
+    summary: Optional[str] = None
+    positive_prompt: Optional[str] = None
+    negative_prompt: Optional[str] = None
+    start_time: Optional[float] = None
+    end_time: Optional[float] = None
+    artifacts: Dict[str, ChapterArtifacts] = field(default_factory=dict)
+    extra: dict = field(default_factory=dict)  # Keys the model does not know, kept for the round trip
+    text_only: bool = False  # Stages 1-2 store a chapter as a bare string
+
+    @property
+    def number(self):
+        return self.index + 1
+
+    @property
+    def duration(self):
+        if self.start_time is None or self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def image_for(self, model_name):
+        artifacts = self.artifacts.get(model_name)
+        return artifacts.image if artifacts else None
+
+    @classmethod
+    def from_legacy(cls, index, value):
+        if isinstance(value, str):
+            return cls(index, text=value, text_only=True)
+        chapter = cls(index)
+        for key, item in value.items():
+            if key in CHAPTER_FIELDS:
+                setattr(chapter, CHAPTER_FIELDS[key], item)
+                continue
+            prefix = next((prefix for prefix in CHAPTER_ARTIFACT_PREFIXES if key.startswith(prefix)), None)
+            # chapter_image_location_<model>_subtitled keys are not images of a model; the stages skip them too
+            if prefix and not key.endswith("_subtitled"):
+                artifacts = chapter.artifacts.setdefault(key[len(prefix):], ChapterArtifacts())
+                setattr(artifacts, CHAPTER_ARTIFACT_PREFIXES[prefix], item)
+            else:
+                chapter.extra[key] = item
+        return chapter
+
+    def to_legacy(self):
+        if self.text_only:
+            return self.text
+        data = {}
+        for key, attribute in CHAPTER_FIELDS.items():
+            value = getattr(self, attribute)
+            if value is not None:
+                data[key] = value
+        for model_name, artifacts in self.artifacts.items():
+            for prefix, attribute in CHAPTER_ARTIFACT_PREFIXES.items():
+                value = getattr(artifacts, attribute)
+                if value is not None:
+                    data[prefix + model_name] = value
+        data.update(self.extra)
+        return data
+
+@slotted
+class Story:
+    chapters: List[Chapter] = field(default_factory=list)
+    videos: Dict[str, ModelVideos] = field(default_factory=dict)
+    tone: Optional[str] = None        # Tone the chapters were written in (stage 2's "tone")
+    story_tone: Optional[str] = None  # Tone stage 1 picked for the storyline
+    fields: dict = field(default_factory=dict)  # Every other top-level value (title, synopsis, character...)
+    _chapters_by_model: Optional[dict] = field(default=None, repr=False, compare=False)
+    _models_by_video: Optional[dict] = field(default=None, repr=False, compare=False)
+
+    @property
+    def effective_tone(self):
+        return self.tone or self.story_tone
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def chapter(self, number):
+        """Chapter by its 1-based number."""
+        return self.chapters[number - 1]
+
+    def reindex(self):
+        """Rebuild the lookups after changing chapters' artifacts or the videos."""
+        self._chapters_by_model = {}
+        for chapter in self.chapters:
+            for model_name in chapter.artifacts:
+                self._chapters_by_model.setdefault(model_name, []).append(chapter)
+        self._models_by_video = {}
+        for model_name, videos in self.videos.items():
+            for path in (videos.video, videos.voiceover):
+                if path:
+                    self._models_by_video[os.path.basename(path)] = model_name
+
+    def models(self):
+        """Models with an artifact in any chapter, in the order they first appear."""
+        if self._chapters_by_model is None:
+            self.reindex()
+        return list(self._chapters_by_model)
+
+    def chapters_for(self, model_name):
+        """The chapters the model has artifacts for, in story order."""
+        if self._chapters_by_model is None:
+            self.reindex()
+        return self._chapters_by_model.get(model_name, [])
+
+    def images_for(self, model_name):
+        """[(chapter, image path)] for the model's chapter images, in story order."""
+        return [(chapter, chapter.artifacts[model_name].image) for chapter in self.chapters_for(model_name)
+                if chapter.artifacts[model_name].image]
+
+    def model_for_video(self, video_path):
+        """The model whose created or voiceover video has this file name (a copy elsewhere matches too)."""
+        if self._models_by_video is None:
+            self.reindex()
+        return self._models_by_video.get(os.path.basename(video_path))
+
+    # ---------------------------------------------------------- legacy layout (schema 1)
+
+    @classmethod
+    def from_legacy(cls, data):
+        story = cls()
+        for key, value in data.items():
+            if key == "story_chapters":
+                story.chapters = [Chapter.from_legacy(index, chapter) for index, chapter in enumerate(value)]
+            elif key == "tone":
+                story.tone = value
+            elif key == "story_tone":
+                story.story_tone = value
+            else:
+                prefix = next((prefix for prefix in VIDEO_PREFIXES if key.startswith(prefix)), None)
+                if prefix:
+                    videos = story.videos.setdefault(key[len(prefix):], ModelVideos())
+                    setattr(videos, VIDEO_PREFIXES[prefix], value)
+                else:
+                    story.fields[key] = value
+        return story
+
+    def to_legacy(self):
+        data = dict(self.fields)
+        if self.story_tone is not None:
+            data["story_tone"] = self.story_tone
+        if self.tone is not None:
+            data["tone"] = self.tone
+        data["story_chapters"] = [chapter.to_legacy() for chapter in self.chapters]
+        for model_name, videos in self.videos.items():
+            for prefix, attribute in VIDEO_PREFIXES.items():
+                value = getattr(videos, attribute)
+                if value is not None:
+                    data[prefix + model_name] = value
+        return data
+
+    # ---------------------------------------------------------- compact layout (schema 2)
+
+    def to_dict(self):
+        chapters = []
+        for chapter in self.chapters:
+            entry = {"text": chapter.text} if chapter.text_only else {
+                attribute: getattr(chapter, attribute) for attribute in CHAPTER_FIELDS.values() if getattr(chapter, attribute) is not None}
+            if chapter.text_only:
+                entry["text_only"] = True
+            if chapter.artifacts:
+                entry["artifacts"] = {model_name: _non_null(artifacts, CHAPTER_ARTIFACT_PREFIXES.values())
+                                      for model_name, artifacts in chapter.artifacts.items()}
+            if chapter.extra:
+                entry["extra"] = chapter.extra
+            chapters.append(entry)
+        return {
+            "schema_version": SCHEMA_VERSION,
+            "tone": self.tone,
+            "story_tone": self.story_tone,
+            "fields": self.fields,
+            "chapters": chapters,
+            "videos": {model_name: _non_null(videos, VIDEO_PREFIXES.values()) for model_name, videos in self.videos.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = migrate(data)
+        chapters = []
+        for index, entry in enumerate(data["chapters"]):
+            chapter = Chapter(index, **{attribute: entry.get(attribute) for attribute in CHAPTER_FIELDS.values()})
+            chapter.text_only = entry.get("text_only", False)
+            chapter.artifacts = {model_name: ChapterArtifacts(**values) for model_name, values in entry.get("artifacts", {}).items()}
+            chapter.extra = entry.get("extra", {})
+            chapters.append(chapter)
+        return cls(chapters=chapters,
+                   videos={model_name: ModelVideos(**values) for model_name, values in data.get("videos", {}).items()},
+                   tone=data.get("tone"), story_tone=data.get("story_tone"), fields=data.get("fields", {}))
+
+def _non_null(record, attributes):
+    return {attribute: getattr(record, attribute) for attribute in attributes if getattr(record, attribute) is not None}
+
+# ---------------------------------------------------------------- migrations
+
+def schema_version(data):
+    return data.get("schema_version", LEGACY_SCHEMA_VERSION)
+
+def _upgrade_legacy(data):
+    return Story.from_legacy(data).to_dict()
+
+# version -> function upgrading a dict of that version to the next one
+MIGRATIONS = {
+    LEGACY_SCHEMA_VERSION: _upgrade_legacy,
+}
+
+def migrate(data):
+    """Upgrade a story dict of any known schema version to SCHEMA_VERSION."""
+    version = schema_version(data)
+    if version > SCHEMA_VERSION:
+        raise ValueError(f"Story schema {version} is newer than this code ({SCHEMA_VERSION}); update the repository")
+    while version < SCHEMA_VERSION:
+        data = MIGRATIONS[version](data)
+        version = schema_version(data)
+    return data
+
+def story_from_data(data):
+    """A Story from a dict of either layout."""
+    if schema_version(data) == LEGACY_SCHEMA_VERSION:
+        return Story.from_legacy(data)
+    return Story.from_dict(data)
+
+def load_story_model(json_path):
+    """Read a story file of either layout (replaying a legacy file's journal) as a Story."""
+    try:
+        from utilities.story_journal_utils import load_story
+    except ImportError:  # Run as a script from utilities/
+        from story_journal_utils import load_story
+    return story_from_data(load_story(json_path))
+
+def dumps_story(story, legacy=True, indent=2):
+    """JSON bytes for a Story; legacy=False writes the compact schema 2 layout."""
+    return dumps_json(story.to_legacy() if legacy else story.to_dict(), indent=indent)
+
+def check_round_trip(json_path):
+    """Problems found converting a story file to the model and back (an empty list when it round-trips)."""
+    with open(json_path, 'rb') as f:
+        data = loads_json(f.read())
+    problems = []
+    story = story_from_data(data)
+    if schema_version(data) == LEGACY_SCHEMA_VERSION and story.to_legacy() != data:
+        problems.append("legacy -> Story -> legacy changed the data")
+    if Story.from_dict(loads_json(dumps_story(story, legacy=False))).to_legacy() != story.to_legacy():
+        problems.append("schema 2 -> Story changed the data")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that story files round-trip through the typed model, or convert them to schema 2.")
+    parser.add_argument("files", nargs="+", help="Story JSON files.")
+    parser.add_argument("-check", action="store_true", help="Only check the round trip (the default).")
+    parser.add_argument("-convert", action="store_true", help="Write <name>.v2.json next to each file in the compact layout.")
+    args = parser.parse_args()
+
+    failures = 0
+    for json_path in args.files:
+        problems = check_round_trip(json_path)
+        failures += bool(problems)
+        print(f"[{'FAIL' if problems else 'ok'}] {json_path}" + "".join(f"\n       {problem}" for problem in problems))
+        if args.convert and not problems:
+            output_path = f"{os.path.splitext(json_path)[0]}.v2.json"
+            with open(output_path, 'wb') as f:
+                f.write(dumps_story(load_story_model(json_path), legacy=False))
+            print(f"       written to {output_path}")
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,322 @@
+import io
+import os
+import sys
+import json
+import mmap
+import shutil
+import struct
+import hashlib
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities import run_context_utils
+    from utilities.scratch_utils import ScratchSpace
+except ImportError:  # Run as a script from utilities/
+    import run_context_utils
+    from scratch_utils import ScratchSpace
+
+# A finished run as one file.  A story pack is a ZIP whose members are stored, not compressed, plus a
+# story_pack.json manifest giving each member's data offset, size and SHA-256, so a member is one slice of
+# the file and is read through mmap without extracting anything.  Any unzip tool can still open a pack.
+#   python utilities/story_pack_utils.py -pack run.storypack -run_id 20240101_120000_ab12cd
+#   python utilities/story_pack_utils.py -list run.storypack
+#   python utilities/story_pack_utils.py -unpack run.storypack [-dest somewhere]
+#   python run_all.py -pack run.storypack -stages 5_create_movie 6_create_mosaic
+# With -pack (or STORY_PACK=run.storypack) the stages read their inputs (story JSON, images, videos) from
+# the pack when they are not on disk: Python reads come straight from the mapped file, and files handed
+# to ffmpeg are copied into the scratch space (tmpfs when it fits).  Only the story JSON, which the
+# stages update, is written out to the run's storylines folder.
+
+PACK_ENV = "STORY_PACK"
+PACK_FORMAT = 1
+MANIFEST_NAME = "story_pack.json"
+PACK_FOLDERS = getattr(gv, 'STORY_PACK_FOLDERS', ["storylines", "enhanced_images", "created_videos", "final_voiceover_video", "mosaics"])
+PACK_SKIP_FOLDERS = {"replaced", "completed_videos"}  # Superseded videos; a pack carries the current ones
+LOCAL_HEADER = struct.Struct("<4s22xHH")  # Signature, then file name and extra field lengths at offset 26
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+def _member_name(path, root):
+    """Zip member name (forward slashes) of a path, relative to the run directory it was packed from."""
+    path = os.path.normpath(path)
+    if root and path.startswith(os.path.normpath(root) + os.sep):
+        path = os.path.relpath(path, root)
+    return path.replace(os.sep, "/")
+
+def _unsafe_member_name(name):
+    """True when a member name would land outside the extraction directory (absolute, a drive, or a .. part)."""
+    parts = name.replace("\\", "/").split("/")
+    return not name or name.startswith(("/", "\\")) or ":" in parts[0] or ".." in parts
+
+def _pack_files(root, folders):
+    for folder in folders:
+        base = os.path.join(root, folder) if root else folder
+        for directory, subdirectories, files in os.walk(base):
+            subdirectories[:] = sorted(d for d in subdirectories if d not in PACK_SKIP_FOLDERS)
+            for name in sorted(files):
+                if not name.endswith((".tmp", ".part.mp4")):
+                    yield os.path.join(directory, name)
+
+def _data_offsets(pack_path):
+    """{member name: offset of its data} read from the local file headers."""
+    offsets = {}
+    with open(pack_path, "rb") as f, zipfile.ZipFile(pack_path) as zf:
+        for info in zf.infolist():
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+            if signature != LOCAL_HEADER_SIGNATURE:
+                raise ValueError(f"{pack_path}: bad local header for {info.filename}")
+            offsets[info.filename] = info.header_offset + LOCAL_HEADER.size + name_length + extra_length
+    return offsets
+
+def write_pack(pack_path, run_id=None, folders=PACK_FOLDERS):
+    """Pack the active (or given) run's folders into pack_path; returns the manifest."""
+    from utilities import run_index_utils
+    run_id = run_id or run_context_utils.get_run_id() or run_index_utils.current_run_id()
+    run_dir = run_context_utils.run_dir_for(run_id) if run_id else None
+    root = run_dir if run_dir and os.path.isdir(run_dir) else ""
+    summary_file = run_index_utils.find_summary_file(run_id=run_id) if run_id else None
+
+    members = {}
+    temp_path = f"{pack_path}.tmp"
+    with zipfile.ZipFile(temp_path, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for path in _pack_files(root, folders):
+            name = _member_name(path, root)
+            digest = hashlib.sha256()
+            with open(path, "rb") as source, zf.open(name, "w", force_zip64=True) as target:
+                for block in iter(lambda: source.read(1 << 20), b""):
+                    digest.update(block)
+                    target.write(block)
+            members[name] = {"size": os.path.getsize(path), "sha256": digest.hexdigest()}
+
+    for name, offset in _data_offsets(temp_path).items():
+        members[name]["offset"] = offset
+    manifest = {
+        "format": PACK_FORMAT,
+        "run_id": run_id,
+        "root": root.replace(os.sep, "/"),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "summary": _member_name(summary_file, root) if summary_file else None,
+        "members": members,
+    }
+    with zipfile.ZipFile(temp_path, "a", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    os.replace(temp_path, pack_path)
+    return manifest
+
+class _MemberReader(io.RawIOBase):
+    """Seekable read-only file over one member's slice of the mapped pack."""
+
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), len(self.view) - self.position)
+        buffer[:count] = self.view[self.position:self.position + count]
+        self.position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: len(self.view)}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+class StoryPack:
+    """A story pack mapped into memory; members are read by name without extracting them."""
+
+    def __init__(self, pack_path):
+        self.path = pack_path
+        with zipfile.ZipFile(pack_path) as zf:
+            self.manifest = json.loads(zf.read(MANIFEST_NAME))
+        if self.manifest.get("format") != PACK_FORMAT:
+            raise ValueError(f"{pack_path}: unsupported story pack format {self.manifest.get('format')}")
+        self.members = self.manifest["members"]
+        names = list(self.members) + ([self.manifest["summary"]] if self.manifest.get("summary") else [])
+        unsafe = [name for name in names if _unsafe_member_name(name)]
+        if unsafe:
+            raise ValueError(f"{pack_path}: member names outside the run directory: {', '.join(unsafe)}")
+        self._file = open(pack_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(pack_path) else None
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def names(self, prefix=""):
+        return [name for name in self.members if name.startswith(prefix)]
+
+    def member_for(self, path):
+        """Member name of a path as the stages see it (relative, or under the packed run directory), or None."""
+        for root in (self.manifest.get("root"), run_context_utils.get_run_dir()):
+            name = _member_name(path, root.replace("/", os.sep) if root else root)
+            if name in self.members:
+                return name
+        return None
+
+    def read(self, name):
+        """The member's bytes as a memoryview into the mapped file (no copy)."""
+        member = self.members[name]
+        return memoryview(self._map)[member["offset"]:member["offset"] + member["size"]]
+
+    def open(self, name):
+        return io.BufferedReader(_MemberReader(self.read(name)))
+
+    def extract(self, name, destination):
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        with open(f"{destination}.tmp", "wb") as f:
+            f.write(self.read(name))
+        os.replace(f"{destination}.tmp", destination)
+        return destination
+
+    def verify(self):
+        """Names of the members whose SHA-256 does not match the manifest."""
+        return [name for name, member in self.members.items() if hashlib.sha256(self.read(name)).hexdigest() != member["sha256"]]
+
+_active = {}  # pack path -> StoryPack
+_inputs = {"scratch": None, "paths": {}}  # Members copied out for programs that need a file (ffmpeg)
+_lock = threading.Lock()
+
+def active_pack():
+    """The pack named by STORY_PACK, mapped once per process, or None."""
+    pack_path = os.environ.get(PACK_ENV)
+    if not pack_path:
+        return None
+    with _lock:
+        if pack_path not in _active:
+            _active[pack_path] = StoryPack(pack_path)
+        return _active[pack_path]
+
+def _pack_member(path):
+    if not path or os.path.exists(path):
+        return None, None
+    pack = active_pack()
+    return (pack, pack.member_for(path)) if pack else (None, None)
+
+def input_exists(path):
+    """True when a stage input is on disk or in the active pack."""
+    return os.path.exists(path) or _pack_member(path)[1] is not None
+
+def input_size(path):
+    pack, name = _pack_member(path)
+    return pack.members[name]["size"] if name else os.path.getsize(path)
+
+def open_input(path):
+    """Open a stage input for binary reading, from disk or straight from the active pack."""
+    pack, name = _pack_member(path)
+    return pack.open(name) if name else open(path, "rb")
+
+def copy_input(path, directory):
+    """Copy a stage input (from disk or the active pack) into directory; returns the copy's path."""
+    destination = os.path.join(directory, os.path.basename(path))
+    with open_input(path) as source, open(destination, "wb") as target:
+        shutil.copyfileobj(source, target)
+    return destination
+
+def local_input(path):
+    """A path a subprocess can read: the file itself, or the pack member copied into the scratch space."""
+    pack, name = _pack_member(path)
+    if not name:
+        return path
+    with _lock:
+        if name not in _inputs["paths"]:
+            if _inputs["scratch"] is None:
+                total = sum(member["size"] for member in pack.members.values())
+                _inputs["scratch"] = ScratchSpace("pack_inputs", os.path.join(run_context_utils.SCRATCH_FOLDER, "pack_inputs"), total).open()
+            _inputs["paths"][name] = pack.extract(name, _inputs["scratch"].path(*name.split("/")))
+        return _inputs["paths"][name]
+
+def list_folder(folder):
+    """Entries directly inside a folder, on disk and in the active pack."""
+    entries = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+    pack = active_pack()
+    if pack:
+        for root in (pack.manifest.get("root"), run_context_utils.get_run_dir()):
+            prefix = _member_name(folder, root.replace("/", os.sep) if root else root).rstrip("/") + "/"
+            entries.update(name[len(prefix):].split("/")[0] for name in pack.names(prefix))
+    return sorted(entries)
+
+def use_pack(pack_path):
+    """Make the stages of this process (and its children) read their inputs from pack_path.
+
+    The story JSON is written out to the run's storylines folder, since the stages update it; returns the run id.
+    """
+    from utilities import run_index_utils
+    os.environ[PACK_ENV] = os.path.abspath(pack_path)
+    pack = active_pack()
+    run_id = pack.manifest.get("run_id")
+    summary = pack.manifest.get("summary")
+    if run_id:
+        run_index_utils.start_run(run_id, activate=False)
+        if pack.manifest.get("root"):
+            run_context_utils.activate_run(run_id)  # Packed from runs/<run_id>/: work in this node's copy of it
+    if summary:
+        summary_path = run_context_utils.run_path(*summary.split("/"))
+        if not os.path.exists(summary_path):
+            pack.extract(summary, summary_path)
+        run_index_utils.record_artifact("summaries", summary_path, stage="story_pack", run_id=run_id)
+    return run_id
+
+def unpack(pack_path, destination=None):
+    """Extract every member (checking its SHA-256) under destination, by default where the run was packed from."""
+    with StoryPack(pack_path) as pack:
+        destination = destination if destination is not None else pack.manifest.get("root", "").replace("/", os.sep)
+        for name, member in pack.members.items():
+            if hashlib.sha256(pack.read(name)).hexdigest() != member["sha256"]:
+                raise ValueError(f"{pack_path}: {name} is corrupt")
+            pack.extract(name, os.path.join(destination, *name.split("/")))
+        return destination or "."
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack a run into one file, or list, verify or unpack a story pack.")
+    parser.add_argument("-pack", type=str, metavar="PACK", help="Write the run to this story pack.")
+    parser.add_argument("-run_id", type=str, help="Run to pack (default: the active or most recent run).")
+    parser.add_argument("-list", type=str, metavar="PACK", help="List the members of a story pack.")
+    parser.add_argument("-verify", type=str, metavar="PACK", help="Check every member's SHA-256.")
+    parser.add_argument("-unpack", type=str, metavar="PACK", help="Extract a story pack.")
+    parser.add_argument("-dest", type=str, help="Where to unpack (default: the run directory it was packed from).")
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    if args.pack:
+        manifest = write_pack(args.pack, args.run_id)
+        total = sum(member["size"] for member in manifest["members"].values())
+        print(f"Packed run {manifest['run_id']}: {len(manifest['members'])} files, {total / 2**20:.1f} MB -> {args.pack}")
+    elif args.list:
+        with StoryPack(args.list) as pack:
+            print(f"Run {pack.manifest['run_id']} packed {pack.manifest['created_at']} (story: {pack.manifest['summary']})")
+            for name, member in sorted(pack.members.items()):
+                print(f"{member['size']:>12}  {member['offset']:>12}  {name}")
+    elif args.verify:
+        with StoryPack(args.verify) as pack:
+            corrupt = pack.verify()
+        print("\n".join(f"Corrupt: {name}" for name in corrupt) or f"All {len(pack.members)} members OK")
+        sys.exit(1 if corrupt else 0)
+    elif args.unpack:
+        print(f"Unpacked to {unpack(args.unpack, args.dest)}")
+    else:
+        parser.print_help()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import hashlib
+import functools
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+try:
+    from utilities import run_context_utils
+except ImportError:  # Run as a script from utilities/
+    import run_context_utils
+
+# Lightweight span tracing for one run's wall time: stages, LLM calls, diffusion calls, image
+# enhancement, gTTS requests and ffmpeg/ffprobe subprocesses.  Spans nest through a context variable;
+# propagate() carries the current span into worker threads and traced_run() into child processes
+# (STORY_TRACE_PARENT), so a child's spans hang under the span that started it.
+#
+# Each process appends its finished spans to traces/<run_id>.events.jsonl; export_chrome_trace() turns
+# that into traces/<run_id>.trace.json (Chrome trace events, open in https://ui.perfetto.dev) and
+# export_otlp_json() into OpenTelemetry OTLP/JSON.  Enable with STORY_TRACE=1 or TRACING_ENABLED.
+# Observers (add_observer(), e.g. metrics_utils) see every finished span even with tracing off.
+
+TRACE_ENV = "STORY_TRACE"
+TRACE_PARENT_ENV = "STORY_TRACE_PARENT"  # "<trace id>-<span id>" of the span that started this process
+TRACES_FOLDER = os.environ.get("STORY_TRACES_FOLDER", "traces")
+NO_RUN = "no_run"
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_pending = {}  # run id -> finished span events not yet written
+_lock = threading.Lock()
+_observers = []  # Called with (span, seconds) for every finished span
+
+def is_enabled():
+    return os.environ.get(TRACE_ENV, "1" if getattr(gv, 'TRACING_ENABLED', False) else "0") == "1"
+
+def is_recording():
+    """True when spans are timed at all: tracing is on or someone observes them."""
+    return bool(_observers) or is_enabled()
+
+def add_observer(observer):
+    """Call observer(span, seconds) for every span that finishes in this process, traced or not."""
+    if observer not in _observers:
+        _observers.append(observer)
+
+def enable():
+    """Turn tracing on for this process and the processes it starts."""
+    os.environ[TRACE_ENV] = "1"
+
+def trace_id_for(run_id):
+    """All processes working on a run share one trace id derived from the run id."""
+    return hashlib.sha256((run_id or NO_RUN).encode("utf-8")).hexdigest()[:32]
+
+def _inherited_parent():
+    value = os.environ.get(TRACE_PARENT_ENV, "")
+    return value.split("-", 1)[1] if "-" in value else None
+
+class Span:
+    __slots__ = ("name", "category", "span_id", "parent_id", "start_ns", "attributes")
+
+    def __init__(self, name, category, parent_id, attributes):
+        self.name = name
+        self.category = category
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.attributes = attributes
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+def _record(span, end_ns):
+    run_id = run_context_utils.get_run_id() or NO_RUN
+    event = {
+        "name": span.name,
+        "cat": span.category,
+        "ph": "X",
+        "ts": span.start_ns / 1000,
+        "dur": (end_ns - span.start_ns) / 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_native_id(),
+        "args": dict(span.attributes, span_id=span.span_id, parent_span_id=span.parent_id, trace_id=trace_id_for(run_id)),
+    }
+    with _lock:
+        _pending.setdefault(run_id, []).append(event)
+
+@contextmanager
+def span(name, category="function", **attributes):
+    """Time a block as a span nested under the current one; yields the Span (or None when nothing records spans)."""
+    if not is_recording():
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, category, parent.span_id if parent else _inherited_parent(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set("error", repr(e)[:200])
+        raise
+    finally:
+        _current_span.reset(token)
+        end_ns = time.time_ns()
+        if is_enabled():
+            _record(current, end_ns)
+        for observer in _observers:
+            try:
+                observer(current, (end_ns - current.start_ns) / 1e9)
+            except Exception as e:  # Measuring must never fail the work being measured
+                print(f"[WARNING] Span observer {getattr(observer, '__name__', observer)} failed: {e}")
+
+def traced(name=None, category="function"):
+    """Decorator form of span(); the span is named after the function unless name is given."""
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not is_recording():
+                return function(*args, **kwargs)
+            with span(span_name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def propagate(function):
+    """Wrap function so it runs in a copy of the caller's context (current span, run) in any thread."""
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
+
+def child_env(env=None):
+    """Environment for a child process that continues the current trace."""
+    env = dict(os.environ if env is None else env)
+    current = _current_span.get()
+    if current is not None:
+        env[TRACE_PARENT_ENV] = f"{trace_id_for(run_context_utils.get_run_id())}-{current.span_id}"
+    return env
+
+def traced_run(command, *args, **kwargs):
+    """subprocess.run() inside a span named after the program (ffmpeg, ffprobe, ...)."""
+    if not is_recording():
+        return subprocess.run(command, *args, **kwargs)
+    program = os.path.basename(command[0] if isinstance(command, (list, tuple)) else str(command).split()[0])
+    command_text = " ".join(str(part) for part in command) if isinstance(command, (list, tuple)) else str(command)
+    with span(program, "subprocess", command=command_text[:300]) as current:
+        kwargs["env"] = child_env(kwargs.get("env"))
+        result = subprocess.run(command, *args, **kwargs)
+        current.set("returncode", result.returncode)
+        return result
+
+def events_path(run_id):
+    return os.path.join(TRACES_FOLDER, f"{run_id or NO_RUN}.events.jsonl")
+
+def flush():
+    """Append this process's finished spans to the per-run event files."""
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+    if not pending:
+        return
+    os.makedirs(TRACES_FOLDER, exist_ok=True)
+    for run_id, events in pending.items():
+        with open(events_path(run_id), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event) + "\n" for event in events))
+
+atexit.register(flush)
+
+def load_events(run_id):
+    flush()
+    path = events_path(run_id)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def export_chrome_trace(run_id, output_path=None):
+    """Write the run's spans (from every process) as a Chrome trace-event file; returns its path or None."""
+    events = load_events(run_id)
+    if not events:
+        return None
+    output_path = output_path or os.path.join(TRACES_FOLDER, f"{run_id}.trace.json")
+    metadata = [{"name": "process_name", "ph": "M", "pid": pid, "args": {"name": f"pipeline {pid}"}}
+                for pid in sorted({event["pid"] for event in events})]
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+                   "displayTimeUnit": "ms", "otherData": {"run_id": run_id}}, f)
+    return output_path
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def export_otlp_json(run_id, output_path=None):
+    """Write the run's spans as OpenTelemetry OTLP/JSON (resourceSpans); returns its path or None."""
+    events = load_events(run_id)
+    if not events:
+        return None
+    spans = []
+    for event in events:
+        args = dict(event["args"])
+        span_id, parent_id, trace_id = args.pop("span_id"), args.pop("parent_span_id"), args.pop("trace_id")
+        args.update({"category": event["cat"], "process.pid": event["pid"], "thread.id": event["tid"]})
+        start_ns = int(event["ts"] * 1000)
+        spans.append({
+            "traceId": trace_id, "spanId": span_id, "parentSpanId": parent_id or "",
+            "name": event["name"], "kind": 1,
+            "startTimeUnixNano": str(start_ns), "endTimeUnixNano": str(start_ns + int(event["dur"] * 1000)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in args.items() if value is not None],
+            "status": {"code": 2, "message": args["error"]} if "error" in args else {},
+        })
+    output_path = output_path or os.path.join(TRACES_FOLDER, f"{run_id}.otlp.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "ai_storyboard_video_generator"}},
+                                        {"key": "run.id", "value": {"stringValue": run_id}}]},
+            "scopeSpans": [{"scope": {"name": "tracing_utils"}, "spans": spans}],
+        }]}, f)
+    return output_path
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export a run's recorded spans as a Chrome trace and OTLP JSON.")
+    parser.add_argument("-run_id", type=str, help="Run to export (default: the active run).")
+    args = parser.parse_args()
+    run_id = args.run_id or run_context_utils.get_run_id() or NO_RUN
+    trace_file = export_chrome_trace(run_id)
+    if trace_file:
+        print(f"Chrome trace: {trace_file}\nOTLP JSON: {export_otlp_json(run_id)}")
+    else:
+        print(f"No spans recorded for run {run_id} in {TRACES_FOLDER}/")
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import sqlite3
+from datetime import datetime
+
+try:
+    import GLOBAL_VARIABLES as gv
+except ImportError:
+    class gv:
+        pass
+
+# Work queue for running pipeline stages on different machines.  Every stage of a run becomes a job
+# with a resource class; a worker (queue_worker.py) only claims jobs of the classes it was started
+# with, e.g. "llm gpu" on the GPU box and "cpu" on cheaper nodes for the FFmpeg/TTS stages.
+# A job becomes claimable once the stage it depends on is done.  Workers exchange artifacts through
+# the run directories (runs/<run_id>/, see run_context_utils): when workers live on different machines,
+# either RUNS_ROOT is on storage every worker can reach (e.g. an NFS mount) or the workers share an
+# artifact store (queue_worker.py -artifact_store, see artifact_store_utils) that they pull a run's files
+# from before each job and push them to after it.
+#
+# Backends: SqliteWorkQueue (one machine, or a shared disk with proper locking) and RedisWorkQueue
+# (any Redis-compatible server; utilities/fake_redis_server.py is a local stand-in for testing).
+
+QUEUE_URL = os.environ.get("STORY_QUEUE_URL", getattr(gv, 'WORK_QUEUE_URL', "sqlite:///work_queue.sqlite"))
+LEASE_SECONDS = getattr(gv, 'WORK_QUEUE_LEASE_SECONDS', 600)  # A running job whose worker stops heartbeating is handed out again
+MAX_ATTEMPTS = getattr(gv, 'WORK_QUEUE_MAX_ATTEMPTS', 2)
+
+# stage -> resource class a worker must offer to run it
+RESOURCE_CLASSES = {
+    "1_dream_up_a_story": "llm",
+    "2_build_out_chapters": "llm",
+    "3_summarize_chapters_add_ai_prompts": "llm",
+    "4_create_images_from_ai_prompts": "gpu",
+    "4b_unique_character": "gpu",
+    "5_create_movie": "cpu",
+    "6_create_mosaic": "cpu",
+    "7_zoompan_movie": "cpu",
+    "8_add_ffmpeg_subtitles": "cpu",
+    "9_create_voiceover": "cpu",
+}
+ALL_RESOURCES = ["llm", "gpu", "cpu"]
+
+# stage -> the stage whose output it reads; the mosaic only needs the images, so it can run next to the movie stages
+STAGE_DEPENDS_ON = {
+    "2_build_out_chapters": "1_dream_up_a_story",
+    "3_summarize_chapters_add_ai_prompts": "2_build_out_chapters",
+    "4_create_images_from_ai_prompts": "3_summarize_chapters_add_ai_prompts",
+    "4b_unique_character": "3_summarize_chapters_add_ai_prompts",
+    "5_create_movie": "4_create_images_from_ai_prompts",
+    "6_create_mosaic": "4_create_images_from_ai_prompts",
+    "7_zoompan_movie": "5_create_movie",
+    "8_add_ffmpeg_subtitles": "7_zoompan_movie",
+    "9_create_voiceover": "8_add_ffmpeg_subtitles",
+}
+
+# Job states: waiting (dependency not done) -> ready -> running -> done | failed; dependents of a failed job are cancelled
+WAITING, READY, RUNNING, DONE, FAILED, CANCELLED = "waiting", "ready", "running", "done", "failed", "cancelled"
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+def plan_jobs(stages):
+    """Return [(stage, resource, dependency stage or None)] for the stages, in the order given.
+
+    A stage that depends on a stage not in the list waits for its nearest listed ancestor instead.
+    """
+    selected = set(stages)
+    planned = []
+    for stage in stages:
+        if stage not in RESOURCE_CLASSES:
+            raise ValueError(f"No resource class for stage: {stage}")
+        parent = STAGE_DEPENDS_ON.get(stage)
+        while parent and parent not in selected:
+            parent = STAGE_DEPENDS_ON.get(parent)
+        planned.append((stage, RESOURCE_CLASSES[stage], parent))
+    return planned
+
+class SqliteWorkQueue:
+    """Work queue in a SQLite file; claims run inside BEGIN IMMEDIATE so two workers never get the same job."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        resource TEXT NOT NULL,
+        status TEXT NOT NULL,
+        depends_on INTEGER,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_until REAL,
+        error TEXT,
+        created_at TEXT NOT NULL,
+        started_at REAL,
+        finished_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, resource, job_id);
+    CREATE INDEX IF NOT EXISTS jobs_depends_on ON jobs (depends_on);
+    """
+    # Columns added after the first release: (column, type); queue files made before them get them on open
+    MIGRATIONS = [("started_at", "REAL")]
+
+    def __init__(self, path="work_queue.sqlite", lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in self.MIGRATIONS:
+            if column not in columns:
+                try:
+                    self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                except sqlite3.OperationalError:  # Another worker added it first
+                    pass
+
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def enqueue_run(self, run_id, stages):
+        """Add one job per stage of the run; returns {stage: job_id}."""
+        job_ids = {}
+        self._transaction()
+        try:
+            for stage, resource, parent in plan_jobs(stages):
+                depends_on = job_ids.get(parent)
+                cursor = self.connection.execute(
+                    "INSERT INTO jobs (run_id, stage, resource, status, depends_on, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (run_id, stage, resource, WAITING if depends_on else READY, depends_on, _now()))
+                job_ids[stage] = cursor.lastrowid
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return job_ids
+
+    def claim(self, resources, worker_id):
+        """Hand the oldest ready job of one of the resource classes to worker_id, or return None."""
+        self._transaction()
+        try:
+            self._release_expired()
+            placeholders = ", ".join("?" for _ in resources)
+            row = self.connection.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND resource IN ({placeholders}) ORDER BY job_id LIMIT 1",
+                (READY, *resources)).fetchone()
+            if row is None:
+                self.connection.execute("COMMIT")
+                return None
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_until = ?, started_at = ? WHERE job_id = ?",
+                (RUNNING, worker_id, time.time() + self.lease_seconds, time.time(), row["job_id"]))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        job = dict(row)
+        job.update(status=RUNNING, worker=worker_id, attempts=job["attempts"] + 1)
+        return job
+
+    def heartbeat(self, job_id, worker_id):
+        """Extend the lease of a running job; False if the job was taken away from this worker."""
+        cursor = self.connection.execute(
+            "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker = ? AND status = ?",
+            (time.time() + self.lease_seconds, job_id, worker_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id):
+        """Mark the job done and release its dependents; False (and no change) if it is no longer leased to worker_id."""
+        self._transaction()
+        try:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = ?, lease_until = NULL, finished_at = ? WHERE job_id = ? AND worker = ? AND status = ?",
+                (DONE, time.time(), job_id, worker_id, RUNNING))
+            if cursor.rowcount == 1:
+                self.connection.execute("UPDATE jobs SET status = ? WHERE depends_on = ? AND status = ?", (READY, job_id, WAITING))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker_id, error=""):
+        """Put the job back for another attempt, or fail it (and cancel its dependents) after max_attempts.
+
+        Returns False (and changes nothing) if the job is no longer leased to worker_id.
+        """
+        self._transaction()
+        try:
+            leased = self.connection.execute(
+                "SELECT 1 FROM jobs WHERE job_id = ? AND worker = ? AND status = ?", (job_id, worker_id, RUNNING)).fetchone() is not None
+            if leased:
+                self._fail(job_id, error)
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return leased
+
+    def _fail(self, job_id, error):
+        attempts = self.connection.execute("SELECT attempts FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+        if attempts < self.max_attempts:
+            self.connection.execute("UPDATE jobs SET status = ?, worker = NULL, lease_until = NULL, error = ? WHERE job_id = ?", (READY, error, job_id))
+            return
+        self.connection.execute("UPDATE jobs SET status = ?, lease_until = NULL, error = ?, finished_at = ? WHERE job_id = ?", (FAILED, error, time.time(), job_id))
+        pending = [job_id]
+        while pending:
+            parent = pending.pop()
+            children = [row[0] for row in self.connection.execute("SELECT job_id FROM jobs WHERE depends_on = ? AND status = ?", (parent, WAITING))]
+            for child in children:
+                self.connection.execute("UPDATE jobs SET status = ?, finished_at = ? WHERE job_id = ?", (CANCELLED, time.time(), child))
+            pending.extend(children)
+
+    def _release_expired(self):
+        expired = self.connection.execute("SELECT job_id FROM jobs WHERE status = ? AND lease_until < ?", (RUNNING, time.time())).fetchall()
+        for row in expired:
+            self._fail(row[0], "lease expired")
+
+    def jobs(self, run_id=None):
+        query, params = "SELECT * FROM jobs", ()
+        if run_id:
+            query, params = query + " WHERE run_id = ?", (run_id,)
+        return [dict(row) for row in self.connection.execute(query + " ORDER BY job_id", params)]
+
+    def pending_count(self, resources=None):
+        """Jobs that are waiting, ready or running (optionally only of these resource classes)."""
+        query, params = "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?, ?)", (WAITING, READY, RUNNING)
+        if resources:
+            query += f" AND resource IN ({', '.join('?' for _ in resources)})"
+            params += tuple(resources)
+        return self.connection.execute(query, params).fetchone()[0]
+
+class RedisWorkQueue:
+    """Work queue on a Redis-compatible server: one hash per job and one ready list per resource class.
+
+    Claims use RPOPLPUSH from the ready list onto the running list, which is atomic on the server.
+    """
+
+    def __init__(self, client, prefix="storyq", lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.client = client
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        import redis  # Optional dependency, only needed for the Redis backend
+        return cls(redis.Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + tuple(str(part) for part in parts))
+
+    def _make_ready(self, job_id, resource):
+        self.client.hset(self._key("job", job_id), mapping={"status": READY, "worker": "", "lease_until": ""})
+        self.client.lpush(self._key("ready", resource), job_id)
+
+    def enqueue_run(self, run_id, stages):
+        job_ids = {}
+        for stage, resource, parent in plan_jobs(stages):
+            job_id = self.client.incr(self._key("next_id"))
+            depends_on = job_ids.get(parent)
+            self.client.hset(self._key("job", job_id), mapping={
+                "job_id": job_id, "run_id": run_id, "stage": stage, "resource": resource,
+                "status": WAITING, "depends_on": depends_on or "", "attempts": 0, "worker": "",
+                "lease_until": "", "error": "", "created_at": _now(), "started_at": "", "finished_at": "",
+            })
+            self.client.rpush(self._key("jobs"), job_id)
+            if depends_on:
+                self.client.rpush(self._key("children", depends_on), job_id)
+            else:
+                self._make_ready(job_id, resource)
+            job_ids[stage] = job_id
+        return job_ids
+
+    def _job(self, job_id):
+        job = self.client.hgetall(self._key("job", job_id))
+        if not job:
+            return None
+        for field in ("job_id", "depends_on", "attempts"):
+            job[field] = int(job[field]) if job.get(field) else None
+        for field in ("lease_until", "started_at", "finished_at"):
+            job[field] = float(job[field]) if job.get(field) else None
+        return job
+
+    def claim(self, resources, worker_id):
+        self._release_expired()
+        for resource in resources:
+            job_id = self.client.rpoplpush(self._key("ready", resource), self._key("running"))
+            if job_id is None:
+                continue
+            self.client.hincrby(self._key("job", job_id), "attempts", 1)
+            self.client.hset(self._key("job", job_id), mapping={
+                "status": RUNNING, "worker": worker_id, "lease_until": time.time() + self.lease_seconds, "started_at": time.time()})
+            return self._job(job_id)
+        return None
+
+    def heartbeat(self, job_id, worker_id):
+        job = self._job(job_id)
+        if not job or job["status"] != RUNNING or job["worker"] != worker_id:
+            return False
+        self.client.hset(self._key("job", job_id), "lease_until", time.time() + self.lease_seconds)
+        return True
+
+    def _release_lease(self, job_id, worker_id):
+        """Take the job off the running list if worker_id still holds it; only one caller can win the LREM."""
+        job = self._job(job_id)
+        if not job or job["status"] != RUNNING or job["worker"] != worker_id:
+            return False
+        return bool(self.client.lrem(self._key("running"), 0, job_id))
+
+    def complete(self, job_id, worker_id):
+        if not self._release_lease(job_id, worker_id):
+            return False
+        self.client.hset(self._key("job", job_id), mapping={"status": DONE, "lease_until": "", "finished_at": time.time()})
+        for child in self.client.lrange(self._key("children", job_id), 0, -1):
+            child_job = self._job(child)
+            if child_job and child_job["status"] == WAITING:
+                self._make_ready(child, child_job["resource"])
+        return True
+
+    def fail(self, job_id, worker_id, error=""):
+        if not self._release_lease(job_id, worker_id):
+            return False
+        self._fail(job_id, error)
+        return True
+
+    def _fail(self, job_id, error):
+        job = self._job(job_id)
+        if job["attempts"] < self.max_attempts:
+            self.client.hset(self._key("job", job_id), "error", error)
+            self._make_ready(job_id, job["resource"])
+            return
+        self.client.hset(self._key("job", job_id), mapping={"status": FAILED, "lease_until": "", "error": error, "finished_at": time.time()})
+        pending = [job_id]
+        while pending:
+            parent = pending.pop()
+            for child in self.client.lrange(self._key("children", parent), 0, -1):
+                child_job = self._job(child)
+                if child_job and child_job["status"] == WAITING:
+                    self.client.hset(self._key("job", child), mapping={"status": CANCELLED, "finished_at": time.time()})
+                    pending.append(child)
+
+    def _release_expired(self):
+        now = time.time()
+        for job_id in self.client.lrange(self._key("running"), 0, -1):
+            job = self._job(job_id)
+            if job and job["lease_until"] and job["lease_until"] < now:
+                # Only the worker whose LREM removed the entry re-queues the job
+                if self.client.lrem(self._key("running"), 0, job_id):
+                    self._fail(job_id, "lease expired")
+
+    def jobs(self, run_id=None):
+        jobs = [self._job(job_id) for job_id in self.client.lrange(self._key("jobs"), 0, -1)]
+        return [job for job in jobs if job and (not run_id or job["run_id"] == run_id)]
+
+    def pending_count(self, resources=None):
+        return sum(1 for job in self.jobs()
+                   if job["status"] in (WAITING, READY, RUNNING) and (not resources or job["resource"] in resources))
+
+def open_queue(url=None, **kwargs):
+    """Open the queue named by url: redis://host:port/db, sqlite:///path.sqlite or a plain file path."""
+    url = url or QUEUE_URL
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue.from_url(url, **kwargs)
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SqliteWorkQueue(url, **kwargs)
+
+def format_jobs(jobs):
+    lines = []
+    for job in jobs:
+        line = f"{job['job_id']:>5}  {job['run_id']}  {job['stage']:<36} {job['resource']:<4} {job['status']:<9} attempts={job['attempts']}"
+        if job.get("worker"):
+            line += f"  worker={job['worker']}"
+        if job.get("error"):
+            line += f"  error={json.dumps(job['error'])[:80]}"
+        lines.append(line)
+    return "\n".join(lines)
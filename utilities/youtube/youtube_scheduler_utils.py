@@ -15,6 +15,12 @@ from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import argparser, run_flow
 
+try:
+    from utilities.failure_utils import StageFailure, UnitFailure
+except ImportError:  # Run as a script from utilities/youtube/
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from failure_utils import StageFailure, UnitFailure
+
 # GLOBAL_VARIABLES
 DAILY_POST_FREQUENCY_SCHEDULE = 3
 MAXIMUM_UPLOADS_PER_RUN = 1
@@ -134,7 +140,7 @@ def resumable_upload(insert_request):
                     print(f"Unexpected uploadStatus value: {response['status'].get('uploadStatus')}")
                     print("Full response for debugging:")
                     print(json.dumps(response, indent=4))
-                    exit(f"The upload failed with an unexpected response: {response}")
+                    raise UnitFailure(f"The upload failed with an unexpected response: {response}", "videos.insert")
         except HttpError as e:
             if e.resp.status in RETRIABLE_STATUS_CODES:
                 error = f"A retriable HTTP error {e.resp.status} occurred:\n{e.content}"
@@ -143,12 +149,13 @@ def resumable_upload(insert_request):
                 print("HTTP 400 Error occurred.")
                 print(e.content)
                 log_quota_usage("videos.insert", QUOTA_COSTS.get("videos.insert", 1600), "Failed", "HTTP 400 Error")
-                sys.exit(1)
+                raise UnitFailure(f"HTTP 400: {e.content}", "videos.insert")
             elif e.resp.status == QUOTA_EXCEEDED_STATUS_CODE:
                 print("Quota exceeded.")
                 print(e.content)
                 log_quota_usage("videos.insert", QUOTA_COSTS.get("videos.insert", 1600), "Failed", "Quota exceeded")
-                sys.exit(1)
+                # No further upload can succeed today
+                raise StageFailure("YouTube quota exceeded")
             else:
                 raise
         except RETRIABLE_EXCEPTIONS as e:
@@ -159,7 +166,7 @@ def resumable_upload(insert_request):
             retry += 1
             if retry > MAX_RETRIES:
                 log_quota_usage("videos.insert", QUOTA_COSTS.get("videos.insert", 1600), "Failed", "Max retries exceeded")
-                exit("No longer attempting to retry.")
+                raise UnitFailure(f"No longer attempting to retry after {MAX_RETRIES} retries: {error}", "videos.insert", transient=True)
             max_sleep = 2 ** retry
             sleep_seconds = random.random() * max_sleep
             time.sleep(sleep_seconds)
@@ -322,6 +329,9 @@ if __name__ == '__main__':
         else:
             print(e.content)
             log_quota_usage("general", 0, "Failed", f"HTTP Error: {e.resp.status}")
+    except (StageFailure, UnitFailure) as e:
+        print(f"[ERROR] Upload failed: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"Unexpected error: {str(e)}")
         sys.exit(1)
\ No newline at end of file
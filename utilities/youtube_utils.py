@@ -13,6 +13,11 @@ from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import argparser, run_flow
 
+try:
+    from utilities.failure_utils import StageFailure, UnitFailure
+except ImportError:  # Run as a script from utilities/
+    from failure_utils import StageFailure, UnitFailure
+
 # Constants and configurations
 httplib2.RETRIES = 1
 MAX_RETRIES = 10
@@ -233,16 +238,18 @@ def resumable_upload(insert_request, next_publish_time, title):
                     print(f"Full Response: {response}")
                     print(f"Response Details: {response}")
                 else:
-                    exit(f"The upload failed with an unexpected response: {response}")
+                    raise UnitFailure(f"The upload failed with an unexpected response: {response}", "videos.insert")
         except HttpError as e:
             if e.resp.status in RETRIABLE_STATUS_CODES:
                 error = f"A retriable HTTP error {e.resp.status} occurred:\n{e.content}"
             elif e.resp.status == QUOTA_EXCEEDED_STATUS_CODE:
                 error_response = json.loads(e.content)
                 print(f"Quota exceeded. Cannot proceed with the upload at this time. Please try again later.\nFull Error Response: {json.dumps(error_response, indent=4)}")
-                sys.exit(1)  # Exit the script with a status code indicating an error.
+                raise StageFailure("YouTube quota exceeded")  # No further upload can succeed today
             else:
                 raise
+        except (StageFailure, UnitFailure):
+            raise
         except RETRIABLE_EXCEPTIONS as e:
             error = f"A retriable error occurred: {e}"
 
@@ -250,7 +257,7 @@ def resumable_upload(insert_request, next_publish_time, title):
             print(error)
             retry += 1
             if retry > MAX_RETRIES:
-                exit("No longer attempting to retry.")
+                raise UnitFailure(f"No longer attempting to retry after {MAX_RETRIES} retries: {error}", "videos.insert", transient=True)
             max_sleep = 2 ** retry
             sleep_seconds = random.random() * max_sleep
             print(f"Sleeping {sleep_seconds} seconds and then retrying...")